@@ -94,6 +94,25 @@ def add_my_options(self):
             metavar="NUM_INSTANCES",
             help="Run NUM_INSTANCES parallel workers",
         )
+        self.parser.add_option(
+            "--workers",
+            action="store",
+            type=int,
+            default=1,
+            metavar="WORKERS",
+            help="Copy up to WORKERS files into Swift at once (default: 1)",
+        )
+        self.parser.add_option(
+            "--resume-file",
+            action="store",
+            dest="resume_path",
+            default=None,
+            metavar="PATH",
+            help=(
+                "Record progress in PATH, and resume after the last file "
+                "recorded there"
+            ),
+        )
 
     @property
     def lockfilename(self):
@@ -151,10 +170,14 @@ def main(self):
                 "--num-instances"
             )
 
+        if self.options.workers < 1:
+            self.parser.error("--workers must be at least 1")
+
         kwargs = {
             "instance_id": self.options.instance_id,
             "num_instances": self.options.num_instances,
             "remove_func": remove,
+            "num_workers": self.options.workers,
         }
 
         if self.options.ids and (self.options.start or self.options.end):
@@ -162,6 +185,11 @@ def main(self):
                 "Cannot specify both individual file(s) and range"
             )
 
+        elif self.options.ids and self.options.resume_path:
+            self.parser.error(
+                "Cannot specify both individual file(s) and --resume-file"
+            )
+
         elif self.options.ids:
             for lfc in self.options.ids:
                 swift.to_swift(
@@ -173,6 +201,7 @@ def main(self):
                 self.logger,
                 start_lfc_id=self.options.start,
                 end_lfc_id=self.options.end,
+                resume_path=self.options.resume_path,
                 **kwargs,
             )
         self.logger.info("Done")
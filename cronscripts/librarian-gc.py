@@ -71,8 +71,46 @@ def add_my_options(self):
             dest="skip_expiry",
             help="Skip expiring aliases with an expiry date in the past.",
         )
+        self.parser.add_option(
+            "",
+            "--shards",
+            type="int",
+            default=1,
+            dest="shards",
+            metavar="SHARDS",
+            help=(
+                "Split the search for unwanted files into SHARDS ranges of "
+                "content IDs."
+            ),
+        )
+        self.parser.add_option(
+            "",
+            "--workers",
+            type="int",
+            default=1,
+            dest="workers",
+            metavar="WORKERS",
+            help="Search up to WORKERS ranges of content IDs at once.",
+        )
+        self.parser.add_option(
+            "",
+            "--checkpoint",
+            dest="checkpoint_path",
+            default=None,
+            metavar="PATH",
+            help=(
+                "Record the ranges of content IDs searched for unwanted "
+                "files in PATH, and resume an interrupted search recorded "
+                "there."
+            ),
+        )
 
     def main(self):
+        if self.options.shards < 1:
+            self.parser.error("--shards must be at least 1")
+        if self.options.workers < 1:
+            self.parser.error("--workers must be at least 1")
+
         librariangc.log = self.logger
 
         if self.options.loglevel <= logging.DEBUG:
@@ -103,7 +141,23 @@ def main(self):
             # Second sweep.
             librariangc.delete_unreferenced_content(conn)
         if not self.options.skip_files:
-            librariangc.delete_unwanted_files(conn)
+            if (
+                self.options.shards > 1
+                or self.options.workers > 1
+                or self.options.checkpoint_path is not None
+            ):
+                librariangc.delete_unwanted_files_in_shards(
+                    conn,
+                    lambda: connect(
+                        user=dbconfig.dbuser,
+                        isolation=ISOLATION_LEVEL_AUTOCOMMIT,
+                    ),
+                    self.options.shards,
+                    self.options.workers,
+                    checkpoint_path=self.options.checkpoint_path,
+                )
+            else:
+                librariangc.delete_unwanted_files(conn)
 
 
 if __name__ == "__main__":
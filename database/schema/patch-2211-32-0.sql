@@ -0,0 +1,32 @@
+-- Copyright 2026 Canonical Ltd.  This software is licensed under the
+-- GNU Affero General Public License version 3 (see the file LICENSE).
+
+SET client_min_messages=ERROR;
+
+CREATE TABLE BinaryPackagePath (
+    id serial PRIMARY KEY,
+    path bytea NOT NULL
+);
+
+-- Paths may be longer than a btree index entry allows, so index their
+-- hashes instead.
+CREATE UNIQUE INDEX binarypackagepath__path_sha256__key
+    ON BinaryPackagePath (sha256(path));
+
+COMMENT ON TABLE BinaryPackagePath IS 'A path of a file shipped in one or more binary packages.';
+COMMENT ON COLUMN BinaryPackagePath.path IS 'The path of the file, relative to the root of the filesystem.';
+
+CREATE TABLE BinaryPackageReleaseContents (
+    binarypackagerelease integer NOT NULL REFERENCES BinaryPackageRelease,
+    binarypackagepath integer NOT NULL REFERENCES BinaryPackagePath,
+    PRIMARY KEY (binarypackagerelease, binarypackagepath)
+);
+
+CREATE INDEX binarypackagereleasecontents__binarypackagepath__idx
+    ON BinaryPackageReleaseContents (binarypackagepath);
+
+COMMENT ON TABLE BinaryPackageReleaseContents IS 'The files shipped in a binary package, as recorded when it was uploaded.  Used to generate Contents files.';
+COMMENT ON COLUMN BinaryPackageReleaseContents.binarypackagerelease IS 'The binary package release.';
+COMMENT ON COLUMN BinaryPackageReleaseContents.binarypackagepath IS 'A path of a file shipped in the binary package release.';
+
+INSERT INTO LaunchpadDatabaseRevision VALUES (2211, 32, 0);
@@ -0,0 +1,30 @@
+-- Copyright 2026 Canonical Ltd.  This software is licensed under the
+-- GNU Affero General Public License version 3 (see the file LICENSE).
+
+SET client_min_messages=ERROR;
+
+CREATE OR REPLACE FUNCTION buildqueue_notify_waiting_trig() RETURNS trigger
+    LANGUAGE plpgsql AS
+$$
+BEGIN
+    -- Tell buildd-manager which processor the newly-waiting job needs, so
+    -- that it can wake up idle builders without waiting for its next
+    -- scan.  Processor-independent jobs send an empty payload.
+    PERFORM pg_notify(
+        'buildqueue_waiting',
+        COALESCE(
+            (SELECT name FROM Processor WHERE id = NEW.processor), ''));
+    RETURN NULL;
+END;
+$$;
+
+COMMENT ON FUNCTION buildqueue_notify_waiting_trig() IS
+    'Notify listeners on the buildqueue_waiting channel when a BuildQueue row becomes WAITING.';
+
+CREATE TRIGGER buildqueue_notify_waiting_t
+    AFTER INSERT OR UPDATE OF status ON BuildQueue
+    FOR EACH ROW
+    WHEN (NEW.status = 0)
+    EXECUTE PROCEDURE buildqueue_notify_waiting_trig();
+
+INSERT INTO LaunchpadDatabaseRevision VALUES (2211, 33, 0);
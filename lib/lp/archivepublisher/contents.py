@@ -0,0 +1,258 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Generate Contents files from the file lists recorded at upload time.
+
+This replaces running apt-ftparchive over the whole pool.  The files
+shipped in each published binary package are cached between runs next
+to the other contents generation caches, so a run only has to look up
+binary packages that were published since the last one.
+"""
+
+__all__ = [
+    "ContentsGenerator",
+    "get_deb_member_path",
+    "write_contents_file",
+]
+
+import gzip
+import os
+from collections import defaultdict
+
+import apt_inst
+from zope.component import getUtility
+
+from lp.archivepublisher.diskpool import poolify
+from lp.archivepublisher.indexcache import IndexCache
+from lp.registry.model.sourcepackagename import SourcePackageName
+from lp.services.database.interfaces import IStore
+from lp.services.librarian.model import LibraryFileAlias
+from lp.services.osutils import ensure_directory_exists
+from lp.soyuz.enums import BinaryPackageFormat, PackagePublishingStatus
+from lp.soyuz.interfaces.binarypackagereleasecontents import (
+    IBinaryPackageReleaseContentsSet,
+)
+from lp.soyuz.model.binarypackagebuild import BinaryPackageBuild
+from lp.soyuz.model.binarypackagename import BinaryPackageName
+from lp.soyuz.model.binarypackagerelease import BinaryPackageRelease
+from lp.soyuz.model.component import Component
+from lp.soyuz.model.files import BinaryPackageFile
+from lp.soyuz.model.publishing import BinaryPackagePublishingHistory
+from lp.soyuz.model.section import Section
+
+DEFAULT_COMPONENT = "main"
+
+# apt-ftparchive pads each path to this column before the list of
+# packages that ship it.
+LOCATION_COLUMN = 60
+
+
+def get_deb_member_path(member):
+    """Return the path of a member of a .deb's data tarball, as bytes.
+
+    :param member: An `apt_inst.TarMember`.
+    """
+    name = member.name
+    if name.startswith("./"):
+        name = name[2:]
+    return name.lstrip("/").encode("UTF-8", "surrogateescape")
+
+
+def read_deb_contents(path):
+    """Return the paths of the files shipped in a .deb on disk."""
+    contents = []
+
+    def callback(member, data):
+        if not member.isdir():
+            contents.append(get_deb_member_path(member))
+
+    apt_inst.DebFile(path).data.go(callback)
+    return contents
+
+
+def get_location(component, section, package):
+    """Return the location of a package as shown in Contents files."""
+    if component != DEFAULT_COMPONENT:
+        section = "%s/%s" % (component, section)
+    return "%s/%s" % (section, package)
+
+
+def write_contents_file(cache_path, contents_path):
+    """Write a Contents file from a cache written by `ContentsGenerator`.
+
+    This writes both `contents_path` and a gzip-compressed copy of it.
+    It does not access the database, so it may be run in a separate
+    process.
+
+    :param cache_path: The path of the cache for this Contents file.
+    :param contents_path: The path of the Contents file to write.
+    """
+    locations = defaultdict(set)
+    for location, paths in IndexCache(cache_path).values():
+        for path in paths:
+            locations[path].add(location)
+
+    ensure_directory_exists(os.path.dirname(contents_path))
+    with open(contents_path, "wb") as plain, gzip.open(
+        contents_path + ".gz", "wb"
+    ) as compressed:
+        for path in sorted(
+            locations, key=lambda path: path.encode("UTF-8", "surrogateescape")
+        ):
+            line = (
+                "%s %s\n"
+                % (
+                    path.ljust(LOCATION_COLUMN - 1),
+                    ",".join(sorted(locations[path])),
+                )
+            ).encode("UTF-8", "surrogateescape")
+            plain.write(line)
+            compressed.write(line)
+
+
+class ContentsGenerator:
+    """Maintain the caches from which Contents files are written.
+
+    There is one cache per suite and architecture, keyed by
+    `BinaryPackageRelease` ID and holding the package's location and the
+    files it ships.  Files are read from the lists recorded when each
+    package was uploaded, or from the pool for packages uploaded before
+    those lists were recorded.
+    """
+
+    # The number of packages whose recorded files are fetched at once.
+    batch_size = 1000
+
+    def __init__(self, archive, pool_root, cache_root, logger):
+        """Create a Contents generator.
+
+        :param archive: The `IArchive` to generate Contents files for.
+        :param pool_root: The root of the archive's pool on disk.
+        :param cache_root: The directory in which to keep caches.
+        :param logger: A logger.
+        """
+        self.archive = archive
+        self.pool_root = pool_root
+        self.cache_root = cache_root
+        self.logger = logger
+
+    def getCachePath(self, suite, arch):
+        """Return the path of the cache for a suite and architecture."""
+        return os.path.join(self.cache_root, suite, "Contents-%s.json" % arch)
+
+    def getPublishedBinaries(self, distroarchseries, pocket):
+        """Return the binary packages that belong in a Contents file.
+
+        :return: A result set of (BinaryPackageRelease ID, binary package
+            name, component name, section name, source package name,
+            filename) tuples.
+        """
+        return IStore(BinaryPackagePublishingHistory).find(
+            (
+                BinaryPackageRelease.id,
+                BinaryPackageName.name,
+                Component.name,
+                Section.name,
+                SourcePackageName.name,
+                LibraryFileAlias.filename,
+            ),
+            BinaryPackagePublishingHistory.archive == self.archive,
+            BinaryPackagePublishingHistory.distroarchseries
+            == distroarchseries,
+            BinaryPackagePublishingHistory.pocket == pocket,
+            BinaryPackagePublishingHistory.status
+            == PackagePublishingStatus.PUBLISHED,
+            BinaryPackagePublishingHistory.binarypackagerelease_id
+            == BinaryPackageRelease.id,
+            BinaryPackageRelease.binpackageformat == BinaryPackageFormat.DEB,
+            BinaryPackagePublishingHistory.binarypackagename_id
+            == BinaryPackageName.id,
+            BinaryPackagePublishingHistory.component_id == Component.id,
+            BinaryPackagePublishingHistory.section_id == Section.id,
+            BinaryPackageRelease.build_id == BinaryPackageBuild.id,
+            BinaryPackageBuild.source_package_name_id == SourcePackageName.id,
+            BinaryPackageFile.binarypackagerelease_id
+            == BinaryPackageRelease.id,
+            BinaryPackageFile.libraryfile_id == LibraryFileAlias.id,
+        )
+
+    def readContentsFromPool(self, component, source_name, filename):
+        """Read the files shipped in a package from the pool.
+
+        :return: A list of paths, or None if the package cannot be read.
+        """
+        path = os.path.join(
+            self.pool_root, poolify(source_name, component), filename
+        )
+        try:
+            return read_deb_contents(path)
+        except Exception as e:
+            # apt_inst raises all sorts of exceptions for damaged files.
+            self.logger.warning("Cannot read contents of %s: %s", path, e)
+            return None
+
+    def updateCache(self, suite, distroarchseries, pocket):
+        """Update the cache for a suite and architecture.
+
+        :return: The path of the updated cache.
+        """
+        arch = distroarchseries.architecturetag
+        cache_path = self.getCachePath(suite, arch)
+        cache = IndexCache(cache_path)
+        missing = []
+        for (
+            bpr_id,
+            package,
+            component,
+            section,
+            source_name,
+            filename,
+        ) in self.getPublishedBinaries(distroarchseries, pocket):
+            location = get_location(component, section, package)
+            cached = cache.get(bpr_id, ())
+            if cached is not None:
+                # The files in a package never change, but its overrides
+                # may have done.
+                cache.set(bpr_id, (), location, cached[1])
+            else:
+                missing.append(
+                    (bpr_id, location, component, source_name, filename)
+                )
+
+        recorded = {}
+        contents_set = getUtility(IBinaryPackageReleaseContentsSet)
+        for start in range(0, len(missing), self.batch_size):
+            recorded.update(
+                contents_set.getPaths(
+                    [
+                        bpr_id
+                        for bpr_id, _, _, _, _ in missing[
+                            start : start + self.batch_size
+                        ]
+                    ]
+                )
+            )
+        for bpr_id, location, component, source_name, filename in missing:
+            paths = recorded.get(bpr_id)
+            if paths is None:
+                paths = self.readContentsFromPool(
+                    component, source_name, filename
+                )
+                if paths is None:
+                    continue
+            cache.set(
+                bpr_id,
+                (),
+                location,
+                [path.decode("UTF-8", "surrogateescape") for path in paths],
+            )
+
+        self.logger.debug(
+            "Contents-%s for %s: %d cached packages, %d new.",
+            arch,
+            suite,
+            cache.hits,
+            len(missing),
+        )
+        cache.save()
+        return cache_path
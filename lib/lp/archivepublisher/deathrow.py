@@ -5,12 +5,16 @@
 Processes removals of packages that are scheduled for deletion.
 """
 
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 from storm.expr import Exists
 from storm.locals import And, ClassAlias, Not, Select
 
 from lp.archivepublisher.config import getPubConfig
+from lp.archivepublisher.diskpool import DiskPool
+from lp.services.config import config
 from lp.services.database.constants import UTC_NOW
 from lp.services.database.interfaces import IStore
 from lp.services.librarian.model import LibraryFileAlias, LibraryFileContent
@@ -48,7 +52,9 @@ def getDeathRow(archive, log, pool_root_override):
     dp = pubconf.getDiskPool(log, pool_root_override=pool_root_override)
 
     log.debug("Preparing death row.")
-    return DeathRow(archive, dp, log)
+    return DeathRow(
+        archive, dp, log, workers=config.archivepublisher.deathrow_workers
+    )
 
 
 class DeathRow:
@@ -59,11 +65,23 @@ class DeathRow:
     by other packages.
     """
 
-    def __init__(self, archive, diskpool, logger):
+    # The number of files whose references are checked in each query.
+    check_batch_size = 1000
+
+    def __init__(self, archive, diskpool, logger, workers=1):
+        """Create a death row processor.
+
+        :param workers: The number of threads used to remove files from
+            the pool.  Files for the same source package are always
+            removed by the same thread, since they may be symlinked to
+            each other.
+        """
         self.archive = archive
         self.diskpool = diskpool
         self._removeFile = diskpool.removeFile
         self.logger = logger
+        self.workers = workers
+        self.dry_run = False
 
     def reap(self, dry_run=False):
         """Reap packages that should be removed from the distribution.
@@ -76,25 +94,23 @@ def reap(self, dry_run=False):
         if dry_run:
             # Don't actually remove the files if we are dry running
             def _mockRemoveFile(
-                component_name, pool_name, pool_version, pub_file
+                component_name, pool_name, pool_version, pub_file, file=None
             ):
+                if file is None:
+                    file = pub_file.libraryfile.filename
                 self.logger.debug(
                     "(Not really!) removing %s %s/%s/%s"
-                    % (
-                        component_name,
-                        pool_name,
-                        pool_version,
-                        pub_file.libraryfile.filename,
-                    )
+                    % (component_name, pool_name, pool_version, file)
                 )
                 fullpath = self.diskpool.pathFor(
-                    component_name, pool_name, pool_version, pub_file
+                    component_name, pool_name, pool_version, file=file
                 )
                 if not fullpath.exists():
                     raise NotInPool
                 return fullpath.lstat().st_size
 
             self._removeFile = _mockRemoveFile
+        self.dry_run = dry_run
 
         source_files, binary_files = self._collectCondemned()
         records = self._tryRemovingFromDisk(source_files, binary_files)
@@ -160,67 +176,91 @@ def _collectCondemned(self):
 
         return (sources, binaries)
 
-    def canRemove(self, publication_class, filename, file_sha256):
-        """Check if given (filename, MD5) can be removed from the pool.
+    def _getReferenceClauses(self, publication_class):
+        """Return clauses joining publications in this archive to files."""
+        if ISourcePackagePublishingHistory.implementedBy(publication_class):
+            return [
+                SourcePackagePublishingHistory.archive == self.archive,
+                SourcePackagePublishingHistory.dateremoved == None,
+                SourcePackagePublishingHistory.sourcepackagerelease
+                == SourcePackageReleaseFile.sourcepackagerelease_id,
+                SourcePackageReleaseFile.libraryfile == LibraryFileAlias.id,
+                LibraryFileAlias.content == LibraryFileContent.id,
+            ]
+        elif IBinaryPackagePublishingHistory.implementedBy(publication_class):
+            return [
+                BinaryPackagePublishingHistory.archive == self.archive,
+                BinaryPackagePublishingHistory.dateremoved == None,
+                BinaryPackagePublishingHistory.binarypackagerelease
+                == BinaryPackageFile.binarypackagerelease_id,
+                BinaryPackageFile.libraryfile == LibraryFileAlias.id,
+                LibraryFileAlias.content == LibraryFileContent.id,
+            ]
+        else:
+            raise AssertionError("%r is not supported." % publication_class)
+
+    def getRemovableFiles(self, publication_class, files):
+        """Return those of the given files that can be removed from the pool.
 
         Check the archive reference-counter implemented in:
         `SourcePackagePublishingHistory` or
-        `BinaryPackagePublishingHistory`.
+        `BinaryPackagePublishingHistory`, for many files at once.
 
         Only allow removal of unnecessary files.
-        """
-        clauses = []
 
-        if ISourcePackagePublishingHistory.implementedBy(publication_class):
-            clauses.extend(
-                [
-                    SourcePackagePublishingHistory.archive == self.archive,
-                    SourcePackagePublishingHistory.dateremoved == None,
-                    SourcePackagePublishingHistory.sourcepackagerelease
-                    == SourcePackageReleaseFile.sourcepackagerelease_id,
-                    SourcePackageReleaseFile.libraryfile
-                    == LibraryFileAlias.id,
-                ]
-            )
-        elif IBinaryPackagePublishingHistory.implementedBy(publication_class):
-            clauses.extend(
-                [
-                    BinaryPackagePublishingHistory.archive == self.archive,
-                    BinaryPackagePublishingHistory.dateremoved == None,
-                    BinaryPackagePublishingHistory.binarypackagerelease
-                    == BinaryPackageFile.binarypackagerelease_id,
-                    BinaryPackageFile.libraryfile == LibraryFileAlias.id,
-                ]
+        :param publication_class: The publication class whose references
+            to the files should be checked.
+        :param files: A collection of (filename, sha256) tuples.
+        :return: A set of those (filename, sha256) tuples which are not
+            referenced by any live or quarantined publication.
+        """
+        clauses = self._getReferenceClauses(publication_class)
+        removable = set(files)
+        right_now = datetime.now(timezone.utc)
+        pending = sorted(removable)
+        for start in range(0, len(pending), self.check_batch_size):
+            batch = pending[start : start + self.check_batch_size]
+            references = (
+                IStore(publication_class)
+                .find(
+                    (
+                        LibraryFileAlias.filename,
+                        LibraryFileContent.sha256,
+                        publication_class.status,
+                        publication_class.scheduleddeletiondate,
+                    ),
+                    *clauses,
+                    LibraryFileAlias.filename.is_in(
+                        {filename for filename, _ in batch}
+                    ),
+                    LibraryFileContent.sha256.is_in(
+                        {file_sha256 for _, file_sha256 in batch}
+                    ),
+                )
+                .config(distinct=True)
             )
-        else:
-            raise AssertionError("%r is not supported." % publication_class)
+            for filename, file_sha256, status, deletion_date in references:
+                if (
+                    # Deny removal if any reference is still active.
+                    status not in inactive_publishing_status
+                    # Deny removal if any reference wasn't dominated yet.
+                    or deletion_date is None
+                    # Deny removal if any reference is still in
+                    # 'quarantine'.
+                    or deletion_date > right_now
+                ):
+                    removable.discard((filename, file_sha256))
+        return removable
 
-        clauses.extend(
-            [
-                LibraryFileAlias.content == LibraryFileContent.id,
-                LibraryFileAlias.filename == filename,
-                LibraryFileContent.sha256 == file_sha256,
-            ]
-        )
+    def canRemove(self, publication_class, filename, file_sha256):
+        """Check if given (filename, SHA-256) can be removed from the pool.
 
-        all_publications = IStore(publication_class).find(
-            publication_class, *clauses
+        See `getRemovableFiles`.
+        """
+        return (filename, file_sha256) in self.getRemovableFiles(
+            publication_class, [(filename, file_sha256)]
         )
 
-        right_now = datetime.now(timezone.utc)
-        for pub in all_publications:
-            # Deny removal if any reference is still active.
-            if pub.status not in inactive_publishing_status:
-                return False
-            # Deny removal if any reference wasn't dominated yet.
-            if pub.scheduleddeletiondate is None:
-                return False
-            # Deny removal if any reference is still in 'quarantine'.
-            if pub.scheduleddeletiondate > right_now:
-                return False
-
-        return True
-
     def _tryRemovingFromDisk(
         self, condemned_source_files, condemned_binary_files
     ):
@@ -230,21 +270,43 @@ def _tryRemovingFromDisk(
         this will result in the files being removed if they're not otherwise
         in use.
         """
-        bytes = 0
         condemned_files = set()
         condemned_records = set()
         considered_files = set()
         details = {}
 
-        def checkPubRecord(pub_record, publication_class):
+        # Find out which of the condemned records' files are still
+        # referenced using a few queries for all of them, rather than
+        # checking each file in turn.
+        condemned = []
+        removable_files = {}
+        for publication_class, pub_records in (
+            (SourcePackagePublishingHistory, condemned_source_files),
+            (BinaryPackagePublishingHistory, condemned_binary_files),
+        ):
+            files_to_check = set()
+            for pub_record in pub_records:
+                files = pub_record.files
+                condemned.append((pub_record, publication_class, files))
+                files_to_check.update(
+                    (
+                        pub_file.libraryfile.filename,
+                        pub_file.libraryfile.content.sha256,
+                    )
+                    for pub_file in files
+                )
+            removable_files[publication_class] = self.getRemovableFiles(
+                publication_class, files_to_check
+            )
+
+        def checkPubRecord(pub_record, publication_class, files):
             """Check if the publishing record can be removed.
 
             It can only be removed if all files in its context are not
             referred to any other 'published' publishing records.
 
-            See `canRemove` for more information.
+            See `getRemovableFiles` for more information.
             """
-            files = pub_record.files
             for pub_file in files:
                 filename = pub_file.libraryfile.filename
                 file_sha256 = pub_file.libraryfile.content.sha256
@@ -272,9 +334,9 @@ def checkPubRecord(pub_record, publication_class):
                 considered_files.add((filename, file_sha256))
 
                 # Check if the removal is allowed, if not continue.
-                if not self.canRemove(
-                    publication_class, filename, file_sha256
-                ):
+                if (filename, file_sha256) not in removable_files[
+                    publication_class
+                ]:
                     self.logger.debug("Cannot remove.")
                     continue
 
@@ -291,23 +353,78 @@ def checkPubRecord(pub_record, publication_class):
                 condemned_records.add(pub_record)
 
         # Check source and binary publishing records.
-        for pub_record in condemned_source_files:
-            checkPubRecord(pub_record, SourcePackagePublishingHistory)
-        for pub_record in condemned_binary_files:
-            checkPubRecord(pub_record, BinaryPackagePublishingHistory)
+        for pub_record, publication_class, files in condemned:
+            checkPubRecord(pub_record, publication_class, files)
 
         self.logger.info(
             "Removing %s files marked for reaping" % len(condemned_files)
         )
 
-        for condemned_file in sorted(condemned_files, reverse=True):
-            component_name, pool_name, pool_version, pub_file = details[
-                condemned_file
-            ]
-            try:
-                bytes += self._removeFile(
-                    component_name, pool_name, pool_version, pub_file
+        condemned_details = [
+            details[condemned_file]
+            for condemned_file in sorted(condemned_files, reverse=True)
+        ]
+        if self.workers > 1 and isinstance(self.diskpool, DiskPool):
+            # Files for the same source package may be symlinks to each
+            # other in different components, so each source package's files
+            # must be removed in order by a single worker.  The files are
+            # resolved to their names here, so that the workers only touch
+            # the filesystem and never this thread's database objects.
+            groups = defaultdict(list)
+            for (
+                component_name,
+                pool_name,
+                pool_version,
+                pub_file,
+            ) in condemned_details:
+                groups[pool_name].append(
+                    (
+                        component_name,
+                        pool_name,
+                        pool_version,
+                        None,
+                        pub_file.libraryfile.filename,
+                    )
+                )
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(
+                    executor.map(self._removeFiles, groups.values())
+                )
+        else:
+            results = [self._removeFiles(condemned_details)]
+
+        freed = defaultdict(lambda: [0, 0])
+        for result in results:
+            for component_name, size in result:
+                freed[component_name][0] += 1
+                freed[component_name][1] += size
+        total_bytes = sum(size for _, size in freed.values())
+        if self.dry_run:
+            self.logger.info(
+                "Total bytes that would be freed: %s" % total_bytes
+            )
+            for component_name, (count, size) in sorted(freed.items()):
+                self.logger.info(
+                    "  %s: %s files, %s bytes" % (component_name, count, size)
                 )
+        else:
+            self.logger.info("Total bytes freed: %s" % total_bytes)
+
+        return condemned_records
+
+    def _removeFiles(self, files):
+        """Remove some condemned files from the pool.
+
+        :param files: A sequence of tuples of arguments to the pool's
+            `removeFile`, starting with the component name.
+        :return: A list of (component_name, bytes freed) tuples for the
+            files that were removed.
+        """
+        removed = []
+        for remove_args in files:
+            component_name = remove_args[0]
+            try:
+                size = self._removeFile(*remove_args)
             except NotInPool as info:
                 # It's safe for us to let this slide because it means that
                 # the file is already gone.
@@ -318,10 +435,9 @@ def checkPubRecord(pub_record, publication_class):
                 # mistake) but there is nothing we can do about it at this
                 # point.
                 self.logger.warning(str(info))
-
-        self.logger.info("Total bytes freed: %s" % bytes)
-
-        return condemned_records
+            else:
+                removed.append((component_name, size))
+        return removed
 
     def _markPublicationRemoved(self, condemned_records):
         # Now that the os.remove() calls have been made, simply let every
@@ -10,6 +10,17 @@
 
 # This code came from sourcerer but has been heavily modified since.
 
+__all__ = [
+    "BadEpochError",
+    "BadInputError",
+    "BadRevisionError",
+    "BadUpstreamError",
+    "Version",
+    "VersionError",
+    "sort_by_version",
+    "version_sort_key",
+]
+
 import re
 
 from debian import changelog
@@ -82,3 +93,99 @@ def __init__(self, ver):
             raise BadUpstreamError(
                 "Bad upstream version format %s" % self.upstream_version
             )
+
+
+# Byte values used by `version_sort_key`.  dpkg orders "~" before the end
+# of a non-digit part, which comes before letters, which come before all
+# other characters.  Letters are encoded as themselves and other
+# characters are shifted above them.
+_TILDE = b"\x01"
+_END_OF_PART = b"\x02"
+_END_OF_NON_DIGITS = b"\x03"
+_NON_LETTER_OFFSET = 0x80
+
+_version_parts = re.compile(r"([^0-9]*)([0-9]*)")
+
+
+def _encode_non_digits(non_digits):
+    encoded = bytearray()
+    for char in non_digits:
+        if char == "~":
+            encoded += _TILDE
+        elif char.isascii() and char.isalpha():
+            encoded.append(ord(char))
+        else:
+            encoded.append(_NON_LETTER_OFFSET + ord(char))
+    return bytes(encoded)
+
+
+def _encode_number(digits):
+    digits = digits.lstrip("0")
+    if len(digits) > 0xFF:
+        raise BadInputError("Number too long in version")
+    return bytes([len(digits)]) + digits.encode("ASCII")
+
+
+def _encode_part(part):
+    """Encode an upstream version or revision for `version_sort_key`.
+
+    dpkg compares these as alternating non-digit and digit sequences,
+    treating a missing sequence as empty or zero respectively.  Only the
+    first pair of sequences can be both empty and zero without being at
+    the end, so it is always kept, while any later such pairs are dropped
+    so that equal parts encode identically.
+    """
+    pairs = [
+        (non_digits, digits.lstrip("0"))
+        for non_digits, digits in _version_parts.findall(part)
+    ]
+    while len(pairs) > 1 and pairs[-1] == ("", ""):
+        pairs.pop()
+    return (
+        b"".join(
+            _encode_non_digits(non_digits)
+            + _END_OF_NON_DIGITS
+            + _encode_number(digits)
+            for non_digits, digits in pairs
+        )
+        + _END_OF_PART
+    )
+
+
+def version_sort_key(version):
+    """Return a byte string that sorts in the same order as `version`.
+
+    Comparing the keys of two Debian versions bytewise gives the same
+    result as comparing the versions using dpkg's rules, so lists of
+    versions can be sorted without comparing each pair in Python, and
+    keys could be stored and indexed by anything that compares bytes.
+
+    :param version: A Debian version string.  It is not validated.
+    """
+    version = str(version)
+    epoch, colon, rest = version.partition(":")
+    if not colon:
+        epoch, rest = "", version
+    upstream, hyphen, revision = rest.rpartition("-")
+    if not hyphen:
+        upstream, revision = rest, ""
+    return (
+        _encode_number(epoch) + _encode_part(upstream) + _encode_part(revision)
+    )
+
+
+def sort_by_version(items, key=None, reverse=False):
+    """Sort items by Debian version.
+
+    :param items: An iterable of items to sort.
+    :param key: A function returning the version string for an item; if
+        None, the items are themselves version strings.
+    :param reverse: If True, sort from highest to lowest version.
+    :return: A new sorted list.  Items with equal versions keep their
+        original relative order.
+    """
+    if key is None:
+        return sorted(items, key=version_sort_key, reverse=reverse)
+    return sorted(
+        items, key=lambda item: version_sort_key(key(item)), reverse=reverse
+    )
@@ -177,8 +177,9 @@ def __init__(
         temppath: Path,
         source_name: str,
         source_version: str,
-        pub_file: IPackageReleaseFile,
+        pub_file: Optional[IPackageReleaseFile],
         logger: logging.Logger,
+        file: Optional[str] = None,
     ) -> None:
         self.archive = archive
         self.rootpath = rootpath
@@ -186,6 +187,11 @@ def __init__(
         self.source_name = source_name
         self.source_version = source_version
         self.pub_file = pub_file
+        if file is None:
+            if pub_file is None:
+                raise AssertionError("Must pass either pub_file or file")
+            file = pub_file.libraryfile.filename
+        self.filename = file
         self.logger = logger
 
         self.file_component = None
@@ -209,7 +215,7 @@ def pathFor(self, component: str) -> Path:
         return (
             self.rootpath
             / poolify(self.source_name, component)
-            / self.pub_file.libraryfile.filename
+            / self.filename
         )
 
     def preferredComponent(
@@ -252,6 +258,8 @@ def addFile(self, component: str):
 
         targetpath = self.pathFor(component)
         targetpath.parent.mkdir(parents=True, exist_ok=True)
+        if TYPE_CHECKING:
+            assert self.pub_file is not None
         lfa = self.pub_file.libraryfile
 
         if self.file_component:
@@ -314,7 +322,7 @@ def removeFile(self, component: str) -> int:
 
         3) Remove the main file and there are symlinks left.
         """
-        filename = self.pub_file.libraryfile.filename
+        filename = self.filename
         if not self.file_component:
             raise NotInPool(
                 "File for removing %s %s/%s is not in pool, skipping."
@@ -390,7 +398,7 @@ def _shufflesymlinks(self, targetcomponent: str) -> None:
             # We're already in the right place.
             return
 
-        filename = self.pub_file.libraryfile.filename
+        filename = self.filename
         if targetcomponent not in self.symlink_components:
             raise ValueError(
                 "Target component '%s' is not a symlink for %s"
@@ -485,7 +493,8 @@ def _getEntry(
         self,
         source_name: str,
         source_version: str,
-        pub_file: IPackageReleaseFile,
+        pub_file: Optional[IPackageReleaseFile],
+        file: Optional[str] = None,
     ) -> DiskPoolEntry:
         """Return a new DiskPoolEntry for the given source and file."""
         if TYPE_CHECKING:
@@ -498,6 +507,7 @@ def _getEntry(
             source_version,
             pub_file,
             self.logger,
+            file=file,
         )
 
     def pathFor(
@@ -561,10 +571,14 @@ def removeFile(
         component: str,
         source_name: str,
         source_version: str,
-        pub_file: IPackageReleaseFile,
+        pub_file: Optional[IPackageReleaseFile] = None,
+        file: Optional[str] = None,
     ) -> int:
         """Remove the specified file from the pool.
 
+        The file may be given either as `pub_file` or by name as `file`;
+        the latter needs no database access.
+
         There are three possible outcomes:
         - If the specified file does not exist, NotInPool will be raised.
 
@@ -577,5 +591,7 @@ def removeFile(
         will be deleted, and the file will be moved to replace it. The
         size of the deleted symlink will be returned.
         """
-        entry = self._getEntry(source_name, source_version, pub_file)
+        entry = self._getEntry(
+            source_name, source_version, pub_file, file=file
+        )
         return entry.removeFile(component)
@@ -58,11 +58,12 @@
 from operator import attrgetter, itemgetter
 
 import apt_pkg
-from storm.expr import And, Cast, Count, Desc, Not, Select
+from storm.expr import And, Cast, Column, Count, Desc, Not, Select, Table
 from zope.component import getUtility
 
+from lp.archivepublisher.debversion import version_sort_key
 from lp.registry.model.sourcepackagename import SourcePackageName
-from lp.services.database.bulk import load_related
+from lp.services.database.bulk import dbify_value, load_related
 from lp.services.database.constants import UTC_NOW
 from lp.services.database.decoratedresultset import DecoratedResultSet
 from lp.services.database.interfaces import IStore
@@ -70,12 +71,13 @@
     block_implicit_flushes,
     flush_database_updates,
 )
-from lp.services.database.stormexpr import IsDistinctFrom
+from lp.services.database.stormexpr import BulkUpdate, IsDistinctFrom, Values
 from lp.services.orderingcheck import OrderingCheck
 from lp.soyuz.adapters.packagelocation import PackageLocation
 from lp.soyuz.enums import BinaryPackageFormat, PackagePublishingStatus
 from lp.soyuz.interfaces.publishing import (
     IPublishingSet,
+    active_publishing_status,
     inactive_publishing_status,
 )
 from lp.soyuz.model.binarypackagebuild import BinaryPackageBuild
@@ -191,8 +193,19 @@ def compare(self, pub1, pub2):
             return version_comparison
 
     def sortPublications(self, publications):
-        """Sort publications from most to least current versions."""
-        return sorted(publications, key=cmp_to_key(self.compare), reverse=True)
+        """Sort publications from most to least current versions.
+
+        This gives the same order as sorting with `compare`, but computes
+        a sort key once per publication rather than comparing each pair.
+        """
+        return sorted(
+            publications,
+            key=lambda pub: (
+                version_sort_key(self.getPackageVersion(pub)),
+                pub.datecreated,
+            ),
+            reverse=True,
+        )
 
 
 def make_package_location(pub):
@@ -480,7 +493,7 @@ def planPackageDomination(
 
         return supersede, keep, delete
 
-    def _sortPackages(self, publications, generalization):
+    def _sortPackages(self, publications, generalization, presorted=False):
         """Partition publications by package name and location, and sort them.
 
         The publications are sorted from most current to least current,
@@ -491,6 +504,10 @@ def _sortPackages(self, publications, generalization):
             or of `BinaryPackagePublishingHistory`.
         :param generalization: A `GeneralizedPublication` helper representing
             the kind of publications these are: source or binary.
+        :param presorted: If True, `publications` are already sorted from
+            most current to least current (for example by the database),
+            so partitioning them preserves that order and they need not be
+            sorted again.
         :return: A dict mapping each package location (package name,
             channel) to a sorted list of publications from `publications`.
         """
@@ -513,6 +530,9 @@ def _sortPackages(self, publications, generalization):
             location = make_package_location(pub)
             pubs_by_name_and_location[(name, location)].append(pub)
 
+        if presorted:
+            return pubs_by_name_and_location
+
         # Sort the publication lists.  This is not an in-place sort, so
         # it involves altering the dict while we iterate it.  Listify
         # the items so that we can be sure that we're not altering the
@@ -633,6 +653,233 @@ def _judgeSuperseded(self, source_records, binary_records):
             # might have the effect of discarding these updates.
             IStore(pub_record).flush()
 
+    def _bulkSupersede(self, pub_class, supersededby):
+        """Mark publications as superseded with a single UPDATE.
+
+        :param pub_class: `SourcePackagePublishingHistory` or
+            `BinaryPackagePublishingHistory`.
+        :param supersededby: A list of (publication ID, superseding
+            release or build ID) pairs.
+        """
+        if not supersededby:
+            return
+        new_supersededby = Table("new_supersededby")
+        IStore(pub_class).execute(
+            BulkUpdate(
+                {
+                    pub_class.status: dbify_value(
+                        pub_class.status, PackagePublishingStatus.SUPERSEDED
+                    )[0],
+                    pub_class.datesuperseded: UTC_NOW,
+                    pub_class.supersededby_id: Column(
+                        "supersededby", new_supersededby
+                    ),
+                },
+                table=pub_class,
+                values=Values(
+                    new_supersededby.name,
+                    [("id", "integer"), ("supersededby", "integer")],
+                    [
+                        [
+                            dbify_value(pub_class.id, pub_id)[0],
+                            dbify_value(
+                                pub_class.supersededby_id, supersededby_id
+                            )[0],
+                        ]
+                        for pub_id, supersededby_id in supersededby
+                    ],
+                ),
+                where=(pub_class.id == Column("id", new_supersededby)),
+            )
+        )
+
+    def _supersedeSources(self, supersede):
+        """Supersede source publications in bulk.
+
+        :param supersede: A list of (superseded publication, dominant
+            publication) pairs, as returned by `planPackageDomination`.
+        """
+        if not supersede:
+            return
+        SPPH = SourcePackagePublishingHistory
+        for pub, dominant in supersede:
+            assert pub.status in active_publishing_status, (
+                "Should not dominate unpublished source %s"
+                % pub.sourcepackagerelease.title
+            )
+            self.logger.debug(
+                "%s/%s has been judged as superseded by %s/%s",
+                pub.sourcepackagerelease.sourcepackagename.name,
+                pub.sourcepackagerelease.version,
+                dominant.sourcepackagerelease.sourcepackagename.name,
+                dominant.sourcepackagerelease.version,
+            )
+        store = IStore(SPPH)
+        store.flush()
+        self._bulkSupersede(
+            SPPH,
+            [
+                (pub.id, dominant.sourcepackagerelease_id)
+                for pub, dominant in supersede
+            ],
+        )
+        store.invalidate()
+
+    def _findOtherBinaryPublications(self, pubs, distroseries, pocket):
+        """Find other active publications of the same binaries.
+
+        This is a bulk version of
+        `IBinaryPackagePublishingHistory.getOtherPublications`.
+
+        :return: A dict mapping each of `pubs` to a list of active
+            publications of the same binary package release in any
+            architecture of `distroseries`, with the same overrides.
+        """
+        if not pubs:
+            return {}
+        BPPH = BinaryPackagePublishingHistory
+        candidates = defaultdict(list)
+        for other in IStore(BPPH).find(
+            BPPH,
+            BPPH.status.is_in(active_publishing_status),
+            BPPH.distroarchseries_id.is_in(
+                [das.id for das in distroseries.architectures]
+            ),
+            BPPH.binarypackagerelease_id.is_in(
+                {pub.binarypackagerelease_id for pub in pubs}
+            ),
+            BPPH.archive == self.archive,
+            BPPH.pocket == pocket,
+        ):
+            candidates[other.binarypackagerelease_id].append(other)
+
+        def overrides(pub):
+            return (
+                pub.component_id,
+                pub.section_id,
+                pub.priority,
+                pub.phased_update_percentage,
+            )
+
+        return {
+            pub: [
+                other
+                for other in candidates[pub.binarypackagerelease_id]
+                if overrides(other) == overrides(pub)
+            ]
+            for pub in pubs
+        }
+
+    def _supersedeBinaries(self, supersede, keep, distroseries, pocket):
+        """Supersede binary publications in bulk.
+
+        As well as the publications in `supersede`, this supersedes their
+        corresponding debug publications, and the publications of
+        architecture-independent binaries in other architectures, unless
+        one of the plans decided to keep them.  Publications that appear
+        more than once are superseded by the first dominant found for them.
+
+        :param supersede: A list of (superseded publication, dominant
+            publication) pairs, as returned by `planPackageDomination`.
+        :param keep: A set of publications that must not be superseded.
+        """
+        if not supersede:
+            return
+        BPPH = BinaryPackagePublishingHistory
+
+        # If a publication is architecture-independent, all publications
+        # with the same context and overrides should be dominated
+        # simultaneously.
+        other_pubs = self._findOtherBinaryPublications(
+            [pub for pub, _ in supersede if not pub.architecture_specific],
+            distroseries,
+            pocket,
+        )
+        dominants = {}
+        for pub, dominant in supersede:
+            assert (
+                not dominant.is_debug
+            ), "Should not dominate with %s (%s); DDEBs cannot dominate" % (
+                dominant.binarypackagerelease.title,
+                dominant.distroarchseries.architecturetag,
+            )
+            if pub not in dominants:
+                dominants[pub] = dominant
+            for dominated in other_pubs.get(pub, []):
+                if dominated not in keep and dominated not in dominants:
+                    dominants[dominated] = dominant
+
+        # Debug publications are dominated along with their corresponding
+        # non-debug publications.  A debug publication corresponds to the
+        # publication of its non-debug binary in the same architecture with
+        # the same overrides (see `findCorrespondingDDEBPublications`), so
+        # key on all of those to pick the right dominant even if the same
+        # release is published more than once.
+        def debug_key(pub, debug_bpr_id):
+            return (
+                debug_bpr_id,
+                pub.distroarchseries_id,
+                pub.component_id,
+                pub.section_id,
+                pub.priority,
+                pub.phased_update_percentage,
+            )
+
+        dominants_by_debug_key = {
+            debug_key(pub, pub.binarypackagerelease.debug_package_id): dominant
+            for pub, dominant in reversed(list(dominants.items()))
+            if pub.binarypackagerelease.debug_package_id is not None
+        }
+        if dominants_by_debug_key:
+            debug_pubs = getUtility(
+                IPublishingSet
+            ).findCorrespondingDDEBPublications(list(dominants))
+            for debug_pub in debug_pubs:
+                if debug_pub not in dominants:
+                    dominants[debug_pub] = dominants_by_debug_key[
+                        debug_key(debug_pub, debug_pub.binarypackagerelease_id)
+                    ]
+
+        builds = load_related(
+            BinaryPackageBuild,
+            [dominant.binarypackagerelease for dominant in dominants.values()],
+            ["build_id"],
+        )
+        load_related(
+            SourcePackageRelease, builds, ["source_package_release_id"]
+        )
+        load_related(DistroArchSeries, builds, ["distro_arch_series_id"])
+        with_build = []
+        without_build = []
+        for pub, dominant in dominants.items():
+            dominant_build = dominant.binarypackagerelease.build
+            # XXX cjwatson 2022-05-01: We can't currently dominate with CI
+            # builds, since supersededby is a reference to a BPB.  Just
+            # leave supersededby unset in that case for now, which isn't
+            # ideal but will work well enough.
+            if dominant_build is None:
+                without_build.append(pub.id)
+            else:
+                self.logger.debug(
+                    "The %s build of %s has been judged as superseded by "
+                    "the build of %s.  Arch-specific == %s",
+                    dominant_build.distro_arch_series.architecturetag,
+                    pub.binarypackagerelease.title,
+                    dominant_build.source_package_release.title,
+                    pub.architecture_specific,
+                )
+                with_build.append((pub.id, dominant_build.id))
+
+        store = IStore(BPPH)
+        store.flush()
+        self._bulkSupersede(BPPH, with_build)
+        if without_build:
+            store.find(BPPH, BPPH.id.is_in(without_build)).set(
+                status=PackagePublishingStatus.SUPERSEDED,
+                datesuperseded=UTC_NOW,
+            )
+        store.invalidate()
+
     def findBinariesForDomination(self, distroarchseries, pocket):
         """Find binary publications that need dominating.
 
@@ -666,7 +913,16 @@ def findBinariesForDomination(self, distroarchseries, pocket):
         # duplications among them, load them alongside the publications.
         # We'll also want their BinaryPackageNames, but adding those to
         # the join would complicate the query.
+        # Let the database sort by version (BPR.version has type debversion
+        # in the database, so this is a proper comparison), so that
+        # _sortPackages need not compare each pair of versions in Python.
         query = IStore(BPPH).find((BPPH, BPR), *main_clauses)
+        query = query.order_by(
+            BPPH.binarypackagename_id,
+            Desc(BPR.version),
+            Desc(BPPH.datecreated),
+            Desc(BPPH.id),
+        )
         bpphs = list(DecoratedResultSet(query, itemgetter(0)))
         load_related(BinaryPackageName, bpphs, ["binarypackagename_id"])
         return bpphs
@@ -705,19 +961,11 @@ def plan(pubs, live_versions):
         def execute_plan():
             if supersede:
                 self.logger.info("Superseding binaries...")
-            for pub, dominant in supersede:
-                pub.supersede(dominant, logger=self.logger)
-                IStore(pub).flush()
-                # If this is architecture-independent, all publications with
-                # the same context and overrides should be dominated
-                # simultaneously, unless one of the plans decided to keep
-                # it.  For this reason, an architecture's plan can't be
-                # executed until all architectures have been planned.
-                if not pub.architecture_specific:
-                    for dominated in pub.getOtherPublications():
-                        if dominated != pub and dominated not in keep:
-                            dominated.supersede(dominant, logger=self.logger)
-                            IStore(dominated).flush()
+            # Architecture-independent publications are superseded in all
+            # architectures at once, unless one of the plans decided to
+            # keep them.  For this reason, an architecture's plan can't be
+            # executed until all architectures have been planned.
+            self._supersedeBinaries(supersede, keep, distroseries, pocket)
             if delete:
                 self.logger.info("Deleting binaries...")
             for pub in delete:
@@ -734,7 +982,9 @@ def execute_plan():
 
             self.logger.info("Finding binaries...")
             bins = self.findBinariesForDomination(distroarchseries, pocket)
-            sorted_packages = self._sortPackages(bins, generalization)
+            sorted_packages = self._sortPackages(
+                bins, generalization, presorted=True
+            )
             self.logger.info("Planning domination of binaries...")
             for (name, location), pubs in sorted_packages.items():
                 self.logger.debug(
@@ -764,7 +1014,9 @@ def execute_plan():
         for distroarchseries in distroseries.architectures:
             self.logger.info("Finding binaries...(2nd pass)")
             bins = self.findBinariesForDomination(distroarchseries, pocket)
-            sorted_packages = self._sortPackages(bins, generalization)
+            sorted_packages = self._sortPackages(
+                bins, generalization, presorted=True
+            )
             self.logger.info("Planning domination of binaries...(2nd pass)")
             for name, location in packages_w_arch_indep.intersection(
                 sorted_packages
@@ -828,6 +1080,15 @@ def findSourcesForDomination(self, distroseries, pocket):
             SPPH.sourcepackagename_id.is_in(candidate_source_names),
             spph_location_clauses,
         )
+        # Let the database sort by version (SPR.version has type debversion
+        # in the database, so this is a proper comparison), so that
+        # _sortPackages need not compare each pair of versions in Python.
+        query = query.order_by(
+            SPPH.sourcepackagename_id,
+            Desc(SPR.version),
+            Desc(SPPH.datecreated),
+            Desc(SPPH.id),
+        )
         spphs = DecoratedResultSet(query, itemgetter(0))
         load_related(SourcePackageName, spphs, ["sourcepackagename_id"])
         return spphs
@@ -848,7 +1109,9 @@ def dominateSources(self, distroseries, pocket):
 
         self.logger.debug("Finding sources...")
         sources = self.findSourcesForDomination(distroseries, pocket)
-        sorted_packages = self._sortPackages(sources, generalization)
+        sorted_packages = self._sortPackages(
+            sources, generalization, presorted=True
+        )
         supersede = []
         delete = []
 
@@ -863,9 +1126,7 @@ def dominateSources(self, distroseries, pocket):
             supersede.extend(cur_supersede)
             delete.extend(cur_delete)
 
-        for pub, dominant in supersede:
-            pub.supersede(dominant, logger=self.logger)
-            IStore(pub).flush()
+        self._supersedeSources(supersede)
         for pub in delete:
             pub.requestDeletion(None)
             IStore(pub).flush()
@@ -934,9 +1195,7 @@ def dominateSourceVersions(
         supersede, _, delete = self.planPackageDomination(
             pubs, live_versions, generalization
         )
-        for pub, dominant in supersede:
-            pub.supersede(dominant, logger=self.logger)
-            IStore(pub).flush()
+        self._supersedeSources(supersede)
         for pub in delete:
             pub.requestDeletion(None, immutable_check=immutable_check)
             IStore(pub).flush()
@@ -0,0 +1,115 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Caches of rendered archive index stanzas.
+
+The publisher keeps one of these next to each Sources or Packages file it
+writes, so that a later run only has to render stanzas for publications
+that were added or overridden since.
+"""
+
+__all__ = [
+    "IndexCache",
+]
+
+import json
+import os
+import tempfile
+
+from lp.services.osutils import ensure_directory_exists
+
+
+class IndexCache:
+    """Rendered stanzas of a single index file, keyed by publication ID.
+
+    Each entry records a fingerprint of the publication's overrides as
+    they were when the stanza was rendered; an entry is only reused if
+    the fingerprint still matches.  Entries looked up or stored during a
+    run are accumulated into a new cache which replaces the old one on
+    `save`, so publications that are no longer published drop out.
+    """
+
+    # Bump this whenever the layout of stored entries changes, so that
+    # caches written by older code are ignored rather than misread.
+    format_version = 1
+
+    def __init__(self, path, reuse=True):
+        """Load the cache at `path`.
+
+        :param path: The file where this cache is stored.
+        :param reuse: If False, ignore any existing entries; the cache
+            will still be rewritten from scratch on `save`.
+        """
+        self.path = path
+        self._old_entries = self._load() if reuse else {}
+        self._new_entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        try:
+            with open(self.path) as cache_file:
+                data = json.load(cache_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            # A damaged cache is no worse than a missing one.
+            return {}
+        if (
+            not isinstance(data, dict)
+            or data.get("format") != self.format_version
+        ):
+            return {}
+        return data.get("entries", {})
+
+    def get(self, publication_id, fingerprint):
+        """Return the values cached for a publication, or None.
+
+        :param publication_id: The ID of a publishing history row.
+        :param fingerprint: A sequence of JSON-serialisable values
+            identifying everything the stanza was rendered from.
+        :return: A list of the values previously passed to `set`, or None
+            if there is no entry or its fingerprint does not match.
+        """
+        entry = self._old_entries.get(str(publication_id))
+        if entry is None or entry[0] != list(fingerprint):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1:]
+
+    def values(self):
+        """Iterate over the values of every entry in the stored cache.
+
+        This does not count as a hit or a miss.
+        """
+        for entry in self._old_entries.values():
+            yield entry[1:]
+
+    def set(self, publication_id, fingerprint, *values):
+        """Record the values rendered for a publication in this run."""
+        self._new_entries[str(publication_id)] = [list(fingerprint)] + list(
+            values
+        )
+
+    def save(self):
+        """Atomically replace the stored cache with this run's entries."""
+        cache_dir = os.path.dirname(self.path)
+        ensure_directory_exists(cache_dir)
+        fd, temp_path = tempfile.mkstemp(
+            dir=cache_dir, prefix="%s_" % os.path.basename(self.path)
+        )
+        try:
+            with os.fdopen(fd, "w") as cache_file:
+                json.dump(
+                    {
+                        "format": self.format_version,
+                        "entries": self._new_entries,
+                    },
+                    cache_file,
+                )
+            os.rename(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
@@ -3,6 +3,7 @@
 
 __all__ = [
     "IndexStanzaFields",
+    "StanzaCache",
     "build_binary_stanza_fields",
     "build_source_stanza_fields",
     "build_translations_stanza_fields",
@@ -13,6 +14,10 @@
 import re
 from collections import OrderedDict
 
+from zope.component import getUtility
+
+from lp.services.memcache.interfaces import IMemcacheClient
+from lp.services.statsd.interfaces.statsd_client import IStatsdClient
 from lp.soyuz.model.publishing import makePoolPath
 
 
@@ -261,3 +266,94 @@ def build_translations_stanza_fields(bpr, packages):
         return fields
     else:
         return None
+
+
+class StanzaCache:
+    """A shared cache of rendered Sources and Packages stanzas.
+
+    A stanza depends only on the release being published and the overrides
+    it is published with, so one rendering can be reused for every pocket,
+    series and archive that the release is copied into.  Entries are kept
+    in memcached, which takes care of eviction.
+    """
+
+    # Bump this whenever the output of build_source_stanza_fields or
+    # build_binary_stanza_fields changes, so that stanzas rendered by
+    # older code are not reused.
+    version = 1
+
+    # Number of seconds before cached stanzas expire.
+    expire = 7 * 24 * 60 * 60
+
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.hits = 0
+        self.misses = 0
+        self._client = getUtility(IMemcacheClient)
+
+    def _makeKey(self, kind, *values):
+        return "index-stanza:%d:%s:%s" % (
+            self.version,
+            kind,
+            ":".join(str(value) for value in values),
+        )
+
+    def _get(self, key, build):
+        stanza = self._client.get(key, logger=self.logger)
+        if stanza is not None:
+            self.hits += 1
+            return stanza
+        self.misses += 1
+        stanza = build().makeOutput()
+        self._client.set(key, stanza, expire=self.expire, logger=self.logger)
+        return stanza
+
+    def getSourceStanza(self, spr, component, section):
+        """Return the rendered Sources stanza for a source publication.
+
+        See `build_source_stanza_fields` for the parameters.
+        """
+        key = self._makeKey("source", spr.id, component.id, section.id)
+        return self._get(
+            key, lambda: build_source_stanza_fields(spr, component, section)
+        )
+
+    def getBinaryStanza(
+        self,
+        bpr,
+        component,
+        section,
+        priority,
+        phased_update_percentage,
+        separate_long_descriptions=False,
+    ):
+        """Return the rendered Packages stanza for a binary publication.
+
+        See `build_binary_stanza_fields` for the parameters.
+        """
+        key = self._makeKey(
+            "binary",
+            bpr.id,
+            component.id,
+            section.id,
+            priority.value,
+            phased_update_percentage,
+            int(separate_long_descriptions),
+        )
+        return self._get(
+            key,
+            lambda: build_binary_stanza_fields(
+                bpr,
+                component,
+                section,
+                priority,
+                phased_update_percentage,
+                separate_long_descriptions,
+            ),
+        )
+
+    def reportStatsdMetrics(self):
+        """Send the accumulated hit and miss counts to statsd."""
+        statsd_client = getUtility(IStatsdClient)
+        statsd_client.incr("archivepublisher.stanza_cache.hits", self.hits)
+        statsd_client.incr("archivepublisher.stanza_cache.misses", self.misses)
@@ -8,17 +8,24 @@
     "FORMAT_TO_SUBCOMPONENT",
     "GLOBAL_PUBLISHER_LOCK",
     "Publisher",
+    "PUBLISHER_INCREMENTAL_INDEXES",
+    "PUBLISHER_INDEX_PIPELINE",
+    "PUBLISHER_STANZA_CACHE",
     "getPublisher",
 ]
 
 import bz2
 import gzip
 import hashlib
+import json
 import lzma
+import multiprocessing
 import os
 import re
 import shutil
+import tempfile
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from functools import partial
 from itertools import chain, groupby
@@ -34,7 +41,9 @@
 from lp.archivepublisher import HARDCODED_COMPONENT_ORDER
 from lp.archivepublisher.config import getPubConfig
 from lp.archivepublisher.domination import Dominator
+from lp.archivepublisher.indexcache import IndexCache
 from lp.archivepublisher.indices import (
+    StanzaCache,
     build_binary_stanza_fields,
     build_source_stanza_fields,
     build_translations_stanza_fields,
@@ -47,13 +56,16 @@
 from lp.registry.interfaces.pocket import PackagePublishingPocket, pocketsuffix
 from lp.registry.interfaces.series import SeriesStatus
 from lp.registry.model.distroseries import DistroSeries
+from lp.services.config import config
 from lp.services.database.bulk import load
 from lp.services.database.constants import UTC_NOW
 from lp.services.database.interfaces import IStore
 from lp.services.database.sqlbase import get_transaction_timestamp
+from lp.services.features import getFeatureFlag
 from lp.services.helpers import filenameToContentType
 from lp.services.librarian.client import LibrarianClient
 from lp.services.osutils import ensure_directory_exists, open_for_writing
+from lp.services.statsd.interfaces.statsd_client import IStatsdClient
 from lp.services.utils import file_exists
 from lp.soyuz.enums import (
     ArchivePublishingMethod,
@@ -93,6 +105,19 @@
 BY_HASH_STAY_OF_EXECUTION = 1
 
 
+# If set, C_writeIndexes only renders stanzas for publications that
+# changed since the previous run.
+PUBLISHER_INCREMENTAL_INDEXES = "archivepublisher.incremental_indexes.enabled"
+
+# If set, C_writeIndexes shares rendered stanzas between pockets, series
+# and archives through memcached.
+PUBLISHER_STANZA_CACHE = "archivepublisher.stanza_cache.enabled"
+
+# If set, C_writeIndexes writes each compressed variant of an index file
+# in its own thread as the index is rendered.
+PUBLISHER_INDEX_PIPELINE = "archivepublisher.index_pipeline.enabled"
+
+
 def reorder_components(components):
     """Return a list of the components provided.
 
@@ -266,11 +291,22 @@ class SHA256ArchiveHash:
 class ByHash:
     """Represents a single by-hash directory tree."""
 
-    def __init__(self, root, key, log):
+    def __init__(self, root, key, log, manifest=None):
+        """Create a by-hash directory tree.
+
+        :param manifest: If not None, a dict recording the entries of each
+            hash directory as they were when last pruned, which is updated
+            in place by `prune`.  Directories that have not been modified
+            since then are not rescanned.
+        """
         self.root = root
         self.path = os.path.join(root, key, "by-hash")
         self.log = log
         self.known_digests = defaultdict(lambda: defaultdict(set))
+        self.manifest = manifest
+        # (mtime, entries) for each hash directory, by hash name; filled
+        # in lazily.
+        self._entries = {}
 
     @property
     def _usable_archive_hashes(self):
@@ -280,6 +316,39 @@ def _usable_archive_hashes(self):
                 usable.append(archive_hash)
         return usable
 
+    def _getMtime(self, hashname):
+        try:
+            return os.stat(os.path.join(self.path, hashname)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _getEntries(self, hashname, revalidate=False):
+        """Return the set of entries on disk in a hash directory.
+
+        The directory is only scanned if neither this object nor the
+        manifest has a record of it as of its current modification time.
+
+        :param revalidate: If True, check that the directory has not been
+            changed by anything else since it was last looked at.
+        """
+        if hashname in self._entries and not revalidate:
+            return self._entries[hashname][1]
+        mtime = self._getMtime(hashname)
+        if hashname in self._entries and self._entries[hashname][0] == mtime:
+            return self._entries[hashname][1]
+        recorded = None
+        if self.manifest is not None:
+            recorded = self.manifest.get(hashname)
+        if mtime is None:
+            entries = set()
+        elif recorded is not None and recorded["mtime"] == mtime:
+            entries = set(recorded["digests"])
+        else:
+            hash_path = os.path.join(self.path, hashname)
+            entries = {entry.name for entry in os.scandir(hash_path)}
+        self._entries[hashname] = (mtime, entries)
+        return entries
+
     def add(self, name, lfa, copy_from_path=None):
         """Ensure that by-hash entries for a single file exist.
 
@@ -298,7 +367,8 @@ def add(self, name, lfa, copy_from_path=None):
                 self.path, archive_hash.apt_name, digest
             )
             self.known_digests[archive_hash.apt_name][digest].add(name)
-            if not os.path.lexists(digest_path):
+            entries = self._getEntries(archive_hash.apt_name)
+            if digest not in entries:
                 self.log.debug(
                     "by-hash: Creating %s for %s" % (digest_path, name)
                 )
@@ -321,6 +391,11 @@ def add(self, name, lfa, copy_from_path=None):
                             shutil.copyfileobj(lfa, outfile, 4 * 1024 * 1024)
                         finally:
                             lfa.close()
+                entries.add(digest)
+                self._entries[archive_hash.apt_name] = (
+                    self._getMtime(archive_hash.apt_name),
+                    entries,
+                )
 
     def known(self, name, hashname, digest):
         """Do we know about a file with this name and digest?"""
@@ -336,33 +411,101 @@ def prune(self):
         for archive_hash in archive_hashes:
             hash_path = os.path.join(self.path, archive_hash.apt_name)
             if os.path.exists(hash_path):
-                prune_hash_directory = True
-                for entry in list(os.scandir(hash_path)):
-                    if (
-                        entry.name
-                        not in self.known_digests[archive_hash.apt_name]
-                    ):
-                        self.log.debug(
-                            "by-hash: Deleting unreferenced %s" % entry.path
-                        )
-                        os.unlink(entry.path)
-                    else:
-                        prune_hash_directory = False
-                if prune_hash_directory:
+                entries = self._getEntries(
+                    archive_hash.apt_name, revalidate=True
+                )
+                known = self.known_digests[archive_hash.apt_name]
+                for digest in sorted(entries - set(known)):
+                    entry_path = os.path.join(hash_path, digest)
+                    self.log.debug(
+                        "by-hash: Deleting unreferenced %s" % entry_path
+                    )
+                    os.unlink(entry_path)
+                    entries.discard(digest)
+                if not entries:
                     os.rmdir(hash_path)
                 else:
                     prune_directory = False
+            self._recordEntries(archive_hash.apt_name)
         if prune_directory and os.path.exists(self.path):
             os.rmdir(self.path)
 
+    def _recordEntries(self, hashname):
+        """Record the current state of a hash directory in the manifest."""
+        if self.manifest is None:
+            return
+        mtime = self._getMtime(hashname)
+        if mtime is None:
+            self.manifest.pop(hashname, None)
+        else:
+            self.manifest[hashname] = {
+                "mtime": mtime,
+                "digests": sorted(self._getEntries(hashname)),
+            }
+
 
 class ByHashes:
     """Represents all by-hash directory trees in an archive."""
 
-    def __init__(self, root, log):
+    # Bump this whenever the layout of the manifest changes, so that
+    # manifests written by older code are ignored rather than misread.
+    manifest_format_version = 1
+
+    def __init__(self, root, log, manifest_path=None):
+        """Create the by-hash directory trees for an archive.
+
+        :param manifest_path: If not None, a file recording the entries in
+            each by-hash directory, which is used to avoid rescanning
+            directories that have not changed, and which is updated by
+            `prune`.
+        """
         self.root = root
         self.log = log
         self.children = {}
+        self.manifest_path = manifest_path
+        self.manifest = None
+        if manifest_path is not None:
+            self.manifest = self._loadManifest()
+
+    def _loadManifest(self):
+        try:
+            with open(self.manifest_path) as manifest_file:
+                data = json.load(manifest_file)
+        except (OSError, ValueError):
+            # A missing or damaged manifest just means rescanning.
+            return {}
+        if (
+            not isinstance(data, dict)
+            or data.get("format") != self.manifest_format_version
+        ):
+            return {}
+        return data.get("children", {})
+
+    def _saveManifest(self):
+        manifest_dir = os.path.dirname(self.manifest_path)
+        ensure_directory_exists(manifest_dir)
+        fd, temp_path = tempfile.mkstemp(
+            dir=manifest_dir,
+            prefix="%s_" % os.path.basename(self.manifest_path),
+        )
+        try:
+            with os.fdopen(fd, "w") as manifest_file:
+                json.dump(
+                    {
+                        "format": self.manifest_format_version,
+                        "children": {
+                            dirpath: child.manifest
+                            for dirpath, child in self.children.items()
+                            if child.manifest
+                        },
+                    },
+                    manifest_file,
+                )
+            os.rename(temp_path, self.manifest_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
 
     def registerChild(self, dirpath):
         """Register a single by-hash directory.
@@ -371,7 +514,12 @@ def registerChild(self, dirpath):
         the `prune` method.
         """
         if dirpath not in self.children:
-            self.children[dirpath] = ByHash(self.root, dirpath, self.log)
+            manifest = None
+            if self.manifest is not None:
+                manifest = self.manifest.setdefault(dirpath, {})
+            self.children[dirpath] = ByHash(
+                self.root, dirpath, self.log, manifest=manifest
+            )
         return self.children[dirpath]
 
     def add(self, path, lfa, copy_from_path=None):
@@ -387,6 +535,8 @@ def known(self, path, hashname, digest):
     def prune(self):
         for child in self.children.values():
             child.prune()
+        if self.manifest_path is not None:
+            self._saveManifest()
 
 
 class Publisher:
@@ -432,6 +582,19 @@ def __init__(
         # This is a set of suite names as returned by DistroSeries.getSuite.
         self.release_files_needed = set()
 
+        # A shared cache of rendered index stanzas, set up by
+        # C_writeIndexes if enabled.
+        self._stanza_cache = None
+
+        # Pool of processes used by C_writeIndexes to compress index
+        # files, the index files it is still writing, and those it is
+        # still compressing.
+        self._index_executor = None
+        self._open_index_files = []
+        self._pending_index_files = []
+        self._pipeline_indexes = False
+        self._compression_times = defaultdict(float)
+
     def setupArchiveDirs(self):
         self.log.debug("Setting up archive directories.")
         self._config.setupArchiveDirs()
@@ -756,6 +919,48 @@ def C_writeIndexes(self, is_careful):
         Iterates over all distroseries and its pockets and components.
         """
         self.log.debug("* Step C': write indexes directly from DB")
+        # Careful runs still refresh the stanza caches, but render
+        # everything from scratch.
+        cache_stanzas = bool(getFeatureFlag(PUBLISHER_INCREMENTAL_INDEXES))
+        if not is_careful and getFeatureFlag(PUBLISHER_STANZA_CACHE):
+            self._stanza_cache = StanzaCache(logger=self.log)
+        workers = config.archivepublisher.index_compression_workers
+        if workers:
+            # Rendering stays in this process, since it needs the
+            # database, but each index file's compressed variants are
+            # produced in parallel by the pool while later index files are
+            # being rendered.
+            # The workers only need the paths of the files to compress, so
+            # start them afresh rather than forking a process that holds a
+            # database connection.
+            self._index_executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            self._pipeline_indexes = bool(
+                getFeatureFlag(PUBLISHER_INDEX_PIPELINE)
+            )
+        try:
+            self._writeIndexes(is_careful, cache_stanzas)
+            self._waitForIndexes()
+        except BaseException:
+            # Don't publish a partial set of indexes, and don't let any
+            # errors from cleaning up hide the original one.
+            self._abortIndexes()
+            raise
+        finally:
+            if self._index_executor is not None:
+                self._index_executor.shutdown()
+                self._index_executor = None
+            self._pipeline_indexes = False
+        self._reportCompressionTimes()
+        if self._stanza_cache is not None:
+            self._stanza_cache.reportStatsdMetrics()
+            self._stanza_cache = None
+
+    def _writeIndexes(self, is_careful, cache_stanzas):
+        """Write index files for each dirty suite; see `C_writeIndexes`."""
         for distroseries in self.distro:
             for pocket in self.archive.getPockets():
                 if not is_careful:
@@ -772,9 +977,85 @@ def C_writeIndexes(self, is_careful):
                 components = self.archive.getComponentsForSeries(distroseries)
                 for component in components:
                     self._writeComponentIndexes(
-                        distroseries, pocket, component
+                        distroseries,
+                        pocket,
+                        component,
+                        cache_stanzas=cache_stanzas,
+                        reuse=not is_careful,
                     )
 
+    def _makeIndexFile(self, path, distroseries):
+        """Return a `RepositoryIndexFile` for writing the index at `path`."""
+        index_file = RepositoryIndexFile(
+            path,
+            self._config.temproot,
+            distroseries.index_compressors,
+            executor=self._index_executor,
+            pipelined=self._pipeline_indexes,
+        )
+        self._open_index_files.append(index_file)
+        return index_file
+
+    def _closeIndexFile(self, index_file):
+        """Close an index file, publishing it now or in the background."""
+        self._open_index_files.remove(index_file)
+        if self._index_executor is None:
+            index_file.close()
+            self._recordCompressionTimes(index_file)
+        else:
+            index_file.closeInBackground()
+            self._pending_index_files.append(index_file)
+
+    def _waitForIndexes(self):
+        """Publish all index files that are being compressed."""
+        pending, self._pending_index_files = self._pending_index_files, []
+        error = None
+        for index_file in pending:
+            try:
+                index_file.wait()
+            except Exception as e:
+                if error is None:
+                    error = e
+            else:
+                self._recordCompressionTimes(index_file)
+        if error is not None:
+            raise error
+
+    def _abortIndexes(self):
+        """Discard all index files that have not been published yet.
+
+        Compression that has not started yet is cancelled, and the outputs
+        of any that has are thrown away.
+        """
+        index_files = self._open_index_files + self._pending_index_files
+        self._open_index_files = []
+        self._pending_index_files = []
+        for index_file in index_files:
+            try:
+                index_file.abort()
+            except Exception:
+                self.log.exception(
+                    "Failed to discard %s" % index_file.filename
+                )
+
+    def _recordCompressionTimes(self, index_file):
+        """Add up the time spent writing each variant of an index file."""
+        for compression_type, elapsed in index_file.compression_times.items():
+            self._compression_times[compression_type] += elapsed
+
+    def _reportCompressionTimes(self):
+        """Send the time spent writing each kind of index file to statsd."""
+        times, self._compression_times = self._compression_times, (
+            defaultdict(float)
+        )
+        statsd_client = getUtility(IStatsdClient)
+        for compression_type, elapsed in sorted(times.items()):
+            statsd_client.timing(
+                "archivepublisher.index_compression_time",
+                elapsed * 1000,
+                labels={"compression": compression_type.name.lower()},
+            )
+
     def C_updateArtifactoryProperties(self, is_careful):
         """Update Artifactory properties to match our database."""
         self.log.debug("* Step C'': Updating properties in Artifactory")
@@ -1047,13 +1328,197 @@ def createSeriesAliases(self):
                     pass
                 os.symlink(current_suite, alias_suite_path)
 
-    def _writeComponentIndexes(self, distroseries, pocket, component):
+    @property
+    def _by_hash_manifest_root(self):
+        """The directory holding this archive's by-hash manifests.
+
+        These record the entries in each suite's by-hash directories, so
+        that unchanged directories need not be rescanned.
+        """
+        return os.path.join(
+            self._config.temproot, "by-hash-manifest", str(self.archive.id)
+        )
+
+    @property
+    def _index_cache_root(self):
+        """The directory holding this archive's `IndexCache` files.
+
+        Caches are kept in a per-archive tree under the temporary root,
+        mirroring the layout of the dists tree, so that they are never
+        published themselves.
+        """
+        return os.path.join(
+            self._config.temproot, "index-cache", str(self.archive.id)
+        )
+
+    def _getIndexCache(self, index_path, reuse):
+        """Return the `IndexCache` for the index file at `index_path`."""
+        cache_path = os.path.join(
+            self._index_cache_root,
+            os.path.relpath(index_path, self._config.distsroot) + ".json",
+        )
+        return IndexCache(cache_path, reuse=reuse)
+
+    def _getSourceStanzas(self, distroseries, pocket, component, cache):
+        """Yield rendered Sources stanzas for a suite and component.
+
+        If `cache` is not None, stanzas for publications it already
+        holds are reused rather than rendered again, and every stanza is
+        recorded in it.
+        """
+        publishing_set = getUtility(IPublishingSet)
+        spphs = publishing_set.getSourcesForPublishing(
+            archive=self.archive,
+            distroseries=distroseries,
+            pocket=pocket,
+            component=component,
+            preload=cache is None,
+        )
+        if cache is None:
+            for spph in spphs:
+                yield self._renderSourceStanza(spph)
+            return
+
+        spphs = list(spphs)
+        fingerprints = {
+            spph.id: (
+                spph.sourcepackagerelease_id,
+                spph.component_id,
+                spph.section_id,
+            )
+            for spph in spphs
+        }
+        cached = {}
+        for spph in spphs:
+            entry = cache.get(spph.id, fingerprints[spph.id])
+            if entry is not None:
+                cached[spph.id] = entry[0]
+        publishing_set.preloadSourcesForPublishing(
+            [spph for spph in spphs if spph.id not in cached]
+        )
+        for spph in spphs:
+            stanza = cached.get(spph.id)
+            if stanza is None:
+                stanza = self._renderSourceStanza(spph)
+            cache.set(spph.id, fingerprints[spph.id], stanza)
+            yield stanza
+
+    def _renderSourceStanza(self, spph):
+        """Render the Sources stanza for a single source publication."""
+        args = (spph.sourcepackagerelease, spph.component, spph.section)
+        if self._stanza_cache is not None:
+            return self._stanza_cache.getSourceStanza(*args)
+        return build_source_stanza_fields(*args).makeOutput()
+
+    def _renderBinaryStanzas(self, bpph, separate_long_descriptions):
+        """Render the index entries for a single binary publication.
+
+        :return: A tuple of (subcomponent, Packages stanza, Translation-en
+            key, Translation-en stanza); the last two are None unless
+            `separate_long_descriptions` is True.
+        """
+        bpr = bpph.binarypackagerelease
+        subcomp = FORMAT_TO_SUBCOMPONENT.get(bpr.binpackageformat)
+        args = (
+            bpr,
+            bpph.component,
+            bpph.section,
+            bpph.priority,
+            bpph.phased_update_percentage,
+            separate_long_descriptions,
+        )
+        if self._stanza_cache is not None:
+            stanza = self._stanza_cache.getBinaryStanza(*args)
+        else:
+            stanza = build_binary_stanza_fields(*args).makeOutput()
+        translation_key = translation_stanza = None
+        if separate_long_descriptions:
+            # Render the Translation-en stanza against a throwaway set;
+            # the caller deduplicates (Package, Description-md5) pairs
+            # across the whole component.
+            packages = set()
+            translation_stanza = build_translations_stanza_fields(
+                bpr, packages
+            ).makeOutput()
+            [translation_key] = packages
+        return subcomp, stanza, translation_key, translation_stanza
+
+    def _getBinaryStanzas(
+        self, arch, pocket, component, separate_long_descriptions, cache
+    ):
+        """Yield rendered index entries for an architecture and component.
+
+        Each entry is as returned by `_renderBinaryStanzas`.  If `cache`
+        is not None, entries for publications it already holds are reused
+        rather than rendered again, and every entry is recorded in it.
+        """
+        publishing_set = getUtility(IPublishingSet)
+        bpphs = publishing_set.getBinariesForPublishing(
+            archive=self.archive,
+            distroarchseries=arch,
+            pocket=pocket,
+            component=component,
+            preload=cache is None,
+        )
+        if cache is None:
+            for bpph in bpphs:
+                yield self._renderBinaryStanzas(
+                    bpph, separate_long_descriptions
+                )
+            return
+
+        bpphs = list(bpphs)
+        fingerprints = {
+            bpph.id: (
+                bpph.binarypackagerelease_id,
+                bpph.component_id,
+                bpph.section_id,
+                bpph.priority.value,
+                bpph.phased_update_percentage,
+                separate_long_descriptions,
+            )
+            for bpph in bpphs
+        }
+        cached = {}
+        for bpph in bpphs:
+            entry = cache.get(bpph.id, fingerprints[bpph.id])
+            if entry is not None:
+                subcomp, stanza, translation_key, translation_stanza = entry
+                if translation_key is not None:
+                    translation_key = tuple(translation_key)
+                cached[bpph.id] = (
+                    subcomp,
+                    stanza,
+                    translation_key,
+                    translation_stanza,
+                )
+        publishing_set.preloadBinariesForPublishing(
+            [bpph for bpph in bpphs if bpph.id not in cached]
+        )
+        for bpph in bpphs:
+            entry = cached.get(bpph.id)
+            if entry is None:
+                entry = self._renderBinaryStanzas(
+                    bpph, separate_long_descriptions
+                )
+            cache.set(bpph.id, fingerprints[bpph.id], *entry)
+            yield entry
+
+    def _writeComponentIndexes(
+        self, distroseries, pocket, component, cache_stanzas=False, reuse=True
+    ):
         """Write Index files for single distroseries + pocket + component.
 
         Iterates over all supported architectures and 'sources', no
         support for installer-* yet.
         Write contents using LP info to an extra plain file (Packages.lp
         and Sources.lp .
+
+        :param cache_stanzas: If True, keep an `IndexCache` alongside each
+            index file written.
+        :param reuse: If True (and `cache_stanzas` is True), reuse stanzas
+            from the previous run's caches where the corresponding
+            publications have not changed; otherwise render everything.
         """
         suite_name = distroseries.getSuite(pocket)
         self.log.debug(
@@ -1070,7 +1535,7 @@ def _writeComponentIndexes(self, distroseries, pocket, component):
             # descriptions from the Packages.
             separate_long_descriptions = True
             packages = set()
-            translation_en = RepositoryIndexFile(
+            translation_en = self._makeIndexFile(
                 os.path.join(
                     self._config.distsroot,
                     suite_name,
@@ -1078,28 +1543,27 @@ def _writeComponentIndexes(self, distroseries, pocket, component):
                     "i18n",
                     "Translation-en",
                 ),
-                self._config.temproot,
-                distroseries.index_compressors,
+                distroseries,
             )
 
-        source_index = RepositoryIndexFile(
-            get_sources_path(self._config, suite_name, component),
-            self._config.temproot,
-            distroseries.index_compressors,
+        sources_path = get_sources_path(self._config, suite_name, component)
+        source_index = self._makeIndexFile(sources_path, distroseries)
+        source_cache = (
+            self._getIndexCache(sources_path, reuse) if cache_stanzas else None
         )
 
-        for spp in getUtility(IPublishingSet).getSourcesForPublishing(
-            archive=self.archive,
-            distroseries=distroseries,
-            pocket=pocket,
-            component=component,
+        for stanza in self._getSourceStanzas(
+            distroseries, pocket, component, source_cache
         ):
-            stanza = build_source_stanza_fields(
-                spp.sourcepackagerelease, spp.component, spp.section
+            source_index.write(stanza.encode("utf-8") + b"\n\n")
+
+        self._closeIndexFile(source_index)
+        if source_cache is not None:
+            source_cache.save()
+            self.log.debug(
+                "Reused %d of %d Sources stanzas"
+                % (source_cache.hits, source_cache.hits + source_cache.misses)
             )
-            source_index.write(stanza.makeOutput().encode("utf-8") + b"\n\n")
-
-        source_index.close()
 
         for arch in distroseries.architectures:
             if not arch.enabled:
@@ -1109,67 +1573,70 @@ def _writeComponentIndexes(self, distroseries, pocket, component):
 
             self.log.debug("Generating Packages for %s" % arch_path)
 
-            indices = {}
-            indices[None] = RepositoryIndexFile(
-                get_packages_path(self._config, suite_name, component, arch),
-                self._config.temproot,
-                distroseries.index_compressors,
+            packages_path = get_packages_path(
+                self._config, suite_name, component, arch
             )
+            indices = {}
+            indices[None] = self._makeIndexFile(packages_path, distroseries)
 
             for subcomp in self.subcomponents:
-                indices[subcomp] = RepositoryIndexFile(
+                indices[subcomp] = self._makeIndexFile(
                     get_packages_path(
                         self._config, suite_name, component, arch, subcomp
                     ),
-                    self._config.temproot,
-                    distroseries.index_compressors,
+                    distroseries,
                 )
 
-            for bpp in getUtility(IPublishingSet).getBinariesForPublishing(
-                archive=self.archive,
-                distroarchseries=arch,
-                pocket=pocket,
-                component=component,
+            # A single cache covers the main Packages file and its
+            # subcomponents, since they come from the same query.
+            binary_cache = (
+                self._getIndexCache(packages_path, reuse)
+                if cache_stanzas
+                else None
+            )
+
+            for (
+                subcomp,
+                stanza,
+                translation_key,
+                translation_stanza,
+            ) in self._getBinaryStanzas(
+                arch,
+                pocket,
+                component,
+                separate_long_descriptions,
+                binary_cache,
             ):
-                subcomp = FORMAT_TO_SUBCOMPONENT.get(
-                    bpp.binarypackagerelease.binpackageformat
-                )
                 if subcomp not in indices:
                     # Skip anything that we're not generating indices
                     # for, eg. ddebs where publish_debug_symbols is
                     # disabled.
                     continue
-                stanza = build_binary_stanza_fields(
-                    bpp.binarypackagerelease,
-                    bpp.component,
-                    bpp.section,
-                    bpp.priority,
-                    bpp.phased_update_percentage,
-                    separate_long_descriptions,
-                )
-                indices[subcomp].write(
-                    stanza.makeOutput().encode("utf-8") + b"\n\n"
-                )
+                indices[subcomp].write(stanza.encode("utf-8") + b"\n\n")
                 if separate_long_descriptions:
-                    # If the (Package, Description-md5) pair already exists
-                    # in the set, build_translations_stanza_fields will
-                    # return None. Otherwise it will add the pair to
-                    # the set and return a stanza to be written to
-                    # Translation-en.
-                    translation_stanza = build_translations_stanza_fields(
-                        bpp.binarypackagerelease, packages
-                    )
-                    if translation_stanza is not None:
+                    # Only write each (Package, Description-md5) pair to
+                    # Translation-en once.
+                    if translation_key not in packages:
+                        packages.add(translation_key)
                         translation_en.write(
-                            translation_stanza.makeOutput().encode("utf-8")
-                            + b"\n\n"
+                            translation_stanza.encode("utf-8") + b"\n\n"
                         )
 
             for index in indices.values():
-                index.close()
+                self._closeIndexFile(index)
+            if binary_cache is not None:
+                binary_cache.save()
+                self.log.debug(
+                    "Reused %d of %d Packages stanzas for %s"
+                    % (
+                        binary_cache.hits,
+                        binary_cache.hits + binary_cache.misses,
+                        arch_path,
+                    )
+                )
 
         if separate_long_descriptions:
-            translation_en.close()
+            self._closeIndexFile(translation_en)
 
     def checkDirtySuiteBeforePublishing(self, distroseries, pocket):
         """Last check before publishing a dirty suite.
@@ -1283,7 +1750,13 @@ def _updateByHash(self, suite, release_file_name, extra_files):
         archive_file_set = getUtility(IArchiveFileSet)
         container = "release:%s" % suite
 
-        by_hashes = ByHashes(self._config.distsroot, self.log)
+        by_hashes = ByHashes(
+            self._config.distsroot,
+            self.log,
+            manifest_path=os.path.join(
+                self._by_hash_manifest_root, "%s.json" % suite
+            ),
+        )
         existing_live_files = {}
         existing_nonlive_files = {}
         reapable_files = set()
@@ -1835,7 +2308,12 @@ def deleteArchive(self):
         for pub in self.archive.getAllPublishedBinaries(include_removed=False):
             pub.dateremoved = UTC_NOW
 
-        for directory in (self._config.archiveroot, self._config.metaroot):
+        for directory in (
+            self._config.archiveroot,
+            self._config.metaroot,
+            self._index_cache_root,
+            self._by_hash_manifest_root,
+        ):
             if directory is None or not os.path.exists(directory):
                 continue
             try:
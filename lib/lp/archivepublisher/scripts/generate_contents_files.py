@@ -5,14 +5,18 @@
 
 __all__ = [
     "GenerateContentsFiles",
+    "NATIVE_CONTENTS_FEATURE_FLAG",
 ]
 
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
 from optparse import OptionValueError
 
 from zope.component import getUtility
 
 from lp.archivepublisher.config import getPubConfig
+from lp.archivepublisher.contents import ContentsGenerator, write_contents_file
 from lp.archivepublisher.publishing import cannot_modify_suite
 from lp.registry.interfaces.distribution import IDistributionSet
 from lp.registry.interfaces.pocket import PackagePublishingPocket
@@ -26,6 +30,7 @@
     DatabaseBlockedPolicy,
     StandbyOnlyDatabasePolicy,
 )
+from lp.services.features import getFeatureFlag
 from lp.services.osutils import ensure_directory_exists
 from lp.services.scripts.base import (
     LaunchpadCronScript,
@@ -33,6 +38,11 @@
 )
 from lp.services.utils import file_exists
 
+# If this feature flag is set, generate Contents files in-process from the
+# file lists recorded when binary packages were uploaded, rather than by
+# running apt-ftparchive over the pool.
+NATIVE_CONTENTS_FEATURE_FLAG = "archivepublisher.native_contents.enabled"
+
 COMPONENTS = [
     "main",
     "restricted",
@@ -110,6 +120,17 @@ def add_my_options(self):
             default=None,
             help="Distribution to generate Contents files for.",
         )
+        self.parser.add_option(
+            "--workers",
+            dest="workers",
+            type="int",
+            default=1,
+            metavar="N",
+            help=(
+                "Write Contents files for up to N architectures in parallel "
+                "when generating them natively (default: 1)."
+            ),
+        )
 
     @property
     def name(self):
@@ -131,6 +152,8 @@ def processOptions(self):
             raise OptionValueError(
                 "Distribution '%s' not found." % self.options.distribution
             )
+        if self.options.workers < 1:
+            raise OptionValueError("--workers must be at least 1.")
 
     def setUpContentArchive(self):
         """Make sure the `content_archive` directories exist."""
@@ -262,6 +285,63 @@ def generateContentsFiles(self, override_root, distro_name):
         self.copyOverrides(override_root)
         self.runAptFTPArchive(distro_name)
 
+    def updateNativeContentsCaches(self, suites):
+        """Bring the native Contents generator's caches up to date.
+
+        :return: A list of (cache path, Contents file path) tuples.
+        """
+        generator = ContentsGenerator(
+            self.distribution.main_archive,
+            self.config.poolroot,
+            os.path.join(
+                self.content_archive,
+                "%s-cache" % self.distribution.name,
+                "contents",
+            ),
+            self.logger,
+        )
+        contents_files = []
+        for suite in suites:
+            series, pocket = self.distribution.getDistroSeriesAndPocket(suite)
+            for das in series.enabled_architectures:
+                cache_path = generator.updateCache(suite, das, pocket)
+                contents_files.append(
+                    (
+                        cache_path,
+                        os.path.join(
+                            self.content_archive,
+                            self.distribution.name,
+                            "dists",
+                            suite,
+                            "Contents-%s" % das.architecturetag,
+                        ),
+                    )
+                )
+        return contents_files
+
+    def writeNativeContentsFiles(self, contents_files):
+        """Write Contents files from the native generator's caches.
+
+        This method may take a long time to run.
+        This method won't access the database.
+
+        :param contents_files: A list of (cache path, Contents file path)
+            tuples, as returned by `updateNativeContentsCaches`.
+        """
+        self.logger.debug("Writing %d Contents files.", len(contents_files))
+        if self.options.workers > 1 and len(contents_files) > 1:
+            # Don't fork the script's database connection into the
+            # workers; they only read caches and write files.
+            with ProcessPoolExecutor(
+                max_workers=self.options.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as executor:
+                # Consume the results so that any exceptions are raised.
+                list(executor.map(write_contents_file, *zip(*contents_files)))
+        else:
+            for cache_path, contents_path in contents_files:
+                write_contents_file(cache_path, contents_path)
+
     def updateContentsFile(self, suite, arch):
         """Update Contents file, if it has changed."""
         contents_dir = os.path.join(
@@ -320,17 +400,26 @@ def process(self):
         """Do the bulk of the work."""
         self.setUp()
         suites = list(self.getSuites())
-        self.writeAptContentsConf(suites)
-        self.createComponentDirs(suites)
+        if getFeatureFlag(NATIVE_CONTENTS_FEATURE_FLAG):
+            contents_files = self.updateNativeContentsCaches(suites)
+
+            # This takes a while.  Ensure that we do it without keeping a
+            # database transaction open.
+            self.txn.commit()
+            with DatabaseBlockedPolicy():
+                self.writeNativeContentsFiles(contents_files)
+        else:
+            self.writeAptContentsConf(suites)
+            self.createComponentDirs(suites)
 
-        overrideroot = self.config.overrideroot
-        distro_name = self.distribution.name
+            overrideroot = self.config.overrideroot
+            distro_name = self.distribution.name
 
-        # This takes a while.  Ensure that we do it without keeping a
-        # database transaction open.
-        self.txn.commit()
-        with DatabaseBlockedPolicy():
-            self.generateContentsFiles(overrideroot, distro_name)
+            # This takes a while.  Ensure that we do it without keeping a
+            # database transaction open.
+            self.txn.commit()
+            with DatabaseBlockedPolicy():
+                self.generateContentsFiles(overrideroot, distro_name)
 
         self.updateContentsFiles(suites)
 
@@ -7,7 +7,10 @@
     "PublishDistro",
 ]
 
+import multiprocessing
 import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from filecmp import dircmp
 from optparse import OptionValueError
 from pathlib import Path
@@ -19,6 +22,7 @@
 from shutil import copy
 from subprocess import CalledProcessError, check_call
 
+from storm.expr import Count
 from storm.store import Store
 from zope.component import getUtility
 
@@ -30,7 +34,13 @@
     getPublisher,
 )
 from lp.archivepublisher.scripts.base import PublisherScript
+from lp.services import scripts
 from lp.services.config import config
+from lp.services.database.interfaces import IStore
+from lp.services.features import (
+    install_feature_controller,
+    make_script_feature_controller,
+)
 from lp.services.limitedlist import LimitedList
 from lp.services.scripts.base import LaunchpadScriptFailure
 from lp.services.webapp.adapter import (
@@ -41,8 +51,13 @@
     ArchivePublishingMethod,
     ArchivePurpose,
     ArchiveStatus,
+    PackagePublishingStatus,
 )
 from lp.soyuz.interfaces.archive import MAIN_ARCHIVE_PURPOSES, IArchiveSet
+from lp.soyuz.model.publishing import (
+    BinaryPackagePublishingHistory,
+    SourcePackagePublishingHistory,
+)
 
 
 def is_ppa_private(ppa):
@@ -68,11 +83,48 @@ def has_oval_data_changed(incoming_dir, published_dir):
     )
 
 
+# The script used by a worker process to publish archives; see
+# `PublishDistro.processArchivesConcurrently`.
+_worker_script = None
+
+
+def init_publisher_worker(name, dbuser, options, reset_store):
+    """Set up a worker process to publish archives.
+
+    Workers are started afresh rather than forked, so this gives each of
+    them its own component architecture, database connection and store.
+    """
+    global _worker_script
+    script = PublishDistro(
+        name, dbuser=dbuser, test_args=[], ignore_cron_control=True
+    )
+    script.options = options
+    script.logger = scripts.logger(options, name)
+    script._init_zca(use_web_security=False)
+    script._init_db(isolation="read_committed")
+    install_feature_controller(make_script_feature_controller(name))
+    script.reset_store = reset_store
+    _worker_script = script
+
+
+def publish_archive_in_worker(archive_id):
+    """Publish an archive in a worker process.
+
+    :return: A tuple of `archive_id` and whether it was published
+        successfully.
+    """
+    return _worker_script.processArchiveInWorker(archive_id)
+
+
 class PublishDistro(PublisherScript):
     """Distro publisher."""
 
     lockfilename = GLOBAL_PUBLISHER_LOCK
 
+    # Whether worker processes reset their store after each archive; see
+    # `init_publisher_worker`.
+    reset_store = True
+
     def add_my_options(self):
         self.addDistroOptions()
 
@@ -234,6 +286,18 @@ def add_my_options(self):
             help="Only run over the archive identified by this reference.",
         )
 
+        self.parser.add_option(
+            "--workers",
+            dest="workers",
+            metavar="NUM",
+            type="int",
+            default=1,
+            help=(
+                "Publish up to NUM archives concurrently, starting with "
+                "those with the most pending publications."
+            ),
+        )
+
     def isCareful(self, option):
         """Is the given "carefulness" option enabled?
 
@@ -318,6 +382,9 @@ def validateOptions(self):
                 "We should not define 'distsroot' in PPA mode!",
             )
 
+        if self.options.workers < 1:
+            raise OptionValueError("--workers must be at least 1.")
+
     def findSuite(self, distribution, suite):
         """Find the named `suite` in the selected `Distribution`.
 
@@ -597,6 +664,98 @@ def processArchive(self, archive_id, reset_store=True):
                 # store and cause performance problems.
                 Store.of(archive).reset()
 
+    def getPendingPublicationCounts(self, archive_ids):
+        """Count the pending publications in each of the given archives.
+
+        :return: A dict mapping archive IDs to the number of pending source
+            and binary publications in each.
+        """
+        counts = defaultdict(int)
+        for pub_class in (
+            SourcePackagePublishingHistory,
+            BinaryPackagePublishingHistory,
+        ):
+            rows = (
+                IStore(pub_class)
+                .find(
+                    (pub_class.archive_id, Count()),
+                    pub_class.archive_id.is_in(archive_ids),
+                    pub_class.status == PackagePublishingStatus.PENDING,
+                )
+                .group_by(pub_class.archive_id)
+            )
+            for archive_id, count in rows:
+                counts[archive_id] += count
+        return counts
+
+    def processArchiveInWorker(self, archive_id):
+        """Publish an archive, logging rather than raising any failure.
+
+        This runs in a worker process set up by `init_publisher_worker`.
+
+        :return: A tuple of `archive_id` and whether it was published
+            successfully.
+        """
+        try:
+            self.processArchive(archive_id, reset_store=self.reset_store)
+        except Exception:
+            self.logger.exception("Failed to publish archive %d.", archive_id)
+            self.txn.abort()
+            return archive_id, False
+        return archive_id, True
+
+    def makeWorkerPool(self, workers, reset_store):
+        """Start a pool of `workers` processes to publish archives."""
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            # Forking a process that has database connections and
+            # perhaps other threads is unsafe, so start workers afresh.
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_publisher_worker,
+            initargs=(self.name, self.dbuser, self.options, reset_store),
+        )
+
+    def processArchivesConcurrently(self, archive_ids, reset_store=True):
+        """Publish `archive_ids` using `self.options.workers` processes.
+
+        Each worker process has its own database connection and store.
+        Archives with the most pending publications are published first.
+        A failure to publish one archive is logged by its worker and does
+        not affect the others.
+        """
+        counts = self.getPendingPublicationCounts(archive_ids)
+        archive_ids = sorted(
+            archive_ids, key=lambda archive_id: -counts[archive_id]
+        )
+        # End our transaction; the workers have their own.
+        self.txn.commit()
+
+        failed_archive_ids = []
+        workers = min(self.options.workers, len(archive_ids))
+        if workers:
+            with self.makeWorkerPool(workers, reset_store) as pool:
+                # Pools hand out work in the order it was submitted.
+                futures = [
+                    pool.submit(publish_archive_in_worker, archive_id)
+                    for archive_id in archive_ids
+                ]
+                for future in futures:
+                    archive_id, succeeded = future.result()
+                    if not succeeded:
+                        failed_archive_ids.append(archive_id)
+
+        if failed_archive_ids:
+            raise LaunchpadScriptFailure(
+                "Failed to publish %d archive(s): %s"
+                % (
+                    len(failed_archive_ids),
+                    ", ".join(
+                        str(archive_id)
+                        for archive_id in sorted(failed_archive_ids)
+                    ),
+                )
+            )
+
     def rsyncOVALData(self):
         # Ensure that the rsync paths have a trailing slash.
         rsync_src = os.path.join(
@@ -707,9 +866,14 @@ def main(self, reset_store_between_archives=True):
                     )
                 archive_ids.append(archive.id)
 
-        for archive_id in archive_ids:
-            self.processArchive(
-                archive_id, reset_store=reset_store_between_archives
+        if self.options.workers > 1:
+            self.processArchivesConcurrently(
+                archive_ids, reset_store=reset_store_between_archives
             )
+        else:
+            for archive_id in archive_ids:
+                self.processArchive(
+                    archive_id, reset_store=reset_store_between_archives
+                )
 
         self.logger.debug("Ciao")
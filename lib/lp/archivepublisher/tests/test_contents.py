@@ -0,0 +1,145 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the native Contents file generator."""
+
+import gzip
+import os
+
+from zope.component import getUtility
+from zope.security.proxy import removeSecurityProxy
+
+from lp.archivepublisher.contents import ContentsGenerator, write_contents_file
+from lp.archivepublisher.indexcache import IndexCache
+from lp.services.log.logger import BufferLogger
+from lp.soyuz.enums import BinaryPackageFormat, PackagePublishingStatus
+from lp.soyuz.interfaces.binarypackagereleasecontents import (
+    IBinaryPackageReleaseContentsSet,
+)
+from lp.soyuz.interfaces.component import IComponentSet
+from lp.testing import TestCase, TestCaseWithFactory
+from lp.testing.layers import LaunchpadZopelessLayer
+
+
+class TestWriteContentsFile(TestCase):
+    def test_writes_sorted_paths_with_locations(self):
+        temp_dir = self.makeTemporaryDirectory()
+        cache_path = os.path.join(temp_dir, "Contents-i386.json")
+        contents_path = os.path.join(temp_dir, "dists", "Contents-i386")
+        cache = IndexCache(cache_path)
+        cache.set(1, (), "devel/foo", ["usr/bin/foo", "usr/share/common"])
+        cache.set(2, (), "universe/net/bar", ["usr/share/common", "bin/bar"])
+        cache.save()
+
+        write_contents_file(cache_path, contents_path)
+
+        with open(contents_path, "rb") as contents_file:
+            contents = contents_file.read()
+        self.assertEqual(
+            b"bin/bar%s universe/net/bar\n"
+            b"usr/bin/foo%s devel/foo\n"
+            b"usr/share/common%s devel/foo,universe/net/bar\n"
+            % (b" " * 52, b" " * 48, b" " * 43),
+            contents,
+        )
+        with gzip.open(contents_path + ".gz", "rb") as compressed_file:
+            self.assertEqual(contents, compressed_file.read())
+
+
+class TestContentsGenerator(TestCaseWithFactory):
+    layer = LaunchpadZopelessLayer
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = self.makeTemporaryDirectory()
+        self.das = self.factory.makeDistroArchSeries()
+        self.archive = self.das.distroseries.main_archive
+        self.logger = BufferLogger()
+        self.generator = ContentsGenerator(
+            self.archive,
+            os.path.join(self.temp_dir, "pool"),
+            os.path.join(self.temp_dir, "cache"),
+            self.logger,
+        )
+
+    def makePublishedBinary(self, paths=None, **kwargs):
+        bpph = self.factory.makeBinaryPackagePublishingHistory(
+            archive=self.archive,
+            distroarchseries=self.das,
+            status=PackagePublishingStatus.PUBLISHED,
+            with_file=True,
+            **kwargs,
+        )
+        if paths is not None:
+            getUtility(IBinaryPackageReleaseContentsSet).add(
+                bpph.binarypackagerelease, paths
+            )
+        return bpph
+
+    def getContents(self, pocket):
+        suite = self.das.distroseries.getSuite(pocket)
+        cache_path = self.generator.updateCache(suite, self.das, pocket)
+        contents_path = os.path.join(self.temp_dir, "Contents")
+        write_contents_file(cache_path, contents_path)
+        with open(contents_path, "rb") as contents_file:
+            return [line.split() for line in contents_file]
+
+    def test_uses_recorded_contents(self):
+        bpph = self.makePublishedBinary(
+            paths=[b"usr/bin/foo"], component="universe"
+        )
+        self.makePublishedBinary(
+            paths=[b"usr/bin/bar"],
+            pocket=bpph.pocket,
+            binpackageformat=BinaryPackageFormat.UDEB,
+        )
+        self.assertEqual(
+            [
+                [
+                    b"usr/bin/foo",
+                    (
+                        "universe/%s/%s"
+                        % (bpph.section.name, bpph.binary_package_name)
+                    ).encode("UTF-8"),
+                ]
+            ],
+            self.getContents(bpph.pocket),
+        )
+
+    def test_reuses_cache(self):
+        # Packages seen by an earlier run are not looked up again, but
+        # changes to their overrides are picked up.
+        bpph = self.makePublishedBinary(paths=[b"usr/bin/foo"])
+        self.getContents(bpph.pocket)
+        removeSecurityProxy(bpph).component = getUtility(IComponentSet)[
+            "multiverse"
+        ]
+        self.logger.clearLogBuffer()
+        self.assertEqual(
+            [
+                [
+                    b"usr/bin/foo",
+                    (
+                        "multiverse/%s/%s"
+                        % (bpph.section.name, bpph.binary_package_name)
+                    ).encode("UTF-8"),
+                ]
+            ],
+            self.getContents(bpph.pocket),
+        )
+        self.assertIn("1 cached packages, 0 new", self.logger.getLogBuffer())
+
+    def test_drops_packages_no_longer_published(self):
+        bpph = self.makePublishedBinary(paths=[b"usr/bin/foo"])
+        self.assertNotEqual([], self.getContents(bpph.pocket))
+        removeSecurityProxy(bpph).status = PackagePublishingStatus.SUPERSEDED
+        self.assertEqual([], self.getContents(bpph.pocket))
+
+    def test_skips_unreadable_packages(self):
+        # A package with no recorded contents is read from the pool; if
+        # that fails, it is left out with a warning.
+        bpph = self.makePublishedBinary()
+        self.assertEqual([], self.getContents(bpph.pocket))
+        self.assertIn(
+            "WARNING Cannot read contents of", self.logger.getLogBuffer()
+        )
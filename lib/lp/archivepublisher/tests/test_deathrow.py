@@ -5,8 +5,10 @@
 
 import shutil
 import tempfile
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+from testtools.matchers import Equals
 from zope.component import getUtility
 
 from lp.archivepublisher.artifactory import ArtifactoryPool
@@ -19,11 +21,14 @@
     ArchivePublishingMethod,
     ArchivePurpose,
     ArchiveRepositoryFormat,
+    PackagePublishingStatus,
 )
 from lp.soyuz.interfaces.component import IComponentSet
+from lp.soyuz.model.publishing import SourcePackagePublishingHistory
 from lp.soyuz.tests.test_publishing import SoyuzTestPublisher
-from lp.testing import TestCaseWithFactory
+from lp.testing import StormStatementRecorder, TestCaseWithFactory
 from lp.testing.layers import LaunchpadZopelessLayer
+from lp.testing.matchers import HasQueryCount
 
 
 class TestDeathRow(TestCaseWithFactory):
@@ -36,7 +41,7 @@ def getTestPublisher(self, distroseries):
         stp.setUpDefaultDistroSeries(distroseries)
         return stp
 
-    def getDeathRow(self, archive):
+    def getDeathRow(self, archive, workers=1):
         """Return an `DeathRow` for the given archive.
 
         Created the temporary 'pool' and 'temp' directories and register
@@ -53,7 +58,7 @@ def clean_pool(pool_path, temp_path):
 
         logger = BufferLogger()
         diskpool = DiskPool(archive, pool_path, temp_path, logger)
-        return DeathRow(archive, diskpool, logger)
+        return DeathRow(archive, diskpool, logger, workers=workers)
 
     def getDiskPoolPath(self, pub, pub_file, diskpool):
         """Return the absolute path to a published file in the disk pool/."""
@@ -171,3 +176,173 @@ def test_skips_conda_source_packages(self):
         self.assertIsNone(pub_source.dateremoved)
         deathrow.reap()
         self.assertIsNotNone(pub_source.dateremoved)
+
+    def makeCondemnedSources(self, stp, count, start=0, **kwargs):
+        """Create some source publications that are ready to be removed.
+
+        Each has a single file of a different size.
+        """
+        past_date = datetime.now(timezone.utc) - timedelta(days=1)
+        return [
+            stp.getPubSource(
+                sourcename="condemned%d" % i,
+                filecontent=b"X" * (i + 1),
+                status=PackagePublishingStatus.SUPERSEDED,
+                scheduleddeletiondate=past_date,
+                **kwargs,
+            )
+            for i in range(start, start + count)
+        ]
+
+    def getFileKeys(self, pubs):
+        return {
+            (
+                pub_file.libraryfile.filename,
+                pub_file.libraryfile.content.sha256,
+            )
+            for pub in pubs
+            for pub_file in pub.files
+        }
+
+    def test_getRemovableFiles(self):
+        # getRemovableFiles excludes files that are still referenced by a
+        # live or quarantined publication.
+        ubuntu = getUtility(IDistributionSet).getByName("ubuntu")
+        hoary = ubuntu.getSeries("hoary")
+        stp = self.getTestPublisher(hoary)
+        deathrow = self.getDeathRow(hoary.main_archive)
+        condemned = self.makeCondemnedSources(stp, 3)
+        future_date = datetime.now(timezone.utc) + timedelta(days=1)
+        postponed = stp.getPubSource(
+            sourcename="condemned1",
+            version="667",
+            status=PackagePublishingStatus.SUPERSEDED,
+            scheduleddeletiondate=future_date,
+        )
+        published = stp.getPubSource(sourcename="condemned2", version="668")
+        # Share the condemned publications' files with the others.
+        for pub, shared_pub in (
+            (postponed, condemned[1]),
+            (published, condemned[2]),
+        ):
+            for pub_file in shared_pub.files:
+                pub.sourcepackagerelease.addFile(pub_file.libraryfile)
+        self.layer.commit()
+
+        self.assertEqual(
+            self.getFileKeys(condemned[:1]),
+            deathrow.getRemovableFiles(
+                SourcePackagePublishingHistory, self.getFileKeys(condemned)
+            ),
+        )
+
+    def test_getRemovableFiles_query_count(self):
+        # The number of queries issued by getRemovableFiles depends on the
+        # number of batches of files, not on the number of files.
+        ubuntu = getUtility(IDistributionSet).getByName("ubuntu")
+        hoary = ubuntu.getSeries("hoary")
+        stp = self.getTestPublisher(hoary)
+        deathrow = self.getDeathRow(hoary.main_archive)
+        deathrow.check_batch_size = 4
+        condemned = self.makeCondemnedSources(stp, 8)
+        self.layer.commit()
+        file_keys = self.getFileKeys(condemned)
+
+        with StormStatementRecorder() as recorder:
+            removable = deathrow.getRemovableFiles(
+                SourcePackagePublishingHistory, file_keys
+            )
+        self.assertEqual(file_keys, removable)
+        self.assertThat(recorder, HasQueryCount(Equals(2)))
+
+    def test_reap_with_workers(self):
+        # Files may be removed from the pool by several threads.
+        ubuntu = getUtility(IDistributionSet).getByName("ubuntu")
+        hoary = ubuntu.getSeries("hoary")
+        stp = self.getTestPublisher(hoary)
+        deathrow = self.getDeathRow(hoary.main_archive, workers=3)
+        condemned = self.makeCondemnedSources(stp, 5)
+        self.layer.commit()
+        for pub in condemned:
+            pub.publish(deathrow.diskpool, deathrow.logger)
+        paths = [
+            self.getDiskPoolPath(pub, pub_file, deathrow.diskpool)
+            for pub in condemned
+            for pub_file in pub.files
+        ]
+        for path in paths:
+            self.assertIsFile(path)
+
+        deathrow.reap()
+
+        for pub in condemned:
+            self.assertIsNotNone(pub.dateremoved)
+        for path in paths:
+            self.assertDoesNotExist(path)
+        self.assertIn(
+            "INFO Total bytes freed: 15", deathrow.logger.getLogBuffer()
+        )
+
+    def test_reap_with_workers_uses_file_names(self):
+        # The workers are only given plain file names to remove, never
+        # database objects.
+        ubuntu = getUtility(IDistributionSet).getByName("ubuntu")
+        hoary = ubuntu.getSeries("hoary")
+        stp = self.getTestPublisher(hoary)
+        deathrow = self.getDeathRow(hoary.main_archive, workers=3)
+        condemned = self.makeCondemnedSources(stp, 2)
+        self.layer.commit()
+        for pub in condemned:
+            pub.publish(deathrow.diskpool, deathrow.logger)
+        calls = []
+        remove_file = deathrow._removeFile
+
+        def record_remove_file(*args):
+            calls.append(args)
+            return remove_file(*args)
+
+        deathrow._removeFile = record_remove_file
+
+        deathrow.reap()
+
+        self.assertEqual(
+            sorted(
+                (
+                    pub.component.name,
+                    pub.pool_name,
+                    pub.pool_version,
+                    None,
+                    pub_file.libraryfile.filename,
+                )
+                for pub in condemned
+                for pub_file in pub.files
+            ),
+            sorted(calls),
+        )
+
+    def test_reap_dry_run_reports_bytes(self):
+        # A dry run leaves the pool alone, but reports how many bytes would
+        # be freed in each component.
+        ubuntu = getUtility(IDistributionSet).getByName("ubuntu")
+        hoary = ubuntu.getSeries("hoary")
+        stp = self.getTestPublisher(hoary)
+        deathrow = self.getDeathRow(hoary.main_archive)
+        condemned = self.makeCondemnedSources(stp, 2)
+        condemned.extend(
+            self.makeCondemnedSources(stp, 1, start=2, component="universe")
+        )
+        self.layer.commit()
+        for pub in condemned:
+            pub.publish(deathrow.diskpool, deathrow.logger)
+
+        deathrow.reap(dry_run=True)
+
+        for pub in condemned:
+            for pub_file in pub.files:
+                self.assertIsFile(
+                    self.getDiskPoolPath(pub, pub_file, deathrow.diskpool)
+                )
+        log = deathrow.logger.getLogBuffer()
+        self.assertIn("INFO Total bytes that would be freed: 6", log)
+        self.assertIn("INFO   main: 2 files, 3 bytes", log)
+        self.assertIn("INFO   universe: 1 files, 3 bytes", log)
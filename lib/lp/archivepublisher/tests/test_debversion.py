@@ -12,6 +12,8 @@
     BadUpstreamError,
     Version,
     VersionError,
+    sort_by_version,
+    version_sort_key,
 )
 
 
@@ -123,6 +125,45 @@ def testComparisons(self):
         for x, y in self.COMPARISONS:
             self.assertTrue(Version(x) < Version(y))
 
+    def testSortKeyComparisons(self):
+        """Sort keys should order versions as dpkg does."""
+        for x, y in self.COMPARISONS:
+            self.assertLess(version_sort_key(x), version_sort_key(y))
+
+    def testSortKeyEquality(self):
+        """Versions that dpkg considers equal should have equal sort keys."""
+        for x, y in (
+            ("1.0", "0:1.0"),
+            ("1.0", "1.0-0"),
+            ("1.0", "1.00"),
+            ("1.0", "1."),
+            ("1.01-1", "1.1-1"),
+        ):
+            self.assertEqual(version_sort_key(x), version_sort_key(y))
+
+    def testSortKeyLeadingZero(self):
+        """A leading zero is compared before anything that follows it."""
+        self.assertLess(version_sort_key("0~1"), version_sort_key("0"))
+        self.assertLess(version_sort_key("0"), version_sort_key("0a"))
+        self.assertLess(version_sort_key("1.0-~1"), version_sort_key("1.0"))
+
+    def testSortByVersion(self):
+        """sort_by_version should sort by version, highest last."""
+        self.assertEqual(
+            ["1.0~rc1", "1.0", "1.0-1", "1.2", "1.10", "1:0.1"],
+            sort_by_version(
+                ["1.10", "1:0.1", "1.0", "1.2", "1.0-1", "1.0~rc1"]
+            ),
+        )
+
+    def testSortByVersionKeyReverse(self):
+        """sort_by_version should accept a key function and reverse."""
+        items = [("b", "2.0"), ("a", "10.0"), ("c", "2.0~1")]
+        self.assertEqual(
+            [("a", "10.0"), ("b", "2.0"), ("c", "2.0~1")],
+            sort_by_version(items, key=lambda item: item[1], reverse=True),
+        )
+
     def testNullEpochIsZero(self):
         """Version should treat an omitted epoch as a zero one."""
         self.assertEqual(Version("1.0"), Version("0:1.0"))
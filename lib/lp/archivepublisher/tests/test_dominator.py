@@ -26,6 +26,7 @@
 from lp.archivepublisher.publishing import Publisher
 from lp.registry.interfaces.pocket import PackagePublishingPocket
 from lp.registry.interfaces.series import SeriesStatus
+from lp.services.database.interfaces import IStore
 from lp.services.log.logger import DevNullLogger
 from lp.soyuz.adapters.packagelocation import PackageLocation
 from lp.soyuz.enums import BinaryPackageFormat, PackagePublishingStatus
@@ -33,6 +34,7 @@
     IPublishingSet,
     ISourcePackagePublishingHistory,
 )
+from lp.soyuz.model.publishing import SourcePackagePublishingHistory
 from lp.soyuz.tests.test_publishing import TestNativePublishingBase
 from lp.testing import (
     StormStatementRecorder,
@@ -193,6 +195,48 @@ def testJudgeAndDominateWithDDEBs(self):
             PackagePublishingStatus.SUPERSEDED,
         )
 
+    def testDominateDDEBsAcrossArchitectures(self):
+        """DDEBs are superseded by the dominant of their own architecture.
+
+        Each architecture-specific DDEB publication is superseded along
+        with the DEB publication built alongside it, so it must point at
+        the dominant build for the same architecture.
+        """
+        ppa = self.factory.makeArchive()
+        pubs = {}
+        for version in ("1.0", "1.1"):
+            source = self.getPubSource(
+                version=version,
+                archive=ppa,
+                architecturehintlist="any",
+                status=PackagePublishingStatus.PUBLISHED,
+            )
+            pubs[version] = self.getPubBinaries(
+                pub_source=source,
+                with_debug=True,
+                status=PackagePublishingStatus.PUBLISHED,
+            )
+
+        dominator = Dominator(self.logger, ppa)
+        dominator.judgeAndDominate(
+            self.breezy_autotest, PackagePublishingPocket.RELEASE
+        )
+
+        self.checkPublications(pubs["1.1"], PackagePublishingStatus.PUBLISHED)
+        dominant_builds = {
+            pub.distroarchseries: pub.binarypackagerelease.build
+            for pub in pubs["1.1"]
+        }
+        self.assertEqual(
+            {self.breezy_autotest_i386, self.breezy_autotest_hppa},
+            set(dominant_builds),
+        )
+        self.checkPublications(pubs["1.0"], PackagePublishingStatus.SUPERSEDED)
+        for pub in pubs["1.0"]:
+            self.assertEqual(
+                dominant_builds[pub.distroarchseries], pub.supersededby
+            )
+
     def test_dominateBinaries_rejects_empty_publication_list(self):
         """Domination asserts for non-empty input list."""
         with lp_dbuser():
@@ -1602,6 +1646,82 @@ def test_findSourcesForDomination_ignores_other_status(self):
             ),
         )
 
+    def test_findSourcesForDomination_sorts_by_version(self):
+        # findSourcesForDomination returns publications sorted from most
+        # to least current, using Debian version ordering.
+        spphs = make_spphs_for_versions(
+            self.factory, ["1.0", "1.0~rc1", "1.10", "1.9", "1:0.1"]
+        )
+        dominator = self.makeDominator(spphs)
+        self.assertEqual(
+            [spphs[4], spphs[2], spphs[3], spphs[0], spphs[1]],
+            list(
+                dominator.findSourcesForDomination(
+                    spphs[0].distroseries, spphs[0].pocket
+                )
+            ),
+        )
+
+    def test_findBinariesForDomination_sorts_by_version(self):
+        # findBinariesForDomination returns publications sorted from most
+        # to least current, using Debian version ordering.
+        bpphs = make_bpphs_for_versions(
+            self.factory, ["1.0", "1.0~rc1", "1.10", "1.9", "1:0.1"]
+        )
+        dominator = self.makeDominator(bpphs)
+        self.assertEqual(
+            [bpphs[4], bpphs[2], bpphs[3], bpphs[0], bpphs[1]],
+            dominator.findBinariesForDomination(
+                bpphs[0].distroarchseries, bpphs[0].pocket
+            ),
+        )
+
+    def test_dominateSources_query_count(self):
+        # The number of queries issued by dominateSources does not depend
+        # on the number of publications superseded.
+        distroseries = self.factory.makeDistroSeries()
+        archive = distroseries.main_archive
+        pocket = PackagePublishingPocket.RELEASE
+
+        def make_package():
+            spn = self.factory.makeSourcePackageName()
+            for version in ("1.0", "1.1", "1.2"):
+                self.factory.makeSourcePackagePublishingHistory(
+                    distroseries=distroseries,
+                    pocket=pocket,
+                    archive=archive,
+                    sourcepackagerelease=(
+                        self.factory.makeSourcePackageRelease(
+                            sourcepackagename=spn, version=version
+                        )
+                    ),
+                    status=PackagePublishingStatus.PUBLISHED,
+                )
+
+        def dominate():
+            dominator = Dominator(DevNullLogger(), archive)
+            with StormStatementRecorder() as recorder:
+                dominator.dominateSources(distroseries, pocket)
+            return recorder
+
+        make_package()
+        recorder1 = dominate()
+        for _ in range(3):
+            make_package()
+        recorder2 = dominate()
+        self.assertThat(recorder2, HasQueryCount.byEquality(recorder1))
+        self.assertEqual(
+            8,
+            IStore(SourcePackagePublishingHistory)
+            .find(
+                SourcePackagePublishingHistory,
+                SourcePackagePublishingHistory.distroseries == distroseries,
+                SourcePackagePublishingHistory.status
+                == PackagePublishingStatus.SUPERSEDED,
+            )
+            .count(),
+        )
+
 
 def make_publications_arch_specific(pubs, arch_specific=True):
     """Set the `architecturespecific` attribute for given SPPHs.
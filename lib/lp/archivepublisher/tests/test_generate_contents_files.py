@@ -3,13 +3,16 @@
 
 """Test for the `generate-contents-files` script."""
 
+import gzip
 import hashlib
 import os
 from optparse import OptionValueError
 
 from testtools.matchers import StartsWith
+from zope.component import getUtility
 
 from lp.archivepublisher.scripts.generate_contents_files import (
+    NATIVE_CONTENTS_FEATURE_FLAG,
     GenerateContentsFiles,
     differ_in_content,
     execute,
@@ -17,10 +20,15 @@
 from lp.archivepublisher.scripts.publish_ftpmaster import PublishFTPMaster
 from lp.registry.interfaces.pocket import PackagePublishingPocket
 from lp.registry.interfaces.series import SeriesStatus
+from lp.services.features.testing import FeatureFixture
 from lp.services.log.logger import DevNullLogger
 from lp.services.osutils import write_file
 from lp.services.scripts.base import LaunchpadScriptFailure
 from lp.services.utils import file_exists
+from lp.soyuz.enums import PackagePublishingStatus
+from lp.soyuz.interfaces.binarypackagereleasecontents import (
+    IBinaryPackageReleaseContentsSet,
+)
 from lp.testing import TestCaseWithFactory
 from lp.testing.faketransaction import FakeTransaction
 from lp.testing.layers import LaunchpadZopelessLayer, ZopelessDatabaseLayer
@@ -168,6 +176,12 @@ def test_requires_real_distro(self):
         )
         self.assertRaises(OptionValueError, script.processOptions)
 
+    def test_workers_must_be_positive(self):
+        script = GenerateContentsFiles(
+            test_args=["-d", self.makeDistro().name, "--workers", "0"]
+        )
+        self.assertRaises(OptionValueError, script.processOptions)
+
     def test_looks_up_distro(self):
         # The script looks up and keeps the distribution named on the
         # command line.
@@ -333,6 +347,48 @@ def test_main(self):
             release_lines,
         )
 
+    def test_main_native(self):
+        # With the native generator enabled, Contents files are written
+        # from the file lists recorded at upload time, without running
+        # apt-ftparchive.
+        self.useFixture(FeatureFixture({NATIVE_CONTENTS_FEATURE_FLAG: "on"}))
+        distro = self.makeDistro()
+        distroseries = self.factory.makeDistroSeries(distribution=distro)
+        das_list = [
+            self.factory.makeDistroArchSeries(distroseries=distroseries)
+            for _ in range(2)
+        ]
+        pocket = PackagePublishingPocket.RELEASE
+        for das in das_list:
+            bpph = self.factory.makeBinaryPackagePublishingHistory(
+                archive=distro.main_archive,
+                distroarchseries=das,
+                pocket=pocket,
+                status=PackagePublishingStatus.PUBLISHED,
+                with_file=True,
+            )
+            getUtility(IBinaryPackageReleaseContentsSet).add(
+                bpph.binarypackagerelease,
+                [("usr/bin/%s" % das.architecturetag).encode("UTF-8")],
+            )
+        suite = distroseries.getSuite(pocket)
+        script = self.makeScript(distro)
+        script.options.workers = 2
+        os.makedirs(os.path.join(script.config.distsroot, suite))
+        script.process()
+        for das in das_list:
+            contents_path = os.path.join(
+                script.config.stagingroot,
+                suite,
+                "Contents-%s.gz" % das.architecturetag,
+            )
+            with gzip.open(contents_path, "rb") as contents_file:
+                contents_lines = contents_file.read().splitlines()
+            self.assertEqual(
+                [("usr/bin/%s" % das.architecturetag).encode("UTF-8")],
+                [line.split()[0] for line in contents_lines],
+            )
+
     def test_run_script(self):
         # The script will run stand-alone.
         self.layer.force_dirty_database()
@@ -0,0 +1,85 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `IndexCache`."""
+
+import json
+import os
+
+from lp.archivepublisher.indexcache import IndexCache
+from lp.testing import TestCase
+
+
+class TestIndexCache(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(
+            self.makeTemporaryDirectory(), "main", "source", "Sources.json"
+        )
+
+    def test_missing_cache_is_empty(self):
+        cache = IndexCache(self.path)
+        self.assertIsNone(cache.get(1, (10, 20)))
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+
+    def test_roundtrip(self):
+        cache = IndexCache(self.path)
+        cache.set(1, (10, 20, None), "Package: foo")
+        cache.save()
+        cache = IndexCache(self.path)
+        self.assertEqual(["Package: foo"], cache.get(1, (10, 20, None)))
+        self.assertEqual((1, 0), (cache.hits, cache.misses))
+
+    def test_fingerprint_mismatch(self):
+        # An entry rendered with different overrides is not reused.
+        cache = IndexCache(self.path)
+        cache.set(1, (10, 20), "Package: foo")
+        cache.save()
+        cache = IndexCache(self.path)
+        self.assertIsNone(cache.get(1, (10, 21)))
+
+    def test_save_drops_unused_entries(self):
+        # Only entries set during this run survive a save.
+        cache = IndexCache(self.path)
+        cache.set(1, (10,), "Package: foo")
+        cache.set(2, (11,), "Package: bar")
+        cache.save()
+        cache = IndexCache(self.path)
+        cache.set(2, (11,), *cache.get(2, (11,)))
+        cache.save()
+        cache = IndexCache(self.path)
+        self.assertIsNone(cache.get(1, (10,)))
+        self.assertEqual(["Package: bar"], cache.get(2, (11,)))
+
+    def test_values(self):
+        cache = IndexCache(self.path)
+        cache.set(1, (10,), "Package: foo")
+        cache.set(2, (11,), "Package: bar", "extra")
+        cache.save()
+        cache = IndexCache(self.path)
+        self.assertContentEqual(
+            [["Package: foo"], ["Package: bar", "extra"]], cache.values()
+        )
+        self.assertEqual((0, 0), (cache.hits, cache.misses))
+
+    def test_no_reuse(self):
+        cache = IndexCache(self.path)
+        cache.set(1, (10,), "Package: foo")
+        cache.save()
+        cache = IndexCache(self.path, reuse=False)
+        self.assertIsNone(cache.get(1, (10,)))
+
+    def test_corrupt_cache_is_ignored(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as cache_file:
+            cache_file.write("{not json")
+        self.assertIsNone(IndexCache(self.path).get(1, (10,)))
+
+    def test_other_format_is_ignored(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as cache_file:
+            json.dump(
+                {"format": 0, "entries": {"1": [[10], "Package: foo"]}},
+                cache_file,
+            )
+        self.assertIsNone(IndexCache(self.path).get(1, (10,)))
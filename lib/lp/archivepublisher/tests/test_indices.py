@@ -11,9 +11,12 @@
 
 from lp.archivepublisher.indices import (
     IndexStanzaFields,
+    StanzaCache,
     build_binary_stanza_fields,
     build_source_stanza_fields,
 )
+from lp.services.memcache.testing import MemcacheFixture
+from lp.services.statsd.tests import StatsMixin
 from lp.soyuz.tests.test_publishing import TestNativePublishingBase
 
 
@@ -496,6 +499,86 @@ def test_source_with_correct_dsc_binaries(self):
         self.assertEqual("foo_bin,\n bar_bin,\n zed_bin", section["Binary"])
 
 
+class TestStanzaCache(StatsMixin, TestNativePublishingBase):
+    """Tests for sharing rendered stanzas through memcached."""
+
+    def setUp(self):
+        super().setUp()
+        self.useFixture(MemcacheFixture())
+        self.setUpStats()
+
+    def test_source_stanza(self):
+        # The first lookup renders the stanza; later lookups, even through
+        # a different cache instance, reuse it.
+        pub_source = self.getPubSource()
+        expected = build_spph_stanza(pub_source).makeOutput()
+        args = (
+            pub_source.sourcepackagerelease,
+            pub_source.component,
+            pub_source.section,
+        )
+        cache = StanzaCache()
+        self.assertEqual(expected, cache.getSourceStanza(*args))
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+        cache = StanzaCache()
+        self.assertEqual(expected, cache.getSourceStanza(*args))
+        self.assertEqual((1, 0), (cache.hits, cache.misses))
+
+    def test_binary_stanza(self):
+        pub_source = self.getPubSource()
+        [pub_binary] = self.getPubBinaries(pub_source=pub_source)
+        args = (
+            pub_binary.binarypackagerelease,
+            pub_binary.component,
+            pub_binary.section,
+            pub_binary.priority,
+            pub_binary.phased_update_percentage,
+        )
+        cache = StanzaCache()
+        self.assertEqual(
+            build_bpph_stanza(pub_binary).makeOutput(),
+            cache.getBinaryStanza(*args),
+        )
+        cache.getBinaryStanza(*args)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_binary_stanza_keyed_by_overrides(self):
+        # Stanzas rendered with different overrides are cached separately.
+        pub_source = self.getPubSource()
+        [pub_binary] = self.getPubBinaries(pub_source=pub_source)
+        cache = StanzaCache()
+        common = (
+            pub_binary.binarypackagerelease,
+            pub_binary.component,
+            pub_binary.section,
+            pub_binary.priority,
+        )
+        cache.getBinaryStanza(*common, None)
+        phased = cache.getBinaryStanza(*common, 50)
+        summary_only = cache.getBinaryStanza(*common, None, True)
+        self.assertEqual((0, 3), (cache.hits, cache.misses))
+        self.assertIn("Phased-Update-Percentage: 50", phased)
+        self.assertIn("Description-md5: ", summary_only)
+
+    def test_reportStatsdMetrics(self):
+        pub_source = self.getPubSource()
+        cache = StanzaCache()
+        for _ in range(3):
+            cache.getSourceStanza(
+                pub_source.sourcepackagerelease,
+                pub_source.component,
+                pub_source.section,
+            )
+        cache.reportStatsdMetrics()
+        self.assertEqual(
+            [
+                ("archivepublisher.stanza_cache.hits,env=test", 2),
+                ("archivepublisher.stanza_cache.misses,env=test", 1),
+            ],
+            [call.args for call in self.stats_client.incr.call_args_list],
+        )
+
+
 class TestIndexStanzaFieldsHelper(unittest.TestCase):
     """Check how this auxiliary class works...
 
@@ -6,9 +6,10 @@
 import os
 import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from optparse import OptionValueError
 from pathlib import Path
-from unittest.mock import call
+from unittest.mock import call, patch
 
 from fixtures import MockPatch
 from storm.store import Store
@@ -25,7 +26,10 @@
 )
 from lp.archivepublisher.interfaces.publisherconfig import IPublisherConfigSet
 from lp.archivepublisher.publishing import Publisher
-from lp.archivepublisher.scripts.publishdistro import PublishDistro
+from lp.archivepublisher.scripts.publishdistro import (
+    PublishDistro,
+    init_publisher_worker,
+)
 from lp.archivepublisher.tests.artifactory_fixture import (
     FakeArtifactoryFixture,
 )
@@ -1045,6 +1049,11 @@ def test_validateOptions_does_not_accept_distsroot_for_private_ppa(self):
         script = self.makeScript(args=["--private-ppa", "--distsroot=/tmp"])
         self.assertRaises(OptionValueError, script.validateOptions)
 
+    def test_validateOptions_does_not_accept_zero_workers(self):
+        # At least one worker is needed to publish anything.
+        script = self.makeScript(args=["--workers=0"])
+        self.assertRaises(OptionValueError, script.validateOptions)
+
     def test_validateOptions_accepts_all_derived_without_distro(self):
         # If --all-derived is given, the --distribution option is not
         # required.
@@ -1482,6 +1491,131 @@ def test_publishes_only_selected_archives(self):
             [((archive, publisher), {})], script.publishArchive.calls
         )
 
+    def test_getPendingPublicationCounts(self):
+        # getPendingPublicationCounts counts pending source and binary
+        # publications in each archive.
+        distro = self.makeDistro()
+        busy_archive = self.factory.makeArchive(distribution=distro)
+        idle_archive = self.factory.makeArchive(distribution=distro)
+        for _ in range(2):
+            self.factory.makeSourcePackagePublishingHistory(
+                archive=busy_archive, status=PackagePublishingStatus.PENDING
+            )
+        self.factory.makeBinaryPackagePublishingHistory(
+            archive=busy_archive, status=PackagePublishingStatus.PENDING
+        )
+        self.factory.makeSourcePackagePublishingHistory(
+            archive=idle_archive, status=PackagePublishingStatus.PUBLISHED
+        )
+        script = self.makeScript(distro)
+        counts = script.getPendingPublicationCounts(
+            [busy_archive.id, idle_archive.id]
+        )
+        self.assertEqual(3, counts[busy_archive.id])
+        self.assertEqual(0, counts[idle_archive.id])
+
+    def useInProcessWorkers(self, script):
+        """Make `script` publish archives in this process, in order."""
+        self.useFixture(
+            MockPatch(
+                "lp.archivepublisher.scripts.publishdistro._worker_script",
+                script,
+            )
+        )
+        self.worker_pools = []
+
+        def make_worker_pool(workers, reset_store):
+            self.worker_pools.append((workers, reset_store))
+            script.reset_store = reset_store
+            return ThreadPoolExecutor(max_workers=1)
+
+        script.makeWorkerPool = make_worker_pool
+
+    def test_makeWorkerPool_spawns_processes(self):
+        # Worker processes are started afresh rather than forked, and are
+        # told how to set themselves up.
+        script = self.makeScript(args=["--workers=2"])
+        with patch(
+            "lp.archivepublisher.scripts.publishdistro.ProcessPoolExecutor"
+        ) as executor:
+            script.makeWorkerPool(2, False)
+        _, kwargs = executor.call_args
+        self.assertEqual(2, kwargs["max_workers"])
+        self.assertEqual("spawn", kwargs["mp_context"].get_start_method())
+        self.assertEqual(init_publisher_worker, kwargs["initializer"])
+        self.assertEqual(
+            (script.name, script.dbuser, script.options, False),
+            kwargs["initargs"],
+        )
+
+    def test_processArchivesConcurrently_prioritises_pending(self):
+        # Archives with the most pending publications are published first.
+        script = self.makeScript()
+        script.txn = FakeTransaction()
+        script.getPendingPublicationCounts = FakeMethod({2: 5, 3: 10})
+        script.processArchive = FakeMethod()
+        self.useInProcessWorkers(script)
+        script.processArchivesConcurrently([1, 2, 3])
+        self.assertEqual(
+            [3, 2, 1], [args[0] for args, _ in script.processArchive.calls]
+        )
+
+    def test_processArchivesConcurrently_resets_store(self):
+        # Workers reset their store between archives unless told not to.
+        script = self.makeScript(args=["--workers=2"])
+        script.txn = FakeTransaction()
+        script.getPendingPublicationCounts = FakeMethod({})
+        script.processArchive = FakeMethod()
+        self.useInProcessWorkers(script)
+        script.processArchivesConcurrently([1], reset_store=False)
+        self.assertEqual([(1, False)], self.worker_pools)
+        self.assertEqual(
+            [((1,), {"reset_store": False})], script.processArchive.calls
+        )
+
+    def test_processArchivesConcurrently_isolates_failures(self):
+        # A failure to publish one archive is logged, but does not stop
+        # the other archives from being published.
+        script = self.makeScript(args=["--workers=2"])
+        script.logger = BufferLogger()
+        script.txn = FakeTransaction()
+        script.getPendingPublicationCounts = FakeMethod({})
+        self.useInProcessWorkers(script)
+        published = []
+
+        def process_archive(archive_id, reset_store=True):
+            if archive_id == 2:
+                raise Exception("Boom")
+            published.append(archive_id)
+
+        script.processArchive = process_archive
+        self.assertRaisesWithContent(
+            LaunchpadScriptFailure,
+            "Failed to publish 1 archive(s): 2",
+            script.processArchivesConcurrently,
+            [1, 2, 3],
+        )
+        self.assertContentEqual([1, 3], published)
+        self.assertIn(
+            "Failed to publish archive 2.", script.logger.getLogBuffer()
+        )
+
+    def test_main_publishes_concurrently_with_workers(self):
+        # With more than one worker, main hands the archives over to
+        # processArchivesConcurrently.
+        distro = self.makeDistro()
+        script = self.makeScript(args=["--workers=4"])
+        script.txn = FakeTransaction()
+        script.findDistros = FakeMethod([distro])
+        archive = self.factory.makeArchive(distribution=distro)
+        script.getTargetArchives = FakeMethod([archive])
+        script.processArchivesConcurrently = FakeMethod()
+        script.main()
+        self.assertEqual(
+            [(([archive.id],), {"reset_store": True})],
+            script.processArchivesConcurrently.calls,
+        )
+
     def setUpOVALDataRsync(self):
         self.oval_data_root = self.makeTemporaryDirectory()
         self.pushConfig(
@@ -52,6 +52,8 @@
 )
 from lp.archivepublisher.publishing import (
     BY_HASH_STAY_OF_EXECUTION,
+    PUBLISHER_INCREMENTAL_INDEXES,
+    PUBLISHER_INDEX_PIPELINE,
     ByHash,
     ByHashes,
     DirectoryHash,
@@ -73,9 +75,11 @@
 from lp.services.database.constants import UTC_NOW
 from lp.services.database.interfaces import IStore
 from lp.services.database.sqlbase import flush_database_caches
+from lp.services.features.testing import FeatureFixture
 from lp.services.gpg.interfaces import IGPGHandler
 from lp.services.log.logger import BufferLogger, DevNullLogger
 from lp.services.osutils import open_for_writing
+from lp.services.statsd.tests import StatsMixin
 from lp.services.utils import file_exists
 from lp.soyuz.enums import (
     ArchivePublishingMethod,
@@ -89,6 +93,7 @@
 )
 from lp.soyuz.interfaces.archive import IArchiveSet
 from lp.soyuz.interfaces.archivefile import IArchiveFileSet
+from lp.soyuz.interfaces.section import ISectionSet
 from lp.soyuz.tests.test_publishing import TestNativePublishingBase
 from lp.testing import TestCaseWithFactory, login_person
 from lp.testing.fakemethod import FakeMethod
@@ -701,6 +706,77 @@ def test_prune_old_hashes(self):
         by_hash.prune()
         self.assertThat(by_hash_path, ByHashHasContents([content]))
 
+    def test_prune_records_manifest(self):
+        # Pruning records the remaining entries in the manifest.
+        root = self.makeTemporaryDirectory()
+        content = b"abc\n"
+        sources_path = "dists/foo/main/source/Sources"
+        with open_for_writing(os.path.join(root, sources_path), "wb") as f:
+            f.write(content)
+        lfa = self.factory.makeLibraryFileAlias(content=content, db_only=True)
+        manifest = {}
+        by_hash = ByHash(
+            root, "dists/foo/main/source", DevNullLogger(), manifest=manifest
+        )
+        by_hash.add("Sources", lfa, copy_from_path=sources_path)
+        by_hash.prune()
+        self.assertEqual(["SHA256"], list(manifest))
+        self.assertEqual(
+            [hashlib.sha256(content).hexdigest()],
+            manifest["SHA256"]["digests"],
+        )
+
+    def test_manifest_avoids_rescanning(self):
+        # A hash directory that is unchanged since the manifest was
+        # recorded is not rescanned.
+        root = self.makeTemporaryDirectory()
+        content = b"abc\n"
+        sources_path = "dists/foo/main/source/Sources"
+        with open_for_writing(os.path.join(root, sources_path), "wb") as f:
+            f.write(content)
+        lfa = self.factory.makeLibraryFileAlias(content=content, db_only=True)
+        manifest = {}
+        by_hash = ByHash(
+            root, "dists/foo/main/source", DevNullLogger(), manifest=manifest
+        )
+        by_hash.add("Sources", lfa, copy_from_path=sources_path)
+        by_hash.prune()
+        scandir = FakeMethod()
+        self.useFixture(MonkeyPatch("os.scandir", scandir))
+        by_hash = ByHash(
+            root, "dists/foo/main/source", DevNullLogger(), manifest=manifest
+        )
+        by_hash.add("Sources", lfa, copy_from_path=sources_path)
+        by_hash.prune()
+        self.assertEqual(0, scandir.call_count)
+        by_hash_path = os.path.join(root, "dists/foo/main/source/by-hash")
+        self.assertThat(by_hash_path, ByHashHasContents([content]))
+
+    def test_manifest_notices_changes(self):
+        # A hash directory that has been changed since the manifest was
+        # recorded is rescanned, so stray entries are still pruned.
+        root = self.makeTemporaryDirectory()
+        content = b"abc\n"
+        sources_path = "dists/foo/main/source/Sources"
+        with open_for_writing(os.path.join(root, sources_path), "wb") as f:
+            f.write(content)
+        lfa = self.factory.makeLibraryFileAlias(content=content, db_only=True)
+        manifest = {}
+        by_hash = ByHash(
+            root, "dists/foo/main/source", DevNullLogger(), manifest=manifest
+        )
+        by_hash.add("Sources", lfa, copy_from_path=sources_path)
+        by_hash.prune()
+        by_hash_path = os.path.join(root, "dists/foo/main/source/by-hash")
+        with open_for_writing(os.path.join(by_hash_path, "SHA256/0"), "w"):
+            pass
+        by_hash = ByHash(
+            root, "dists/foo/main/source", DevNullLogger(), manifest=manifest
+        )
+        by_hash.add("Sources", lfa, copy_from_path=sources_path)
+        by_hash.prune()
+        self.assertThat(by_hash_path, ByHashHasContents([content]))
+
 
 class TestByHashes(TestCaseWithFactory):
     """Unit tests for details of handling a set of by-hash directory trees."""
@@ -792,8 +868,43 @@ def test_prune(self):
         by_hashes.prune()
         self.assertThat(root, matcher)
 
+    def test_prune_saves_manifest(self):
+        # If given a manifest path, pruning saves the state of each by-hash
+        # directory there for use by later runs.
+        root = self.makeTemporaryDirectory()
+        manifest_path = os.path.join(
+            self.makeTemporaryDirectory(), "manifests", "foo.json"
+        )
+        content = b"abc\n"
+        sources_path = "dists/foo/main/source/Sources"
+        with open_for_writing(os.path.join(root, sources_path), "wb") as f:
+            f.write(content)
+        lfa = self.factory.makeLibraryFileAlias(content=content, db_only=True)
+        by_hashes = ByHashes(
+            root, DevNullLogger(), manifest_path=manifest_path
+        )
+        by_hashes.add(sources_path, lfa, copy_from_path=sources_path)
+        by_hashes.prune()
+        by_hashes = ByHashes(
+            root, DevNullLogger(), manifest_path=manifest_path
+        )
+        self.assertEqual(
+            [hashlib.sha256(content).hexdigest()],
+            by_hashes.manifest["dists/foo/main/source"]["SHA256"]["digests"],
+        )
 
-class TestPublisher(TestPublisherBase):
+    def test_corrupt_manifest_is_ignored(self):
+        root = self.makeTemporaryDirectory()
+        manifest_path = os.path.join(self.makeTemporaryDirectory(), "foo.json")
+        with open(manifest_path, "w") as manifest_file:
+            manifest_file.write("{not json")
+        by_hashes = ByHashes(
+            root, DevNullLogger(), manifest_path=manifest_path
+        )
+        self.assertEqual({}, by_hashes.manifest)
+
+
+class TestPublisher(StatsMixin, TestPublisherBase):
     """Testing `Publisher` behaviour."""
 
     def assertReleaseContentsMatch(self, release, filename, contents):
@@ -1971,6 +2082,216 @@ def testPPAArchiveIndexCompressors(self):
                 archive_publisher, uncompressed_file_path, [".xz"]
             )
 
+    def testPPAArchiveIndexCompressionWorkers(self):
+        # Compressing index files in a pool of worker processes produces
+        # exactly the same files as compressing them serially.
+        archive_publisher = self.setupPPAArchiveIndexTest(
+            long_descriptions=False
+        )
+        suite_path = os.path.join(
+            archive_publisher._config.distsroot, "breezy-autotest", "main"
+        )
+        index_paths = [
+            os.path.join(suite_path, path + suffix)
+            for path in (
+                os.path.join("source", "Sources"),
+                os.path.join("binary-i386", "Packages"),
+                os.path.join("debian-installer", "binary-i386", "Packages"),
+                os.path.join("i18n", "Translation-en"),
+            )
+            for suffix in (".gz", ".bz2")
+        ]
+
+        def read_indexes():
+            contents = {}
+            for path in index_paths:
+                with open(path, "rb") as index_file:
+                    contents[path] = index_file.read()
+            return contents
+
+        serial_contents = read_indexes()
+        for path in index_paths:
+            os.unlink(path)
+        self.pushConfig("archivepublisher", index_compression_workers=2)
+        archive_publisher.C_writeIndexes(False)
+        self.assertEqual(serial_contents, read_indexes())
+        self.assertIsNone(archive_publisher._index_executor)
+        self.assertEqual([], archive_publisher._pending_index_files)
+
+        # remove PPA root
+        shutil.rmtree(config.personalpackagearchive.root)
+
+    def testPPAArchiveIndexCompressionWorkersError(self):
+        # If writing the indexes fails, index files that are being written
+        # or compressed are discarded rather than published, and the
+        # original error is raised.
+        archive_publisher = self.setupPPAArchiveIndexTest()
+        suite_path = os.path.join(
+            archive_publisher._config.distsroot, "breezy-autotest", "main"
+        )
+        index_paths = [
+            os.path.join(suite_path, path + suffix)
+            for path in (
+                os.path.join("source", "Sources"),
+                os.path.join("binary-i386", "Packages"),
+            )
+            for suffix in (".gz", ".bz2")
+        ]
+        for path in index_paths:
+            os.unlink(path)
+        self.pushConfig("archivepublisher", index_compression_workers=2)
+
+        def broken_binary_stanzas(*args, **kwargs):
+            raise ValueError("Broken stanzas")
+
+        # By then, the Sources files are being compressed in the
+        # background.
+        self.patch(
+            archive_publisher, "_getBinaryStanzas", broken_binary_stanzas
+        )
+        temproot = archive_publisher._config.temproot
+        temp_files = os.listdir(temproot)
+        self.assertRaisesWithContent(
+            ValueError,
+            "Broken stanzas",
+            archive_publisher.C_writeIndexes,
+            False,
+        )
+        for path in index_paths:
+            self.assertFalse(os.path.exists(path))
+        self.assertContentEqual(temp_files, os.listdir(temproot))
+        self.assertIsNone(archive_publisher._index_executor)
+        self.assertEqual([], archive_publisher._open_index_files)
+        self.assertEqual([], archive_publisher._pending_index_files)
+
+    def testPPAArchiveIndexPipeline(self):
+        # Writing compressed index files in pipelined threads produces
+        # exactly the same files as compressing them serially, and the
+        # time spent on each kind of file is reported.
+        self.setUpStats()
+        archive_publisher = self.setupPPAArchiveIndexTest(
+            long_descriptions=False
+        )
+        suite_path = os.path.join(
+            archive_publisher._config.distsroot, "breezy-autotest", "main"
+        )
+        index_paths = [
+            os.path.join(suite_path, path + suffix)
+            for path in (
+                os.path.join("source", "Sources"),
+                os.path.join("binary-i386", "Packages"),
+                os.path.join("i18n", "Translation-en"),
+            )
+            for suffix in (".gz", ".bz2")
+        ]
+
+        def read_indexes():
+            contents = {}
+            for path in index_paths:
+                with open(path, "rb") as index_file:
+                    contents[path] = index_file.read()
+            return contents
+
+        serial_contents = read_indexes()
+        for path in index_paths:
+            os.unlink(path)
+        self.stats_client.timing.reset_mock()
+        self.useFixture(FeatureFixture({PUBLISHER_INDEX_PIPELINE: "on"}))
+        archive_publisher.C_writeIndexes(False)
+        self.assertEqual(serial_contents, read_indexes())
+        self.assertFalse(archive_publisher._pipeline_indexes)
+        self.assertContentEqual(
+            [
+                "archivepublisher.index_compression_time,"
+                "compression=%s,env=test" % compression_type.name.lower()
+                for compression_type in self.ubuntutest.getSeries(
+                    "breezy-autotest"
+                ).index_compressors
+            ],
+            [call.args[0] for call in self.stats_client.timing.call_args_list],
+        )
+
+        # remove PPA root
+        shutil.rmtree(config.personalpackagearchive.root)
+
+    def testPPAArchiveIndexIncremental(self):
+        # With incremental index generation enabled, rendered stanzas are
+        # cached and reused by later runs, which produce the same indexes
+        # as a full rebuild.
+        self.useFixture(FeatureFixture({PUBLISHER_INCREMENTAL_INDEXES: "on"}))
+        archive_publisher = self.setupPPAArchiveIndexTest(
+            long_descriptions=False
+        )
+        index_paths = [
+            os.path.join("source", "Sources"),
+            os.path.join("binary-i386", "Packages"),
+            os.path.join("debian-installer", "binary-i386", "Packages"),
+            os.path.join("debug", "binary-i386", "Packages"),
+            os.path.join("i18n", "Translation-en"),
+        ]
+        expected_contents = {
+            path: self._checkCompressedFiles(archive_publisher, path, [".gz"])
+            for path in index_paths
+        }
+        cache_root = os.path.join(
+            archive_publisher._index_cache_root, "breezy-autotest", "main"
+        )
+        self.assertThat(
+            os.path.join(cache_root, "source", "Sources.json"), PathExists()
+        )
+        self.assertThat(
+            os.path.join(cache_root, "binary-i386", "Packages.json"),
+            PathExists(),
+        )
+
+        # A second run renders nothing, but writes identical indexes.
+        build_source = FakeMethod()
+        build_binary = FakeMethod()
+        self.useFixture(
+            MonkeyPatch(
+                "lp.archivepublisher.publishing.build_source_stanza_fields",
+                build_source,
+            )
+        )
+        self.useFixture(
+            MonkeyPatch(
+                "lp.archivepublisher.publishing.build_binary_stanza_fields",
+                build_binary,
+            )
+        )
+        archive_publisher.C_writeIndexes(False)
+        self.assertEqual(0, build_source.call_count)
+        self.assertEqual(0, build_binary.call_count)
+        for path in index_paths:
+            self.assertEqual(
+                expected_contents[path],
+                self._checkCompressedFiles(archive_publisher, path, [".gz"]),
+            )
+
+        # remove PPA root
+        shutil.rmtree(config.personalpackagearchive.root)
+
+    def testPPAArchiveIndexIncrementalOverrideChanged(self):
+        # Cached stanzas are keyed by the overrides they were rendered
+        # with, so they are not reused once those change.
+        self.useFixture(FeatureFixture({PUBLISHER_INCREMENTAL_INDEXES: "on"}))
+        archive_publisher = self.setupPPAArchiveIndexTest()
+        cprov = getUtility(IPersonSet).getByName("cprov")
+        [spph] = cprov.archive.getPublishedSources(
+            name="foo", status=PackagePublishingStatus.PUBLISHED
+        )
+        removeSecurityProxy(spph).section = getUtility(ISectionSet)["web"]
+
+        archive_publisher.C_writeIndexes(False)
+        index_contents = self._checkCompressedFiles(
+            archive_publisher, os.path.join("source", "Sources"), [".gz"]
+        )
+        self.assertIn(b"Section: web", index_contents)
+        self.assertNotIn(b"Section: base", index_contents)
+
+        # remove PPA root
+        shutil.rmtree(config.personalpackagearchive.root)
+
     def testDirtyingPocketsWithDeletedPackages(self):
         """Test that dirtying pockets with deleted packages works.
 
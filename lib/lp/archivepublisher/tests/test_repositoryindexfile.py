@@ -11,6 +11,7 @@
 import stat
 import tempfile
 import unittest
+from concurrent.futures import ProcessPoolExecutor
 
 from lp.archivepublisher.utils import RepositoryIndexFile
 from lp.soyuz.enums import IndexCompressionType
@@ -184,3 +185,174 @@ def testRemoveOld(self):
             ["boing.bz2", "boing.gz", "boing.xz"],
             sorted(os.listdir(self.root)),
         )
+
+    def testExecutorMatchesSerial(self):
+        """Compressing with an executor gives byte-identical files."""
+        content = b"".join(
+            b"Package: foo%d\nVersion: %d\n\n" % (i, i) for i in range(1000)
+        )
+        serial_file = self.getRepoFile("serial")
+        serial_file.write(content)
+        serial_file.close()
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            parallel_file = RepositoryIndexFile(
+                os.path.join(self.root, "parallel"),
+                self.temp_root,
+                [
+                    IndexCompressionType.GZIP,
+                    IndexCompressionType.BZIP2,
+                    IndexCompressionType.XZ,
+                ],
+                executor=executor,
+            )
+            parallel_file.write(content)
+            parallel_file.close()
+
+        self.assertEqual(0, len(os.listdir(self.temp_root)))
+        for suffix in (".gz", ".bz2", ".xz"):
+            with open(os.path.join(self.root, "serial" + suffix), "rb") as f:
+                serial_content = f.read()
+            with open(os.path.join(self.root, "parallel" + suffix), "rb") as f:
+                parallel_content = f.read()
+            self.assertEqual(serial_content, parallel_content)
+
+    def testCloseInBackground(self):
+        """Files compressed in the background are published by `wait`."""
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            repo_file = RepositoryIndexFile(
+                os.path.join(self.root, "boing"),
+                self.temp_root,
+                [IndexCompressionType.UNCOMPRESSED, IndexCompressionType.XZ],
+                executor=executor,
+            )
+            repo_file.write(b"hello")
+            repo_file.closeInBackground()
+            self.assertEqual([], os.listdir(self.root))
+            repo_file.wait()
+
+        self.assertEqual(["boing", "boing.xz"], sorted(os.listdir(self.root)))
+        self.assertEqual(0, len(os.listdir(self.temp_root)))
+        with lzma.open(os.path.join(self.root, "boing.xz")) as xz_file:
+            self.assertEqual(b"hello", xz_file.read())
+
+    def testPipelinedMatchesSerial(self):
+        """Compressing in pipelined threads gives byte-identical files."""
+        content = b"".join(
+            b"Package: foo%d\nVersion: %d\n\n" % (i, i) for i in range(1000)
+        )
+        compressors = [
+            IndexCompressionType.UNCOMPRESSED,
+            IndexCompressionType.GZIP,
+            IndexCompressionType.BZIP2,
+            IndexCompressionType.XZ,
+        ]
+        serial_file = self.getRepoFile("serial", compressors=compressors)
+        serial_file.write(content)
+        serial_file.close()
+        pipelined_file = RepositoryIndexFile(
+            os.path.join(self.root, "pipelined"),
+            self.temp_root,
+            compressors,
+            pipelined=True,
+        )
+        # Use a small chunk size so that the contents are spread over
+        # many chunks.
+        pipelined_file.pipeline_chunk_size = 1024
+        for line in content.splitlines(keepends=True):
+            pipelined_file.write(line)
+        pipelined_file.close()
+
+        self.assertEqual(0, len(os.listdir(self.temp_root)))
+        for suffix in ("", ".gz", ".bz2", ".xz"):
+            with open(os.path.join(self.root, "serial" + suffix), "rb") as f:
+                serial_content = f.read()
+            with open(
+                os.path.join(self.root, "pipelined" + suffix), "rb"
+            ) as f:
+                pipelined_content = f.read()
+            self.assertEqual(serial_content, pipelined_content)
+
+    def testPipelinedError(self):
+        """Errors in compressor threads are raised by `close`."""
+        repo_file = RepositoryIndexFile(
+            os.path.join(self.root, "boing"),
+            self.temp_root,
+            [IndexCompressionType.UNCOMPRESSED, IndexCompressionType.XZ],
+            pipelined=True,
+        )
+        repo_file.write(b"hello")
+        [thread] = repo_file._threads
+
+        def broken_write(content):
+            raise OSError("Disk full")
+
+        # Nothing is handed to the thread until the file is closed.
+        thread.index_file.write = broken_write
+        self.assertRaisesRegex(OSError, "Disk full", repo_file.close)
+        self.assertEqual([], os.listdir(self.root))
+
+    def testPipelinedStartsThreadsOnWrite(self):
+        """Compressor threads are only started by the first write."""
+        repo_file = RepositoryIndexFile(
+            os.path.join(self.root, "boing"),
+            self.temp_root,
+            [IndexCompressionType.UNCOMPRESSED, IndexCompressionType.XZ],
+            pipelined=True,
+        )
+        self.assertEqual([], repo_file._threads)
+        repo_file.close()
+        self.assertEqual(["boing", "boing.xz"], sorted(os.listdir(self.root)))
+        with lzma.open(os.path.join(self.root, "boing.xz")) as xz_file:
+            self.assertEqual(b"", xz_file.read())
+
+    def testExitWithError(self):
+        """Leaving the context with an error publishes nothing."""
+        for pipelined in (False, True):
+            with self.assertRaisesRegex(ValueError, "Boom"):
+                with RepositoryIndexFile(
+                    os.path.join(self.root, "boing"),
+                    self.temp_root,
+                    [
+                        IndexCompressionType.UNCOMPRESSED,
+                        IndexCompressionType.XZ,
+                    ],
+                    pipelined=pipelined,
+                ) as repo_file:
+                    repo_file.write(b"hello")
+                    raise ValueError("Boom")
+            self.assertEqual([], repo_file._threads)
+            self.assertEqual([], os.listdir(self.root))
+            self.assertEqual([], os.listdir(self.temp_root))
+
+    def testAbortInBackground(self):
+        """Aborting discards files being compressed in the background."""
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            repo_file = RepositoryIndexFile(
+                os.path.join(self.root, "boing"),
+                self.temp_root,
+                [IndexCompressionType.GZIP, IndexCompressionType.XZ],
+                executor=executor,
+            )
+            repo_file.write(b"hello")
+            repo_file.closeInBackground()
+            repo_file.abort()
+
+        self.assertEqual([], os.listdir(self.root))
+        self.assertEqual([], os.listdir(self.temp_root))
+
+    def testCompressionTimes(self):
+        """The time spent writing each variant is recorded."""
+        repo_file = self.getRepoFile("boing")
+        repo_file.write(b"hello")
+        repo_file.close()
+        times = repo_file.compression_times
+        self.assertEqual(
+            {
+                IndexCompressionType.GZIP,
+                IndexCompressionType.BZIP2,
+                IndexCompressionType.XZ,
+            },
+            set(times),
+        )
+        for elapsed in times.values():
+            self.assertGreater(elapsed, 0)
@@ -13,8 +13,11 @@
 import gzip
 import lzma
 import os
+import queue
 import stat
 import tempfile
+import threading
+import time
 
 from lp.soyuz.enums import ArchivePurpose, IndexCompressionType
 from lp.soyuz.interfaces.archive import default_name_by_purpose
@@ -43,6 +46,9 @@ class PlainTempFile:
     suffix = ""
     # File path built on initialization.
     path = None
+    _fd = None
+    # Seconds spent writing and closing this file.
+    elapsed = 0.0
 
     def __init__(self, temp_root, filename, auto_open=True):
         self.temp_root = temp_root
@@ -61,10 +67,25 @@ def open(self):
         self._fd = self._buildFile(fd)
 
     def write(self, content):
+        start = time.monotonic()
         self._fd.write(content)
+        self.elapsed += time.monotonic() - start
 
     def close(self):
+        start = time.monotonic()
         self._fd.close()
+        self.elapsed += time.monotonic() - start
+
+    def discard(self):
+        """Close and remove the temporary file without publishing it."""
+        if self._fd is not None:
+            try:
+                self._fd.close()
+            except Exception:
+                pass
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
 
     def __del__(self):
         """Remove temporary file if it was left behind."""
@@ -100,6 +121,79 @@ def _buildFile(self, fd):
         return lzma.LZMAFile(self.path, mode="wb", format=lzma.FORMAT_XZ)
 
 
+TEMP_FILE_CLASSES = (PlainTempFile, GzipTempFile, Bzip2TempFile, XZTempFile)
+
+
+def compress_index_file(source_path, compression_type, temp_root, filename):
+    """Write a compressed copy of an uncompressed index file.
+
+    This is run in worker processes by `RepositoryIndexFile` when it is
+    given an executor, so it must only rely on its arguments.
+
+    :return: A tuple of the path to the compressed temporary file and
+        the number of seconds spent compressing it.
+    """
+    [cls] = [
+        cls
+        for cls in TEMP_FILE_CLASSES
+        if cls.compression_type == compression_type
+    ]
+    index_file = cls(temp_root, filename)
+    with open(source_path, "rb") as source:
+        while True:
+            chunk = source.read(1024 * 1024)
+            if not chunk:
+                break
+            index_file.write(chunk)
+    index_file.close()
+    # Hand responsibility for the temporary file over to the caller.
+    path, index_file.path = index_file.path, None
+    return path, index_file.elapsed
+
+
+class CompressorThread(threading.Thread):
+    """Write to an index file from a bounded queue in a separate thread.
+
+    zlib, bz2 and lzma release the GIL while compressing, so several of
+    these threads can make progress at the same time as each other and as
+    the thread producing the contents.
+    """
+
+    def __init__(self, index_file, queue_size):
+        super().__init__(name="compress-%s" % index_file.filename, daemon=True)
+        self.index_file = index_file
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.aborted = False
+
+    def abort(self):
+        """Stop compressing as soon as possible.
+
+        The index file is left for the caller to discard.
+        """
+        self.aborted = True
+        self.queue.put(None)
+
+    def run(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            if self.error is not None or self.aborted:
+                # Keep draining the queue so that the producer never
+                # blocks on a compressor that has given up.
+                continue
+            try:
+                self.index_file.write(chunk)
+            except Exception as e:
+                self.error = e
+        try:
+            self.index_file.close()
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+
+
 class RepositoryIndexFile:
     """Facilitates the publication of repository index files.
 
@@ -107,7 +201,20 @@ class RepositoryIndexFile:
     formats (plain, gzip, bzip2, and xz) transparently and atomically.
     """
 
-    def __init__(self, path, temp_root, compressors=None):
+    # In pipelined mode, contents are handed to the compressor threads in
+    # chunks of about this many bytes, and each thread's queue holds at
+    # most this many chunks; this bounds the memory used per compressor.
+    pipeline_chunk_size = 256 * 1024
+    pipeline_queue_size = 16
+
+    def __init__(
+        self,
+        path,
+        temp_root,
+        compressors=None,
+        executor=None,
+        pipelined=False,
+    ):
         """Store repositories destinations and filename.
 
         The given 'temp_root' needs to exist; on the other hand, the
@@ -116,33 +223,204 @@ def __init__(self, path, temp_root, compressors=None):
 
         Additionally creates the needed temporary files in the given
         'temp_root'.
+
+        If an 'executor' (a `concurrent.futures.Executor`) is given, only
+        the uncompressed contents are written as they arrive; the
+        compressed files are produced from them in parallel by the
+        executor when the file is closed.
+
+        If 'pipelined' is True, each compressed file is instead written by
+        its own `CompressorThread` as the contents arrive.  The threads are
+        started by the first `write`.
         """
+        assert not (
+            executor is not None and pipelined
+        ), "Cannot both pipeline and use an executor."
         if compressors is None:
             compressors = [IndexCompressionType.UNCOMPRESSED]
 
         self.root, filename = os.path.split(path)
         assert os.path.exists(temp_root), "Temporary root does not exist."
+        self.temp_root = temp_root
+        self.filename = filename
+        self._executor = executor
+        self._pending = None
 
         self.index_files = []
         self.old_index_files = []
-        for cls in (PlainTempFile, GzipTempFile, Bzip2TempFile, XZTempFile):
+        for cls in TEMP_FILE_CLASSES:
             if cls.compression_type in compressors:
-                self.index_files.append(cls(temp_root, filename))
+                self.index_files.append(
+                    cls(
+                        temp_root,
+                        filename,
+                        auto_open=(executor is None or cls is PlainTempFile),
+                    )
+                )
             else:
                 self.old_index_files.append(
                     cls(temp_root, filename, auto_open=False)
                 )
 
+        if executor is None:
+            self._source_file = None
+        elif IndexCompressionType.UNCOMPRESSED in compressors:
+            self._source_file = self.index_files[0]
+        else:
+            # The uncompressed contents are still needed as input to the
+            # compressors, even though they won't be published.
+            self._source_file = PlainTempFile(temp_root, filename)
+
+        # Files written to directly by `write`, as opposed to those fed by
+        # compressor threads.
+        self._direct_files = []
+        self._pipelined_files = []
+        self._threads = []
+        self._buffer = bytearray()
+        for index_file in self.index_files:
+            if pipelined and (
+                index_file.compression_type
+                != IndexCompressionType.UNCOMPRESSED
+            ):
+                self._pipelined_files.append(index_file)
+            else:
+                self._direct_files.append(index_file)
+
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
-        self.close()
+        if type is None:
+            self.close()
+        else:
+            self.abort()
 
     def write(self, content):
         """Write contents to all target files."""
-        for index_file in self.index_files:
+        if self._source_file is not None:
+            self._source_file.write(content)
+            return
+        for index_file in self._direct_files:
             index_file.write(content)
+        if self._pipelined_files:
+            if not self._threads:
+                self._startPipeline()
+            self._buffer += content
+            if len(self._buffer) >= self.pipeline_chunk_size:
+                self._flushPipeline()
+
+    def _startPipeline(self):
+        """Start a compressor thread for each pipelined file."""
+        for index_file in self._pipelined_files:
+            thread = CompressorThread(index_file, self.pipeline_queue_size)
+            thread.start()
+            self._threads.append(thread)
+
+    def _flushPipeline(self):
+        """Hand buffered contents over to the compressor threads."""
+        if self._buffer:
+            chunk = bytes(self._buffer)
+            self._buffer.clear()
+            for thread in self._threads:
+                thread.queue.put(chunk)
+
+    def _joinPipeline(self):
+        """Wait for the compressor threads to finish their files."""
+        if not self._threads:
+            # Nothing was written, so there's no need for threads.
+            for index_file in self._pipelined_files:
+                index_file.close()
+            return
+        self._flushPipeline()
+        threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.queue.put(None)
+        for thread in threads:
+            thread.join()
+        for thread in threads:
+            if thread.error is not None:
+                raise thread.error
+
+    @property
+    def compression_times(self):
+        """A dict mapping compression types to seconds spent writing them.
+
+        This is complete once the file has been closed.
+        """
+        return {
+            index_file.compression_type: index_file.elapsed
+            for index_file in self.index_files
+        }
+
+    def closeInBackground(self):
+        """Close the uncompressed file and start compressing it.
+
+        This requires an executor.  The files are not published until
+        `wait` is called.
+        """
+        assert self._executor is not None, "No executor to compress with."
+        self._source_file.close()
+        self._pending = []
+        for index_file in self.index_files:
+            if index_file is self._source_file:
+                continue
+            self._pending.append(
+                (
+                    index_file,
+                    self._executor.submit(
+                        compress_index_file,
+                        self._source_file.path,
+                        index_file.compression_type,
+                        self.temp_root,
+                        self.filename,
+                    ),
+                )
+            )
+
+    def wait(self):
+        """Wait for background compression and publish the results."""
+        assert self._pending is not None, "closeInBackground not called."
+        pending, self._pending = self._pending, None
+        error = None
+        for index_file, future in pending:
+            try:
+                index_file.path, index_file.elapsed = future.result()
+            except Exception as e:
+                # Keep collecting the other results, so that their
+                # temporary files are cleaned up.
+                if error is None:
+                    error = e
+        if self._source_file not in self.index_files:
+            os.remove(self._source_file.path)
+        if error is not None:
+            raise error
+        self._publish()
+
+    def abort(self):
+        """Discard the temporary files without publishing anything.
+
+        Any compressor threads are stopped, and any background compression
+        that has not started yet is cancelled.
+        """
+        threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.abort()
+        for thread in threads:
+            thread.join()
+        pending, self._pending = self._pending or [], None
+        for _, future in pending:
+            if future.cancel():
+                continue
+            try:
+                path, _ = future.result()
+            except Exception:
+                continue
+            if os.path.exists(path):
+                os.remove(path)
+        for index_file in self.index_files:
+            index_file.discard()
+        if self._source_file is not None:
+            self._source_file.discard()
 
     def close(self):
         """Close temporary files and atomically publish them.
@@ -152,6 +430,16 @@ def close(self):
         It also fixes the final files' permissions making them readable and
         writable by their group and readable by others.
         """
+        if self._executor is not None:
+            self.closeInBackground()
+            self.wait()
+            return
+        for index_file in self._direct_files:
+            index_file.close()
+        self._joinPipeline()
+        self._publish()
+
+    def _publish(self):
         if os.path.exists(self.root):
             assert os.access(self.root, os.W_OK), (
                 "%s not writeable!" % self.root
@@ -160,7 +448,6 @@ def close(self):
             os.makedirs(self.root)
 
         for index_file in self.index_files:
-            index_file.close()
             root_path = os.path.join(self.root, index_file.filename)
             os.rename(index_file.path, root_path)
             # XXX julian 2007-10-03
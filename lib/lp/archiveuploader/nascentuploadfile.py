@@ -29,6 +29,7 @@
 from zope.component import getUtility
 
 from lp.app.errors import NotFoundError
+from lp.archivepublisher.contents import get_deb_member_path
 from lp.archivepublisher.ddtp_tarball import DdtpTarballUpload
 from lp.archivepublisher.debian_installer import DebianInstallerUpload
 from lp.archivepublisher.dist_upgrader import DistUpgraderUpload
@@ -51,6 +52,7 @@
 from lp.services.encoding import guess as guess_encoding
 from lp.services.librarian.interfaces import ILibraryFileAliasSet
 from lp.services.librarian.utils import filechunks
+from lp.services.statsd.interfaces.statsd_client import IStatsdClient
 from lp.soyuz.enums import (
     BinaryPackageFormat,
     PackagePublishingPriority,
@@ -58,6 +60,9 @@
 )
 from lp.soyuz.interfaces.binarypackagebuild import IBinaryPackageBuildSet
 from lp.soyuz.interfaces.binarypackagename import IBinaryPackageNameSet
+from lp.soyuz.interfaces.binarypackagereleasecontents import (
+    IBinaryPackageReleaseContentsSet,
+)
 from lp.soyuz.interfaces.component import IComponentSet
 from lp.soyuz.interfaces.publishing import active_publishing_status
 from lp.soyuz.interfaces.section import ISectionSet
@@ -102,6 +107,136 @@ def check_cutoff(self, name, mtime):
             self.ancient_files[name] = mtime
 
 
+def read_size_and_checksums(filepath, checksum_names):
+    """Read a file and return its size and checksums.
+
+    :param filepath: The path of the file to read.
+    :param checksum_names: The names of the `hashlib` algorithms to use.
+    :return: A tuple of the size of the file and a dict mapping each
+        checksum name to its hex digest.
+    """
+    digesters = {n: hashlib.new(n) for n in checksum_names}
+    size = 0
+    with open(filepath, "rb") as ckfile:
+        for chunk in filechunks(ckfile):
+            for digester in digesters.values():
+                digester.update(chunk)
+            size += len(chunk)
+    return size, {n: digester.hexdigest() for n, digester in digesters.items()}
+
+
+class DebInspection:
+    """Everything we need to know about a binary package's contents.
+
+    Binary packages may be hundreds of megabytes, so rather than
+    checking their checksums, extracting their control files and
+    checking the timestamps of their members separately, we gather all
+    of that in one go: the file is read to compute its checksums, and
+    then `apt_inst` walks the control and data tarballs once.  (`apt_inst`
+    needs a real file that it can seek around in, so it can't share the
+    first read; but it follows straight on, so the file is still in the
+    page cache.)
+
+    Errors are recorded rather than raised, so that each verification
+    step can report those that concern it.
+    """
+
+    def __init__(
+        self,
+        filepath,
+        checksum_names,
+        future_cutoff,
+        past_cutoff,
+        walk_data=True,
+    ):
+        """Inspect a package.
+
+        :param walk_data: If False, only walk the control tarball; the
+            data tarball's timestamps and contents are not gathered.
+        """
+        self.size = None
+        self.checksums = None
+        # An exception raised while reading or opening the package, or
+        # None.
+        self.open_error = None
+        # A (type, exception) tuple for an error raised while extracting
+        # or parsing the control file, or None.
+        self.control_error = None
+        # An exception raised while walking the package's members, or
+        # None.
+        self.members_error = None
+        self.control = None
+        self.tar_checker = TarFileDateChecker(future_cutoff, past_cutoff)
+        # The paths of the files shipped in the package.
+        self.contents = []
+        # Map of inspection phases to their durations, in seconds.
+        self.durations = {}
+
+        start = time.monotonic()
+        try:
+            self.size, self.checksums = read_size_and_checksums(
+                filepath, checksum_names
+            )
+        except OSError as error:
+            self.open_error = error
+            self.control_error = (sys.exc_info()[0], error)
+            return
+        self.durations["checksums"] = time.monotonic() - start
+
+        start = time.monotonic()
+        try:
+            self.inspectMembers(filepath, walk_data=walk_data)
+        finally:
+            self.durations["members"] = time.monotonic() - start
+
+    def inspectMembers(self, filepath, walk_data=True):
+        """Walk the control and (optionally) data tarballs of a package."""
+        try:
+            deb_file = apt_inst.DebFile(filepath)
+        except Exception as error:
+            # We get a SystemError from the constructor if the .deb does
+            # not contain all the expected top-level members
+            # (debian-binary, control.tar.gz, and data.tar.*).
+            self.open_error = error
+            self.control_error = (sys.exc_info()[0], error)
+            return
+
+        control_files = []
+
+        def control_callback(member, data):
+            self.tar_checker.callback(member, data)
+            if member.name in ("control", "./control"):
+                control_files.append(data)
+
+        def data_callback(member, data):
+            self.tar_checker.callback(member, data)
+            # Record the files shipped in the package while we're here, so
+            # that Contents files can be generated without reading it again.
+            if not member.isdir():
+                self.contents.append(get_deb_member_path(member))
+
+        try:
+            deb_file.control.go(control_callback)
+            if walk_data:
+                deb_file.data.go(data_callback)
+        except Exception as error:
+            # There is a very large number of places where we might get
+            # an exception while walking the package.  Many of them come
+            # from apt_inst/apt_pkg and they are terrible in giving sane
+            # exceptions, so we record them all.
+            self.members_error = error
+
+        try:
+            if control_files:
+                control_file = control_files[0]
+            else:
+                # Let apt_inst explain what's wrong.
+                control_file = deb_file.control.extractdata("control")
+            self.control = apt_pkg.TagSection(control_file, bytes=True)
+        except Exception as error:
+            self.control_error = (sys.exc_info()[0], error)
+
+
 def splitComponentAndSection(component_and_section):
     """Split the component out of the section."""
     if "/" not in component_and_section:
@@ -221,26 +356,18 @@ def checkSizeAndCheckSum(self):
                 % self.filename
             )
 
-        # Read in the file and compute its md5 and sha1 checksums and remember
-        # the size of the file as read-in.
-        digesters = {n: hashlib.new(n) for n in self.checksums.keys()}
-        with open(self.filepath, "rb") as ckfile:
-            size = 0
-            for chunk in filechunks(ckfile):
-                for digester in digesters.values():
-                    digester.update(chunk)
-                size += len(chunk)
+        size, checksums = self.computeSizeAndCheckSums()
 
         # Check the size and checksum match what we were told in __init__
         for n in sorted(self.checksums.keys()):
-            if digesters[n].hexdigest() != self.checksums[n]:
+            if checksums[n] != self.checksums[n]:
                 raise UploadError(
                     "File %s mentioned in the changes has a %s mismatch. "
                     "%s != %s"
                     % (
                         self.filename,
                         n,
-                        digesters[n].hexdigest(),
+                        checksums[n],
                         self.checksums[n],
                     )
                 )
@@ -250,6 +377,15 @@ def checkSizeAndCheckSum(self):
                 "%s != %s" % (self.filename, size, self.size)
             )
 
+    def computeSizeAndCheckSums(self):
+        """Read the nascent file and compute its size and checksums.
+
+        :return: A tuple of the size of the file as read in and a dict
+            mapping each checksum name in `self.checksums` to its hex
+            digest.
+        """
+        return read_size_and_checksums(self.filepath, self.checksums.keys())
+
 
 class CustomUploadFile(NascentUploadFile):
     """NascentUpload file for Custom uploads.
@@ -528,9 +664,15 @@ class BaseBinaryUploadFile(PackageUploadFile):
     # then used to locate or create the relevant sources and build.
     control = None
     control_version = None
+    contents = None
     sourcepackagerelease = None
     source_name = None
     source_version = None
+    # The cached results of inspect().
+    _inspection = None
+    # Whether inspect() needs to walk the data tarball, for timestamp
+    # checks and contents.
+    inspect_data = True
 
     def __init__(
         self,
@@ -611,6 +753,52 @@ def local_checks(self):
         """Should be implemented locally."""
         raise NotImplementedError
 
+    def inspect(self):
+        """Inspect the package in a single pass, if not already done.
+
+        The checksums, control file, member timestamps and list of files
+        shipped are all gathered together, and the result is cached for
+        use by `checkSizeAndCheckSum`, `extractAndParseControl` and
+        `verifyDebTimestamp`.
+
+        :return: A `DebInspection`.
+        """
+        if self._inspection is None:
+            future_cutoff = time.time() + self.policy.future_time_grace
+            earliest_year = time.strptime(str(self.policy.earliest_year), "%Y")
+            past_cutoff = time.mktime(earliest_year)
+            inspection = DebInspection(
+                self.filepath,
+                self.checksums.keys(),
+                future_cutoff,
+                past_cutoff,
+                walk_data=self.inspect_data,
+            )
+            self.reportInspection(inspection)
+            self._inspection = inspection
+        return self._inspection
+
+    def reportInspection(self, inspection):
+        """Report how long each phase of inspecting this package took.
+
+        This lets us see how expensive verifying large packages such as
+        kernels and debug symbols is.
+        """
+        statsd_client = getUtility(IStatsdClient)
+        for phase, duration in sorted(inspection.durations.items()):
+            statsd_client.timing(
+                "upload_file.inspection_duration",
+                duration * 1000,
+                labels={"format": self.format.name, "phase": phase},
+            )
+
+    def computeSizeAndCheckSums(self):
+        """See `NascentUploadFile`."""
+        inspection = self.inspect()
+        if inspection.checksums is None:
+            raise inspection.open_error
+        return inspection.size, inspection.checksums
+
     def verify(self):
         """Verify the contents of the .deb or .udeb as best we can.
 
@@ -628,16 +816,15 @@ def verify(self):
 
     def extractAndParseControl(self):
         """Extract and parse control information."""
-        try:
-            deb_file = apt_inst.DebFile(self.filepath)
-            control_file = deb_file.control.extractdata("control")
-            control_lines = apt_pkg.TagSection(control_file, bytes=True)
-        except Exception as e:
+        inspection = self.inspect()
+        if inspection.control_error is not None:
+            error_type, error = inspection.control_error
             yield UploadError(
                 "%s: extracting control file raised %s: %s. giving up."
-                % (self.filename, sys.exc_info()[0], e)
+                % (self.filename, error_type, error)
             )
             return
+        control_lines = inspection.control
 
         for mandatory_field in self.mandatory_fields:
             if control_lines.find(mandatory_field) is None:
@@ -843,56 +1030,42 @@ def verifyDebTimestamp(self):
         """Check specific DEB format timestamp checks."""
         self.logger.debug("Verifying timestamps in %s" % (self.filename))
 
-        future_cutoff = time.time() + self.policy.future_time_grace
-        earliest_year = time.strptime(str(self.policy.earliest_year), "%Y")
-        past_cutoff = time.mktime(earliest_year)
-
-        tar_checker = TarFileDateChecker(future_cutoff, past_cutoff)
-        tar_checker.reset()
-        try:
-            deb_file = apt_inst.DebFile(self.filepath)
-        except SystemError as error:
-            # We get an error from the constructor if the .deb does not
-            # contain all the expected top-level members (debian-binary,
-            # control.tar.gz, and data.tar.*).
-            yield UploadError(str(error))
+        inspection = self.inspect()
+        if inspection.open_error is not None:
+            yield UploadError(str(inspection.open_error))
             return
-        try:
-            deb_file.control.go(tar_checker.callback)
-            deb_file.data.go(tar_checker.callback)
-            future_files = list(tar_checker.future_files)
-            if future_files:
-                first_file = future_files[0]
-                timestamp = time.ctime(tar_checker.future_files[first_file])
-                yield UploadError(
-                    "%s: has %s file(s) with a time stamp too "
-                    "far into the future (e.g. %s [%s])."
-                    % (self.filename, len(future_files), first_file, timestamp)
-                )
-
-            ancient_files = list(tar_checker.ancient_files)
-            if ancient_files:
-                first_file = ancient_files[0]
-                timestamp = time.ctime(tar_checker.ancient_files[first_file])
-                yield UploadError(
-                    "%s: has %s file(s) with a time stamp too "
-                    "far in the past (e.g. %s [%s])."
-                    % (
-                        self.filename,
-                        len(ancient_files),
-                        first_file,
-                        timestamp,
-                    )
-                )
-        except Exception as error:
-            # There is a very large number of places where we
-            # might get an exception while checking the timestamps.
-            # Many of them come from apt_inst/apt_pkg and they are
-            # terrible in giving sane exceptions. We thusly capture
-            # them all and make them into rejection messages instead
+        if inspection.members_error is not None:
             yield UploadError(
                 "%s: deb contents timestamp check failed: %s"
-                % (self.filename, error)
+                % (self.filename, inspection.members_error)
+            )
+            return
+
+        self.contents = inspection.contents
+        tar_checker = inspection.tar_checker
+        future_files = list(tar_checker.future_files)
+        if future_files:
+            first_file = future_files[0]
+            timestamp = time.ctime(tar_checker.future_files[first_file])
+            yield UploadError(
+                "%s: has %s file(s) with a time stamp too "
+                "far into the future (e.g. %s [%s])."
+                % (self.filename, len(future_files), first_file, timestamp)
+            )
+
+        ancient_files = list(tar_checker.ancient_files)
+        if ancient_files:
+            first_file = ancient_files[0]
+            timestamp = time.ctime(tar_checker.ancient_files[first_file])
+            yield UploadError(
+                "%s: has %s file(s) with a time stamp too "
+                "far in the past (e.g. %s [%s])."
+                % (
+                    self.filename,
+                    len(ancient_files),
+                    first_file,
+                    timestamp,
+                )
             )
 
     #
@@ -1093,6 +1266,10 @@ def storeInDatabase(self, build):
                 restricted=self.policy.archive.private,
             )
         binary.addFile(library_file)
+        if self.format == BinaryPackageFormat.DEB and self.contents:
+            getUtility(IBinaryPackageReleaseContentsSet).add(
+                binary, self.contents
+            )
         return binary
 
 
@@ -1100,6 +1277,9 @@ class UdebBinaryUploadFile(BaseBinaryUploadFile):
     """Represents an uploaded binary package file in udeb format."""
 
     format = BinaryPackageFormat.UDEB
+    # UDEBs get neither timestamp checks nor contents, so there's no need
+    # to walk their data.
+    inspect_data = False
 
     @property
     def local_checks(self):
@@ -1130,12 +1310,12 @@ def local_checks(self):
             self.verifyDepends,
             self.verifySection,
             self.verifyPriority,
-            # We used to run verifyFormat here too.  However,
-            # verifyDebTimestamp does an approximately equivalent check in
-            # passing by iterating over the control and data parts via
-            # apt_inst.DebFile, and both verifyFormat and verifyDebTimestamp
-            # can be slow on large files, so it's best to avoid running both
-            # of them.
+            # We used to run verifyFormat here too.  However, inspect()
+            # does an approximately equivalent check in passing by
+            # iterating over the control and data parts via
+            # apt_inst.DebFile, and both verifyFormat and inspect() can be
+            # slow on large files, so it's best to avoid running both of
+            # them.
             self.verifyDebTimestamp,
         ]
 
@@ -5,6 +5,7 @@
 
 __all__ = ["ProcessUpload"]
 
+import copy
 import os
 
 from lp.archiveuploader.uploadpolicy import findPolicyByName
@@ -110,6 +111,20 @@ def add_my_options(self):
             help="Override the announcement list",
         )
 
+        self.parser.add_option(
+            "--workers",
+            action="store",
+            type="int",
+            dest="workers",
+            metavar="NUM",
+            default=1,
+            help=(
+                "Process up to NUM uploads concurrently.  Uploads of the "
+                "same source package to the same archive and suite are "
+                "still processed one at a time."
+            ),
+        )
+
     def main(self):
         if len(self.args) != 1:
             raise LaunchpadScriptFailure(
@@ -117,6 +132,9 @@ def main(self):
                 "argument, namely the fsroot for the upload."
             )
 
+        if self.options.workers < 1:
+            raise LaunchpadScriptFailure("--workers must be at least 1.")
+
         self.options.base_fsroot = os.path.abspath(self.args[0])
 
         if not os.path.isdir(self.options.base_fsroot):
@@ -127,10 +145,13 @@ def main(self):
         self.logger.debug("Initializing connection.")
 
         def getPolicy(distro, build):
-            self.options.distro = distro.name
-            policy = findPolicyByName(self.options.context)
-            policy.setOptions(self.options)
-            if self.options.builds:
+            # Uploads may be processed in several threads at once, so
+            # don't modify the shared options.
+            options = copy.copy(self.options)
+            options.distro = distro.name
+            policy = findPolicyByName(options.context)
+            policy.setOptions(options)
+            if options.builds:
                 assert build, "--builds specified but no build"
                 policy.distroseries = build.distro_series
                 policy.pocket = build.pocket
@@ -146,6 +167,7 @@ def getPolicy(distro, build):
             getPolicy,
             self.txn,
             self.logger,
+            workers=self.options.workers,
         )
         with default_timeout(config.uploader.timeout):
             processor.processUploadQueue(self.options.leafname)
@@ -10,27 +10,33 @@
 import os
 import subprocess
 import tarfile
+import time
 from functools import partial
 from unittest import mock
 
 import six
 from debian.deb822 import Changes, Deb822, Dsc
+from fixtures import MockPatchObject
 from testtools.matchers import (
     Contains,
     Equals,
+    GreaterThan,
     MatchesAny,
     MatchesListwise,
     MatchesRegex,
     MatchesSetwise,
     MatchesStructure,
 )
+from zope.component import getUtility
 
+from lp.archiveuploader import nascentuploadfile
 from lp.archiveuploader.changesfile import ChangesFile
 from lp.archiveuploader.dscfile import DSCFile
 from lp.archiveuploader.nascentuploadfile import (
     CustomUploadFile,
     DebBinaryUploadFile,
     NascentUploadFile,
+    UdebBinaryUploadFile,
     UploadError,
 )
 from lp.archiveuploader.tests import AbsolutelyAnythingGoesUploadPolicy
@@ -38,11 +44,15 @@
 from lp.registry.interfaces.pocket import PackagePublishingPocket
 from lp.services.log.logger import BufferLogger
 from lp.services.osutils import write_file
+from lp.services.statsd.tests import StatsMixin
 from lp.soyuz.enums import (
     BinarySourceReferenceType,
     PackagePublishingStatus,
     PackageUploadCustomFormat,
 )
+from lp.soyuz.interfaces.binarypackagereleasecontents import (
+    IBinaryPackageReleaseContentsSet,
+)
 from lp.testing import TestCaseWithFactory
 from lp.testing.layers import LaunchpadZopelessLayer, ZopelessDatabaseLayer
 
@@ -445,7 +455,7 @@ def test_checkBuild_inconsistent(self):
         self.assertRaises(UploadError, uploadfile.checkBuild, build)
 
 
-class DebBinaryUploadFileTests(PackageUploadFileTestCase):
+class DebBinaryUploadFileTests(StatsMixin, PackageUploadFileTestCase):
     """Tests for DebBinaryUploadFile."""
 
     layer = LaunchpadZopelessLayer
@@ -481,9 +491,19 @@ def _writeCompressedFile(self, filename, data):
             f.write(data)
 
     def createDeb(
-        self, filename, control, control_format, data_format, members=None
+        self,
+        filename,
+        control,
+        control_format,
+        data_format,
+        members=None,
+        data_files=None,
     ):
-        """Return the contents of a dummy .deb file."""
+        """Return the contents of a dummy .deb file.
+
+        :param data_files: An optional list of paths of empty files to
+            include in the data tarball.
+        """
         tempdir = self.makeTemporaryDirectory()
         control = {k: six.ensure_text(v) for k, v in control.items()}
         if members is None:
@@ -514,8 +534,13 @@ def createDeb(
                 )
             elif member.startswith("data.tar."):
                 with io.BytesIO() as data_tar_buf:
-                    with tarfile.open(mode="w", fileobj=data_tar_buf):
-                        pass
+                    with tarfile.open(
+                        mode="w", fileobj=data_tar_buf
+                    ) as data_tar:
+                        for data_file in data_files or []:
+                            tarinfo = tarfile.TarInfo(name=data_file)
+                            tarinfo.mtime = int(time.time())
+                            data_tar.addfile(tarinfo, fileobj=io.BytesIO())
                     data_tar_bytes = data_tar_buf.getvalue()
                 self._writeCompressedFile(
                     os.path.join(tempdir, member), data_tar_bytes
@@ -541,6 +566,7 @@ def createDebBinaryUploadFile(
         control_format=None,
         data_format=None,
         members=None,
+        data_files=None,
     ):
         """Create a DebBinaryUploadFile."""
         if (
@@ -548,11 +574,17 @@ def createDebBinaryUploadFile(
             or control_format is not None
             or data_format is not None
             or members is not None
+            or data_files is not None
         ):
             if control is None:
                 control = self.getBaseControl()
             data = self.createDeb(
-                filename, control, control_format, data_format, members=members
+                filename,
+                control,
+                control_format,
+                data_format,
+                members=members,
+                data_files=data_files,
             )
         else:
             data = b"DUMMY DATA"
@@ -733,6 +765,165 @@ def test_verifyDebTimestamp_SystemError(self):
             ),
         )
 
+    def test_verifyDebTimestamp_records_contents(self):
+        # verifyDebTimestamp records the files shipped in the package,
+        # omitting directories.
+        uploadfile = self.createDebBinaryUploadFile(
+            "foo_0.42_i386.deb",
+            "main/python",
+            "unknown",
+            "mypkg",
+            "0.42",
+            None,
+            control_format="gz",
+            data_format="xz",
+            data_files=["./usr/bin/foo", "./usr/share/doc/foo/copyright"],
+        )
+        list(uploadfile.verifyDebTimestamp())
+        self.assertEqual(
+            [b"usr/bin/foo", b"usr/share/doc/foo/copyright"],
+            uploadfile.contents,
+        )
+
+    def test_storeInDatabase_records_contents(self):
+        # storeInDatabase records the files shipped in the package for
+        # use when generating Contents files.
+        uploadfile = self.createDebBinaryUploadFile(
+            "foo_0.42_i386.deb",
+            "main/python",
+            "unknown",
+            "mypkg",
+            "0.42",
+            None,
+        )
+        uploadfile.parseControl(self.getBaseControl())
+        uploadfile.contents = [b"usr/bin/foo"]
+        bpr = uploadfile.storeInDatabase(self.factory.makeBinaryPackageBuild())
+        self.assertEqual(
+            {bpr.id: [b"usr/bin/foo"]},
+            getUtility(IBinaryPackageReleaseContentsSet).getPaths([bpr.id]),
+        )
+
+    def test_inspect_single_pass(self):
+        # Checking the checksums, extracting the control file and checking
+        # timestamps share a single inspection of the package.
+        uploadfile = self.createDebBinaryUploadFile(
+            "foo_0.42_i386.deb",
+            "main/python",
+            "unknown",
+            "mypkg",
+            "0.42",
+            None,
+            control_format="gz",
+            data_format="xz",
+            data_files=["./usr/bin/foo"],
+        )
+        read_size_and_checksums = self.useFixture(
+            MockPatchObject(
+                nascentuploadfile,
+                "read_size_and_checksums",
+                wraps=nascentuploadfile.read_size_and_checksums,
+            )
+        ).mock
+        deb_file = self.useFixture(
+            MockPatchObject(
+                nascentuploadfile.apt_inst,
+                "DebFile",
+                wraps=nascentuploadfile.apt_inst.DebFile,
+            )
+        ).mock
+        uploadfile.checkSizeAndCheckSum()
+        self.assertEqual([], list(uploadfile.extractAndParseControl()))
+        self.assertEqual([], list(uploadfile.verifyDebTimestamp()))
+        self.assertEqual(1, read_size_and_checksums.call_count)
+        self.assertEqual(1, deb_file.call_count)
+        self.assertEqual("dulwich", uploadfile.source_name)
+        self.assertEqual([b"usr/bin/foo"], uploadfile.contents)
+
+    def test_inspect_udeb_skips_data(self):
+        # UDEBs are not checked for timestamps and have no contents, so
+        # inspecting them only walks the control tarball.
+        data = self.createDeb(
+            "foo_0.42_i386.udeb",
+            self.getBaseControl(),
+            "gz",
+            "gz",
+            data_files=["./usr/bin/foo"],
+        )
+        path, md5, sha1, size = self.writeUploadFile(
+            "foo_0.42_i386.udeb", data
+        )
+        uploadfile = UdebBinaryUploadFile(
+            path,
+            dict(MD5=md5),
+            size,
+            "main/python",
+            "unknown",
+            "mypkg",
+            "0.42",
+            None,
+            self.policy,
+            self.logger,
+        )
+        inspection = uploadfile.inspect()
+        self.assertIsNone(inspection.members_error)
+        self.assertEqual([], inspection.contents)
+        self.assertEqual([], list(uploadfile.extractAndParseControl()))
+        self.assertEqual("dulwich", uploadfile.source_name)
+
+    def test_inspect_not_a_deb(self):
+        # Files that aren't valid packages still have their checksums
+        # checked, and the problem is reported by the verification steps.
+        uploadfile = self.createDebBinaryUploadFile(
+            "foo_0.42_i386.deb",
+            "main/python",
+            "unknown",
+            "mypkg",
+            "0.42",
+            None,
+        )
+        uploadfile.checkSizeAndCheckSum()
+        errors = list(uploadfile.extractAndParseControl())
+        self.assertEqual(1, len(errors))
+        self.assertStartsWith(
+            str(errors[0]),
+            "foo_0.42_i386.deb: extracting control file raised ",
+        )
+        self.assertEqual(1, len(list(uploadfile.verifyDebTimestamp())))
+
+    def test_inspect_reports_timing(self):
+        # Inspecting a package reports how long each phase took.
+        self.setUpStats()
+        uploadfile = self.createDebBinaryUploadFile(
+            "foo_0.42_i386.deb",
+            "main/python",
+            "unknown",
+            "mypkg",
+            "0.42",
+            None,
+            control_format="gz",
+            data_format="gz",
+        )
+        uploadfile.inspect()
+        uploadfile.inspect()
+        self.assertThat(
+            [call[0] for call in self.stats_client.timing.call_args_list],
+            MatchesListwise(
+                [
+                    MatchesListwise(
+                        (
+                            Equals(
+                                "upload_file.inspection_duration,env=test,"
+                                "format=DEB,phase=%s" % phase
+                            ),
+                            GreaterThan(0),
+                        )
+                    )
+                    for phase in ("checksums", "members")
+                ]
+            ),
+        )
+
     def test_storeInDatabase(self):
         # storeInDatabase creates a BinaryPackageRelease.
         uploadfile = self.createDebBinaryUploadFile(
@@ -12,6 +12,9 @@
 import os
 import shutil
 import tempfile
+import threading
+import time
+from unittest import mock
 
 import six
 from fixtures import MonkeyPatch
@@ -36,6 +39,7 @@
     UploadHandler,
     UploadProcessor,
     UploadStatusEnum,
+    UserUploadHandler,
     parse_build_upload_leaf_name,
 )
 from lp.buildmaster.enums import BuildFarmJobType, BuildStatus
@@ -1626,6 +1630,93 @@ def testUploadStatsdMetricsBuildUploadUser(self):
             ),
         )
 
+    def testUploadStatsdMetricsQueue(self):
+        # The throughput of a run over the queue and the longest time an
+        # upload waited in it are reported.
+        self.setUpStats()
+        uploadprocessor = self.getUploadProcessor(self.layer.txn)
+        self.queueUpload("bar_1.0-1")
+        self.queueUpload("bar_1.0-2")
+
+        uploadprocessor.processUploadQueue()
+
+        self.assertEqual(
+            [mock.call("upload_queue.processed,env=test,workers=1", 2)],
+            self.stats_client.incr.call_args_list,
+        )
+        self.assertEqual(
+            [
+                "upload_queue.throughput,env=test,workers=1",
+                "upload_queue.max_wait,env=test,workers=1",
+            ],
+            [call[0][0] for call in self.stats_client.gauge.call_args_list],
+        )
+
+    def testProcessUploadQueueInParallel(self):
+        # Uploads can be processed by several workers, each with its own
+        # transactions.
+        self.setUpStats()
+        uploadprocessor = self.setupBreezyAndGetUploadProcessor()
+        uploadprocessor.workers = 2
+        self.queueUpload("bar_1.0-1")
+        self.queueUpload("baz_1.0-1")
+
+        uploadprocessor.processUploadQueue()
+
+        self.assertEqual([], os.listdir(self.incoming_folder))
+        self.assertEqual([], os.listdir(self.failed_folder))
+        for name in ("bar", "baz"):
+            queue_items = self.breezy.getPackageUploads(
+                status=PackageUploadStatus.NEW,
+                name=name,
+                version="1.0-1",
+                exact_match=True,
+            )
+            self.assertEqual(1, queue_items.count())
+        self.assertEqual(2, self.stats_client.timing.call_count)
+        self.assertEqual(
+            [mock.call("upload_queue.processed,env=test,workers=2", 2)],
+            self.stats_client.incr.call_args_list,
+        )
+
+    def testProcessUploadsInParallelSerialisesByKey(self):
+        # Uploads that share a serialisation key are processed one at a
+        # time and in order, while others are processed concurrently.
+        uploadprocessor = self.getUploadProcessor(self.layer.txn)
+        uploadprocessor.workers = 3
+        keys = {"a1": {"a"}, "b": {"b"}, "a2": {"a"}, "ac": {"a", "c"}}
+        lock = threading.Lock()
+        events = []
+
+        def processUpload(fsroot, upload):
+            with lock:
+                events.append(("start", upload))
+            time.sleep(0.1)
+            with lock:
+                events.append(("end", upload))
+            return True
+
+        uploadprocessor.getSerialisationKeys = lambda fsroot, upload: keys[
+            upload
+        ]
+        uploadprocessor.processUpload = processUpload
+
+        self.assertEqual(
+            4,
+            uploadprocessor.processUploadsInParallel(
+                self.incoming_folder, ["a1", "b", "a2", "ac"]
+            ),
+        )
+        self.assertLess(
+            events.index(("end", "a1")), events.index(("start", "a2"))
+        )
+        self.assertLess(
+            events.index(("end", "a2")), events.index(("start", "ac"))
+        )
+        self.assertLess(
+            events.index(("start", "b")), events.index(("end", "a1"))
+        )
+
     def testUploadStatsdMetricsBuildUploadBinaryPackage(self):
         self.setUpStats()
         self.setupBreezy()
@@ -2787,6 +2878,92 @@ def testInvalidLeafName(self):
             "Unable to extract build id from leaf name bar, skipping.", str(e)
         )
 
+    def testSerialisationKeysUserUpload(self):
+        # User uploads are serialised on the archive, suite and source
+        # package that each of their changes files targets.
+        self.queueUpload("bar_1.0-1", "ubuntu")
+        handler = UserUploadHandler(
+            self.uploadprocessor, self.incoming_folder, "bar_1.0-1"
+        )
+        self.assertEqual(
+            {(self.ubuntu.main_archive.id, self.breezy.id, "RELEASE", "bar")},
+            handler.getSerialisationKeys(),
+        )
+
+    def testSerialisationKeysUserUploadPaths(self):
+        # Uploads of the same source package to the same suite get the
+        # same key whichever upload path they use.
+        keys = []
+        for count, relative_path in enumerate(("", "ubuntu", "ubuntu/breezy")):
+            queue_entry = "bar-%d" % count
+            self.queueUpload(
+                "bar_1.0-1", relative_path, queue_entry=queue_entry
+            )
+            handler = UserUploadHandler(
+                self.uploadprocessor, self.incoming_folder, queue_entry
+            )
+            keys.append(handler.getSerialisationKeys())
+        self.assertEqual(
+            [{(self.ubuntu.main_archive.id, self.breezy.id, "RELEASE", "bar")}]
+            * 3,
+            keys,
+        )
+
+    def testSerialisationKeysUserUploadBadPath(self):
+        # Uploads to bad paths will be rejected, so they don't wait for
+        # anything.
+        self.queueUpload("bar_1.0-1", "nonexistent")
+        handler = UserUploadHandler(
+            self.uploadprocessor, self.incoming_folder, "bar_1.0-1"
+        )
+        self.assertEqual(
+            {("bar_1.0-1", "nonexistent/bar_1.0-1_source.changes")},
+            handler.getSerialisationKeys(),
+        )
+
+    def testSerialisationKeysBinaryPackageBuild(self):
+        # Binary package build uploads get the same keys as user uploads
+        # of the same source package to the same suite.
+        self.switchToAdmin()
+        build = self.factory.makeBinaryPackageBuild(
+            distroarchseries=self.breezy["i386"],
+            archive=self.ubuntu.main_archive,
+            pocket=PackagePublishingPocket.RELEASE,
+        )
+        self.switchToUploader()
+        self.queueUpload("bar_1.0-1_binary", queue_entry="build")
+        build_handler = BuildUploadHandler(
+            self.getUploadProcessor(self.layer.txn, builds=True),
+            self.incoming_folder,
+            "build",
+            build,
+        )
+        self.queueUpload("bar_1.0-1", queue_entry="user")
+        user_handler = UserUploadHandler(
+            self.uploadprocessor, self.incoming_folder, "user"
+        )
+        self.assertEqual(
+            {(self.ubuntu.main_archive.id, self.breezy.id, "RELEASE", "bar")},
+            build_handler.getSerialisationKeys(),
+        )
+        self.assertEqual(
+            user_handler.getSerialisationKeys(),
+            build_handler.getSerialisationKeys(),
+        )
+
+    def testSerialisationKeysOtherBuild(self):
+        # Other build uploads don't touch archives, so they are only
+        # serialised with uploads from the same build.
+        self.switchToAdmin()
+        build = self.factory.makeSnapBuild()
+        self.switchToUploader()
+        handler = BuildUploadHandler(
+            self.uploadprocessor, self.incoming_folder, "test", build
+        )
+        self.assertEqual(
+            {("SNAPBUILD", build.id)}, handler.getSerialisationKeys()
+        )
+
     def testNoBuildEntry(self):
         # Directories with that refer to a nonexistent build
         # should be skipped and a warning logged.
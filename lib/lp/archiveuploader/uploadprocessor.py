@@ -47,9 +47,12 @@
 import os
 import shutil
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
 
 from zope.component import getUtility
+from zope.security.management import endInteraction
 
 from lp.app.errors import NotFoundError
 from lp.archiveuploader.charmrecipeupload import CharmRecipeUpload
@@ -63,6 +66,7 @@
 from lp.archiveuploader.ocirecipeupload import OCIRecipeUpload
 from lp.archiveuploader.rockrecipeupload import RockRecipeUpload
 from lp.archiveuploader.snapupload import SnapUpload
+from lp.archiveuploader.tagfiles import parse_tagfile
 from lp.archiveuploader.uploadpolicy import (
     BuildDaemonUploadPolicy,
     UploadPolicyError,
@@ -80,6 +84,11 @@
 from lp.registry.interfaces.distribution import IDistributionSet
 from lp.registry.interfaces.person import IPersonSet
 from lp.rocks.interfaces.rockrecipebuild import IRockRecipeBuild
+from lp.services.database.sqlbase import disconnect_stores
+from lp.services.features import (
+    get_relevant_feature_controller,
+    install_feature_controller,
+)
 from lp.services.log.logger import BufferLogger
 from lp.services.statsd.interfaces.statsd_client import IStatsdClient
 from lp.services.webapp.adapter import (
@@ -87,8 +96,10 @@
     set_request_started,
 )
 from lp.services.webapp.errorlog import ErrorReportingUtility, ScriptRequest
+from lp.services.webapp.interaction import ANONYMOUS, setupInteractionByEmail
 from lp.snappy.interfaces.snapbuild import ISnapBuild
 from lp.soyuz.interfaces.archive import IArchiveSet, NoSuchPPA
+from lp.soyuz.interfaces.binarypackagebuild import IBinaryPackageBuild
 from lp.soyuz.interfaces.livefsbuild import ILiveFSBuild
 
 __all__ = [
@@ -155,6 +166,7 @@ def __init__(
         policy_for_distro,
         ztm,
         log,
+        workers=1,
     ):
         """Create a new upload processor.
 
@@ -167,6 +179,7 @@ def __init__(
             distribution
         :param ztm: Database transaction to use
         :param log: Logger to use for reporting
+        :param workers: Number of threads to process uploads with
         """
         self.base_fsroot = base_fsroot
         self.dry_run = dry_run
@@ -177,6 +190,10 @@ def __init__(
         self.builds = builds
         self._getPolicyForDistro = policy_for_distro
         self.ztm = ztm
+        self.workers = workers
+        # The longest time an upload has waited in the queue during this
+        # run, in seconds.
+        self._max_queue_wait = 0
 
     def reportStatsdMetrics(self, handler, upload_duration):
         upload_type = "UserUpload"
@@ -214,6 +231,10 @@ def processUploadQueue(self, leaf_name=None):
             self.log.debug(
                 "Checked in %s, found %s" % (fsroot, uploads_to_process)
             )
+            queue_started = time.monotonic()
+            self._max_queue_wait = 0
+            processed = 0
+            parallel_uploads = []
             for upload in uploads_to_process:
                 self.log.debug("Considering upload %s" % upload)
                 if leaf_name is not None and upload != leaf_name:
@@ -222,25 +243,154 @@ def processUploadQueue(self, leaf_name=None):
                         % (upload, leaf_name)
                     )
                     continue
-                set_request_started(enable_timeout=False)
-                try:
-                    handler = UploadHandler.forProcessor(self, fsroot, upload)
-                    date_started = datetime.now(timezone.utc)
-                except CannotGetBuild as e:
-                    self.log.warning(e)
-                else:
-                    handler.process()
-                    date_completed = datetime.now(timezone.utc)
-                    upload_duration = (
-                        date_completed - date_started
-                    ).total_seconds() * 1000
-                    self.reportStatsdMetrics(handler, upload_duration)
-                finally:
-                    clear_request_started()
+                if self.workers > 1:
+                    parallel_uploads.append(upload)
+                elif self.processUpload(fsroot, upload):
+                    processed += 1
+            if parallel_uploads:
+                processed += self.processUploadsInParallel(
+                    fsroot, parallel_uploads
+                )
+            self.reportQueueStatsdMetrics(
+                processed, time.monotonic() - queue_started
+            )
         finally:
             self.log.debug("Rolling back any remaining transactions.")
             self.ztm.abort()
 
+    def processUpload(self, fsroot, upload):
+        """Process a single upload directory in its own transactions.
+
+        :param fsroot: Path to the directory containing the upload.
+        :param upload: Name of the upload directory.
+        :return: True if the upload was processed, or False if it was
+            skipped.
+        """
+        set_request_started(enable_timeout=False)
+        try:
+            try:
+                arrived = os.stat(os.path.join(fsroot, upload)).st_mtime
+                handler = UploadHandler.forProcessor(self, fsroot, upload)
+                date_started = datetime.now(timezone.utc)
+            except CannotGetBuild as e:
+                self.log.warning(e)
+                return False
+            self._max_queue_wait = max(
+                self._max_queue_wait, time.time() - arrived
+            )
+            handler.process()
+            date_completed = datetime.now(timezone.utc)
+            upload_duration = (
+                date_completed - date_started
+            ).total_seconds() * 1000
+            self.reportStatsdMetrics(handler, upload_duration)
+            return True
+        finally:
+            clear_request_started()
+
+    def processUploadInWorker(self, fsroot, upload):
+        """Process a single upload in a worker thread.
+
+        Storm stores and Zope security interactions belong to the thread
+        that uses them, so the worker sets up its own anonymous
+        interaction, just as the script does, and closes the stores that
+        it opened once the upload has been processed; nothing is shared
+        with the main thread or other workers.
+        """
+        setupInteractionByEmail(ANONYMOUS)
+        try:
+            return self.processUpload(fsroot, upload)
+        finally:
+            endInteraction()
+            disconnect_stores()
+
+    def getSerialisationKeys(self, fsroot, upload):
+        """Return the keys that an upload must be serialised on.
+
+        :return: A set of keys, or None if the upload should be skipped.
+        """
+        set_request_started(enable_timeout=False)
+        try:
+            return UploadHandler.forProcessor(
+                self, fsroot, upload
+            ).getSerialisationKeys()
+        except CannotGetBuild as e:
+            self.log.warning(e)
+            return None
+        finally:
+            clear_request_started()
+            self.ztm.abort()
+
+    def processUploadsInParallel(self, fsroot, uploads):
+        """Process uploads using up to `self.workers` threads.
+
+        Each upload is processed in its own transactions, just as when
+        processing uploads serially, using the worker thread's own
+        database connection and store (see `processUploadInWorker`).
+        Uploads that share a serialisation key (for example, uploads of
+        the same source package to the same archive and suite) are never
+        processed at the same time, and are processed in the order in
+        which they were found.
+
+        :return: The number of uploads processed.
+        """
+        pending = []
+        for upload in uploads:
+            keys = self.getSerialisationKeys(fsroot, upload)
+            if keys is not None:
+                pending.append((upload, keys))
+
+        processed = 0
+        running = {}
+        with ThreadPoolExecutor(
+            max_workers=self.workers,
+            initializer=install_feature_controller,
+            initargs=(get_relevant_feature_controller(),),
+        ) as executor:
+            while pending or running:
+                # Start any uploads whose keys are not in use by a running
+                # upload or needed by an earlier pending upload.
+                blocked = set()
+                for keys in running.values():
+                    blocked.update(keys)
+                still_pending = []
+                for upload, keys in pending:
+                    if len(running) < self.workers and not (keys & blocked):
+                        future = executor.submit(
+                            self.processUploadInWorker, fsroot, upload
+                        )
+                        running[future] = keys
+                    else:
+                        still_pending.append((upload, keys))
+                    blocked.update(keys)
+                pending = still_pending
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    if future.result():
+                        processed += 1
+        return processed
+
+    def reportQueueStatsdMetrics(self, processed, duration):
+        """Report the throughput and latency of a run over the queue.
+
+        :param processed: The number of uploads processed.
+        :param duration: The time taken to process them, in seconds.
+        """
+        if not processed:
+            return
+        statsd_client = getUtility(IStatsdClient)
+        labels = {"workers": self.workers}
+        statsd_client.incr("upload_queue.processed", processed, labels=labels)
+        if duration > 0:
+            statsd_client.gauge(
+                "upload_queue.throughput", processed / duration, labels=labels
+            )
+        statsd_client.gauge(
+            "upload_queue.max_wait", self._max_queue_wait, labels=labels
+        )
+
     def locateDirectories(self, fsroot):
         """Return a list of upload directories in a given queue.
 
@@ -540,6 +690,57 @@ def moveUpload(self, subdir_name, logger):
         )
         shutil.move(self.upload_path, target_path)
 
+    def getSerialisationKeys(self):
+        """Return the keys that this upload must be serialised on.
+
+        When uploads are processed in parallel, uploads that share a key
+        are processed one at a time, in order.  Package uploads are keyed
+        on the (archive ID, distroseries ID, pocket name, source package
+        name) that each of their changes files targets.
+
+        :return: A set of hashable keys.
+        """
+        return {
+            self.getChangesFileSerialisationKey(changes_file)
+            for changes_file in self.locateChangesFiles()
+        }
+
+    def getChangesFileSerialisationKey(self, changes_file):
+        """Return the key that a changes file must be serialised on.
+
+        The target archive, series and pocket are worked out from the
+        upload path, the upload policy and the changes file in the same
+        way as `processChangesFile` and `NascentUpload` do, so that user
+        uploads and build uploads of the same source package to the same
+        suite get the same key however they were uploaded.
+
+        :param changes_file: The path of a changes file relative to the
+            upload directory.
+        """
+        relative_path = os.path.dirname(changes_file)
+        try:
+            distribution, suite_name, archive = parse_upload_path(
+                relative_path
+            )
+            changes = parse_tagfile(
+                os.path.join(self.upload_path, changes_file)
+            )
+            source_name = changes["Source"].decode().split()[0]
+            policy = self._getPolicyForDistro(distribution)
+            policy.archive = archive
+            if suite_name is None:
+                suite_name = changes["Distribution"].decode()
+            policy.setDistroSeriesAndPocket(suite_name)
+        except Exception:
+            # The upload will be rejected, so it has nothing to wait for.
+            return (self.upload, changes_file)
+        return (
+            policy.archive.id,
+            policy.distroseries.id,
+            policy.pocket.name,
+            source_name,
+        )
+
     @staticmethod
     def orderFilenames(fnames):
         """Order filenames, sorting *_source.changes before others.
@@ -628,6 +829,17 @@ def __init__(self, processor, fsroot, upload, build=None):
     def _getPolicyForDistro(self, distribution):
         return self.processor._getPolicyForDistro(distribution, self.build)
 
+    def getSerialisationKeys(self):
+        """See `UploadHandler`."""
+        build = self.build
+        if IBinaryPackageBuild.providedBy(
+            build
+        ) or ISourcePackageRecipeBuild.providedBy(build):
+            return super().getSerialisationKeys()
+        else:
+            # Other builds don't upload to archives.
+            return {(build.job_type.name, build.id)}
+
     def _processUpload(self, upload):
         upload.process(self.build)
 
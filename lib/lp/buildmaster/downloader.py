@@ -10,6 +10,7 @@
 __all__ = [
     "DownloadCommand",
     "EndFetchServiceSessionCommand",
+    "HashMismatch",
     "RemoveResourcesFetchServiceSessionCommand",
     "RequestFetchServiceSessionCommand",
     "RequestProcess",
@@ -17,6 +18,7 @@
     "RetrieveFetchServiceSessionCommand",
 ]
 
+import hashlib
 import os.path
 import tempfile
 from typing import List, Tuple
@@ -28,14 +30,29 @@
 from twisted.protocols import amp
 
 
+class HashMismatch(Exception):
+    """A downloaded file did not have the expected SHA-1 checksum."""
+
+
 class DownloadCommand(amp.Command):
+    """Download a file, resuming any earlier partial download of it.
+
+    If `sha1` is given, then the downloaded file is checked against it,
+    and the partial download is kept between attempts so that a later
+    attempt can carry on from where this one stopped.
+    """
+
     arguments = [
         (b"file_url", amp.Unicode()),
         (b"path_to_write", amp.Unicode()),
         (b"timeout", amp.Integer()),
+        (b"sha1", amp.Unicode(optional=True)),
+    ]
+    response = [
+        (b"resumed_from", amp.Integer()),
     ]
-    response: List[Tuple[bytes, amp.Argument]] = []
     errors = {
+        HashMismatch: b"HASH_MISMATCH",
         RequestException: b"REQUEST_ERROR",
         StreamingError: b"STREAMING_ERROR",
     }
@@ -135,6 +152,9 @@ class RequestProxyTokenCommand(amp.Command):
 class RequestProcess(AMPChild):
     """A subprocess that performs requests for buildd-manager."""
 
+    # The size of the chunks in which to write downloaded files.
+    download_chunk_size = 1024 * 1024
+
     @staticmethod
     def _saveResponseToFile(streamed_response, path_to_write):
         """Helper method to save a streamed response to a given path.
@@ -163,13 +183,67 @@ def _saveResponseToFile(streamed_response, path_to_write):
             os.rename(f.name, path_to_write)
         return {}
 
+    def _downloadVerified(
+        self, session, file_url, path_to_write, timeout, sha1
+    ):
+        """Download a file via a partial file, and check its checksum.
+
+        The partial file is left behind if the download is interrupted, and
+        the next call for the same file asks the server for the rest of it.
+        """
+        os.makedirs(os.path.dirname(path_to_write), exist_ok=True)
+        partial_path = path_to_write + ".part"
+        digest = hashlib.sha1()
+        resumed_from = 0
+        try:
+            with open(partial_path, "rb") as partial:
+                for chunk in iter(
+                    lambda: partial.read(self.download_chunk_size), b""
+                ):
+                    digest.update(chunk)
+                    resumed_from += len(chunk)
+        except FileNotFoundError:
+            pass
+        headers = {}
+        if resumed_from:
+            headers["Range"] = "bytes=%d-" % resumed_from
+        response = session.get(
+            file_url, headers=headers, timeout=timeout, stream=True
+        )
+        if resumed_from and response.status_code == 416:
+            # We already have the whole file.
+            response.close()
+        else:
+            response.raise_for_status()
+            if response.status_code != 206:
+                # The server sent the whole file, so start again.
+                digest = hashlib.sha1()
+                resumed_from = 0
+            with open(partial_path, "ab" if resumed_from else "wb") as f:
+                for chunk in response.iter_content(self.download_chunk_size):
+                    digest.update(chunk)
+                    f.write(chunk)
+        if digest.hexdigest() != sha1:
+            os.unlink(partial_path)
+            raise HashMismatch(
+                "%s has SHA-1 %s, expected %s"
+                % (file_url, digest.hexdigest(), sha1)
+            )
+        os.rename(partial_path, path_to_write)
+        return {"resumed_from": resumed_from}
+
     @DownloadCommand.responder
-    def downloadCommand(self, file_url, path_to_write, timeout):
+    def downloadCommand(self, file_url, path_to_write, timeout, sha1=None):
         with Session() as session:
             session.trust_env = False
+            if sha1 is not None:
+                return self._downloadVerified(
+                    session, file_url, path_to_write, timeout, sha1
+                )
             response = session.get(file_url, timeout=timeout, stream=True)
             response.raise_for_status()
-            return self._saveResponseToFile(response, path_to_write)
+            self._saveResponseToFile(response, path_to_write)
+            return {"resumed_from": 0}
 
     @RequestProxyTokenCommand.responder
     def requestProxyTokenCommand(self, url, auth_header, proxy_username):
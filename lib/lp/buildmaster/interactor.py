@@ -9,6 +9,7 @@
 
 import logging
 import os.path
+import re
 import sys
 import traceback
 from collections import OrderedDict, namedtuple
@@ -53,6 +54,12 @@ class QuietQueryFactory(xmlrpc._QueryFactory):
 _default_process_pool = None
 _default_process_pool_shutdown = None
 
+# Semaphores limiting concurrent downloads from each builder, keyed by
+# builder URL.  Entries are removed again once nothing is using them.
+_download_semaphores = {}
+
+sha1_re = re.compile(r"^[0-9a-f]{40}$")
+
 
 def default_pool(reactor=None):
     global _default_pool
@@ -241,6 +248,9 @@ def getURL(self, sha1):
     def getFile(self, sha_sum, path_to_write, logger=None):
         """Fetch a file from the builder.
 
+        At most `config.builddmaster.download_connections_per_builder`
+        files are fetched from each builder at once, if set.
+
         :param sha_sum: The sha of the file (which is also its name on the
             builder)
         :param path_to_write: A file name to write the file to
@@ -248,7 +258,32 @@ def getFile(self, sha_sum, path_to_write, logger=None):
         :return: A Deferred that calls back when the download is done, or
             errback with the error string.
         """
+        limit = config.builddmaster.download_connections_per_builder
+        if not limit:
+            yield self._getFile(sha_sum, path_to_write, logger=logger)
+            return
+        semaphore = _download_semaphores.get(self.url)
+        if semaphore is None or semaphore.limit != limit:
+            semaphore = defer.DeferredSemaphore(limit)
+            _download_semaphores[self.url] = semaphore
+        try:
+            yield semaphore.run(
+                self._getFile, sha_sum, path_to_write, logger=logger
+            )
+        finally:
+            if (
+                semaphore.tokens == semaphore.limit
+                and _download_semaphores.get(self.url) is semaphore
+            ):
+                del _download_semaphores[self.url]
+
+    @defer.inlineCallbacks
+    def _getFile(self, sha_sum, path_to_write, logger=None):
         file_url = self.getURL(sha_sum)
+        # Most files are named by their SHA-1, which lets the downloader
+        # check them and resume interrupted downloads.  Others, such as
+        # the build log, are fetched as they are.
+        sha1 = sha_sum if sha1_re.match(sha_sum) else None
         for attempt in range(config.builddmaster.download_attempts):
             try:
                 # Download the file in a subprocess.  We used to download it
@@ -257,14 +292,21 @@ def getFile(self, sha_sum, path_to_write, logger=None):
                 # that it struggled to keep up with incoming packets in time
                 # to avoid TCP timeouts (perhaps because of too much
                 # synchronous work being done on the reactor thread).
-                yield self.process_pool.doWork(
+                response = yield self.process_pool.doWork(
                     DownloadCommand,
                     file_url=file_url,
                     path_to_write=path_to_write,
                     timeout=self.timeout,
+                    sha1=sha1,
                 )
                 if logger is not None:
-                    logger.info("Grabbed %s" % file_url)
+                    if response["resumed_from"]:
+                        logger.info(
+                            "Grabbed %s, resuming from byte %d"
+                            % (file_url, response["resumed_from"])
+                        )
+                    else:
+                        logger.info("Grabbed %s" % file_url)
                 break
             except Exception as e:
                 if logger is not None:
@@ -156,6 +156,17 @@ class IBuildQueueSet(Interface):
     def get(buildqueue_id):
         """Return the `IBuildQueue` with the given id."""
 
+    def lockForDispatch(buildqueue):
+        """Lock a build candidate until the end of the transaction.
+
+        This stops several buildd-manager processes from dispatching the
+        same candidate at once.
+
+        :return: True if `buildqueue` is still waiting and is now locked;
+            False if another process has already dispatched it or is about
+            to do so.
+        """
+
     def getByBuilder(builder):
         """Return an IBuildQueue instance for a builder.
 
@@ -183,3 +194,17 @@ def findBuildCandidates(
             the given values of `virtualized`, `open_resources`, and
             `restricted_resources`.
         """
+
+    def findBuildCandidatesForGroups(builder_groups):
+        """Find candidate jobs for several groups of builders at once.
+
+        This is equivalent to calling `findBuildCandidates` once for each
+        group, but uses a constant number of queries.
+
+        :param builder_groups: A sequence of (processor, virtualized,
+            limit, open_resources, restricted_resources) tuples, with the
+            same meanings as the parameters of `findBuildCandidates`.
+        :return: A list with one element for each builder group, each of
+            which is a list of up to `limit` `IBuildQueue` items in the
+            same order as `findBuildCandidates` would return them.
+        """
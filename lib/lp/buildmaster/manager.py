@@ -6,16 +6,19 @@
 __all__ = [
     "BuilddManager",
     "BUILDD_MANAGER_LOG_NAME",
+    "BuilderShard",
+    "BuildQueueListener",
     "PrefetchedBuilderFactory",
     "WorkerScanner",
 ]
 
 import datetime
 import logging
-import os.path
 import shutil
+import zlib
 from collections import defaultdict
 
+import psycopg2
 import six
 import transaction
 from storm.expr import Column, LeftJoin, Table
@@ -43,11 +46,14 @@
 from lp.buildmaster.interfaces.buildqueue import IBuildQueueSet
 from lp.buildmaster.interfaces.processor import IProcessorSet
 from lp.buildmaster.model.builder import Builder
+from lp.buildmaster.model.buildfarmjobbehaviour import get_grabbing_directory
 from lp.buildmaster.model.buildqueue import BuildQueue
-from lp.services.config import config
+from lp.services.config import config, dbconfig
 from lp.services.database.bulk import dbify_value
 from lp.services.database.interfaces import IStore
+from lp.services.database.sqlbase import ISOLATION_LEVEL_AUTOCOMMIT, connect
 from lp.services.database.stormexpr import BulkUpdate, Values
+from lp.services.features import getFeatureFlag
 from lp.services.propertycache import get_property_cache
 from lp.services.statsd.interfaces.statsd_client import IStatsdClient
 
@@ -66,6 +72,10 @@
 # mark it builderok=False.
 BUILDER_FAILURE_THRESHOLD = 5
 
+# If set, fetch build candidates for all builder groups with idle builders
+# in a single query, rather than one query per builder group.
+BULK_CANDIDATE_QUERY_FEATURE_FLAG = "buildmaster.bulk_candidate_query.enabled"
+
 
 class PrefetchedBuildCandidates:
     """A set of build candidates updated using efficient bulk queries.
@@ -105,6 +115,53 @@ def _addCandidates(self, builder_group_key, candidates):
             self.candidates[builder_group_key].append(candidate.id)
             self.sort_keys[candidate.id] = self._getSortKey(candidate)
 
+    @staticmethod
+    def _isIdle(vitals):
+        return (
+            vitals.build_queue is None
+            and vitals.builderok
+            and not vitals.manual
+        )
+
+    def getBuilderGroupQueries(self, builder_group_keys):
+        """Return the parameters for finding candidates for builder groups.
+
+        :param builder_group_keys: A sequence of keys of `builder_groups`.
+        :return: A list of (processor, virtualized, limit, open_resources,
+            restricted_resources) tuples, suitable for passing to
+            `IBuildQueueSet.findBuildCandidatesForGroups`.
+        """
+        processor_names = {
+            processor_name
+            for processor_name, _, _, _ in builder_group_keys
+            if processor_name is not None
+        }
+        processors_by_name = {None: None}
+        if processor_names:
+            processors_by_name.update(
+                (processor.name, processor)
+                for processor in getUtility(IProcessorSet).getAll()
+                if processor.name in processor_names
+            )
+        builder_groups = []
+        for builder_group_key in builder_group_keys:
+            (
+                processor_name,
+                virtualized,
+                restricted_resources,
+                open_resources,
+            ) = builder_group_key
+            builder_groups.append(
+                (
+                    processors_by_name[processor_name],
+                    virtualized,
+                    len(self.builder_groups[builder_group_key]),
+                    open_resources,
+                    restricted_resources,
+                )
+            )
+        return builder_groups
+
     def prefetchForBuilder(self, vitals):
         """Ensure that the prefetched cache is populated for this builder."""
         missing_builder_group_keys = set(
@@ -112,33 +169,47 @@ def prefetchForBuilder(self, vitals):
         ) - set(self.candidates)
         if not missing_builder_group_keys:
             return
-        processor_set = getUtility(IProcessorSet)
-        processors_by_name = {
-            processor_name: (
-                processor_set.getByName(processor_name)
-                if processor_name is not None
-                else None
+        bulk = bool(getFeatureFlag(BULK_CANDIDATE_QUERY_FEATURE_FLAG))
+        if bulk:
+            # Fetch candidates for every builder group with an idle builder
+            # at once, so that the rest of this scan cycle can work from
+            # the cache.
+            missing_builder_group_keys.update(
+                builder_group_key
+                for builder_group_key, group_vitals in (
+                    self.builder_groups.items()
+                )
+                if builder_group_key not in self.candidates
+                and any(self._isIdle(v) for v in group_vitals)
             )
-            for processor_name, _, _, _ in missing_builder_group_keys
-        }
+        builder_group_keys = list(missing_builder_group_keys)
+        builder_groups = self.getBuilderGroupQueries(builder_group_keys)
         bq_set = getUtility(IBuildQueueSet)
-        for builder_group_key in missing_builder_group_keys:
-            (
-                processor_name,
-                virtualized,
-                restricted_resources,
-                open_resources,
-            ) = builder_group_key
-            self._addCandidates(
-                builder_group_key,
+        if bulk:
+            all_candidates = bq_set.findBuildCandidatesForGroups(
+                builder_groups
+            )
+        else:
+            all_candidates = [
                 bq_set.findBuildCandidates(
-                    processor=processors_by_name[processor_name],
+                    processor=processor,
                     virtualized=virtualized,
-                    limit=len(self.builder_groups[builder_group_key]),
+                    limit=limit,
                     open_resources=open_resources,
                     restricted_resources=restricted_resources,
-                ),
-            )
+                )
+                for (
+                    processor,
+                    virtualized,
+                    limit,
+                    open_resources,
+                    restricted_resources,
+                ) in builder_groups
+            ]
+        for builder_group_key, candidates in zip(
+            builder_group_keys, all_candidates
+        ):
+            self._addCandidates(builder_group_key, candidates)
 
     def pop(self, vitals):
         """Return a suitable build candidate for this builder.
@@ -168,9 +239,80 @@ def pop(self, vitals):
             return None
 
 
+class BuilderShard:
+    """A deterministic subset of the build farm's builders.
+
+    Several buildd-manager processes can share the build farm by each
+    scanning only the builders in its own shard.  Builders are assigned to
+    shards either by a hash of their names, which spreads them evenly, or
+    by a hash of their regions, which keeps each region's builders
+    together.
+    """
+
+    def __init__(self, index, count, key="name"):
+        if count < 1:
+            raise ValueError("Shard count must be at least 1.")
+        if not 0 <= index < count:
+            raise ValueError(
+                "Shard index %d is out of range for %d shards."
+                % (index, count)
+            )
+        if key not in ("name", "region"):
+            raise ValueError("Unknown shard key: %s" % key)
+        self.index = index
+        self.count = count
+        self.key = key
+
+    @classmethod
+    def fromConfig(cls):
+        """Return the shard configured for this process."""
+        return cls(
+            config.builddmaster.shard_index,
+            config.builddmaster.shard_count,
+            key=config.builddmaster.shard_by,
+        )
+
+    def __repr__(self):
+        return "<BuilderShard %d/%d by %s>" % (
+            self.index,
+            self.count,
+            self.key,
+        )
+
+    def __contains__(self, vitals):
+        """Does this shard own the builder with these `BuilderVitals`?"""
+        if self.count == 1:
+            return True
+        if self.key == "region":
+            value = vitals.region or ""
+        else:
+            value = vitals.name
+        # Python's hash() varies between processes, so use something
+        # stable.
+        return zlib.crc32(value.encode("UTF-8")) % self.count == self.index
+
+    @property
+    def statsd_labels(self):
+        return {"shard": self.index}
+
+
 class BaseBuilderFactory:
     date_updated = None
 
+    # The `BuilderShard` whose builders this factory returns, or None for
+    # all builders.
+    shard = None
+
+    # The maximum number of candidates that `acquireBuildCandidate` tries
+    # to lock in one go.
+    max_lock_attempts = 10
+
+    def __init__(self, shard=None):
+        self.shard = shard
+
+    def _inShard(self, vitals):
+        return self.shard is None or vitals in self.shard
+
     def update(self):
         """Update the factory's view of the world."""
         raise NotImplementedError
@@ -207,10 +349,28 @@ def acquireBuildCandidate(self, vitals, builder):
         builder scan can be in this code at the same time (as long as we
         don't yield).
 
-        If there's ever more than one build manager running at once, then
-        this code will need some sort of mutex.
+        If more than one build manager is running at once (see
+        `BuilderShard`), then they may find the same candidate, so the
+        candidate is also locked in the database before it is marked as
+        building.
         """
         candidate = self.findBuildCandidate(vitals)
+        # Another buildd-manager process may have dispatched our candidate
+        # since we found it, or be about to do so; if so, move on to the
+        # next one.  If we are offered a candidate that we have already
+        # failed to lock, then there is nothing else to try until the
+        # other process has finished with it, so give up until the next
+        # scan.
+        bq_set = getUtility(IBuildQueueSet)
+        failed_ids = set()
+        while candidate is not None and not bq_set.lockForDispatch(candidate):
+            failed_ids.add(candidate.id)
+            if len(failed_ids) >= self.max_lock_attempts:
+                candidate = None
+                break
+            candidate = self.findBuildCandidate(vitals)
+            if candidate is not None and candidate.id in failed_ids:
+                candidate = None
         if candidate is not None:
             candidate.markAsBuilding(builder)
             transaction.commit()
@@ -247,8 +407,12 @@ def getVitals(self, name):
     def iterVitals(self):
         """See `BaseBuilderFactory`."""
         return (
-            extract_vitals_from_db(b)
-            for b in getUtility(IBuilderSet).__iter__()
+            vitals
+            for vitals in (
+                extract_vitals_from_db(b)
+                for b in getUtility(IBuilderSet).__iter__()
+            )
+            if self._inShard(vitals)
         )
 
     def findBuildCandidate(self, vitals):
@@ -284,9 +448,13 @@ def update(self):
         getUtility(IBuilderSet).preloadProcessors(
             [b for b, _ in builders_and_current_bqs]
         )
+        all_vitals = (
+            extract_vitals_from_db(b, bq) for b, bq in builders_and_current_bqs
+        )
         self.vitals_map = {
-            b.name: extract_vitals_from_db(b, bq)
-            for b, bq in builders_and_current_bqs
+            vitals.name: vitals
+            for vitals in all_vitals
+            if self._inShard(vitals)
         }
         self.candidates = PrefetchedBuildCandidates(
             list(self.vitals_map.values())
@@ -333,6 +501,71 @@ def get_statsd_labels(builder, build):
     return labels
 
 
+class BuildQueueListener:
+    """Listen for notifications of newly-waiting build jobs.
+
+    A database trigger sends a notification on the `buildqueue_waiting`
+    channel whenever a `BuildQueue` row becomes WAITING, with the name of
+    the job's processor (or an empty string for processor-independent
+    jobs) as its payload.  Notifications are only a hint: if anything goes
+    wrong, the listener drops its connection and reconnects on the next
+    poll, and builders are still scanned periodically in any case.
+    """
+
+    channel = "buildqueue_waiting"
+
+    def __init__(self, logger, connect=None):
+        self.logger = logger
+        if connect is None:
+            connect = self._connect
+        self._connect_func = connect
+        self._connection = None
+
+    @staticmethod
+    def _connect():
+        return connect(
+            user=dbconfig.dbuser, isolation=ISOLATION_LEVEL_AUTOCOMMIT
+        )
+
+    def _getConnection(self):
+        if self._connection is None:
+            connection = self._connect_func()
+            cursor = connection.cursor()
+            cursor.execute("LISTEN %s" % self.channel)
+            cursor.close()
+            self._connection = connection
+        return self._connection
+
+    def poll(self):
+        """Return the payloads of any notifications received since last time.
+
+        :return: A set of processor names, possibly including the empty
+            string for jobs that can run on any processor.
+        """
+        try:
+            connection = self._getConnection()
+            connection.poll()
+        except psycopg2.Error:
+            self.logger.warning(
+                "Failed to poll for build queue notifications:\n",
+                exc_info=True,
+            )
+            self.close()
+            return set()
+        payloads = {notify.payload for notify in connection.notifies}
+        del connection.notifies[:]
+        return payloads
+
+    def close(self):
+        """Close the listening connection, if any."""
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except psycopg2.Error:
+                pass
+            self._connection = None
+
+
 def judge_failure(builder_count, job_count, exc, retry=True):
     """Judge how to recover from a scan failure.
 
@@ -516,6 +749,11 @@ def __init__(
         self._clock = clock
         self.date_cancel = None
         self.date_scanned = None
+        self._last_poll_start = None
+        self._scanning = False
+        # What caused the current scan: "poll" for scheduled scans, or
+        # "notification" for scans woken up by a newly-waiting job.
+        self.scan_trigger = "poll"
 
         self.can_retry = True
 
@@ -543,8 +781,23 @@ def stopCycle(self):
         """Terminate the LoopingCall."""
         self.loop.stop()
 
+    def wake(self):
+        """Scan the builder now, since a job it can run has been queued.
+
+        :return: A Deferred that fires when the scan is complete.
+        """
+        return self.singleCycle(trigger="notification")
+
     @defer.inlineCallbacks
-    def singleCycle(self):
+    def singleCycle(self, trigger="poll"):
+        # A scheduled scan and one woken up by a notification may overlap;
+        # only run one at a time.
+        if self._scanning:
+            self.logger.debug(
+                "Skipping builder %s (scan in progress)" % self.builder_name
+            )
+            return
+
         # Inhibit scanning if the BuilderFactory hasn't updated since
         # the last run. This doesn't matter for the base BuilderFactory,
         # as it's always up to date, but PrefetchedBuilderFactory caches
@@ -561,6 +814,9 @@ def singleCycle(self):
 
         self.logger.debug("Scanning builder %s" % self.builder_name)
 
+        start = self._clock.seconds()
+        self._scanning = True
+        self.scan_trigger = trigger
         try:
             yield self.scan()
 
@@ -571,10 +827,35 @@ def singleCycle(self):
             self.scan_failure_count = 0
         except Exception as e:
             self._scanFailed(self.can_retry, e)
+        finally:
+            self._scanning = False
+            self.scan_trigger = "poll"
+            self.recordCycleTime(trigger, start)
 
         self.logger.debug("Scan finished for builder %s" % self.builder_name)
         self.date_scanned = datetime.datetime.utcnow()
 
+    def recordCycleTime(self, trigger, start):
+        """Record how long a scan took, and how long since the last one.
+
+        Scheduled scans should start every `SCAN_INTERVAL` seconds; if the
+        interval between them grows, then this buildd-manager process is
+        overloaded and should be split into more shards.
+        """
+        now = self._clock.seconds()
+        labels = dict(self.manager.statsd_labels)
+        self.statsd_client.timing(
+            "buildd_manager.scan_duration", (now - start) * 1000, labels=labels
+        )
+        if trigger == "poll":
+            if self._last_poll_start is not None:
+                self.statsd_client.timing(
+                    "buildd_manager.scan_interval",
+                    (start - self._last_poll_start) * 1000,
+                    labels=labels,
+                )
+            self._last_poll_start = start
+
     def _scanFailed(self, retry, exc):
         """Deal with failures encountered during the scan cycle.
 
@@ -719,6 +1000,25 @@ def updateVersion(self, vitals, worker_status):
             self.builder_factory[self.builder_name].version = version
             transaction.commit()
 
+    def recordDispatchLatency(self, builder, build):
+        """Record how long a build waited before it was first dispatched."""
+        if (
+            build.date_created is None
+            or build.date_started is None
+            or build.date_first_dispatched != build.date_started
+        ):
+            # Retried builds have been waiting since they were reset, not
+            # since they were created.
+            return
+        latency = build.date_started - build.date_created
+        labels = get_statsd_labels(builder, build)
+        labels["trigger"] = self.scan_trigger
+        self.statsd_client.timing(
+            "builders.dispatch_latency",
+            latency.total_seconds() * 1000,
+            labels=labels,
+        )
+
     @defer.inlineCallbacks
     def scan(self):
         """Probe the builder and update/dispatch/collect as appropriate.
@@ -815,6 +1115,9 @@ def scan(self):
                     # failure_count.
                     builder.resetFailureCount()
                     transaction.commit()
+                    self.recordDispatchLatency(
+                        builder, builder.currentjob.specific_build
+                    )
             else:
                 # Ask the BuilderInteractor to clean the worker. It might
                 # be immediately cleaned on return, in which case we go
@@ -839,18 +1142,33 @@ class BuilddManager(service.Service):
     # How often to flush logtail updates, in seconds.
     FLUSH_LOGTAILS_INTERVAL = 15
 
-    def __init__(self, clock=None, builder_factory=None):
+    # How often to check for notifications of newly-waiting jobs, in
+    # seconds, if config.builddmaster.dispatch_notifications is set.
+    NOTIFY_POLL_INTERVAL = 1
+
+    def __init__(
+        self, clock=None, builder_factory=None, listener=None, shard=None
+    ):
         # Use the clock if provided, it's so that tests can
         # advance it.  Use the reactor by default.
         if clock is None:
             clock = reactor
         self._clock = clock
         self.workers = []
-        self.builder_factory = builder_factory or PrefetchedBuilderFactory()
+        if shard is None:
+            shard = BuilderShard.fromConfig()
+        self.shard = shard
+        self.builder_factory = builder_factory or PrefetchedBuilderFactory(
+            shard=shard
+        )
         self.logger = self._setupLogger()
         self.current_builders = []
         self.pending_logtails = {}
         self.statsd_client = getUtility(IStatsdClient)
+        self.statsd_labels = shard.statsd_labels
+        if listener is None and config.builddmaster.dispatch_notifications:
+            listener = BuildQueueListener(self.logger)
+        self.listener = listener
 
     def _setupLogger(self):
         """Set up a 'worker-scanner' logger that redirects to twisted.
@@ -894,6 +1212,48 @@ def scanBuilders(self):
             transaction.abort()
         self.logger.debug("Builder refresh complete.")
 
+    def _canDispatch(self, vitals, processor_names):
+        """Could this builder start one of the notified jobs now?"""
+        if (
+            vitals.build_queue is not None
+            or not vitals.builderok
+            or vitals.manual
+            or vitals.clean_status != BuilderCleanStatus.CLEAN
+        ):
+            return False
+        return "" in processor_names or not processor_names.isdisjoint(
+            vitals.processor_names
+        )
+
+    def checkForWaitingJobs(self):
+        """Wake up idle builders that can run newly-waiting jobs.
+
+        :return: A list of the `WorkerScanner`s that were woken up.
+        """
+        woken = []
+        try:
+            processor_names = self.listener.poll()
+            if not processor_names:
+                return woken
+            self.logger.debug(
+                "Build jobs waiting for %s."
+                % ", ".join(sorted(name or "any" for name in processor_names))
+            )
+            self.builder_factory.update()
+            for worker in self.workers:
+                vitals = self.builder_factory.getVitals(worker.builder_name)
+                if self._canDispatch(vitals, processor_names):
+                    woken.append(worker)
+                    worker.wake()
+        except Exception:
+            self.logger.error(
+                "Failure while checking for waiting jobs:\n", exc_info=True
+            )
+            transaction.abort()
+        if woken:
+            self.statsd_client.incr("builders.woken", len(woken))
+        return woken
+
     def addLogTail(self, build_queue_id, logtail):
         self.pending_logtails[build_queue_id] = logtail
 
@@ -950,7 +1310,7 @@ def startService(self):
         # leftovers here if buildd-manager was restarted while gathering
         # builds.  The behaviour will recreate this directory as needed.
         try:
-            shutil.rmtree(os.path.join(config.builddmaster.root, "grabbing"))
+            shutil.rmtree(get_grabbing_directory())
         except FileNotFoundError:
             pass
         # Add and start WorkerScanners for each current builder, and any
@@ -963,6 +1323,15 @@ def startService(self):
             self.flush_logtails_loop,
             self.flush_logtails_deferred,
         ) = self._startLoop(self.FLUSH_LOGTAILS_INTERVAL, self.flushLogTails)
+        # Wake up idle builders as soon as jobs they can run are queued,
+        # rather than waiting for their next scan.
+        if self.listener is not None:
+            (
+                self.check_waiting_jobs_loop,
+                self.check_waiting_jobs_deferred,
+            ) = self._startLoop(
+                self.NOTIFY_POLL_INTERVAL, self.checkForWaitingJobs
+            )
 
     def stopService(self):
         """Callback for when we need to shut down."""
@@ -972,6 +1341,10 @@ def stopService(self):
         deferreds.append(self.scan_builders_deferred)
         deferreds.append(self.flush_logtails_deferred)
 
+        if self.listener is not None:
+            deferreds.append(self.check_waiting_jobs_deferred)
+            self.check_waiting_jobs_loop.stop()
+            self.listener.close()
         self.flush_logtails_loop.stop()
         self.scan_builders_loop.stop()
         for worker in self.workers:
@@ -5,12 +5,14 @@
 
 __all__ = [
     "BuildFarmJobBehaviourBase",
+    "get_grabbing_directory",
 ]
 
 import gzip
 import logging
 import os
 import tempfile
+import time
 from collections import OrderedDict
 from copy import deepcopy
 from datetime import datetime
@@ -35,12 +37,28 @@
 from lp.services.librarian.utils import copy_and_close
 from lp.services.propertycache import cachedproperty
 from lp.services.statsd.interfaces.statsd_client import IStatsdClient
+from lp.services.twistedsupport import gatherResults
 from lp.services.utils import sanitise_urls
 from lp.services.webapp import canonical_url
 
 WORKER_LOG_FILENAME = "buildlog"
 
 
+def get_grabbing_directory():
+    """Return the directory in which build results are gathered.
+
+    When the build farm is split between several buildd-manager shards,
+    each has its own, so that a shard clearing out leftovers when it starts
+    doesn't disturb downloads in progress in the others.
+    """
+    root = os.path.abspath(config.builddmaster.root)
+    if config.builddmaster.shard_count > 1:
+        return os.path.join(
+            root, "grabbing-%d" % config.builddmaster.shard_index
+        )
+    return os.path.join(root, "grabbing")
+
+
 class BuildFarmJobBehaviourBase:
     """Ensures that all behaviours inherit the same initialization.
 
@@ -413,6 +431,27 @@ def _downloadFiles(self, worker_status, upload_path, logger):
             filenames_to_download.append((sha1, out_file_name))
         yield self._worker.getFiles(filenames_to_download, logger=logger)
 
+    def _recordDownloadStats(self, grab_dir, duration):
+        """Record how much was downloaded from the builder, and how fast."""
+        size = 0
+        for dirpath, _, filenames in os.walk(grab_dir):
+            for filename in filenames:
+                size += os.path.getsize(os.path.join(dirpath, filename))
+        labels = {
+            "job_type": self.build.job_type.name,
+            "builder_name": self._builder.name,
+            "region": self._builder.region,
+        }
+        statsd_client = getUtility(IStatsdClient)
+        statsd_client.incr("build.download_bytes", size, labels=labels)
+        statsd_client.timing(
+            "build.download_duration", duration * 1000, labels=labels
+        )
+        if duration > 0:
+            statsd_client.gauge(
+                "build.download_throughput", size / duration, labels=labels
+            )
+
     @defer.inlineCallbacks
     def _saveBuildSpecificFiles(self, upload_path):
         # Specific for each build type
@@ -443,7 +482,7 @@ def handleSuccess(self, worker_status, logger):
 
         # Create a single directory to store build result files.
         upload_leaf = self.getUploadDirLeaf(self.build.build_cookie)
-        grab_dir = os.path.join(root, "grabbing", upload_leaf)
+        grab_dir = os.path.join(get_grabbing_directory(), upload_leaf)
         logger.debug("Storing build result at '%s'" % grab_dir)
 
         # Build the right UPLOAD_PATH so the distribution and archive
@@ -459,13 +498,21 @@ def handleSuccess(self, worker_status, logger):
         build.updateStatus(BuildStatus.GATHERING, worker_status=worker_status)
         transaction.commit()
 
-        yield self._downloadFiles(worker_status, upload_path, logger)
-
         # Certain builds might require saving specific files. This is the case,
         # for example, for snap builds that use the fetch service as their
         # proxy, which require a metadata file to be retrieve in the end of the
-        # build.
-        yield self._saveBuildSpecificFiles(upload_path)
+        # build.  This doesn't depend on the build's own files, so do it
+        # while they are downloading.
+        start = time.monotonic()
+        yield gatherResults(
+            [
+                defer.maybeDeferred(
+                    self._downloadFiles, worker_status, upload_path, logger
+                ),
+                defer.maybeDeferred(self._saveBuildSpecificFiles, upload_path),
+            ]
+        )
+        self._recordDownloadStats(grab_dir, time.monotonic() - start)
 
         transaction.commit()
 
@@ -12,7 +12,17 @@
 from itertools import groupby
 from operator import attrgetter
 
-from storm.expr import SQL, Cast, Coalesce, Desc, Exists, Or
+from storm.expr import (
+    SQL,
+    And,
+    Cast,
+    Coalesce,
+    Desc,
+    Exists,
+    Or,
+    Select,
+    Union,
+)
 from storm.properties import Bool, DateTime, Int, TimeDelta, Unicode
 from storm.references import Reference
 from storm.store import Store
@@ -28,7 +38,7 @@
 )
 from lp.buildmaster.interfaces.buildfarmjob import ISpecificBuildFarmJobSource
 from lp.buildmaster.interfaces.buildqueue import IBuildQueue, IBuildQueueSet
-from lp.services.database.bulk import load_referencing, load_related
+from lp.services.database.bulk import load, load_referencing, load_related
 from lp.services.database.constants import DEFAULT, UTC_NOW
 from lp.services.database.enumcol import DBEnum
 from lp.services.database.interfaces import IStore
@@ -250,6 +260,23 @@ def get(self, buildqueue_id):
             raise NotFoundError(buildqueue_id)
         return bq
 
+    def lockForDispatch(self, buildqueue):
+        """See `IBuildQueueSet`."""
+        store = IStore(BuildQueue)
+        locked = (
+            store.execute(
+                "SELECT id FROM BuildQueue "
+                "WHERE id = ? AND status = ? AND builder IS NULL "
+                "FOR UPDATE SKIP LOCKED",
+                (buildqueue.id, BuildQueueStatus.WAITING.value),
+            ).get_one()
+            is not None
+        )
+        if not locked:
+            # Our copy is out of date.
+            store.invalidate(removeSecurityProxy(buildqueue))
+        return locked
+
     def getByBuilder(self, builder):
         """See `IBuildQueueSet`."""
         return IStore(BuildQueue).find(BuildQueue, builder=builder).one()
@@ -296,20 +323,11 @@ def _getWorkerScannerLogger(self):
         logger = logging.getLogger("worker-scanner")
         return logger
 
-    def findBuildCandidates(
-        self,
-        processor,
-        virtualized,
-        limit,
-        open_resources=None,
-        restricted_resources=None,
-    ):
-        """See `IBuildQueueSet`."""
+    def _getJobTypeConditions(self):
+        """Return conditions imposed by each specific job type."""
         # Circular import.
         from lp.buildmaster.model.buildfarmjob import BuildFarmJob
 
-        logger = self._getWorkerScannerLogger()
-
         job_type_conditions = []
         job_sources = specific_build_farm_job_sources()
         for job_type, job_source in job_sources.items():
@@ -318,6 +336,21 @@ def findBuildCandidates(
                 job_type_conditions.append(
                     Or(BuildFarmJob.job_type != job_type, Exists(SQL(query)))
                 )
+        return job_type_conditions
+
+    def _getCandidateConditions(
+        self,
+        job_type_conditions,
+        processor,
+        virtualized,
+        open_resources=None,
+        restricted_resources=None,
+    ):
+        """Return conditions matching candidates for a builder group."""
+        # Circular import.
+        from lp.buildmaster.model.buildfarmjob import BuildFarmJob
+
+        logger = self._getWorkerScannerLogger()
 
         def get_int_feature_flag(flag):
             value_str = getFeatureFlag(flag)
@@ -372,20 +405,94 @@ def get_int_feature_flag(flag):
                 )
             )
 
+        return [
+            BuildFarmJob.id == BuildQueue._build_farm_job_id,
+            BuildQueue.status == BuildQueueStatus.WAITING,
+            BuildQueue.processor == processor,
+            BuildQueue.virtualized == virtualized,
+            BuildQueue.builder == None,
+            *job_type_conditions,
+            *score_conditions,
+            *resource_conditions,
+        ]
+
+    def findBuildCandidates(
+        self,
+        processor,
+        virtualized,
+        limit,
+        open_resources=None,
+        restricted_resources=None,
+    ):
+        """See `IBuildQueueSet`."""
+        # Circular import.
+        from lp.buildmaster.model.buildfarmjob import BuildFarmJob
+
         store = IStore(BuildQueue)
         return list(
             store.using(BuildQueue, BuildFarmJob).find(
                 BuildQueue,
-                BuildFarmJob.id == BuildQueue._build_farm_job_id,
-                BuildQueue.status == BuildQueueStatus.WAITING,
-                BuildQueue.processor == processor,
-                BuildQueue.virtualized == virtualized,
-                BuildQueue.builder == None,
-                *job_type_conditions,
-                *score_conditions,
-                *resource_conditions,
+                *self._getCandidateConditions(
+                    self._getJobTypeConditions(),
+                    processor,
+                    virtualized,
+                    open_resources=open_resources,
+                    restricted_resources=restricted_resources,
+                ),
             )
             # This must match the ordering used in
             # PrefetchedBuildCandidates._getSortKey.
             .order_by(Desc(BuildQueue.lastscore), BuildQueue.id)[:limit]
         )
+
+    def findBuildCandidatesForGroups(self, builder_groups):
+        """See `IBuildQueueSet`."""
+        # Circular import.
+        from lp.buildmaster.model.buildfarmjob import BuildFarmJob
+
+        if not builder_groups:
+            return []
+        job_type_conditions = self._getJobTypeConditions()
+        # Each builder group gets its own index-ordered, limited
+        # subselect, so the database can stop reading each group's part of
+        # the queue as soon as it has enough candidates; combining them
+        # with UNION ALL saves a round-trip per group.
+        selects = []
+        for index, group in enumerate(builder_groups):
+            (
+                processor,
+                virtualized,
+                limit,
+                open_resources,
+                restricted_resources,
+            ) = group
+            selects.append(
+                Select(
+                    (Cast(index, "integer"), BuildQueue.id),
+                    where=And(
+                        *self._getCandidateConditions(
+                            job_type_conditions,
+                            processor,
+                            virtualized,
+                            open_resources=open_resources,
+                            restricted_resources=restricted_resources,
+                        )
+                    ),
+                    tables=(BuildQueue, BuildFarmJob),
+                    # This must match the ordering used in
+                    # PrefetchedBuildCandidates._getSortKey.
+                    order_by=(Desc(BuildQueue.lastscore), BuildQueue.id),
+                    limit=limit,
+                )
+            )
+        store = IStore(BuildQueue)
+        rows = list(store.execute(Union(*selects, all=True)))
+        bqs = {
+            bq.id: bq for bq in load(BuildQueue, [bq_id for _, bq_id in rows])
+        }
+        candidates = [[] for _ in builder_groups]
+        for index, bq_id in rows:
+            candidates[index].append(bqs[bq_id])
+        for group_candidates in candidates:
+            group_candidates.sort(key=lambda bq: (-bq.lastscore, bq.id))
+        return candidates
@@ -415,6 +415,86 @@ def test_findBuildCandidates_honours_minimum_score(self):
                 logger.output,
             )
 
+    def test_findBuildCandidatesForGroups(self):
+        # BuildQueueSet.findBuildCandidatesForGroups returns the same
+        # candidates as calling findBuildCandidates for each group.
+        proc = self.factory.makeProcessor(supports_virtualized=True)
+        other_proc = self.factory.makeProcessor()
+        for processor, virtualized, score in (
+            (proc, True, 10),
+            (proc, True, 30),
+            (proc, False, 20),
+            (other_proc, True, 40),
+            (other_proc, True, 50),
+        ):
+            self.factory.makeBinaryPackageBuild(
+                archive=self.factory.makeArchive(virtualized=virtualized),
+                processor=processor,
+            ).queueBuild().manualScore(score)
+        das = self.factory.makeDistroArchSeries(processor=proc)
+        repository = self.factory.makeGitRepository(
+            builder_constraints=["large"]
+        )
+        self.factory.makeCIBuild(
+            git_repository=repository, distro_arch_series=das
+        ).queueBuild()
+        builder_groups = [
+            (proc, True, 5, None, None),
+            (proc, False, 5, None, None),
+            (proc, True, 5, ("large",), None),
+            (other_proc, True, 1, None, None),
+            (self.factory.makeProcessor(), True, 5, None, None),
+            (None, True, 5, None, None),
+        ]
+        expected = [
+            self.bq_set.findBuildCandidates(
+                processor=processor,
+                virtualized=virtualized,
+                limit=limit,
+                open_resources=open_resources,
+                restricted_resources=restricted_resources,
+            )
+            for (
+                processor,
+                virtualized,
+                limit,
+                open_resources,
+                restricted_resources,
+            ) in builder_groups
+        ]
+        self.assertEqual([30, 10], [bq.lastscore for bq in expected[0]])
+        self.assertEqual(3, len(expected[2]))
+        self.assertEqual([50], [bq.lastscore for bq in expected[3]])
+        self.assertEqual(
+            expected, self.bq_set.findBuildCandidatesForGroups(builder_groups)
+        )
+        self.assertEqual([], self.bq_set.findBuildCandidatesForGroups([]))
+
+    def test_findBuildCandidatesForGroups_honours_minimum_score(self):
+        processors = [self.factory.makeProcessor() for _ in range(2)]
+        bqs = []
+        for processor in processors:
+            bqs.append([])
+            for score in (100000, 99999):
+                bq = self.factory.makeBinaryPackageBuild(
+                    processor=processor
+                ).queueBuild()
+                bq.manualScore(score)
+                bqs[-1].append(bq)
+        features = {
+            "buildmaster.minimum_score.%s" % processors[0].name: "100000"
+        }
+        with FeatureFixture(features):
+            self.assertEqual(
+                [[bqs[0][0]], bqs[1]],
+                self.bq_set.findBuildCandidatesForGroups(
+                    [
+                        (processor, True, 3, None, None)
+                        for processor in processors
+                    ]
+                ),
+            )
+
 
 class TestFindBuildCandidatesPPABase(TestFindBuildCandidatesBase):
     ppa_joe_private = False
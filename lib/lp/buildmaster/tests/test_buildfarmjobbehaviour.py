@@ -9,6 +9,7 @@
 import tempfile
 from collections import OrderedDict
 from datetime import datetime
+from unittest import mock
 
 import six
 from fixtures import MockPatchObject
@@ -392,7 +393,7 @@ def test_verifySuccessfulBuild_denies_unmodifiable_suite(self):
         self.assertRaises(AssertionError, behaviour.verifySuccessfulBuild)
 
 
-class TestHandleStatusMixin:
+class TestHandleStatusMixin(StatsMixin):
     """Tests for `IPackageBuild`s handleStatus method."""
 
     layer = LaunchpadZopelessLayer
@@ -489,6 +490,34 @@ def test_handleStatus_WAITING_OK_normal_file(self):
         self.assertEqual(BuildStatus.UPLOADING, self.build.status)
         self.assertResultCount(1, "incoming")
 
+    @defer.inlineCallbacks
+    def test_handleStatus_WAITING_OK_download_stats(self):
+        # handleStatus records how much it downloaded from the builder, and
+        # how fast.
+        self.setUpStats()
+        with dbuser(config.builddmaster.dbuser):
+            yield self.behaviour.handleStatus(
+                self.build.buildqueue_record,
+                {
+                    "builder_status": "BuilderStatus.WAITING",
+                    "build_status": "BuildStatus.OK",
+                    "filemap": {"myfile.py": "test_file_hash"},
+                },
+            )
+        labels = "builder_name=%s,env=test,job_type=%s,region=%s" % (
+            self.builder.name,
+            self.build.job_type.name,
+            self.builder.region,
+        )
+        self.assertIn(
+            mock.call("build.download_bytes,%s" % labels, 24),
+            self.stats_client.incr.call_args_list,
+        )
+        self.assertIn(
+            "build.download_duration,%s" % labels,
+            [call[0][0] for call in self.stats_client.timing.call_args_list],
+        )
+
     @defer.inlineCallbacks
     def test_handleStatus_WAITING_OK_gathering_status(self):
         # handleStatus sets the build's status to GATHERING while
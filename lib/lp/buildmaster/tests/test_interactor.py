@@ -30,6 +30,7 @@
 from twisted.internet.task import Clock
 from twisted.python.failure import Failure
 
+from lp.buildmaster.downloader import HashMismatch
 from lp.buildmaster.enums import (
     BuilderCleanStatus,
     BuilderResetProtocol,
@@ -60,6 +61,7 @@
     WorkerTestHelpers,
 )
 from lp.services.config import config
+from lp.services.log.logger import BufferLogger
 from lp.services.twistedsupport.testing import TReqFixture
 from lp.services.twistedsupport.treq import check_status
 from lp.soyuz.enums import PackagePublishingStatus
@@ -1045,3 +1047,71 @@ def test_getFiles_limited_retries(self):
         self.worker_helper.makeCacheFile(tachandler, sha1, contents=b"log")
         with ExpectedException(RuntimeError, r"^Boom$"):
             yield worker.getFiles([(sha1, temp_name)])
+
+    @defer.inlineCallbacks
+    def test_getFiles_resumes_partial_download(self):
+        # getFiles carries on from where an earlier attempt to download a
+        # file stopped.
+        tachandler = self.worker_helper.getServerWorker()
+        worker = self.worker_helper.getClientWorker()
+        temp_dir = self.makeTemporaryDirectory()
+        temp_name = os.path.join(temp_dir, "log")
+        contents = b"0123456789" * 100
+        sha1 = hashlib.sha1(contents).hexdigest()
+        self.worker_helper.makeCacheFile(tachandler, sha1, contents=contents)
+        with open(temp_name + ".part", "wb") as partial:
+            partial.write(contents[:500])
+        logger = BufferLogger()
+        yield worker.getFiles([(sha1, temp_name)], logger=logger)
+        with open(temp_name, "rb") as f:
+            self.assertEqual(contents, f.read())
+        self.assertFalse(os.path.exists(temp_name + ".part"))
+        self.assertIn("resuming from byte 500", logger.getLogBuffer())
+
+    @defer.inlineCallbacks
+    def test_getFiles_checks_sha1(self):
+        # getFiles refuses a file whose contents don't match its SHA-1,
+        # and doesn't try to resume from it next time.
+        self.pushConfig("builddmaster", download_attempts=1)
+        tachandler = self.worker_helper.getServerWorker()
+        worker = self.worker_helper.getClientWorker()
+        temp_dir = self.makeTemporaryDirectory()
+        temp_name = os.path.join(temp_dir, "log")
+        sha1 = hashlib.sha1(b"log").hexdigest()
+        self.worker_helper.makeCacheFile(tachandler, sha1, contents=b"gol")
+        with ExpectedException(HashMismatch):
+            yield worker.getFiles([(sha1, temp_name)])
+        self.assertEqual([], os.listdir(temp_dir))
+
+    @defer.inlineCallbacks
+    def test_getFiles_per_builder_limit(self):
+        # getFiles honours the configured limit on concurrent downloads
+        # from a single builder.
+        self.pushConfig("builddmaster", download_connections_per_builder=2)
+        self.worker_helper.getServerWorker()
+        worker = self.worker_helper.getClientWorker()
+        downloads = []
+
+        def doWork(command, **kwargs):
+            downloads.append(defer.Deferred())
+            return downloads[-1]
+
+        self.useFixture(
+            MockPatchObject(worker.process_pool, "doWork", side_effect=doWork)
+        )
+        temp_dir = self.makeTemporaryDirectory()
+        d = worker.getFiles(
+            [
+                (
+                    hashlib.sha1(b"%d" % i).hexdigest(),
+                    os.path.join(temp_dir, str(i)),
+                )
+                for i in range(3)
+            ]
+        )
+        self.assertEqual(2, len(downloads))
+        downloads[0].callback({"resumed_from": 0})
+        self.assertEqual(3, len(downloads))
+        for download in downloads[1:]:
+            download.callback({"resumed_from": 0})
+        yield d
@@ -7,10 +7,12 @@
 import signal
 import time
 import xmlrpc.client
+from datetime import datetime, timedelta, timezone
 from typing import Dict
 from unittest import mock
 
 import transaction
+from fixtures import MockPatchObject
 from testtools.matchers import Equals
 from testtools.testcase import ExpectedException
 from testtools.twistedsupport import AsynchronousDeferredRunTest
@@ -39,15 +41,19 @@
 from lp.buildmaster.interfaces.buildqueue import IBuildQueueSet
 from lp.buildmaster.manager import (
     BUILDER_FAILURE_THRESHOLD,
+    BULK_CANDIDATE_QUERY_FEATURE_FLAG,
     JOB_RESET_THRESHOLD,
     SCAN_FAILURE_THRESHOLD,
     BuilddManager,
     BuilderFactory,
+    BuilderShard,
+    BuildQueueListener,
     PrefetchedBuilderFactory,
     WorkerScanner,
     judge_failure,
     recover_failure,
 )
+from lp.buildmaster.model.buildqueue import BuildQueueSet
 from lp.buildmaster.tests.harness import BuilddManagerTestSetup
 from lp.buildmaster.tests.mock_workers import (
     BrokenWorker,
@@ -65,6 +71,7 @@
 )
 from lp.registry.interfaces.distribution import IDistributionSet
 from lp.services.config import config
+from lp.services.features.testing import FeatureFixture
 from lp.services.log.logger import BufferLogger
 from lp.services.statsd.tests import StatsMixin
 from lp.soyuz.interfaces.binarypackagebuild import IBinaryPackageBuildSet
@@ -179,6 +186,43 @@ def testScanDispatchForResetBuilder(self):
         self.assertEqual(0, builder.failure_count)
         self.assertTrue(builder.currentjob is not None)
 
+    def test_recordDispatchLatency(self):
+        # The time between a build's creation and its first dispatch is
+        # recorded, along with what triggered the dispatching scan.
+        builder = self.factory.makeBuilder()
+        build = removeSecurityProxy(self.factory.makeBinaryPackageBuild())
+        build.date_created = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        build.date_started = build.date_created + timedelta(seconds=3)
+        build.date_first_dispatched = build.date_started
+        scanner = self._getScanner(builder_name=builder.name)
+        scanner.scan_trigger = "notification"
+        scanner.recordDispatchLatency(builder, build)
+        self.assertEqual(
+            [
+                mock.call(
+                    "builders.dispatch_latency,arch={},build=True,"
+                    "builder_name={},env=test,job_type=PACKAGEBUILD,"
+                    "region={},trigger=notification,virtualized=True".format(
+                        build.processor.name, builder.name, builder.region
+                    ),
+                    3000.0,
+                )
+            ],
+            self.stats_client.timing.call_args_list,
+        )
+
+    def test_recordDispatchLatency_ignores_retried_builds(self):
+        # A build that has been dispatched before has been waiting since
+        # it was reset, so its age says nothing about dispatch latency.
+        builder = self.factory.makeBuilder()
+        build = removeSecurityProxy(self.factory.makeBinaryPackageBuild())
+        build.date_created = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        build.date_first_dispatched = build.date_created + timedelta(seconds=3)
+        build.date_started = build.date_created + timedelta(seconds=60)
+        scanner = self._getScanner(builder_name=builder.name)
+        scanner.recordDispatchLatency(builder, build)
+        self.assertEqual([], self.stats_client.timing.call_args_list)
+
     def _checkNoDispatch(self, builder):
         """Assert that no dispatch has occurred."""
         builder = getUtility(IBuilderSet).get(builder.id)
@@ -1059,6 +1103,41 @@ def test_findBuildCandidate_avoids_duplicates(self):
         # by ID.
         self.assertThat(recorder, HasQueryCount(Equals(1)))
 
+    def test_findBuildCandidate_bulk(self):
+        # With the bulk candidate query enabled, the first call to
+        # findBuildCandidate fetches candidates for all builder groups with
+        # idle builders, so later calls for other builders don't need to
+        # query for candidates.
+        self.useFixture(
+            FeatureFixture({BULK_CANDIDATE_QUERY_FEATURE_FLAG: "on"})
+        )
+        builder_names = []
+        bqs = []
+        for _ in range(3):
+            das = self.factory.makeDistroArchSeries()
+            builder_names.append(
+                self.factory.makeBuilder(processors=[das.processor]).name
+            )
+            bqs.append(
+                self.factory.makeBinaryPackageBuild(
+                    distroarchseries=das
+                ).queueBuild()
+            )
+        transaction.commit()
+        pbf = PrefetchedBuilderFactory()
+        pbf.update()
+
+        self.assertEqual(
+            bqs[0], pbf.findBuildCandidate(pbf.getVitals(builder_names[0]))
+        )
+        transaction.abort()
+        for builder_name, bq in zip(builder_names[1:], bqs[1:]):
+            with StormStatementRecorder() as recorder:
+                candidate = pbf.findBuildCandidate(pbf.getVitals(builder_name))
+            self.assertEqual(bq, candidate)
+            # Only a single query, to fetch the candidate by ID.
+            self.assertThat(recorder, HasQueryCount(Equals(1)))
+
     def test_findBuildCandidate_honours_resources(self):
         das = self.factory.makeDistroArchSeries()
         builders = [
@@ -1124,11 +1203,112 @@ def test_acquireBuildCandidate_marks_building(self):
         )
         self.assertEqual(BuildQueueStatus.RUNNING, candidate.status)
 
+    def test_acquireBuildCandidate_skips_dispatched_candidates(self):
+        # If another buildd-manager process dispatches a candidate after
+        # it was prefetched, acquireBuildCandidate moves on to the next.
+        das = self.factory.makeDistroArchSeries()
+        builders = [
+            self.factory.makeBuilder(processors=[das.processor])
+            for _ in range(2)
+        ]
+        bqs = [
+            self.factory.makeBinaryPackageBuild(
+                distroarchseries=das
+            ).queueBuild()
+            for _ in range(2)
+        ]
+        transaction.commit()
+        pbf = PrefetchedBuilderFactory()
+        pbf.update()
+        pbf.candidates.prefetchForBuilder(pbf.getVitals(builders[1].name))
+        other_builder = self.factory.makeBuilder()
+        bqs[0].markAsBuilding(other_builder)
+        transaction.commit()
+
+        candidate = pbf.acquireBuildCandidate(
+            pbf.getVitals(builders[1].name), builders[1]
+        )
+        self.assertEqual(bqs[1], candidate)
+        self.assertEqual(builders[1], candidate.builder)
+
+    def test_acquireBuildCandidate_gives_up_on_locked_candidate(self):
+        # If the same candidate that could not be locked is found again,
+        # acquireBuildCandidate gives up until the next scan rather than
+        # trying to lock it over and over.
+        das = self.factory.makeDistroArchSeries()
+        builder = self.factory.makeBuilder(processors=[das.processor])
+        bq = self.factory.makeBinaryPackageBuild(
+            distroarchseries=das
+        ).queueBuild()
+        transaction.commit()
+        lock_for_dispatch = self.useFixture(
+            MockPatchObject(
+                BuildQueueSet, "lockForDispatch", return_value=False
+            )
+        ).mock
+        bf = BuilderFactory()
+
+        candidate = bf.acquireBuildCandidate(
+            bf.getVitals(builder.name), builder
+        )
+        self.assertIsNone(candidate)
+        self.assertEqual(1, lock_for_dispatch.call_count)
+        self.assertEqual(BuildQueueStatus.WAITING, bq.status)
+
+    def test_acquireBuildCandidate_limits_lock_attempts(self):
+        # acquireBuildCandidate only tries to lock a limited number of
+        # candidates in one go.
+        das = self.factory.makeDistroArchSeries()
+        # Each builder lets one more candidate be prefetched.
+        builders = [
+            self.factory.makeBuilder(processors=[das.processor])
+            for _ in range(3)
+        ]
+        for _ in range(3):
+            self.factory.makeBinaryPackageBuild(
+                distroarchseries=das
+            ).queueBuild()
+        transaction.commit()
+        lock_for_dispatch = self.useFixture(
+            MockPatchObject(
+                BuildQueueSet, "lockForDispatch", return_value=False
+            )
+        ).mock
+        pbf = PrefetchedBuilderFactory()
+        pbf.update()
+        pbf.max_lock_attempts = 2
+
+        candidate = pbf.acquireBuildCandidate(
+            pbf.getVitals(builders[0].name), builders[0]
+        )
+        self.assertIsNone(candidate)
+        self.assertEqual(2, lock_for_dispatch.call_count)
+
+    def test_update_honours_shard(self):
+        # A factory for a shard of the build farm only knows about the
+        # builders in that shard.
+        builder_names = [self.factory.makeBuilder().name for _ in range(10)]
+        transaction.commit()
+        shard_builder_names = []
+        for index in range(3):
+            pbf = PrefetchedBuilderFactory(shard=BuilderShard(index, 3))
+            pbf.update()
+            shard_builder_names.append(
+                [vitals.name for vitals in pbf.iterVitals()]
+            )
+        # Each builder is in exactly one shard.
+        self.assertContentEqual(
+            set(builder_names)
+            | {vitals.name for vitals in BuilderFactory().iterVitals()},
+            sum(shard_builder_names, []),
+        )
+
 
 class FakeBuilddManager:
     """A minimal fake version of `BuilddManager`."""
 
     pending_logtails: Dict[int, str] = {}
+    statsd_labels: Dict[str, int] = {}
 
     def addLogTail(self, build_queue_id, logtail):
         self.pending_logtails[build_queue_id] = logtail
@@ -1293,6 +1473,110 @@ def test_getExpectedCookie_caches(self):
         self.assertIs(None, cookie4)
 
 
+class TestBuilderShard(TestCase):
+    def makeVitals(self, name):
+        return extract_vitals_from_db(MockBuilder(name=name), None)
+
+    def test_single_shard(self):
+        shard = BuilderShard(0, 1)
+        self.assertIn(self.makeVitals("foo"), shard)
+
+    def test_shards_partition_builders(self):
+        shards = [BuilderShard(index, 4) for index in range(4)]
+        all_vitals = [self.makeVitals("builder-%d" % i) for i in range(40)]
+        for vitals in all_vitals:
+            self.assertEqual(
+                1, len([shard for shard in shards if vitals in shard])
+            )
+        # Builders are spread over more than one shard.
+        self.assertGreater(
+            len(
+                {
+                    shard.index
+                    for vitals in all_vitals
+                    for shard in shards
+                    if vitals in shard
+                }
+            ),
+            1,
+        )
+
+    def test_shard_by_region(self):
+        # Sharding by region keeps each region's builders together.
+        # (Builders' regions are taken from their names.)
+        shards = [BuilderShard(index, 4, key="region") for index in range(4)]
+        for region in ("lcy02-amd64", "bos03-arm64", "bos03-riscv64"):
+            owners = {
+                shard.index
+                for i in range(10)
+                for shard in shards
+                if self.makeVitals("%s-%03d" % (region, i)) in shard
+            }
+            self.assertEqual(1, len(owners))
+
+    def test_validation(self):
+        self.assertRaises(ValueError, BuilderShard, 0, 0)
+        self.assertRaises(ValueError, BuilderShard, 2, 2)
+        self.assertRaises(ValueError, BuilderShard, -1, 2)
+        self.assertRaises(ValueError, BuilderShard, 0, 2, key="colour")
+
+    def test_fromConfig(self):
+        self.pushConfig(
+            "builddmaster", shard_count=3, shard_index=2, shard_by="region"
+        )
+        shard = BuilderShard.fromConfig()
+        self.assertEqual(
+            (2, 3, "region"), (shard.index, shard.count, shard.key)
+        )
+
+
+class TestWorkerScannerCycleTime(StatsMixin, TestCase):
+    layer = ZopelessDatabaseLayer
+    run_tests_with = AsynchronousDeferredRunTest
+
+    def setUp(self):
+        super().setUp()
+        self.setUpStats()
+
+    @defer.inlineCallbacks
+    def test_records_cycle_times(self):
+        # Each scan records how long it took, and scheduled scans also
+        # record how long it has been since the previous scheduled scan,
+        # labelled with the manager's shard.
+        clock = task.Clock()
+        manager = BuilddManager(clock=clock, shard=BuilderShard(1, 2))
+        scanner = WorkerScanner(
+            "mock", BuilderFactory(), manager, BufferLogger(), clock=clock
+        )
+
+        def scan():
+            clock.advance(2)
+
+        scanner.scan = scan
+        yield scanner.singleCycle()
+        clock.advance(13)
+        yield scanner.wake()
+        clock.advance(13)
+        yield scanner.singleCycle()
+        self.assertEqual(
+            [
+                mock.call(
+                    "buildd_manager.scan_duration,env=test,shard=1", 2000
+                ),
+                mock.call(
+                    "buildd_manager.scan_duration,env=test,shard=1", 2000
+                ),
+                mock.call(
+                    "buildd_manager.scan_duration,env=test,shard=1", 2000
+                ),
+                mock.call(
+                    "buildd_manager.scan_interval,env=test,shard=1", 30000
+                ),
+            ],
+            self.stats_client.timing.call_args_list,
+        )
+
+
 class TestJudgeFailure(TestCase):
     def test_same_count_below_threshold(self):
         # A few consecutive failures aren't any cause for alarm, as it
@@ -1464,6 +1748,24 @@ def test_startService_clears_grabbing(self):
 
         self.assertFalse(os.path.exists(os.path.join(tempdir, "grabbing")))
 
+    def test_startService_clears_only_own_grabbing(self):
+        # When the build farm is sharded, each shard gathers build results
+        # in its own directory, and only clears that out when it starts.
+        self._stub_out_scheduleNextScanCycle()
+        tempdir = self.makeTemporaryDirectory()
+        self.pushConfig(
+            "builddmaster", root=tempdir, shard_count=2, shard_index=1
+        )
+        for name in ("grabbing-0", "grabbing-1"):
+            os.makedirs(os.path.join(tempdir, name, "some-upload"))
+        clock = task.Clock()
+        manager = BuilddManager(clock=clock)
+
+        manager.startService()
+
+        self.assertTrue(os.path.exists(os.path.join(tempdir, "grabbing-0")))
+        self.assertFalse(os.path.exists(os.path.join(tempdir, "grabbing-1")))
+
     def test_startService_adds_scanBuilders_loop(self):
         # When startService is called, the manager will start up a
         # scanBuilders loop.
@@ -1496,6 +1798,144 @@ def test_startService_adds_flushLogTails_loop(self):
         clock.advance(advance)
         self.assertNotEqual(0, manager.flushLogTails.call_count)
 
+    def test_startService_adds_checkForWaitingJobs_loop(self):
+        # If there is a listener for waiting jobs, startService starts a
+        # loop that checks it.
+        self._stub_out_scheduleNextScanCycle()
+        clock = task.Clock()
+        manager = BuilddManager(clock=clock, listener=FakeBuildQueueListener())
+        manager.checkForWaitingJobs = FakeMethod()
+
+        manager.startService()
+        self.addCleanup(manager.stopService)
+        clock.advance(BuilddManager.NOTIFY_POLL_INTERVAL + 1)
+        self.assertNotEqual(0, manager.checkForWaitingJobs.call_count)
+
+    def test_no_listener_by_default(self):
+        manager = BuilddManager()
+        self.assertIsNone(manager.listener)
+        self.pushConfig("builddmaster", dispatch_notifications=True)
+        manager = BuilddManager()
+        self.assertIsInstance(manager.listener, BuildQueueListener)
+
+
+class FakeBuildQueueListener:
+    """A `BuildQueueListener` that returns canned notifications."""
+
+    def __init__(self, *payloads):
+        self.payloads = set(payloads)
+        self.closed = False
+
+    def poll(self):
+        payloads = self.payloads
+        self.payloads = set()
+        return payloads
+
+    def close(self):
+        self.closed = True
+
+
+class TestBuildQueueListener(TestCaseWithFactory):
+    """Test listening for notifications of newly-waiting build jobs."""
+
+    layer = LaunchpadZopelessLayer
+
+    def test_poll(self):
+        listener = BuildQueueListener(BufferLogger())
+        self.addCleanup(listener.close)
+        self.assertEqual(set(), listener.poll())
+        processor = self.factory.makeProcessor()
+        self.factory.makeBinaryPackageBuild(processor=processor).queueBuild()
+        transaction.commit()
+        self.assertEqual({processor.name}, listener.poll())
+        # Notifications are only returned once.
+        self.assertEqual(set(), listener.poll())
+
+    def test_poll_reconnects_after_errors(self):
+        # Errors are logged, and the next poll reconnects.
+        logger = BufferLogger()
+        connections = []
+
+        def connect():
+            connection = BuildQueueListener._connect()
+            connections.append(connection)
+            return connection
+
+        listener = BuildQueueListener(logger, connect=connect)
+        self.addCleanup(listener.close)
+        listener.poll()
+        connections[0].close()
+        self.assertEqual(set(), listener.poll())
+        self.assertIn(
+            "Failed to poll for build queue notifications",
+            logger.getLogBuffer(),
+        )
+        self.assertEqual(set(), listener.poll())
+        self.assertEqual(2, len(connections))
+
+
+class TestCheckForWaitingJobs(StatsMixin, TestCaseWithFactory):
+    """Test waking up idle builders when jobs are queued."""
+
+    layer = LaunchpadZopelessLayer
+
+    def setUp(self):
+        super().setUp()
+        self.setUpStats()
+        self.patch(WorkerScanner, "startCycle", FakeMethod())
+        self.patch(WorkerScanner, "wake", FakeMethod())
+        self.processor = self.factory.makeProcessor()
+
+    def makeManager(self, *payloads):
+        manager = BuilddManager(
+            builder_factory=BuilderFactory(),
+            listener=FakeBuildQueueListener(*payloads),
+        )
+        manager.logger = BufferLogger()
+        return manager
+
+    def makeBuilder(self, **kwargs):
+        builder = self.factory.makeBuilder(
+            processors=[self.processor], **kwargs
+        )
+        builder.setCleanStatus(BuilderCleanStatus.CLEAN)
+        return builder
+
+    def test_wakes_idle_clean_builders(self):
+        idle = self.makeBuilder()
+        self.makeBuilder(manual=True)
+        dirty = self.makeBuilder()
+        dirty.setCleanStatus(BuilderCleanStatus.DIRTY)
+        self.factory.makeBuilder()
+        transaction.commit()
+        manager = self.makeManager(self.processor.name)
+        manager.scanBuilders()
+        woken = manager.checkForWaitingJobs()
+        self.assertEqual(
+            [idle.name], [worker.builder_name for worker in woken]
+        )
+        self.assertEqual(1, WorkerScanner.wake.call_count)
+        self.assertEqual(
+            [mock.call("builders.woken,env=test", 1)],
+            self.stats_client.incr.call_args_list,
+        )
+
+    def test_processor_independent_jobs_wake_any_builder(self):
+        builder = self.makeBuilder()
+        transaction.commit()
+        manager = self.makeManager("")
+        manager.scanBuilders()
+        woken = manager.checkForWaitingJobs()
+        self.assertIn(builder.name, [worker.builder_name for worker in woken])
+
+    def test_no_notifications(self):
+        self.makeBuilder()
+        transaction.commit()
+        manager = self.makeManager()
+        manager.scanBuilders()
+        self.assertEqual([], manager.checkForWaitingJobs())
+        self.assertEqual(0, WorkerScanner.wake.call_count)
+
 
 class TestFailureAssessmentsAndStatsdMetrics(StatsMixin, TestCaseWithFactory):
     layer = ZopelessDatabaseLayer
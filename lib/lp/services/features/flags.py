@@ -268,6 +268,24 @@
             "",
             "",
         ),
+        (
+            "buildmaster.bulk_candidate_query.enabled",
+            "boolean",
+            "If true, buildd-manager fetches build candidates for all groups "
+            "of idle builders in a single query.",
+            "disabled",
+            "",
+            "",
+        ),
+        (
+            "librarian.deduplicate_uploads.enabled",
+            "boolean",
+            "If true, link uploads whose content the librarian already has "
+            "to the existing content rather than storing it again.",
+            "disabled",
+            "",
+            "",
+        ),
         (
             "soyuz.named_auth_token.allow_new",
             "boolean",
@@ -295,6 +313,44 @@
             "",
             "",
         ),
+        (
+            "archivepublisher.incremental_indexes.enabled",
+            "boolean",
+            "If true, cache rendered Sources and Packages stanzas between "
+            "publisher runs and only render stanzas for publications that "
+            "changed.",
+            "",
+            "",
+            "",
+        ),
+        (
+            "archivepublisher.stanza_cache.enabled",
+            "boolean",
+            "If true, share rendered Sources and Packages stanzas between "
+            "pockets, series and archives using memcached.",
+            "",
+            "",
+            "",
+        ),
+        (
+            "archivepublisher.index_pipeline.enabled",
+            "boolean",
+            "If true, write each compressed variant of the Sources and "
+            "Packages files in its own thread while they are generated.",
+            "",
+            "",
+            "",
+        ),
+        (
+            "archivepublisher.native_contents.enabled",
+            "boolean",
+            "If true, generate Contents files from the file lists recorded "
+            "when binary packages were uploaded, rather than by running "
+            "apt-ftparchive over the pool.",
+            "",
+            "",
+            "",
+        ),
         (
             "bugs.webhooks.disabled",
             "boolean",
@@ -17,6 +17,7 @@
 import socket
 import threading
 import time
+from collections import deque
 from socket import AF_INET, SOCK_STREAM
 from urllib.error import HTTPError, URLError
 from urllib.parse import quote, urljoin, urlparse, urlunparse
@@ -128,8 +129,11 @@ def _sendLine(self, line, check_for_error_responses=True):
         if check_for_error_responses:
             self._checkError()
 
-    def _sendHeader(self, name, value):
-        self._sendLine(("%s: %s" % (name, value)).encode())
+    def _sendHeader(self, name, value, check_for_error_responses=True):
+        self._sendLine(
+            ("%s: %s" % (name, value)).encode(),
+            check_for_error_responses=check_for_error_responses,
+        )
 
     def addFile(
         self,
@@ -169,10 +173,7 @@ def addFile(
         name = six.ensure_binary(name)
 
         # Import in this method to avoid a circular import
-        from lp.services.librarian.model import (
-            LibraryFileAlias,
-            LibraryFileContent,
-        )
+        from lp.services.librarian.model import LibraryFileAlias
 
         try:
             self._connect()
@@ -199,6 +200,7 @@ def addFile(
             self._sendHeader("Database-Name", databaseName)
             self._sendHeader("File-Content-ID", contentID)
             self._sendHeader("File-Alias-ID", aliasID)
+            self._sendHeader("Reuse-Content", "yes")
 
             if debugID is not None:
                 self._sendHeader("Debug-ID", debugID)
@@ -237,18 +239,14 @@ def addFile(
             response = six.ensure_str(
                 self.state.f.readline().strip(), errors="replace"
             )
-            if response != "200":
-                raise UploadFailed("Server said: " + response)
-
             # Add rows to DB
-            content = LibraryFileContent(
-                id=contentID,
-                filesize=size,
-                sha256=sha256_digester.hexdigest(),
-                sha1=sha1_digester.hexdigest(),
-                md5=md5_digester.hexdigest(),
+            content = self._getStoredContent(
+                store,
+                response,
+                contentID,
+                size,
+                (md5_digester, sha1_digester, sha256_digester),
             )
-            store.add(content)
             LibraryFileAlias(
                 id=aliasID,
                 content=content,
@@ -270,6 +268,198 @@ def addFile(
         finally:
             self._close()
 
+    # The number of uploads in a batch that may be waiting for a reply from
+    # the server at once.
+    max_pipelined_uploads = 16
+
+    def addFiles(self, files, expires=None, allow_zero_length=False):
+        """Add several files to the librarian over a single connection.
+
+        Each upload is sent without waiting for the server to reply to the
+        previous ones, which saves a round trip per file.
+
+        :param files: A sequence of (name, size, file, contentType) tuples,
+            as for `addFile`.
+        :param expires: Expiry time of the files, as for `addFile`.
+        :param allow_zero_length: If True permit zero length files.
+        :returns: A list with an item for each file in `files`: either the
+            new alias ID as an integer, or an `UploadFailed` exception if
+            that file could not be uploaded.
+        """
+        if allow_zero_length:
+            min_size = -1
+        else:
+            min_size = 0
+        results = [None] * len(files)
+        requests = []
+        for index, (_, size, file, _) in enumerate(files):
+            if file is None:
+                raise TypeError("Bad File Descriptor: %s" % repr(file))
+            if size <= min_size:
+                results[index] = UploadFailed("Invalid length: %d" % size)
+            else:
+                requests.append(index)
+        if not requests:
+            return results
+
+        # Import in this method to avoid a circular import
+        from lp.services.librarian.model import LibraryFileAlias
+
+        store = IPrimaryStore(LibraryFileAlias)
+        databaseName = self._getDatabaseName(store)
+        contentIDs = [
+            row[0]
+            for row in store.execute(
+                "SELECT nextval('libraryfilecontent_id_seq') "
+                "FROM generate_series(1, %s)",
+                (len(requests),),
+            )
+        ]
+        aliasIDs = [
+            row[0]
+            for row in store.execute(
+                "SELECT nextval('libraryfilealias_id_seq') "
+                "FROM generate_series(1, %s)",
+                (len(requests),),
+            )
+        ]
+
+        waiting = deque()
+        stored = []
+
+        def read_response():
+            index, contentID, aliasID, digests = waiting.popleft()
+            response = six.ensure_str(
+                self.state.f.readline().strip(), errors="replace"
+            )
+            if not response:
+                waiting.appendleft((index, contentID, aliasID, digests))
+                raise UploadFailed("Server closed the connection")
+            if response != "200" and not response.startswith("200 "):
+                results[index] = UploadFailed("Server said: " + response)
+            else:
+                results[index] = aliasID
+                stored.append((index, contentID, aliasID, digests, response))
+
+        try:
+            self._connect()
+            for index, contentID, aliasID in zip(
+                requests, contentIDs, aliasIDs
+            ):
+                name, size, file, _ = files[index]
+                # Replies to earlier uploads may arrive at any time, so
+                # don't mistake them for early errors.
+                self._sendLine(
+                    b"STORE %d %s" % (size, six.ensure_binary(name)),
+                    check_for_error_responses=False,
+                )
+                for header, value in (
+                    ("Database-Name", databaseName),
+                    ("File-Content-ID", contentID),
+                    ("File-Alias-ID", aliasID),
+                    ("Continue-On-Error", "yes"),
+                    ("Reuse-Content", "yes"),
+                ):
+                    self._sendHeader(
+                        header, value, check_for_error_responses=False
+                    )
+                self._sendLine(b"", check_for_error_responses=False)
+
+                digests = (hashlib.md5(), hashlib.sha1(), hashlib.sha256())
+                bytesWritten = 0
+                for chunk in iter(lambda: file.read(1024 * 64), b""):
+                    self.state.f.write(chunk)
+                    bytesWritten += len(chunk)
+                    for digester in digests:
+                        digester.update(chunk)
+                assert (
+                    bytesWritten == size
+                ), "size is %d, but %d were read from the file" % (
+                    size,
+                    bytesWritten,
+                )
+                waiting.append((index, contentID, aliasID, digests))
+                if len(waiting) >= self.max_pipelined_uploads:
+                    self.state.f.flush()
+                    read_response()
+            self.state.f.flush()
+            while waiting:
+                read_response()
+        except (UploadFailed, OSError) as e:
+            if isinstance(e, socket.timeout):
+                e = UploadFailed(
+                    "Server timed out after %s second(s)"
+                    % config.librarian.client_socket_timeout
+                )
+            elif not isinstance(e, UploadFailed):
+                e = UploadFailed(
+                    "[%s:%s]: %s" % (self.upload_host, self.upload_port, e)
+                )
+            # Everything we haven't had a reply for has failed.
+            for index in requests:
+                if results[index] is None:
+                    results[index] = e
+        finally:
+            self._close()
+
+        # Add rows to DB
+        for index, contentID, aliasID, digests, response in stored:
+            name, size, _, contentType = files[index]
+            try:
+                content = self._getStoredContent(
+                    store, response, contentID, size, digests
+                )
+            except UploadFailed as e:
+                results[index] = e
+                continue
+            LibraryFileAlias(
+                id=aliasID,
+                content=content,
+                filename=six.ensure_text(name),
+                mimetype=contentType,
+                expires=expires,
+                restricted=self.restricted,
+            )
+        store.flush()
+        return results
+
+    def _getStoredContent(self, store, response, contentID, size, digests):
+        """Return the `LibraryFileContent` for a file the server accepted.
+
+        :param store: The store to use.
+        :param response: The server's reply to the upload.  "200" means
+            that the server stored the file as `contentID`, so a new row is
+            created for it; "200 <id>" means that the server already had
+            identical content with that ID, which is reused.
+        :param contentID: The content ID that the file was sent with.
+        :param size: The size of the file.
+        :param digests: MD5, SHA-1 and SHA-256 digesters for the file.
+        :raises UploadFailed: If the server did not accept the file.
+        """
+        # Import in this method to avoid a circular import
+        from lp.services.librarian.model import LibraryFileContent
+
+        if response == "200":
+            md5_digester, sha1_digester, sha256_digester = digests
+            content = LibraryFileContent(
+                id=contentID,
+                filesize=size,
+                sha256=sha256_digester.hexdigest(),
+                sha1=sha1_digester.hexdigest(),
+                md5=md5_digester.hexdigest(),
+            )
+            store.add(content)
+            return content
+        elif response.startswith("200 "):
+            content = store.get(LibraryFileContent, int(response[4:]))
+            if content is None:
+                raise UploadFailed(
+                    "Server reused missing content: " + response[4:]
+                )
+            return content
+        else:
+            raise UploadFailed("Server said: " + response)
+
     def _getDatabaseName(self, store):
         return store.execute("SELECT current_database();").get_one()[0]
 
@@ -67,6 +67,21 @@ def addFile(name, size, file, contentType, expires=None):
         Returns the id of the newly added LibraryFileAlias
         """
 
+    def addFiles(files, expires=None, allow_zero_length=False):
+        """Add several files to the librarian over a single connection.
+
+        As per addFile, except that uploads are pipelined, and a failure to
+        upload one file does not prevent the others from being uploaded.
+
+        :param files: A sequence of (name, size, file, contentType) tuples.
+        :param expires: Expiry time of the files, or None to keep them until
+            unreferenced.
+
+        Returns a list with, for each file, either the id of the newly added
+        LibraryFileAlias or the `UploadFailed` exception describing why it
+        could not be added.
+        """
+
     def remoteAddFile(name, size, file, contentType, expires=None):
         """Add a file to the librarian using the remote protocol.
 
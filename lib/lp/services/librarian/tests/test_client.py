@@ -23,6 +23,7 @@
 from lp.services.database.interfaces import IStandbyStore, IStore
 from lp.services.database.policy import StandbyDatabasePolicy
 from lp.services.database.sqlbase import block_implicit_flushes
+from lp.services.features.testing import FeatureFixture
 from lp.services.librarian import client as client_module
 from lp.services.librarian.client import (
     LibrarianClient,
@@ -32,6 +33,9 @@
 )
 from lp.services.librarian.interfaces.client import UploadFailed
 from lp.services.librarian.model import LibraryFileAlias
+from lp.services.librarianserver.storage import (
+    DEDUPLICATE_UPLOADS_FEATURE_FLAG,
+)
 from lp.services.propertycache import cachedproperty
 from lp.services.timeout import override_timeout, with_timeout
 from lp.testing import TestCase
@@ -39,6 +43,7 @@
     DatabaseLayer,
     FunctionalLayer,
     LaunchpadFunctionalLayer,
+    LibrarianLayer,
 )
 from lp.testing.views import create_webservice_error_view
 
@@ -359,10 +364,10 @@ def test_addFile_no_response_check_at_end_headers_for_empty_file(self):
             "text/plain",
             allow_zero_length=True,
         )
-        # addFile() calls _sendHeader() three times and _sendLine()
+        # addFile() calls _sendHeader() four times and _sendLine()
         # twice, but it does not check if the server responded
         # in the second call.
-        self.assertEqual(4, client.check_error_calls)
+        self.assertEqual(5, client.check_error_calls)
 
     def test_addFile_response_check_at_end_headers_for_non_empty_file(self):
         # When addFile() sends the request header, it checks if the
@@ -371,9 +376,9 @@ def test_addFile_response_check_at_end_headers_for_non_empty_file(self):
         # empty line following the headers.
         client = InstrumentedLibrarianClient()
         client.addFile("sample.txt", 4, io.BytesIO(b"1234"), "text/plain")
-        # addFile() calls _sendHeader() three times and _sendLine()
+        # addFile() calls _sendHeader() four times and _sendLine()
         # twice.
-        self.assertEqual(5, client.check_error_calls)
+        self.assertEqual(6, client.check_error_calls)
 
     def test_addFile_hashes(self):
         # addFile() sets the MD5, SHA-1 and SHA-256 hashes on the
@@ -393,6 +398,71 @@ def test_addFile_hashes(self):
         self.assertEqual(sha1, lfa.content.sha1)
         self.assertEqual(sha256, lfa.content.sha256)
 
+    def test_addFiles(self):
+        # addFiles() uploads several files over one connection.
+        client = LibrarianClient()
+        contents = [b"one", b"two", b"three"]
+        alias_ids = client.addFiles(
+            [
+                ("file%d.txt" % i, len(data), io.BytesIO(data), "text/plain")
+                for i, data in enumerate(contents)
+            ]
+        )
+        transaction.commit()
+        self.assertEqual(3, len(set(alias_ids)))
+        for alias_id, data in zip(alias_ids, contents):
+            lfa = IStore(LibraryFileAlias).get(LibraryFileAlias, alias_id)
+            self.assertEqual(
+                hashlib.sha256(data).hexdigest(), lfa.content.sha256
+            )
+            self.assertEqual(data, client.getFileByAlias(alias_id).read())
+
+    def test_addFiles_pipelines_more_than_window(self):
+        client = LibrarianClient()
+        client.max_pipelined_uploads = 2
+        contents = [b"%d" % i for i in range(5)]
+        alias_ids = client.addFiles(
+            [
+                ("file.txt", len(data), io.BytesIO(data), "text/plain")
+                for data in contents
+            ]
+        )
+        transaction.commit()
+        self.assertEqual(
+            contents,
+            [client.getFileByAlias(alias_id).read() for alias_id in alias_ids],
+        )
+
+    def test_addFiles_reports_failures_per_file(self):
+        # A file that can't be uploaded doesn't stop the others.
+        client = LibrarianClient()
+        results = client.addFiles(
+            [
+                ("empty.txt", 0, io.BytesIO(b""), "text/plain"),
+                ("sample.txt", 6, io.BytesIO(b"sample"), "text/plain"),
+            ]
+        )
+        self.assertIsInstance(results[0], UploadFailed)
+        self.assertEqual("Invalid length: 0", str(results[0]))
+        self.assertIsInstance(results[1], int)
+
+    def test_addFiles_wrong_database(self):
+        # Failures reported by the server are reported for each file.
+        client = LibrarianClient()
+        client._getDatabaseName = lambda cur: "wrong_database"
+        results = client.addFiles(
+            [
+                ("one.txt", 3, io.BytesIO(b"one"), "text/plain"),
+                ("two.txt", 3, io.BytesIO(b"two"), "text/plain"),
+            ]
+        )
+        self.assertEqual(2, len(results))
+        for result in results:
+            self.assertIsInstance(result, UploadFailed)
+            self.assertStartsWith(
+                str(result), "Server said: 400 Wrong database"
+            )
+
     def test__getURLForDownload(self):
         # This protected method is used by getFileByAlias. It is supposed to
         # use the internal host and port rather than the external, proxied
@@ -586,6 +656,73 @@ def test_thread_state_FileUploadClient(self):
         self.assertEqual(5, client.check_error_calls)
 
 
+class LibrarianClientDeduplicationTestCase(TestCase):
+    layer = LaunchpadFunctionalLayer
+
+    def setUp(self):
+        super().setUp()
+        self.useFixture(
+            FeatureFixture({DEDUPLICATE_UPLOADS_FEATURE_FLAG: "on"})
+        )
+        transaction.commit()
+        # Restart the Librarian so it picks up the feature flag.
+        LibrarianLayer.librarian_fixture.cleanUp()
+        LibrarianLayer.librarian_fixture.setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        # Restart the Librarian so it picks up the feature flag change.
+        self.attachLibrarianLog(LibrarianLayer.librarian_fixture)
+        LibrarianLayer.librarian_fixture.cleanUp()
+        LibrarianLayer.librarian_fixture.setUp()
+
+    def assertSharesContent(self, client, alias_ids, data):
+        lfas = [
+            IStore(LibraryFileAlias).get(LibraryFileAlias, alias_id)
+            for alias_id in alias_ids
+        ]
+        self.assertEqual(len(alias_ids), len(set(alias_ids)))
+        self.assertEqual(1, len({lfa.content.id for lfa in lfas}))
+        for alias_id in alias_ids:
+            self.assertEqual(data, client.getFileByAlias(alias_id).read())
+
+    def test_addFile_reuses_identical_content(self):
+        # If the server already has identical content, addFile() links
+        # the new alias to it rather than creating new content.
+        client = LibrarianClient()
+        data = b"some identical data"
+        alias_id1 = client.addFile(
+            "file1.txt", len(data), io.BytesIO(data), "text/plain"
+        )
+        transaction.commit()
+        alias_id2 = client.addFile(
+            "file2.txt", len(data), io.BytesIO(data), "text/plain"
+        )
+        transaction.commit()
+        self.assertSharesContent(client, [alias_id1, alias_id2], data)
+        self.assertEqual(
+            "file2.txt",
+            IStore(LibraryFileAlias).get(LibraryFileAlias, alias_id2).filename,
+        )
+
+    def test_addFiles_reuses_identical_content(self):
+        # addFiles() reuses identical content in the same way.
+        client = LibrarianClient()
+        data = b"some identical data"
+        alias_id = client.addFile(
+            "file.txt", len(data), io.BytesIO(data), "text/plain"
+        )
+        transaction.commit()
+        results = client.addFiles(
+            [
+                ("copy%d.txt" % i, len(data), io.BytesIO(data), "text/plain")
+                for i in range(2)
+            ]
+        )
+        transaction.commit()
+        self.assertSharesContent(client, [alias_id] + results, data)
+
+
 class TestWebServiceErrors(unittest.TestCase):
     """Test that errors are correctly mapped to HTTP status codes."""
 
@@ -12,13 +12,14 @@
 from xmlrpc.client import Fault
 
 from pymacaroons import Macaroon
-from storm.expr import SQL, Not
+from storm.expr import SQL, Desc, Exists, Not, Or, Select
 from twisted.internet import defer
 from twisted.internet import reactor as default_reactor
 from twisted.internet import threads
 from twisted.web import xmlrpc
 
 from lp.services.config import config
+from lp.services.database.constants import UTC_NOW
 from lp.services.database.interfaces import IStore
 from lp.services.database.sqlbase import session_store
 from lp.services.librarian.model import (
@@ -56,6 +57,37 @@ def lookupBySHA1(self, digest):
             )
         ]
 
+    def lookupBySHA256(self, digest, size):
+        """Return the IDs of live contents with this SHA-256 and size.
+
+        Contents are only returned if they have an unexpired alias, since
+        otherwise the garbage collector may be about to remove them.  The
+        most recently added contents are returned first.
+        """
+        live_alias = Exists(
+            Select(
+                1,
+                tables=[LibraryFileAlias],
+                where=(
+                    (LibraryFileAlias.content_id == LibraryFileContent.id)
+                    & Or(
+                        LibraryFileAlias.expires == None,
+                        LibraryFileAlias.expires > UTC_NOW,
+                    )
+                ),
+            )
+        )
+        return list(
+            IStore(LibraryFileContent)
+            .find(
+                LibraryFileContent.id,
+                LibraryFileContent.sha256 == digest,
+                LibraryFileContent.filesize == size,
+                live_alias,
+            )
+            .order_by(Desc(LibraryFileContent.id))
+        )
+
     @defer.inlineCallbacks
     def _verifyMacaroon(self, macaroon, aliasid):
         """Verify an LFA-authorising macaroon with the authserver.
@@ -4,10 +4,12 @@
 """Librarian garbage collection routines"""
 
 import hashlib
+import json
 import multiprocessing.pool
 import os
 import re
 import sys
+import threading
 from contextlib import ExitStack
 from datetime import datetime, timedelta, timezone
 from time import time
@@ -22,7 +24,12 @@
     listReferences,
     quote_identifier,
 )
-from lp.services.features import getFeatureFlag
+from lp.services.features import (
+    get_relevant_feature_controller,
+    getFeatureFlag,
+    install_feature_controller,
+    uninstall_feature_controller,
+)
 from lp.services.librarianserver import swift
 from lp.services.librarianserver.storage import (
     _relFileLocation as relative_file_path,
@@ -35,6 +42,9 @@
 
 STREAM_CHUNK_SIZE = 64 * 1024
 
+# The largest content ID that fits in the on-disk storage layout.
+MAX_CONTENT_ID = 0xFFFFFFFF
+
 
 def file_exists(content_id):
     """True if the file exists either on disk or in Swift.
@@ -624,7 +634,10 @@ def __call__(self, chunksize):
 
         cur = self.con.cursor()
 
-        # Delete unreferenced LibraryFileContent entries.
+        # Delete unreferenced LibraryFileContent entries.  The librarian
+        # may have linked new aliases to some of them since we looked, if
+        # it found that an upload was identical to existing content, so
+        # check again.
         cur.execute(
             """
             DELETE FROM LibraryFileContent
@@ -633,27 +646,23 @@ def __call__(self, chunksize):
                 WHERE id BETWEEN %s AND %s) AS UnreferencedLibraryFileContent
             WHERE
                 LibraryFileContent.id = UnreferencedLibraryFileContent.content
+                AND NOT EXISTS (
+                    SELECT 1 FROM LibraryFileAlias
+                    WHERE LibraryFileAlias.content = LibraryFileContent.id)
+            RETURNING LibraryFileContent.id
             """,
             (self.index, self.index + chunksize - 1),
         )
-        rows_deleted = cur.rowcount
-        self.total_deleted += rows_deleted
+        deleted_ids = [row[0] for row in cur.fetchall()]
+        self.total_deleted += len(deleted_ids)
         self.con.commit()
 
         # Remove files from disk. We do this outside the transaction,
         # as the garbage collector happily deals with files that exist
         # on disk but not in the DB.
-        cur.execute(
-            """
-            SELECT content FROM UnreferencedLibraryFileContent
-            WHERE id BETWEEN %s AND %s
-            """,
-            (self.index, self.index + chunksize - 1),
-        )
-
         pool = multiprocessing.pool.ThreadPool(10)
         try:
-            pool.map(self.remove_content, (row[0] for row in cur.fetchall()))
+            pool.map(self.remove_content, deleted_ids)
         finally:
             pool.close()
             pool.join()
@@ -683,16 +692,182 @@ def delete_unwanted_files(con):
         con.autocommit = orig_autocommit
 
 
-def delete_unwanted_disk_files(con):
+def _content_id_range(min_content_id, max_content_id):
+    if min_content_id is None:
+        min_content_id = 0
+    if max_content_id is None:
+        max_content_id = MAX_CONTENT_ID
+    return min_content_id, max_content_id
+
+
+def plan_shards(max_content_id, num_shards):
+    """Split the content ID space into roughly equal ranges.
+
+    :param max_content_id: The largest content ID currently in use, or
+        None if there are none.
+    :param num_shards: The number of ranges to return.
+    :return: A list of [min, max] inclusive content ID ranges.  The last
+        range is open-ended (its max is None), so that it also covers any
+        files with IDs beyond those in the database.
+    """
+    if max_content_id is None:
+        return [[0, None]]
+    size = max(1, -(-(max_content_id + 1) // num_shards))
+    shards = [
+        [start, start + size - 1]
+        for start in range(0, max_content_id + 1, size)
+    ]
+    shards[-1][1] = None
+    return shards
+
+
+class GCCheckpoint:
+    """Record the progress of a range-partitioned run on disk.
+
+    This holds the shards the run was split into and which of them have
+    been completed, so that a run that was killed can be resumed with the
+    same shards.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.shards = None
+        self.done = set()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load a previous run's progress, returning True if there was one."""
+        try:
+            with open(self.path) as checkpoint_file:
+                data = json.load(checkpoint_file)
+            self.shards = data["shards"]
+            self.done = set(data["done"])
+        except FileNotFoundError:
+            return False
+        except (KeyError, TypeError, ValueError):
+            log.warning("Ignoring damaged checkpoint %s" % self.path)
+            return False
+        return True
+
+    def start(self, shards):
+        """Start a new run with the given shards."""
+        self.shards = shards
+        self.done = set()
+        self._save()
+
+    def markDone(self, index):
+        with self._lock:
+            self.done.add(index)
+            self._save()
+
+    def finish(self):
+        """Forget about a completed run."""
+        os.unlink(self.path)
+
+    def _save(self):
+        temp_path = self.path + ".new"
+        with open(temp_path, "w") as checkpoint_file:
+            json.dump(
+                {"shards": self.shards, "done": sorted(self.done)},
+                checkpoint_file,
+            )
+        os.rename(temp_path, self.path)
+
+
+def delete_unwanted_files_in_shards(
+    con, connect, num_shards, num_workers, checkpoint_path=None
+):
+    """Delete unwanted files from disk and Swift, in parallel.
+
+    The content ID space is split into `num_shards` ranges, which are
+    processed by up to `num_workers` threads.  Each shard streams its
+    wanted content IDs from its own database cursor and walks only the
+    part of the storage that holds its range, so memory use does not grow
+    with the size of the store.
+
+    :param con: A database connection, used to plan the shards.
+    :param connect: A callable returning a new database connection; each
+        shard uses its own connection.
+    :param checkpoint_path: If not None, record completed shards in this
+        file, and resume a previous run recorded there.
+    """
+    checkpoint = GCCheckpoint(checkpoint_path) if checkpoint_path else None
+    if checkpoint is not None and checkpoint.load():
+        shards = checkpoint.shards
+        log.info(
+            "Resuming: %d of %d shards already done."
+            % (len(checkpoint.done), len(shards))
+        )
+    else:
+        cur = con.cursor()
+        try:
+            cur.execute("SELECT max(id) FROM LibraryFileContent")
+            max_content_id = cur.fetchone()[0]
+        finally:
+            cur.close()
+        con.rollback()
+        shards = plan_shards(max_content_id, num_shards)
+        if checkpoint is not None:
+            checkpoint.start(shards)
+    done = checkpoint.done if checkpoint is not None else set()
+
+    # Feature controllers are per-thread, so share ours with the workers.
+    swift_enabled = getFeatureFlag("librarian.swift.enabled") or False
+    feature_controller = get_relevant_feature_controller()
+
+    def process_shard(index):
+        min_content_id, max_content_id = shards[index]
+        install_feature_controller(feature_controller)
+        shard_con = connect()
+        try:
+            # Disable autocommit so that we can use named cursors.
+            shard_con.autocommit = False
+            delete_unwanted_disk_files(
+                shard_con, min_content_id, max_content_id
+            )
+            if swift_enabled:
+                delete_unwanted_swift_files(
+                    shard_con, min_content_id, max_content_id
+                )
+        finally:
+            shard_con.rollback()
+            shard_con.close()
+            uninstall_feature_controller()
+        if checkpoint is not None:
+            checkpoint.markDone(index)
+
+    pool = multiprocessing.pool.ThreadPool(num_workers)
+    try:
+        pool.map(
+            process_shard,
+            [index for index in range(len(shards)) if index not in done],
+            chunksize=1,
+        )
+    finally:
+        pool.close()
+        pool.join()
+    if checkpoint is not None:
+        checkpoint.finish()
+
+
+def delete_unwanted_disk_files(con, min_content_id=None, max_content_id=None):
     """Delete files found on disk that have no corresponding record in the
     database.
 
     Files will only be deleted if they were created more than one day ago
     to avoid deleting files that have just been uploaded but have yet to have
     the database records committed.
-    """
 
-    log.info("Deleting unwanted files from disk.")
+    If min_content_id or max_content_id are given, only files with content
+    IDs in that range (inclusive) are considered.
+    """
+    min_content_id, max_content_id = _content_id_range(
+        min_content_id, max_content_id
+    )
+    log.info(
+        "Deleting unwanted files from disk (content IDs %d to %d)."
+        % (min_content_id, max_content_id)
+    )
 
     swift_enabled = getFeatureFlag("librarian.swift.enabled") or False
 
@@ -702,8 +877,11 @@ def delete_unwanted_disk_files(con):
     # Results are ordered so we don't have to suck them all in at once.
     cur.execute(
         """
-        SELECT id FROM LibraryFileContent ORDER BY id
-        """
+        SELECT id FROM LibraryFileContent
+        WHERE id BETWEEN %s AND %s
+        ORDER BY id
+        """,
+        (min_content_id, max_content_id),
     )
     content_id_iter = iter(cur)
 
@@ -720,9 +898,12 @@ def get_next_wanted_content_id():
 
     hex_content_id_re = re.compile(r"^([0-9a-f]{8})(\.migrated)?$")
     ONE_DAY = 24 * 60 * 60
+    storage_root = get_storage_root()
+    min_hex_content_id = "%08x" % min_content_id
+    max_hex_content_id = "%08x" % max_content_id
 
     for dirpath, dirnames, filenames in os.walk(
-        get_storage_root(), followlinks=True
+        storage_root, followlinks=True
     ):
         # Ignore known and harmless noise in the Librarian storage area.
         if "incoming" in dirnames:
@@ -745,6 +926,19 @@ def get_next_wanted_content_id():
             except ValueError:
                 dirnames.remove(dirname)
                 log.warning("Ignoring invalid directory %s" % dirname)
+                continue
+            # Don't descend into directories that only hold files outside
+            # the range we were asked to consider.
+            prefix = "".join(
+                os.path.relpath(
+                    os.path.join(dirpath, dirname), storage_root
+                ).split(os.sep)
+            )
+            if (
+                prefix < min_hex_content_id[: len(prefix)]
+                or prefix > max_hex_content_id[: len(prefix)]
+            ):
+                dirnames.remove(dirname)
 
         # We need everything in order to ensure we visit files in the
         # same order we retrieve wanted files from the database.
@@ -768,7 +962,10 @@ def get_next_wanted_content_id():
                 log.warning("Ignoring invalid path %s" % path)
                 continue
 
-            content_id = int(match.groups()[0], 16)
+            file_content_id = int(match.groups()[0], 16)
+            if not min_content_id <= file_content_id <= max_content_id:
+                continue
+            content_id = file_content_id
 
             while (
                 next_wanted_content_id is not None
@@ -824,14 +1021,21 @@ def get_next_wanted_content_id():
     )
 
 
-def swift_files(max_lfc_id):
+def swift_files(max_lfc_id, min_lfc_id=0):
     """Generate all files stored in all configured Swift instances.
 
     For each file, yield (connection_pool, container, name).  Results are
     yielded in numerical order; if the same file is present in multiple
     Swift instances, all copies of it are yielded before moving on to the
     next file.
+
+    Only the containers that may hold files from min_lfc_id to max_lfc_id
+    are listed, but those containers may also hold files outside that
+    range.
     """
+    if min_lfc_id > max_lfc_id:
+        return
+    first_container = swift.swift_location(min_lfc_id)[0]
     final_container = swift.swift_location(max_lfc_id)[0]
 
     with ExitStack() as stack:
@@ -842,7 +1046,9 @@ def swift_files(max_lfc_id):
         # We generate the container names, rather than query the
         # server, because the mock Swift implementation doesn't
         # support that operation.
-        container_num = -1
+        container_num = (
+            int(first_container[len(swift.SWIFT_CONTAINER_PREFIX) :]) - 1
+        )
         container = None
         while container != final_container:
             container_num += 1
@@ -877,18 +1083,28 @@ def swift_files(max_lfc_id):
                 seen_names.add((obj["name"], pool_index))
 
 
-def delete_unwanted_swift_files(con):
-    """Delete files found in Swift that have no corresponding db record."""
+def delete_unwanted_swift_files(con, min_content_id=None, max_content_id=None):
+    """Delete files found in Swift that have no corresponding db record.
+
+    If min_content_id or max_content_id are given, only files with content
+    IDs in that range (inclusive) are considered.
+    """
     assert getFeatureFlag("librarian.swift.enabled")
 
-    log.info("Deleting unwanted files from Swift.")
+    min_content_id, max_content_id = _content_id_range(
+        min_content_id, max_content_id
+    )
+    log.info(
+        "Deleting unwanted files from Swift (content IDs %d to %d)."
+        % (min_content_id, max_content_id)
+    )
 
     # Get the largest LibraryFileContent id in the database. This lets
     # us know when to stop looking in Swift for more files.
     cur = con.cursor()
     try:
         cur.execute("SELECT max(id) FROM LibraryFileContent")
-        max_lfc_id = cur.fetchone()[0]
+        max_lfc_id = min(cur.fetchone()[0] or 0, max_content_id)
     finally:
         cur.close()
 
@@ -898,8 +1114,11 @@ def delete_unwanted_swift_files(con):
     # Results are ordered so we don't have to suck them all in at once.
     cur.execute(
         """
-        SELECT id FROM LibraryFileContent ORDER BY id
-        """
+        SELECT id FROM LibraryFileContent
+        WHERE id BETWEEN %s AND %s
+        ORDER BY id
+        """,
+        (min_content_id, max_content_id),
     )
     content_id_iter = iter(cur)
 
@@ -914,14 +1133,19 @@ def get_next_wanted_content_id():
     removed_count = 0
     content_id = next_wanted_content_id = -1
 
-    for connection_pool, container, obj in swift_files(max_lfc_id):
+    for connection_pool, container, obj in swift_files(
+        max_lfc_id, min_lfc_id=min_content_id
+    ):
         name = obj["name"]
 
         # We may have a segment of a large file.
         if "/" in name:
-            content_id = int(name.split("/", 1)[0])
+            file_content_id = int(name.split("/", 1)[0])
         else:
-            content_id = int(name)
+            file_content_id = int(name)
+        if not min_content_id <= file_content_id <= max_content_id:
+            continue
+        content_id = file_content_id
 
         while (
             next_wanted_content_id is not None
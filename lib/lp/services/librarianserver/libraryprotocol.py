@@ -1,6 +1,7 @@
 # Copyright 2009-2018 Canonical Ltd.  This software is licensed under the
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
+from collections import deque
 from datetime import datetime, timezone
 
 from twisted.internet import protocol
@@ -45,6 +46,14 @@ class FileUploadProtocol(basic.LineReceiver):
       :Database-Name: if specified, the name of the database the client is
         connected to.  The server will check that this matches, and reject the
         request if it doesn't.
+      :Continue-On-Error: if "yes", a failure to store this file is reported
+        without closing the connection, so that any requests the client has
+        already sent after it are still processed.
+      :Reuse-Content: if "yes" and File-Content-ID was specified, the
+        server may decline to store a file that is identical to content it
+        already has.  It then replies with "200 1234", where "1234" is the
+        id of the existing content, and the client should link its alias to
+        that content rather than creating a new one.
 
     The File-Content-ID and File-Alias-ID headers are also described in
     <https://launchpad.canonical.com/LibrarianTransactions>.
@@ -56,13 +65,44 @@ class FileUploadProtocol(basic.LineReceiver):
     and an appropriate message.
 
     Once the server has replied, the client may re-use the connection as if it
-    were just established to start a new upload.
+    were just established to start a new upload.  The client may also send
+    further requests without waiting for replies; the replies are sent in
+    the same order as the requests.
     """
 
     delimiter = b"\r\n"  # same as HTTP
     state = "command"
 
+    def connectionMade(self):
+        # Replies to requests in the order the requests were received.
+        # Each is a [line, close] list, with line None until the reply is
+        # ready.
+        self.pendingResponses = deque()
+
+    def _queueResponse(self):
+        """Reserve a place for the reply to the current request."""
+        response = [None, False]
+        self.pendingResponses.append(response)
+        return response
+
+    def _sendResponse(self, response, line, close=False):
+        """Send a reply, once all earlier replies have been sent."""
+        response[:] = [line, close]
+        while (
+            self.pendingResponses and self.pendingResponses[0][0] is not None
+        ):
+            line, close = self.pendingResponses.popleft()
+            self.sendLine(line)
+            if close:
+                self.pendingResponses.clear()
+                self.transport.loseConnection()
+                return
+
     def lineReceived(self, line):
+        if self.state == "closing":
+            # We've rejected an earlier request; ignore anything else the
+            # client sent after it.
+            return
         try:
             try:
                 line = line.decode("UTF-8")
@@ -74,19 +114,31 @@ def lineReceived(self, line):
         except Exception:
             self.unknownError()
 
-    def sendError(self, msg, code="400"):
+    def sendError(self, msg, code="400", response=None, close=True):
         """Sends a correctly formatted error to the client, and closes the
-        connection."""
-        self.sendLine((code + " " + msg).encode("UTF-8"))
-        self.transport.loseConnection()
+        connection unless told otherwise.
+
+        :param response: The place reserved for this reply by
+            `_queueResponse`; if None, the reply follows all outstanding
+            replies.
+        """
+        if response is None:
+            response = self._queueResponse()
+        if close:
+            self.state = "closing"
+        self._sendResponse(
+            response, (code + " " + msg).encode("UTF-8"), close=close
+        )
 
-    def unknownError(self, failure=None):
+    def unknownError(self, failure=None, response=None, close=True):
         log.msg("Uncaught exception in FileUploadProtocol:")
         if failure is not None:
             log.err(failure)
         else:
             log.err()
-        self.sendError("Internal server error", "500")
+        self.sendError(
+            "Internal server error", "500", response=response, close=close
+        )
 
     def translateErrors(self, failure):
         """Errback to translate storage errors to protocol errors."""
@@ -97,9 +149,9 @@ def translateErrors(self, failure):
             % (exc.clientDatabaseName, exc.serverDatabaseName)
         )
 
-    def protocolErrors(self, failure):
+    def protocolErrors(self, failure, response=None, close=True):
         failure.trap(ProtocolViolation)
-        self.sendError(failure.value.msg)
+        self.sendError(failure.value.msg, response=response, close=close)
 
     def badLine(self, line):
         raise ProtocolViolation("Unexpected message from client: " + line)
@@ -165,6 +217,7 @@ def command_STORE(self, args):
             )
         fileLibrary = self.factory.fileLibrary
         self.newFile = fileLibrary.startAddFile(name, size)
+        self.continueOnError = False
         self.bytesLeft = size
         self.state = "header"
 
@@ -202,40 +255,60 @@ def header_database_name(self, value):
     def header_debug_id(self, value):
         self.newFile.debugID = value
 
+    def header_continue_on_error(self, value):
+        self.continueOnError = value.lower() == "yes"
+
+    def header_reuse_content(self, value):
+        self.newFile.reuseContent = value.lower() == "yes"
+
     def rawDataReceived(self, data):
+        if self.state == "closing":
+            return
         realdata, rest = data[: self.bytesLeft], data[self.bytesLeft :]
         self.bytesLeft -= len(realdata)
         self.newFile.append(realdata)
 
         if self.bytesLeft == 0:
+            # Later requests may replace self.newFile before this one has
+            # been stored.
+            newFile = self.newFile
+            close = not self.continueOnError
+            response = self._queueResponse()
+
             # Store file.
             deferred = self._storeFile()
 
             def _sendID(ids):
                 # Send ID to client.
                 fileID, aliasID = ids
-                if self.newFile.contentID is None:
+                if newFile.contentID is None:
                     # Respond with deprecated server-generated IDs.
-                    self.sendLine(
-                        ("200 %s/%s" % (fileID, aliasID)).encode("UTF-8")
-                    )
+                    line = ("200 %s/%s" % (fileID, aliasID)).encode("UTF-8")
+                elif fileID != newFile.contentID:
+                    # Tell the client which existing content to use.
+                    line = ("200 %s" % fileID).encode("UTF-8")
                 else:
-                    self.sendLine(b"200")
+                    line = b"200"
+                self._sendResponse(response, line)
 
-            deferred.addBoth(self.logDebugging)
+            deferred.addBoth(self.logDebugging, newFile)
             deferred.addCallback(_sendID)
             deferred.addErrback(self.translateErrors)
-            deferred.addErrback(self.protocolErrors)
-            deferred.addErrback(self.unknownError)
-
-            # Treat remaining bytes (if any) as a new command.
-            self.state = "command"
-            self.setLineMode(rest)
-
-    def logDebugging(self, result_or_failure):
-        if self.newFile.debugID is not None:
-            for msg in self.newFile.debugLog:
-                log.msg("Debug %s: %s" % (self.newFile.debugID, msg))
+            deferred.addErrback(self.protocolErrors, response, close)
+            deferred.addErrback(self.unknownError, response, close)
+
+            # Treat remaining bytes (if any) as a new command, unless
+            # storing this file failed and we're closing the connection.
+            if self.state != "closing":
+                self.state = "command"
+                self.setLineMode(rest)
+
+    def logDebugging(self, result_or_failure, newFile=None):
+        if newFile is None:
+            newFile = self.newFile
+        if newFile.debugID is not None:
+            for msg in newFile.debugLog:
+                log.msg("Debug %s: %s" % (newFile.debugID, msg))
         return result_or_failure
 
     def _storeFile(self):
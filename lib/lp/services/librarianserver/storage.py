@@ -18,13 +18,16 @@
 from lp.services.database.interfaces import (
     DEFAULT_FLAVOR,
     MAIN_STORE,
+    IStore,
     IStoreSelector,
 )
 from lp.services.database.postgresql import ConnectionString
 from lp.services.features import getFeatureFlag
+from lp.services.librarian.model import LibraryFileContent
 from lp.services.librarianserver import swift
 
 __all__ = [
+    "DEDUPLICATE_UPLOADS_FEATURE_FLAG",
     "DigestMismatchError",
     "LibrarianStorage",
     "LibraryFileUpload",
@@ -36,6 +39,12 @@
 ]
 
 
+# If this feature flag is set, uploads whose content is identical to a file
+# we already have are linked to the existing content rather than stored
+# again.
+DEDUPLICATE_UPLOADS_FEATURE_FLAG = "librarian.deduplicate_uploads.enabled"
+
+
 def fsync_path(path, dir=False):
     fd = os.open(path, os.O_RDONLY | (os.O_DIRECTORY if dir else 0))
     try:
@@ -92,9 +101,17 @@ class LibrarianStorage:
     swift_download_attempts = 0
     swift_download_fails = 0
 
-    def __init__(self, directory, library):
+    def __init__(self, directory, library, swift_cache=None):
+        """Create a `LibrarianStorage`.
+
+        :param directory: The root of the on-disk file store.
+        :param library: A `Library`.
+        :param swift_cache: An optional `SwiftCache` for popular files
+            that are only in Swift.
+        """
         self.directory = directory
         self.library = library
+        self.swift_cache = swift_cache
         self.incoming = os.path.join(self.directory, "incoming")
         try:
             os.mkdir(self.incoming)
@@ -104,10 +121,47 @@ def __init__(self, directory, library):
     def hasFile(self, fileid):
         return os.access(self._fileLocation(fileid), os.F_OK)
 
+    def contentExists(self, fileid, check_swift=False):
+        """Is the content of a file available, either on disk or in Swift?
+
+        Unlike `open`, this blocks, so it must not be called from the
+        reactor thread.
+        """
+        if self.hasFile(fileid):
+            return True
+        if check_swift:
+            container, name = swift.swift_location(fileid)
+            for connection_pool in swift.connection_pools:
+                swift_connection = connection_pool.get()
+                try:
+                    swift.quiet_swiftclient(
+                        swift_connection.head_object, container, name
+                    )
+                except swiftclient.ClientException as x:
+                    if x.http_status == 404:
+                        connection_pool.put(swift_connection)
+                    else:
+                        log.err(x)
+                except Exception as x:
+                    log.err(x)
+                else:
+                    connection_pool.put(swift_connection)
+                    return True
+        return False
+
     CHUNK_SIZE = StaticProducer.bufferSize
 
     @defer.inlineCallbacks
-    def open(self, fileid):
+    def open(self, fileid, byte_range=None):
+        """Open a file for reading.
+
+        :param fileid: The ID of the `LibraryFileContent` to open.
+        :param byte_range: If not None, a (first, last) tuple of inclusive
+            byte offsets; the returned stream only yields that part of the
+            file.
+        :return: A Deferred that fires with a stream, or with None if the
+            file cannot be found.
+        """
         if getFeatureFlag("librarian.swift.enabled"):
             # Log our attempt.
             self.swift_download_attempts += 1
@@ -119,6 +173,20 @@ def open(self, fileid):
                     )
                 )
 
+            # Popular files that are no longer on local disk may be in the
+            # cache.
+            if self.swift_cache is not None and not self.hasFile(fileid):
+                stream = self.swift_cache.open(fileid, byte_range=byte_range)
+                if stream is not None:
+                    return stream
+
+            # Ask Swift for just the part of the file we want, rather than
+            # streaming and discarding everything before it.
+            if byte_range is not None:
+                request_headers = {"Range": "bytes=%d-%d" % byte_range}
+            else:
+                request_headers = None
+
             # First, try and stream the file from Swift.  Try the newest
             # configured instance first.
             swift_download_fail = False
@@ -132,6 +200,7 @@ def open(self, fileid):
                         container,
                         name,
                         resp_chunk_size=self.CHUNK_SIZE,
+                        headers=request_headers,
                     )
                     return TxSwiftStream(
                         connection_pool, swift_connection, chunks
@@ -154,13 +223,22 @@ def open(self, fileid):
 
         path = self._fileLocation(fileid)
         if os.path.exists(path):
+            if byte_range is not None:
+                return FileRange(path, *byte_range)
             return open(path, "rb")
 
     def _fileLocation(self, fileid):
         return os.path.join(self.directory, _relFileLocation(str(fileid)))
 
     def startAddFile(self, filename, size):
-        return LibraryFileUpload(self, filename, size)
+        upload = LibraryFileUpload(self, filename, size)
+        # Feature flags are only available in the reactor thread, but
+        # uploads are stored in a separate thread, so look them up now.
+        upload.deduplicate = bool(
+            getFeatureFlag(DEDUPLICATE_UPLOADS_FEATURE_FLAG)
+        )
+        upload.check_swift = bool(getFeatureFlag("librarian.swift.enabled"))
+        return upload
 
     def getFileAlias(self, aliasid, token, path):
         return self.library.getAlias(aliasid, token, path)
@@ -196,6 +274,25 @@ def read(self, size):
         return return_chunk
 
 
+class FileRange:
+    """A stream yielding part of a file on disk."""
+
+    def __init__(self, path, first, last):
+        self._file = open(path, "rb")
+        self._file.seek(first)
+        self._remaining = last - first + 1
+
+    def read(self, size):
+        if self._remaining <= 0:
+            return b""
+        data = self._file.read(min(size, self._remaining))
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
 class LibraryFileUpload:
     """A file upload from a client."""
 
@@ -206,6 +303,9 @@ class LibraryFileUpload:
     expires = None
     databaseName = None
     debugID = None
+    reuseContent = False
+    deduplicate = False
+    check_swift = False
 
     def __init__(self, storage, filename, size):
         self.storage = storage
@@ -227,6 +327,19 @@ def append(self, data):
         self.sha1_digester.update(data)
         self.sha256_digester.update(data)
 
+    def _findExistingContent(self, sha256):
+        """Return existing content identical to this upload, or None."""
+        for content_id in self.storage.library.lookupBySHA256(
+            sha256, self.size
+        ):
+            if self.storage.contentExists(
+                content_id, check_swift=self.check_swift
+            ):
+                return IStore(LibraryFileContent).get(
+                    LibraryFileContent, content_id
+                )
+        return None
+
     @write_transaction
     def store(self):
         self.debugLog.append(
@@ -269,31 +382,61 @@ def store(self):
             self.debugLog.append("database name %r ok" % (self.databaseName,))
             # If we haven't got a contentID, we need to create one and return
             # it to the client.
+            sha256 = self.sha256_digester.hexdigest()
             if self.contentID is None:
-                content = self.storage.library.add(
-                    dstDigest,
-                    self.size,
-                    self.md5_digester.hexdigest(),
-                    self.sha256_digester.hexdigest(),
-                )
+                content = None
+                if self.deduplicate:
+                    content = self._findExistingContent(sha256)
+                existing = content is not None
+                if not existing:
+                    content = self.storage.library.add(
+                        dstDigest,
+                        self.size,
+                        self.md5_digester.hexdigest(),
+                        sha256,
+                    )
                 contentID = content.id
                 aliasID = self.storage.library.addAlias(
                     content, self.filename, self.mimetype, self.expires
                 ).id
                 self.debugLog.append(
-                    "created contentID: %r, aliasID: %r."
-                    % (contentID, aliasID)
+                    "%s contentID: %r, aliasID: %r."
+                    % (
+                        "reused" if existing else "created",
+                        contentID,
+                        aliasID,
+                    )
                 )
             else:
-                contentID = self.contentID
+                # The client creates the content and alias rows itself, so
+                # if it can cope with it, tell it about any identical
+                # content that we already have rather than storing the file
+                # again.
+                content = None
+                if self.deduplicate and self.reuseContent:
+                    content = self._findExistingContent(sha256)
+                existing = content is not None
+                if existing:
+                    contentID = content.id
+                    self.debugLog.append("reused contentID: %r" % (contentID,))
+                else:
+                    contentID = self.contentID
+                    self.debugLog.append(
+                        "received contentID: %r" % (contentID,)
+                    )
                 aliasID = None
-                self.debugLog.append("received contentID: %r" % (contentID,))
 
         except Exception:
             # Abort transaction and re-raise
             self.debugLog.append("failed to get contentID/aliasID, aborting")
             raise
 
+        if existing:
+            # We already have this content, so there's nothing to write.
+            os.remove(self.tmpfilepath)
+            self.debugLog.append("committed")
+            return contentID, aliasID
+
         # Move file to final location
         try:
             self._move(contentID)
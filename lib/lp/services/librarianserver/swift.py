@@ -4,7 +4,9 @@
 """Move files from Librarian disk storage into Swift."""
 
 __all__ = [
+    "FeedCheckpoint",
     "SWIFT_CONTAINER_PREFIX",
+    "SwiftThrottle",
     "connection",
     "connection_pools",
     "filesystem_path",
@@ -17,7 +19,10 @@
 import hashlib
 import os.path
 import re
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from urllib.parse import quote
 
@@ -32,6 +37,12 @@
 
 ONE_DAY = 24 * 60 * 60
 
+# The number of files looked up in the database at once.
+FEED_BATCH_SIZE = 100
+
+# The number of files per worker that may be waiting to be copied.
+FEED_QUEUE_FACTOR = 4
+
 
 def quiet_swiftclient(func, *args, **kwargs):
     # XXX cjwatson 2018-01-02: swiftclient has some very rude logging
@@ -58,6 +69,8 @@ def to_swift(
     instance_id=None,
     num_instances=None,
     remove_func=False,
+    num_workers=1,
+    resume_path=None,
 ):
     """Copy a range of Librarian files from disk into Swift.
 
@@ -70,8 +83,16 @@ def to_swift(
 
     If remove_func is set, it is called for every file after being copied into
     Swift.
+
+    Files are copied by num_workers threads, each with its own Swift
+    connection, while this thread walks the disk store and looks files up
+    in the database in batches.  All workers back off while Swift is
+    returning server errors.
+
+    If resume_path is set, the ID of the last file processed (below which
+    every file has been dealt with) is recorded there as we go, and a later
+    run with the same resume_path starts after it.
     """
-    swift_connection = connection_pools[-1].get()
     fs_root = os.path.abspath(config.librarian_server.root)
 
     if start_lfc_id is None:
@@ -80,6 +101,13 @@ def to_swift(
         # Maximum id capable of being stored on the filesystem - ffffffff
         end_lfc_id = 0xFFFFFFFF
 
+    checkpoint = FeedCheckpoint(resume_path) if resume_path else None
+    if checkpoint is not None:
+        last_lfc_id = checkpoint.load()
+        if last_lfc_id is not None and last_lfc_id >= start_lfc_id:
+            log.info(f"Resuming after {last_lfc_id}")
+            start_lfc_id = last_lfc_id + 1
+
     log.info(
         "Walking disk store {} from {} to {}, inclusive".format(
             fs_root, start_lfc_id, end_lfc_id
@@ -92,8 +120,107 @@ def to_swift(
             )
         )
 
+    throttle = SwiftThrottle()
+    # Files that have been handed to workers, in ID order, so that we
+    # only move the checkpoint past a file once it and every file before
+    # it have been dealt with.
+    pending = deque()
+    max_pending = num_workers * FEED_QUEUE_FACTOR
+    # Recent uploads are skipped, so the checkpoint must not move past
+    # the first of them or a later run would never copy it.
+    resume_limit = None
+    processed = 0
+
+    def finish(lfc, future):
+        nonlocal processed
+        if future is not None:
+            future.result()
+        processed += 1
+        if checkpoint is not None and (
+            resume_limit is None or lfc < resume_limit
+        ):
+            checkpoint.advance(lfc)
+
+    candidates = _walk_disk_store(
+        log, fs_root, start_lfc_id, end_lfc_id, instance_id, num_instances
+    )
+    executor = ThreadPoolExecutor(max_workers=num_workers)
+    try:
+        for batch in _batches(candidates, FEED_BATCH_SIZE):
+            # Skip files which have been modified recently, as they may
+            # be uploads still in progress.
+            recent_cutoff = time.time() - ONE_DAY
+            old_files = []
+            for lfc, fs_path in batch:
+                try:
+                    mtime = os.path.getmtime(fs_path)
+                except FileNotFoundError:
+                    # Removed by a parallel feeder.
+                    continue
+                if mtime > recent_cutoff:
+                    log.debug("Skipping recent upload %s" % fs_path)
+                    if resume_limit is None:
+                        resume_limit = lfc
+                    continue
+                old_files.append((lfc, fs_path))
+            md5s = dict(
+                IStandbyStore(LibraryFileContent).find(
+                    (LibraryFileContent.id, LibraryFileContent.md5),
+                    LibraryFileContent.id.is_in([lfc for lfc, _ in old_files]),
+                )
+            )
+            for lfc, fs_path in old_files:
+                log.debug(f"Found {lfc} ({os.path.basename(fs_path)})")
+                if lfc not in md5s:
+                    log.info(f"{lfc} exists on disk but not in the db")
+                    future = None
+                else:
+                    future = executor.submit(
+                        _feed_file,
+                        log,
+                        throttle,
+                        lfc,
+                        fs_path,
+                        md5s[lfc],
+                        remove_func,
+                    )
+                pending.append((lfc, future))
+                while len(pending) > max_pending:
+                    finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+    finally:
+        for _, future in pending:
+            if future is not None:
+                future.cancel()
+        executor.shutdown(wait=True)
+        if checkpoint is not None:
+            checkpoint.save()
+
+    log.info(f"Processed {processed} files")
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _walk_disk_store(
+    log, fs_root, start_lfc_id, end_lfc_id, instance_id, num_instances
+):
+    """Yield (LibraryFileContent.id, path) for files in the disk store.
+
+    Files are yielded in ID order.
+    """
     start_fs_path = filesystem_path(start_lfc_id)
     end_fs_path = filesystem_path(end_lfc_id)
+    _filename_re = re.compile("^[0-9a-f]{2}$")
 
     # Walk the Librarian on disk file store, searching for matching
     # files that may need to be copied into Swift. We need to follow
@@ -114,8 +241,6 @@ def to_swift(
 
         log.debug(f"Scanning {dirpath} for matching files")
 
-        _filename_re = re.compile("^[0-9a-f]{2}$")
-
         for filename in sorted(filenames):
             fs_path = os.path.join(dirpath, filename)
 
@@ -146,35 +271,135 @@ def to_swift(
                 if (lfc % num_instances) != instance_id:
                     continue
 
-            # Skip files which have been modified recently, as they
-            # may be uploads still in progress.
-            if os.path.getmtime(fs_path) > time.time() - ONE_DAY:
-                log.debug("Skipping recent upload %s" % fs_path)
-                continue
+            yield lfc, fs_path
+
 
-            log.debug(f"Found {lfc} ({filename})")
+def _feed_file(log, throttle, lfc_id, fs_path, db_md5_hash, remove_func):
+    """Copy a single file into Swift, retrying on server errors.
 
+    This is run in a worker thread.
+    """
+    connection_pool = connection_pools[-1]
+    attempt = 1
+    while True:
+        throttle.wait()
+        swift_connection = connection_pool.get()
+        try:
+            _to_swift_file(log, swift_connection, lfc_id, fs_path, db_md5_hash)
+        except FileNotFoundError:
+            # Removed by a parallel feeder.
+            log.debug(f"{fs_path} disappeared; skipping")
+            connection_pool.put(swift_connection)
+            return
+        except swiftclient.ClientException as x:
+            swift_connection.close()
             if (
-                IStandbyStore(LibraryFileContent).get(LibraryFileContent, lfc)
-                is None
+                x.http_status is None
+                or x.http_status < 500
+                or attempt >= throttle.max_attempts
             ):
-                log.info(f"{lfc} exists on disk but not in the db")
-                continue
+                raise
+            delay = throttle.backoff()
+            log.warning(
+                "Swift returned {} for {}; backing off for {:.1f} "
+                "seconds".format(x.http_status, lfc_id, delay)
+            )
+            attempt += 1
+            continue
+        except BaseException:
+            swift_connection.close()
+            raise
+        connection_pool.put(swift_connection)
+        throttle.succeeded()
+        break
 
-            _to_swift_file(log, swift_connection, lfc, fs_path)
+    if remove_func:
+        remove_func(fs_path)
 
-            if remove_func:
-                remove_func(fs_path)
 
-    connection_pools[-1].put(swift_connection)
+class SwiftThrottle:
+    """Slow down all feeder workers while Swift reports server errors.
 
+    Each server error doubles the delay before every request, and each
+    success halves it again, so the feeder settles at roughly the rate
+    Swift can sustain.
+    """
+
+    min_delay = 0.5
+    max_delay = 60.0
+
+    # The number of times to try copying a file before giving up.
+    max_attempts = 6
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.delay = 0.0
+
+    def wait(self):
+        with self._lock:
+            delay = self.delay
+        if delay:
+            time.sleep(delay)
+
+    def backoff(self):
+        """Record a server error, returning the new delay."""
+        with self._lock:
+            self.delay = min(
+                max(self.delay * 2, self.min_delay), self.max_delay
+            )
+            return self.delay
 
-def _to_swift_file(log, swift_connection, lfc_id, fs_path):
+    def succeeded(self):
+        """Record a successful request."""
+        with self._lock:
+            self.delay /= 2
+            if self.delay < self.min_delay:
+                self.delay = 0.0
+
+
+class FeedCheckpoint:
+    """The ID of the last file processed by a feeder, kept on disk."""
+
+    # How many files to process between saves.
+    save_interval = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.lfc_id = None
+        self._unsaved = 0
+
+    def load(self):
+        try:
+            with open(self.path) as checkpoint_file:
+                self.lfc_id = int(checkpoint_file.read().strip())
+        except FileNotFoundError:
+            self.lfc_id = None
+        return self.lfc_id
+
+    def advance(self, lfc_id):
+        self.lfc_id = lfc_id
+        self._unsaved += 1
+        if self._unsaved >= self.save_interval:
+            self.save()
+
+    def save(self):
+        if self.lfc_id is None or not self._unsaved:
+            return
+        temp_path = self.path + ".new"
+        with open(temp_path, "w") as checkpoint_file:
+            checkpoint_file.write("%d\n" % self.lfc_id)
+        os.rename(temp_path, self.path)
+        self._unsaved = 0
+
+
+def _to_swift_file(log, swift_connection, lfc_id, fs_path, db_md5_hash=None):
     """Copy a single file into Swift.
 
     This is separate for the benefit of tests; production code should use
     `to_swift` rather than calling this function directly, since this omits
     a number of checks.
+
+    If db_md5_hash is not given, it is looked up in the database.
     """
     container, obj_name = swift_location(lfc_id)
 
@@ -213,7 +438,15 @@ def _to_swift_file(log, swift_connection, lfc_id, fs_path):
                 lfc_id, container, obj_name
             )
         )
-        _put(log, swift_connection, lfc_id, container, obj_name, fs_path)
+        _put(
+            log,
+            swift_connection,
+            lfc_id,
+            container,
+            obj_name,
+            fs_path,
+            db_md5_hash=db_md5_hash,
+        )
 
 
 def rename(path):
@@ -223,13 +456,24 @@ def rename(path):
     os.rename(path, path + ".migrated")
 
 
-def _put(log, swift_connection, lfc_id, container, obj_name, fs_path):
+def _put(
+    log,
+    swift_connection,
+    lfc_id,
+    container,
+    obj_name,
+    fs_path,
+    db_md5_hash=None,
+):
     fs_size = os.path.getsize(fs_path)
     fs_file = HashStream(open(fs_path, "rb"))
 
-    db_md5_hash = (
-        IStandbyStore(LibraryFileContent).get(LibraryFileContent, lfc_id).md5
-    )
+    if db_md5_hash is None:
+        db_md5_hash = (
+            IStandbyStore(LibraryFileContent)
+            .get(LibraryFileContent, lfc_id)
+            .md5
+        )
 
     assert hasattr(fs_file, "tell") and hasattr(
         fs_file, "seek"
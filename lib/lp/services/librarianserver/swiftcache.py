@@ -0,0 +1,309 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""A local on-disk cache of popular files stored in Swift."""
+
+__all__ = [
+    "SwiftCache",
+]
+
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+from swiftclient import client as swiftclient
+from twisted.internet import defer
+from twisted.internet.threads import deferToThread
+from twisted.python import log
+from twisted.python.failure import Failure
+from zope.component import getUtility
+
+from lp.services.config import config
+from lp.services.librarianserver import swift
+from lp.services.librarianserver.storage import FileRange
+from lp.services.statsd.interfaces.statsd_client import IStatsdClient
+
+
+class SwiftCache:
+    """A size-bounded, least-recently-used cache of files from Swift.
+
+    Files are only admitted to the cache once they have been requested
+    `admit_after` times recently, so that files requested once (which is
+    most of them) don't push out the popular ones.  Admitted files are
+    fetched into the cache in the background while requests for them
+    carry on being served from Swift, and concurrent requests for a file
+    that is being fetched share the same fetch.
+
+    All methods other than `_fetch` must be called in the reactor thread.
+    """
+
+    # How many files' recent request counts to remember for admission
+    # control.
+    max_candidates = 100000
+
+    # How often to log hit ratios.
+    log_interval = 1000
+
+    # The size of the chunks in which to read files from Swift.
+    fetch_chunk_size = 256 * 1024
+
+    # How old a partly-fetched file must be, in seconds, before it is
+    # assumed to have been left behind by a previous run.
+    stale_fetch_age = 60 * 60
+
+    def __init__(self, directory, max_size, max_file_size, admit_after=2):
+        """Create a cache.
+
+        :param directory: The directory in which to store cached files.
+            Any files already there are kept.
+        :param max_size: The maximum total size of cached files, in bytes.
+        :param max_file_size: The maximum size of a single cached file, in
+            bytes.
+        :param admit_after: The number of recent requests for a file after
+            which it is admitted to the cache.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.max_file_size = min(max_file_size, max_size)
+        self.admit_after = admit_after
+        # Map of content IDs to sizes, least recently used first.
+        self._entries = OrderedDict()
+        self.size = 0
+        # Map of content IDs to recent request counts, or to None for
+        # files too large to cache.
+        self._candidates = OrderedDict()
+        # Map of content IDs to lists of Deferreds waiting for them to be
+        # fetched.
+        self._fetching = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @classmethod
+    def fromConfig(cls):
+        """Create a cache as configured, or return None if disabled."""
+        directory = config.librarian_server.swift_cache_directory
+        if not directory:
+            return None
+        return cls(
+            directory,
+            config.librarian_server.swift_cache_size,
+            config.librarian_server.swift_cache_max_file_size,
+            admit_after=config.librarian_server.swift_cache_admit_after,
+        )
+
+    def _path(self, fileid):
+        return os.path.join(self.directory, "%08x" % fileid)
+
+    def _load(self):
+        """Index the files left in the cache by a previous run."""
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        stale_fetch_time = time.time() - self.stale_fetch_age
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if entry.name.startswith("fetch-"):
+                    # A partly-fetched file.  Leave it alone unless it has
+                    # been abandoned, in case it is still being written.
+                    if stat.st_mtime < stale_fetch_time:
+                        try:
+                            os.unlink(entry.path)
+                        except FileNotFoundError:
+                            pass
+                    continue
+                try:
+                    fileid = int(entry.name, 16)
+                except ValueError:
+                    continue
+                entries.append((stat.st_mtime, fileid, stat.st_size))
+        for _, fileid, size in sorted(entries):
+            self._entries[fileid] = size
+            self.size += size
+        self._evict()
+
+    def _evict(self):
+        """Remove least recently used files until the cache fits."""
+        while self.size > self.max_size:
+            fileid, size = self._entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.unlink(self._path(fileid))
+            except FileNotFoundError:
+                pass
+
+    def _record(self, hit, size=0):
+        """Record a request, and the number of bytes served from the cache."""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        statsd_client = getUtility(IStatsdClient)
+        statsd_client.incr(
+            "librarian.swift_cache.requests",
+            labels={"result": "hit" if hit else "miss"},
+        )
+        if size:
+            statsd_client.incr("librarian.swift_cache.bytes_served", size)
+        requests = self.hits + self.misses
+        if requests % self.log_interval == 0:
+            log.msg(
+                "Swift cache: %d hits, %d misses (%.1f%% hit ratio), "
+                "%d files, %d bytes"
+                % (
+                    self.hits,
+                    self.misses,
+                    100.0 * self.hits / requests,
+                    len(self._entries),
+                    self.size,
+                )
+            )
+
+    def _admit(self, fileid):
+        """Should we fetch a file into the cache now?"""
+        if fileid in self._fetching:
+            return True
+        count = self._candidates.pop(fileid, 0)
+        if count is None:
+            # Too large to cache.
+            self._candidates[fileid] = None
+            return False
+        count += 1
+        self._candidates[fileid] = count
+        while len(self._candidates) > self.max_candidates:
+            self._candidates.popitem(last=False)
+        return count >= self.admit_after
+
+    def _openCached(self, fileid, byte_range):
+        path = self._path(fileid)
+        try:
+            if byte_range is not None:
+                stream = FileRange(path, *byte_range)
+            else:
+                stream = open(path, "rb")
+        except FileNotFoundError:
+            # Someone removed it behind our back; forget about it.
+            self.size -= self._entries.pop(fileid)
+            return None
+        self._entries.move_to_end(fileid)
+        os.utime(path)
+        if byte_range is not None:
+            self._record(True, byte_range[1] - byte_range[0] + 1)
+        else:
+            self._record(True, self._entries[fileid])
+        return stream
+
+    def open(self, fileid, byte_range=None):
+        """Open a file from the cache.
+
+        If the file is not in the cache but is popular, start fetching it
+        into the cache in the background; this request does not wait for
+        that.
+
+        :param fileid: The ID of the `LibraryFileContent` to open.
+        :param byte_range: If not None, a (first, last) tuple of inclusive
+            byte offsets to read.
+        :return: A stream, or None if the file is not in the cache and
+            should be read from Swift as usual.
+        """
+        if fileid in self._entries:
+            stream = self._openCached(fileid, byte_range)
+            if stream is not None:
+                return stream
+        if self._admit(fileid):
+            self._fetchOnce(fileid)
+        self._record(False)
+        return None
+
+    def _fetchOnce(self, fileid):
+        """Fetch a file into the cache, sharing any fetch in progress.
+
+        :return: A Deferred that fires with True if the file is now in the
+            cache, otherwise False.
+        """
+        if fileid in self._entries:
+            return defer.succeed(True)
+        waiters = self._fetching.get(fileid)
+        if waiters is None:
+            waiters = self._fetching[fileid] = []
+            deferred = deferToThread(self._fetch, fileid)
+            deferred.addBoth(self._fetched, fileid)
+        waiter = defer.Deferred()
+        waiters.append(waiter)
+        return waiter
+
+    def _fetched(self, result, fileid):
+        """Record the result of a fetch and wake up anyone waiting for it."""
+        waiters = self._fetching.pop(fileid)
+        cached = False
+        if isinstance(result, Failure):
+            log.err(result, "Failed to fetch %d into Swift cache" % fileid)
+        elif result is not None:
+            size, cached = result
+            if cached:
+                self._entries[fileid] = size
+                self.size += size
+                self._evict()
+                getUtility(IStatsdClient).incr("librarian.swift_cache.fetches")
+            else:
+                self._candidates[fileid] = None
+        else:
+            # It isn't in Swift yet, so start counting again.
+            self._candidates.pop(fileid, None)
+        for waiter in waiters:
+            waiter.callback(cached)
+
+    def _fetch(self, fileid):
+        """Copy a file from Swift into the cache.
+
+        This is run in a separate thread.
+
+        :return: None if the file is not in Swift, otherwise a (size,
+            cached) tuple, where `cached` is False if the file is too large
+            to cache.
+        :raises ValueError: if Swift sent fewer or more bytes than it said
+            it would.
+        """
+        container, name = swift.swift_location(fileid)
+        for connection_pool in reversed(swift.connection_pools):
+            swift_connection = connection_pool.get()
+            try:
+                headers, chunks = swift.quiet_swiftclient(
+                    swift_connection.get_object,
+                    container,
+                    name,
+                    resp_chunk_size=self.fetch_chunk_size,
+                )
+            except swiftclient.ClientException as x:
+                if x.http_status != 404:
+                    raise
+                connection_pool.put(swift_connection)
+                continue
+            size = int(headers["content-length"])
+            if size > self.max_file_size:
+                swift_connection.close()
+                return size, False
+            fd, temp_path = tempfile.mkstemp(
+                dir=self.directory, prefix="fetch-"
+            )
+            try:
+                fetched = 0
+                with os.fdopen(fd, "wb") as temp_file:
+                    for chunk in chunks:
+                        temp_file.write(chunk)
+                        fetched += len(chunk)
+                if fetched != size:
+                    raise ValueError(
+                        "Fetched %d bytes of %d from Swift" % (fetched, size)
+                    )
+                os.rename(temp_path, self._path(fileid))
+            except BaseException:
+                swift_connection.close()
+                os.unlink(temp_path)
+                raise
+            connection_pool.put(swift_connection)
+            return size, True
+        return None
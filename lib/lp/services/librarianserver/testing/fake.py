@@ -92,6 +92,13 @@ def addFile(self, name, size, file, contentType, expires=None):
             name, size, file, contentType, expires=expires
         ).id
 
+    def addFiles(self, files, expires=None, allow_zero_length=False):
+        """See `IFileUploadClient`."""
+        return [
+            self.addFile(name, size, file, contentType, expires=expires)
+            for name, size, file, contentType in files
+        ]
+
     def _storeFile(self, name, size, file, contentType, expires=None):
         """Like `addFile`, but returns the `LibraryFileAlias`."""
         content = file.read()
@@ -373,6 +373,42 @@ def test_DeleteUnreferencedContent(self):
         results = list(cur.fetchall())
         self.assertEqual(len(results), 0, "Too many results %r" % (results,))
 
+    def test_DeleteUnreferencedContent_rereferenced(self):
+        # If the librarian links a new alias to content after the garbage
+        # collector decided that it was unreferenced, the content is kept.
+        librariangc.merge_duplicates(self.con)
+        cur = self.con.cursor()
+        cur.execute(
+            """
+            SELECT LibraryFileContent.id
+            FROM LibraryFileContent
+            LEFT OUTER JOIN LibraryFileAlias
+                ON LibraryFileContent.id = LibraryFileAlias.content
+            WHERE LibraryFileAlias.id IS NULL
+            """
+        )
+        unreferenced_ids = [row[0] for row in cur.fetchall()]
+        self.assertNotEqual([], unreferenced_ids)
+        pruner = librariangc.UnreferencedContentPruner(self.con)
+        rereferenced_id = unreferenced_ids[0]
+        cur.execute(
+            "UPDATE LibraryFileAlias SET content = %s WHERE id = %s",
+            (rereferenced_id, self.f1_id),
+        )
+        self.con.commit()
+
+        while not pruner.isDone():
+            pruner(100)
+
+        self.assertTrue(self.file_exists(rereferenced_id))
+        cur = self.con.cursor()
+        cur.execute(
+            "SELECT id FROM LibraryFileContent WHERE id = %s",
+            (rereferenced_id,),
+        )
+        self.assertEqual([(rereferenced_id,)], cur.fetchall())
+        self.assertEqual(len(unreferenced_ids) - 1, pruner.total_deleted)
+
     def test_DeleteUnreferencedContent2(self):
         # Like testDeleteUnreferencedContent, except that the file is
         # removed from disk before attempting to remove the unreferenced
@@ -517,6 +553,83 @@ def test_deleteUnwantedFiles(self):
         for content_id in (row[0] for row in cur.fetchall()):
             self.assertTrue(self.file_exists(content_id))
 
+    def _deleteOrphanedContent(self):
+        """Delete an unreferenced content row, leaving its file behind."""
+        self.ztm.begin()
+        cur = cursor()
+        cur.execute(
+            """
+            SELECT LibraryFileContent.id
+            FROM LibraryFileContent
+            LEFT OUTER JOIN LibraryFileAlias
+                ON LibraryFileContent.id = content
+            WHERE LibraryFileAlias.id IS NULL
+            LIMIT 1
+            """
+        )
+        content_id = cur.fetchone()[0]
+        cur.execute(
+            "DELETE FROM LibraryFileContent WHERE id=%s", (content_id,)
+        )
+        self.ztm.commit()
+        self.assertTrue(self.file_exists(content_id))
+        return content_id
+
+    def connectGC(self):
+        return connect(
+            user=config.librarian_gc.dbuser,
+            isolation=ISOLATION_LEVEL_AUTOCOMMIT,
+        )
+
+    def test_delete_unwanted_files_in_shards(self):
+        content_id = self._deleteOrphanedContent()
+        checkpoint_path = os.path.join(
+            self.makeTemporaryDirectory(), "checkpoint"
+        )
+
+        with self.librariangc_thinking_it_is_tomorrow():
+            librariangc.delete_unwanted_files_in_shards(
+                self.con,
+                self.connectGC,
+                num_shards=3,
+                num_workers=2,
+                checkpoint_path=checkpoint_path,
+            )
+
+        self.assertFalse(self.file_exists(content_id))
+        # A completed run leaves no checkpoint behind.
+        self.assertFalse(os.path.exists(checkpoint_path))
+
+        # Nothing else has been removed.
+        self.ztm.begin()
+        cur = cursor()
+        cur.execute("SELECT id FROM LibraryFileContent")
+        for content_id in (row[0] for row in cur.fetchall()):
+            self.assertTrue(self.file_exists(content_id))
+
+    def test_delete_unwanted_files_in_shards_resumes(self):
+        # A run resumed from a checkpoint skips the shards that were
+        # already done.
+        content_id = self._deleteOrphanedContent()
+        checkpoint_path = os.path.join(
+            self.makeTemporaryDirectory(), "checkpoint"
+        )
+        checkpoint = librariangc.GCCheckpoint(checkpoint_path)
+        checkpoint.start([[0, content_id], [content_id + 1, None]])
+        checkpoint.markDone(0)
+
+        with self.librariangc_thinking_it_is_tomorrow():
+            librariangc.delete_unwanted_files_in_shards(
+                self.con,
+                self.connectGC,
+                num_shards=1,
+                num_workers=1,
+                checkpoint_path=checkpoint_path,
+            )
+
+        self.assertTrue(self.file_exists(content_id))
+        self.assertFalse(os.path.exists(checkpoint_path))
+
     def test_delete_unwanted_files_bug437084(self):
         # There was a bug where delete_unwanted_files() would die
         # if the last file found on disk was unwanted.
@@ -1196,6 +1309,22 @@ def test_delete_unwanted_files_handles_multiple_instances(self):
             )
 
 
+class TestPlanShards(TestCase):
+    def test_no_content(self):
+        self.assertEqual([[0, None]], librariangc.plan_shards(None, 4))
+
+    def test_splits_evenly(self):
+        self.assertEqual(
+            [[0, 24], [25, 49], [50, 74], [75, None]],
+            librariangc.plan_shards(99, 4),
+        )
+
+    def test_more_shards_than_content(self):
+        self.assertEqual(
+            [[0, 0], [1, 1], [2, None]], librariangc.plan_shards(2, 10)
+        )
+
+
 class TestBlobCollection(TestCase):
     layer = LaunchpadZopelessLayer
 
@@ -3,6 +3,7 @@
 
 import hashlib
 import os.path
+from datetime import datetime, timedelta, timezone
 
 import transaction
 from fixtures import TempDir
@@ -16,6 +17,7 @@
 from lp.services.librarian.model import LibraryFileContent
 from lp.services.librarianserver import db, swift
 from lp.services.librarianserver.storage import (
+    DEDUPLICATE_UPLOADS_FEATURE_FLAG,
     DigestMismatchError,
     DuplicateFileIDError,
     LibrarianStorage,
@@ -64,6 +66,96 @@ def test_addFiles_identical(self):
         # to the garbage collector
         self.assertNotEqual(id1, id2)
 
+    def test_addFiles_identical_deduplicated(self):
+        # If upload deduplication is enabled, identical files share their
+        # content, which is only stored once.
+        self.useFixture(
+            FeatureFixture({DEDUPLICATE_UPLOADS_FEATURE_FLAG: "on"})
+        )
+        data = b"data " * 5000
+        newfile1 = self.storage.startAddFile("file1", len(data))
+        newfile1.append(data)
+        id1, alias1 = newfile1.store()
+        newfile2 = self.storage.startAddFile("file2", len(data))
+        newfile2.append(data)
+        id2, alias2 = newfile2.store()
+        self.assertEqual(id1, id2)
+        self.assertNotEqual(alias1, alias2)
+        self.assertEqual(
+            "file2", self.storage.getFileAlias(alias2, None, "/").filename
+        )
+        self.assertEqual([], os.listdir(self.storage.incoming))
+        self.assertIn("reused contentID: %r" % id1, newfile2.debugLog[-2])
+
+    def test_addFiles_deduplicated_ignores_expired_content(self):
+        # Content whose aliases have all expired may be about to be
+        # garbage-collected, so it isn't reused.
+        self.useFixture(
+            FeatureFixture({DEDUPLICATE_UPLOADS_FEATURE_FLAG: "on"})
+        )
+        data = b"data " * 50
+        newfile1 = self.storage.startAddFile("file1", len(data))
+        newfile1.expires = datetime.now(timezone.utc) - timedelta(days=1)
+        newfile1.append(data)
+        id1, _ = newfile1.store()
+        newfile2 = self.storage.startAddFile("file2", len(data))
+        newfile2.append(data)
+        id2, _ = newfile2.store()
+        self.assertNotEqual(id1, id2)
+
+    def test_addFiles_deduplicated_ignores_missing_content(self):
+        # Content that isn't actually stored anywhere isn't reused.
+        self.useFixture(
+            FeatureFixture({DEDUPLICATE_UPLOADS_FEATURE_FLAG: "on"})
+        )
+        data = b"data " * 50
+        newfile1 = self.storage.startAddFile("file1", len(data))
+        newfile1.append(data)
+        id1, _ = newfile1.store()
+        os.unlink(self.storage._fileLocation(id1))
+        newfile2 = self.storage.startAddFile("file2", len(data))
+        newfile2.append(data)
+        id2, _ = newfile2.store()
+        self.assertNotEqual(id1, id2)
+        self.assertTrue(self.storage.hasFile(id2))
+
+    def test_clientProvidedIDs_deduplicated(self):
+        # If upload deduplication is enabled and the client can reuse
+        # content, a file with a client-provided content ID that is
+        # identical to existing content isn't stored again, and the ID of
+        # the existing content is returned instead.
+        self.useFixture(
+            FeatureFixture({DEDUPLICATE_UPLOADS_FEATURE_FLAG: "on"})
+        )
+        data = b"data " * 50
+        newfile1 = self.storage.startAddFile("file1", len(data))
+        newfile1.append(data)
+        id1, _ = newfile1.store()
+        newfile2 = self.storage.startAddFile("file2", len(data))
+        newfile2.contentID = 6661
+        newfile2.aliasID = 6662
+        newfile2.reuseContent = True
+        newfile2.append(data)
+        self.assertEqual((id1, None), newfile2.store())
+        self.assertFalse(self.storage.hasFile(6661))
+        self.assertEqual([], os.listdir(self.storage.incoming))
+
+    def test_clientProvidedIDs_not_deduplicated_without_reuse(self):
+        # Files from clients that can't reuse content are stored as usual.
+        self.useFixture(
+            FeatureFixture({DEDUPLICATE_UPLOADS_FEATURE_FLAG: "on"})
+        )
+        data = b"data " * 50
+        newfile1 = self.storage.startAddFile("file1", len(data))
+        newfile1.append(data)
+        newfile1.store()
+        newfile2 = self.storage.startAddFile("file2", len(data))
+        newfile2.contentID = 6661
+        newfile2.aliasID = 6662
+        newfile2.append(data)
+        self.assertEqual((6661, None), newfile2.store())
+        self.assertTrue(self.storage.hasFile(6661))
+
     def test_badDigest(self):
         data = b"data " * 50
         digest = "crud"
@@ -245,6 +337,52 @@ def test_fetch_with_close_at_end_does_not_reuse_connection(self):
         # SwiftStream.close doesn't know that.
         self.assertEqual(0, len(swift.connection_pools[-1]._pool))
 
+    @defer.inlineCallbacks
+    def test_byte_range(self):
+        # A byte range can be fetched from Swift without fetching the rest
+        # of the file, and the connection is reused afterwards.
+        data = b"".join(bytes([i]) * self.storage.CHUNK_SIZE for i in range(4))
+        newfile = self.storage.startAddFile("file", len(data))
+        newfile.mimetype = "text/plain"
+        newfile.append(data)
+        lfc_id, _ = newfile.store()
+        self.moveToSwift(lfc_id)
+        first = self.storage.CHUNK_SIZE - 1
+        last = self.storage.CHUNK_SIZE * 2
+        stream = yield self.storage.open(lfc_id, byte_range=(first, last))
+        self.assertIsNotNone(stream)
+        chunks = []
+        while True:
+            chunk = yield stream.read(self.storage.CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.assertEqual(data[first : last + 1], b"".join(chunks))
+        self.assertEqual(1, len(swift.connection_pools[-1]._pool))
+
+    def test_deduplicate_content_in_swift(self):
+        # Uploads can be deduplicated against content that has been moved
+        # to Swift.
+        self.useFixture(
+            FeatureFixture(
+                {
+                    "librarian.swift.enabled": True,
+                    DEDUPLICATE_UPLOADS_FEATURE_FLAG: True,
+                }
+            )
+        )
+        data = b"x" * 100
+        newfile1 = self.storage.startAddFile("file1", len(data))
+        newfile1.append(data)
+        id1, _ = newfile1.store()
+        transaction.commit()
+        self.moveToSwift(id1)
+        newfile2 = self.storage.startAddFile("file2", len(data))
+        newfile2.append(data)
+        id2, _ = newfile2.store()
+        self.assertEqual(id1, id2)
+        self.assertFalse(self.storage.hasFile(id2))
+
     @defer.inlineCallbacks
     def test_multiple_swift_instances(self):
         # If multiple Swift instances are configured, LibrarianStorage tries
@@ -7,6 +7,7 @@
 import io
 import os.path
 import time
+from collections import Counter
 from unittest.mock import patch
 
 import transaction
@@ -434,6 +435,95 @@ def remove_this_and_others(path):
         finally:
             swift_client.close()
 
+    def test_multiple_workers(self):
+        log = BufferLogger()
+        swift.to_swift(log, remove_func=os.unlink, num_workers=3)
+
+        swift_client = self.swift_fixture.connect()
+        try:
+            for lfc, contents in zip(self.lfcs, self.contents):
+                self.assertFalse(os.path.exists(swift.filesystem_path(lfc.id)))
+                container, name = swift.swift_location(lfc.id)
+                headers, obj = swift_client.get_object(container, name)
+                self.assertEqual(contents, obj, "Did not round trip")
+        finally:
+            swift_client.close()
+
+    def test_resume(self):
+        # A feeder given a resume file starts after the last file it
+        # records, and records where it got to.
+        log = BufferLogger()
+        resume_path = os.path.join(self.makeTemporaryDirectory(), "resume")
+        with open(resume_path, "w") as resume_file:
+            resume_file.write("%d\n" % self.lfcs[1].id)
+
+        swift.to_swift(log, remove_func=os.unlink, resume_path=resume_path)
+
+        for lfc in self.lfcs[:2]:
+            self.assertTrue(os.path.exists(swift.filesystem_path(lfc.id)))
+        for lfc in self.lfcs[2:]:
+            self.assertFalse(os.path.exists(swift.filesystem_path(lfc.id)))
+        self.assertGreaterEqual(
+            swift.FeedCheckpoint(resume_path).load(), self.lfcs[-1].id
+        )
+
+    def test_resume_stops_before_recent_upload(self):
+        # Recent uploads are skipped, so the resume file must not record
+        # that they have been processed.
+        log = BufferLogger()
+        resume_path = os.path.join(self.makeTemporaryDirectory(), "resume")
+        os.utime(swift.filesystem_path(self.lfcs[2].id))
+
+        swift.to_swift(log, remove_func=os.unlink, resume_path=resume_path)
+
+        self.assertTrue(os.path.exists(swift.filesystem_path(self.lfcs[2].id)))
+        self.assertFalse(
+            os.path.exists(swift.filesystem_path(self.lfcs[3].id))
+        )
+        self.assertEqual(
+            self.lfcs[1].id, swift.FeedCheckpoint(resume_path).load()
+        )
+
+    def test_backs_off_on_server_errors(self):
+        # Server errors from Swift make the feeder back off and retry.
+        log = BufferLogger()
+        real_to_swift_file = swift._to_swift_file
+        failures = []
+
+        def to_swift_file(log, swift_connection, lfc_id, *args):
+            if lfc_id == self.lfcs[0].id and not failures:
+                failures.append(lfc_id)
+                raise swiftclient.ClientException("Oops", http_status=503)
+            return real_to_swift_file(log, swift_connection, lfc_id, *args)
+
+        with patch.object(
+            swift, "_to_swift_file", side_effect=to_swift_file
+        ), patch.object(swift.time, "sleep") as sleep:
+            swift.to_swift(log, remove_func=os.unlink, num_workers=2)
+
+        self.assertEqual([self.lfcs[0].id], failures)
+        self.assertIn(
+            "Swift returned 503 for %d" % self.lfcs[0].id, log.getLogBuffer()
+        )
+        sleep.assert_called_with(swift.SwiftThrottle.min_delay)
+        for lfc in self.lfcs:
+            self.assertFalse(os.path.exists(swift.filesystem_path(lfc.id)))
+
+    def test_gives_up_after_repeated_server_errors(self):
+        log = BufferLogger()
+        with patch.object(
+            swift,
+            "_to_swift_file",
+            side_effect=swiftclient.ClientException("Oops", http_status=503),
+        ) as to_swift_file, patch.object(swift.time, "sleep"):
+            self.assertRaises(swiftclient.ClientException, swift.to_swift, log)
+        # Other files may have been started before the feeder gave up, but
+        # each is only tried a limited number of times.
+        attempts = Counter(call[0][2] for call in to_swift_file.call_args_list)
+        self.assertEqual(
+            swift.SwiftThrottle.max_attempts, max(attempts.values())
+        )
+
     def test_swift_timeout(self):
         # The librarian's Swift connections honour the configured timeout.
         self.pushConfig(
@@ -448,6 +538,26 @@ def test_swift_timeout(self):
         )
 
 
+class TestSwiftThrottle(TestCase):
+    layer = BaseLayer
+
+    def test_backoff_and_recover(self):
+        throttle = swift.SwiftThrottle()
+        self.assertEqual(0.0, throttle.delay)
+        self.assertEqual(0.5, throttle.backoff())
+        self.assertEqual(1.0, throttle.backoff())
+        throttle.succeeded()
+        self.assertEqual(0.5, throttle.delay)
+        throttle.succeeded()
+        self.assertEqual(0.0, throttle.delay)
+
+    def test_max_delay(self):
+        throttle = swift.SwiftThrottle()
+        for _ in range(20):
+            throttle.backoff()
+        self.assertEqual(throttle.max_delay, throttle.delay)
+
+
 class TestHashStream(TestCase):
     layer = BaseLayer
 
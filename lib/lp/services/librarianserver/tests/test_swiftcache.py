@@ -0,0 +1,263 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the librarian's cache of popular files from Swift."""
+
+import os
+import time
+from unittest import mock
+
+import transaction
+from fixtures import TempDir
+from testtools.twistedsupport import (
+    AsynchronousDeferredRunTest,
+    flush_logged_errors,
+)
+from twisted.internet import defer
+
+from lp.services.features.testing import FeatureFixture
+from lp.services.librarianserver import db, swift
+from lp.services.librarianserver.storage import LibrarianStorage
+from lp.services.librarianserver.swiftcache import SwiftCache
+from lp.services.log.logger import DevNullLogger
+from lp.services.statsd.tests import StatsMixin
+from lp.testing import TestCase
+from lp.testing.dbuser import switch_dbuser
+from lp.testing.layers import LaunchpadZopelessLayer
+from lp.testing.swift.fixture import SwiftFixture
+
+
+class TestSwiftCache(StatsMixin, TestCase):
+    layer = LaunchpadZopelessLayer
+    run_tests_with = AsynchronousDeferredRunTest.make_factory(timeout=30)
+
+    def setUp(self):
+        super().setUp()
+        switch_dbuser("librarian")
+        self.swift_fixture = self.useFixture(SwiftFixture())
+        self.useFixture(FeatureFixture({"librarian.swift.enabled": True}))
+        self.directory = self.useFixture(TempDir()).path
+        self.pushConfig("librarian_server", root=self.directory)
+        self.cache_directory = self.useFixture(TempDir()).path
+        self.setUpStats()
+        transaction.commit()
+
+    def makeCache(self, max_size=1000, max_file_size=1000, admit_after=2):
+        return SwiftCache(
+            self.cache_directory,
+            max_size,
+            max_file_size,
+            admit_after=admit_after,
+        )
+
+    def makeStorage(self, cache):
+        return LibrarianStorage(
+            self.directory, db.Library(), swift_cache=cache
+        )
+
+    def addSwiftFile(self, storage, data):
+        newfile = storage.startAddFile("file", len(data))
+        newfile.mimetype = "text/plain"
+        newfile.append(data)
+        lfc_id, _ = newfile.store()
+        path = swift.filesystem_path(lfc_id)
+        swift_connection = self.swift_fixture.connect()
+        try:
+            swift._to_swift_file(
+                DevNullLogger(), swift_connection, lfc_id, path
+            )
+        finally:
+            swift_connection.close()
+        os.unlink(path)
+        return lfc_id
+
+    @defer.inlineCallbacks
+    def readAll(self, stream):
+        chunks = []
+        while True:
+            chunk = yield stream.read(1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        stream.close()
+        return b"".join(chunks)
+
+    @defer.inlineCallbacks
+    def openFetched(self, cache, lfc_id, byte_range=None):
+        """Open a file from the cache, waiting for it to be fetched."""
+        stream = cache.open(lfc_id, byte_range=byte_range)
+        if stream is None:
+            yield cache._fetchOnce(lfc_id)
+            stream = cache.open(lfc_id, byte_range=byte_range)
+        return stream
+
+    @defer.inlineCallbacks
+    def test_admits_popular_files(self):
+        # A file is only fetched into the cache once it has been requested
+        # enough times, and the request that admits it doesn't wait for
+        # the fetch.
+        cache = self.makeCache()
+        storage = self.makeStorage(cache)
+        lfc_id = self.addSwiftFile(storage, b"x" * 100)
+        self.assertIsNone(cache.open(lfc_id))
+        self.assertNotIn(lfc_id, cache._fetching)
+        self.assertIsNone(cache.open(lfc_id))
+        self.assertIn(lfc_id, cache._fetching)
+        cached = yield cache._fetchOnce(lfc_id)
+        self.assertTrue(cached)
+        stream = cache.open(lfc_id)
+        self.assertIsNotNone(stream)
+        data = yield self.readAll(stream)
+        self.assertEqual(b"x" * 100, data)
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+        self.assertEqual(100, cache.size)
+        self.assertEqual(["%08x" % lfc_id], os.listdir(self.cache_directory))
+        calls = self.stats_client.incr.call_args_list
+        self.assertEqual(
+            1, calls.count(mock.call("librarian.swift_cache.fetches,env=test"))
+        )
+        self.assertEqual(
+            1,
+            calls.count(
+                mock.call("librarian.swift_cache.bytes_served,env=test", 100)
+            ),
+        )
+        self.assertEqual(
+            1,
+            calls.count(
+                mock.call("librarian.swift_cache.requests,env=test,result=hit")
+            ),
+        )
+
+    @defer.inlineCallbacks
+    def test_byte_range(self):
+        cache = self.makeCache(admit_after=1)
+        storage = self.makeStorage(cache)
+        lfc_id = self.addSwiftFile(storage, bytes(range(100)))
+        stream = yield self.openFetched(cache, lfc_id, byte_range=(10, 19))
+        data = yield self.readAll(stream)
+        self.assertEqual(bytes(range(10, 20)), data)
+
+    @defer.inlineCallbacks
+    def test_coalesces_concurrent_misses(self):
+        # Concurrent requests for a file share a single fetch from Swift.
+        cache = self.makeCache(admit_after=1)
+        storage = self.makeStorage(cache)
+        lfc_id = self.addSwiftFile(storage, b"x" * 100)
+        fetches = []
+        real_fetch = cache._fetch
+
+        def fetch(fileid):
+            fetches.append(fileid)
+            return real_fetch(fileid)
+
+        cache._fetch = fetch
+        for _ in range(3):
+            self.assertIsNone(cache.open(lfc_id))
+        yield cache._fetchOnce(lfc_id)
+        self.assertEqual([lfc_id], fetches)
+        data = yield self.readAll(cache.open(lfc_id))
+        self.assertEqual(b"x" * 100, data)
+
+    @defer.inlineCallbacks
+    def test_evicts_least_recently_used(self):
+        cache = self.makeCache(max_size=250, admit_after=1)
+        storage = self.makeStorage(cache)
+        lfc_ids = [
+            self.addSwiftFile(storage, data)
+            for data in (b"a" * 100, b"b" * 100, b"c" * 100)
+        ]
+        for lfc_id in lfc_ids[:2]:
+            stream = yield self.openFetched(cache, lfc_id)
+            stream.close()
+        # Use the first file again, so that the second is evicted.
+        cache.open(lfc_ids[0]).close()
+        stream = yield self.openFetched(cache, lfc_ids[2])
+        stream.close()
+        self.assertEqual(200, cache.size)
+        self.assertContentEqual(
+            ["%08x" % lfc_ids[0], "%08x" % lfc_ids[2]],
+            os.listdir(self.cache_directory),
+        )
+
+    @defer.inlineCallbacks
+    def test_does_not_cache_large_files(self):
+        cache = self.makeCache(max_file_size=50, admit_after=1)
+        storage = self.makeStorage(cache)
+        lfc_id = self.addSwiftFile(storage, b"x" * 100)
+        stream = yield self.openFetched(cache, lfc_id)
+        self.assertIsNone(stream)
+        self.assertEqual([], os.listdir(self.cache_directory))
+        # It is not fetched again.
+        self.assertIsNone(cache.open(lfc_id))
+        self.assertNotIn(lfc_id, cache._fetching)
+        # The storage falls back to reading from Swift.
+        stream = yield storage.open(lfc_id)
+        data = yield self.readAll(stream)
+        self.assertEqual(b"x" * 100, data)
+
+    @defer.inlineCallbacks
+    def test_discards_incomplete_fetches(self):
+        # A file is only cached if Swift sends as many bytes as it said it
+        # would.
+        cache = self.makeCache(admit_after=1)
+        storage = self.makeStorage(cache)
+        lfc_id = self.addSwiftFile(storage, b"x" * 100)
+        real_quiet_swiftclient = swift.quiet_swiftclient
+
+        def quiet_swiftclient(*args, **kwargs):
+            headers, chunks = real_quiet_swiftclient(*args, **kwargs)
+            return dict(headers, **{"content-length": "200"}), chunks
+
+        self.patch(swift, "quiet_swiftclient", quiet_swiftclient)
+        self.assertIsNone(cache.open(lfc_id))
+        cached = yield cache._fetchOnce(lfc_id)
+        self.assertFalse(cached)
+        self.assertEqual(1, len(flush_logged_errors(ValueError)))
+        self.assertEqual(0, cache.size)
+        self.assertEqual([], os.listdir(self.cache_directory))
+
+    @defer.inlineCallbacks
+    def test_reloads_existing_files(self):
+        cache = self.makeCache(admit_after=1)
+        storage = self.makeStorage(cache)
+        lfc_id = self.addSwiftFile(storage, b"x" * 100)
+        stream = yield self.openFetched(cache, lfc_id)
+        stream.close()
+        cache = self.makeCache()
+        self.assertEqual(100, cache.size)
+        data = yield self.readAll(cache.open(lfc_id))
+        self.assertEqual(b"x" * 100, data)
+        self.assertEqual(1, cache.hits)
+
+    def test_load_removes_stale_fetches(self):
+        # Only partly-fetched files that have been abandoned are removed
+        # when loading the cache.
+        stale_time = time.time() - SwiftCache.stale_fetch_age - 60
+        for name in ("fetch-stale", "fetch-active", "other"):
+            path = os.path.join(self.cache_directory, name)
+            with open(path, "wb") as f:
+                f.write(b"x")
+            if name == "fetch-stale":
+                os.utime(path, (stale_time, stale_time))
+        cache = self.makeCache()
+        self.assertEqual(0, cache.size)
+        self.assertContentEqual(
+            ["fetch-active", "other"], os.listdir(self.cache_directory)
+        )
+
+    @defer.inlineCallbacks
+    def test_storage_uses_cache(self):
+        # The storage serves the first request from Swift while the cache
+        # is filled, and later ones from the cache.
+        cache = self.makeCache(admit_after=1)
+        storage = self.makeStorage(cache)
+        lfc_id = self.addSwiftFile(storage, b"x" * 100)
+        stream = yield storage.open(lfc_id)
+        data = yield self.readAll(stream)
+        self.assertEqual(b"x" * 100, data)
+        yield cache._fetchOnce(lfc_id)
+        stream = yield storage.open(lfc_id)
+        data = yield self.readAll(stream)
+        self.assertEqual(b"x" * 100, data)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
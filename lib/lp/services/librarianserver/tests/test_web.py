@@ -312,6 +312,115 @@ def test_headers(self):
         # And we should have a correct Last-Modified header too.
         self.assertEqual(last_modified_header, "Tue, 30 Jan 2001 13:45:59 GMT")
 
+    def addSampleFile(self, sample_data=b"0123456789" * 10):
+        client = LibrarianClient()
+        file_alias_id = client.addFile(
+            "sample",
+            len(sample_data),
+            BytesIO(sample_data),
+            contentType="text/plain",
+        )
+        self.commit()
+        return client.getURLForAlias(file_alias_id), sample_data
+
+    def test_etag(self):
+        # Files have a strong entity tag based on their SHA-256, which
+        # clients can use to revalidate cached copies.
+        url, sample_data = self.addSampleFile()
+        etag = '"%s"' % hashlib.sha256(sample_data).hexdigest()
+        response = requests.get(url)
+        response.raise_for_status()
+        self.assertEqual(etag, response.headers["ETag"])
+        self.assertEqual("bytes", response.headers["Accept-Ranges"])
+
+        response = requests.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b"", response.content)
+        response = requests.get(
+            url, headers={"If-None-Match": '"other", W/%s' % etag}
+        )
+        self.assertEqual(304, response.status_code)
+
+        # If-None-Match takes precedence over If-Modified-Since.
+        response = requests.get(
+            url,
+            headers={
+                "If-None-Match": '"other"',
+                "If-Modified-Since": response.headers["Last-Modified"],
+            },
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(sample_data, response.content)
+
+    def test_single_range(self):
+        url, sample_data = self.addSampleFile()
+        for range_header, expected_range in (
+            ("bytes=10-19", (10, 19)),
+            ("bytes=95-", (95, 99)),
+            ("bytes=-5", (95, 99)),
+            ("bytes=90-1000", (90, 99)),
+        ):
+            response = requests.get(url, headers={"Range": range_header})
+            self.assertEqual(206, response.status_code)
+            first, last = expected_range
+            self.assertEqual(
+                "bytes %d-%d/100" % expected_range,
+                response.headers["Content-Range"],
+            )
+            self.assertEqual(sample_data[first : last + 1], response.content)
+
+    def test_multiple_ranges(self):
+        url, sample_data = self.addSampleFile()
+        response = requests.get(url, headers={"Range": "bytes=0-4,-3"})
+        self.assertEqual(206, response.status_code)
+        content_type, boundary = response.headers["Content-Type"].split(
+            "; boundary="
+        )
+        self.assertEqual("multipart/byteranges", content_type)
+        self.assertEqual(
+            (
+                "\r\n--{boundary}\r\n"
+                "Content-Type: text/plain\r\n"
+                "Content-Range: bytes 0-4/100\r\n\r\n"
+                "01234"
+                "\r\n--{boundary}\r\n"
+                "Content-Type: text/plain\r\n"
+                "Content-Range: bytes 97-99/100\r\n\r\n"
+                "789"
+                "\r\n--{boundary}--\r\n"
+            )
+            .format(boundary=boundary)
+            .encode("ASCII"),
+            response.content,
+        )
+
+    def test_unsatisfiable_range(self):
+        url, _ = self.addSampleFile()
+        response = requests.get(url, headers={"Range": "bytes=100-"})
+        self.assertEqual(416, response.status_code)
+        self.assertEqual("bytes */100", response.headers["Content-Range"])
+
+    def test_invalid_range_is_ignored(self):
+        url, sample_data = self.addSampleFile()
+        response = requests.get(url, headers={"Range": "bytes=20-10"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(sample_data, response.content)
+
+    def test_if_range(self):
+        # Ranges are only honoured if If-Range matches the entity tag.
+        url, sample_data = self.addSampleFile()
+        etag = '"%s"' % hashlib.sha256(sample_data).hexdigest()
+        response = requests.get(
+            url, headers={"Range": "bytes=0-4", "If-Range": etag}
+        )
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(sample_data[:5], response.content)
+        response = requests.get(
+            url, headers={"Range": "bytes=0-4", "If-Range": '"other"'}
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(sample_data, response.content)
+
     def test_missing_storage(self):
         # When a file exists in the DB but is missing from disk, a 404
         # is just confusing. It's an internal error, so 500 instead.
@@ -1,8 +1,11 @@
 # Copyright 2009-2023 Canonical Ltd.  This software is licensed under the
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
+import math
+import os
 import time
 from datetime import datetime
+from functools import partial
 from urllib.parse import urlparse
 
 import six
@@ -39,6 +42,88 @@
 )
 fourOhFour = resource.NoResource("No such resource")
 
+# Requests for more byte ranges than this are answered with the whole file,
+# so that clients can't make us open a vast number of streams at once.
+MAX_BYTE_RANGES = 20
+
+
+def parse_byte_ranges(header, size):
+    """Parse the value of an HTTP Range header.
+
+    :param header: The value of the header, as bytes.
+    :param size: The size of the requested file.
+    :return: A list of (first, last) tuples of inclusive byte offsets, one
+        for each satisfiable range in the header, or None if the header is
+        invalid and should be ignored.
+    """
+    unit, _, specs = header.partition(b"=")
+    if unit.strip().lower() != b"bytes" or not specs:
+        return None
+    byte_ranges = []
+    for spec in specs.split(b","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, dash, last = spec.partition(b"-")
+        first = first.strip()
+        last = last.strip()
+        if (
+            not dash
+            or (first and not first.isdigit())
+            or (last and not last.isdigit())
+            or not (first or last)
+        ):
+            return None
+        if not first:
+            # A suffix range: the last N bytes of the file.
+            if int(last) == 0 or size == 0:
+                continue
+            byte_ranges.append((max(0, size - int(last)), size - 1))
+        elif last and int(last) < int(first):
+            return None
+        elif int(first) < size:
+            last = min(int(last), size - 1) if last else size - 1
+            byte_ranges.append((int(first), last))
+    return byte_ranges
+
+
+def etag_matches(header, etag):
+    """Does an If-None-Match header match an entity tag?
+
+    This uses the weak comparison function, as RFC 9110 requires for
+    If-None-Match.
+    """
+    for tag in header.split(b","):
+        tag = tag.strip()
+        if tag.startswith(b"W/"):
+            tag = tag[2:]
+        if tag in (b"*", etag):
+            return True
+    return False
+
+
+def get_requested_byte_ranges(request, size, etag):
+    """Return the byte ranges a request asks for.
+
+    :return: A list of (first, last) tuples of inclusive byte offsets,
+        which is empty if none of the requested ranges can be satisfied, or
+        None if the whole file should be sent.
+    """
+    header = request.getHeader(b"range")
+    if header is None or request.method not in (b"GET", b"HEAD"):
+        return None
+    # If-Range makes the Range header conditional on the file being the
+    # one the client has part of already.  We only support entity tags
+    # here; if we're sent a date, we send the whole file, which is always
+    # safe.
+    if_range = request.getHeader(b"if-range")
+    if if_range is not None and (etag is None or if_range.strip() != etag):
+        return None
+    byte_ranges = parse_byte_ranges(header, size)
+    if byte_ranges is not None and len(byte_ranges) > MAX_BYTE_RANGES:
+        return None
+    return byte_ranges
+
 
 class NotFound(Exception):
     pass
@@ -135,6 +220,7 @@ def _getFileAlias(self, aliasID, token, path):
                 alias.mimetype,
                 alias.date_created,
                 alias.content.filesize,
+                alias.content.sha256,
                 alias.restricted,
             )
         except LookupError:
@@ -162,6 +248,7 @@ def _cb_getFileAlias(self, results, filename, request):
             mimetype,
             date_created,
             size,
+            sha256,
             restricted,
         ) = results
         # Return a 404 if the filename in the URL is incorrect. This offers
@@ -174,12 +261,30 @@ def _cb_getFileAlias(self, results, filename, request):
             )
             return fourOhFour
 
-        stream = yield self.storage.open(dbcontentID)
+        # Files never change once they are in the librarian, so their
+        # SHA-256 makes a good strong entity tag.
+        if sha256 is not None:
+            etag = b'"%s"' % sha256.encode("ASCII")
+        else:
+            etag = None
+        byte_ranges = get_requested_byte_ranges(request, size, etag)
+        stream = yield self.storage.open(
+            dbcontentID, byte_range=byte_ranges[0] if byte_ranges else None
+        )
         if stream is not None:
             # XXX: Brad Crittenden 2007-12-05 bug=174204: When encodings are
             # stored as part of a file's metadata this logic will be replaced.
             encoding, mimetype = guess_librarian_encoding(dbfilename, mimetype)
-            file = File(mimetype, encoding, date_created, stream, size)
+            file = File(
+                mimetype,
+                encoding,
+                date_created,
+                stream,
+                size,
+                etag=etag,
+                byte_ranges=byte_ranges,
+                open_range=partial(self.storage.open, dbcontentID),
+            )
             # Set our caching headers. Public Librarian files can be
             # cached forever, while private ones mustn't be at all.
             request.setHeader(
@@ -207,7 +312,31 @@ def render_GET(self, request):
 class File(resource.Resource):
     isLeaf = True
 
-    def __init__(self, contentType, encoding, modification_time, stream, size):
+    def __init__(
+        self,
+        contentType,
+        encoding,
+        modification_time,
+        stream,
+        size,
+        etag=None,
+        byte_ranges=None,
+        open_range=None,
+    ):
+        """Construct a `File`.
+
+        :param stream: A stream for the whole file, or for the first of
+            `byte_ranges` if any.
+        :param etag: The file's entity tag, including quotes, or None.
+        :param byte_ranges: A list of (first, last) tuples of inclusive
+            byte offsets to send as a partial response, or None to send
+            the whole file.  An empty list means that the request could
+            not be satisfied.
+        :param open_range: A callable taking a (first, last) tuple and
+            returning a Deferred that fires with a stream for that part of
+            the file.  It is used to send the second and later of several
+            byte ranges.
+        """
         resource.Resource.__init__(self)
         # Have to convert the UTC datetime to POSIX timestamp (localtime)
         offset = datetime.utcnow() - datetime.now()
@@ -219,9 +348,14 @@ def __init__(self, contentType, encoding, modification_time, stream, size):
         self.encoding = encoding
         self.stream = stream
         self.size = size
-
-    def _setContentHeaders(self, request):
-        request.setHeader(b"content-length", intToBytes(self.size))
+        self.etag = etag
+        self.byte_ranges = byte_ranges
+        self.open_range = open_range
+
+    def _setContentHeaders(self, request, length=None):
+        if length is None:
+            length = self.size
+        request.setHeader(b"content-length", intToBytes(length))
         if self.type:
             request.setHeader(
                 b"content-type", six.ensure_binary(self.type, "ASCII")
@@ -231,38 +365,102 @@ def _setContentHeaders(self, request):
                 b"content-encoding", six.ensure_binary(self.encoding, "ASCII")
             )
 
+    def _contentRange(self, byte_range):
+        return b"bytes %d-%d/%d" % (byte_range + (self.size,))
+
+    def _isCached(self, request):
+        """Is the client's copy of this file still valid?
+
+        This sets the response code if so.
+        """
+        if_none_match = request.getHeader(b"if-none-match")
+        if self.etag is None or if_none_match is None:
+            return (
+                request.setLastModified(self._modification_time) is http.CACHED
+            )
+        # If-None-Match takes precedence over If-Modified-Since, so only
+        # set the Last-Modified header rather than letting
+        # `setLastModified` compare it with If-Modified-Since.
+        request.lastModified = math.ceil(self._modification_time)
+        if etag_matches(if_none_match, self.etag):
+            request.setResponseCode(http.NOT_MODIFIED)
+            return True
+        return False
+
+    def _getMultipartSeparators(self, boundary):
+        """Return the separators to send before each part of the response."""
+        content_type = six.ensure_binary(
+            self.type or "application/octet-stream", "ASCII"
+        )
+        return [
+            b"\r\n--%s\r\nContent-Type: %s\r\nContent-Range: %s\r\n\r\n"
+            % (boundary, content_type, self._contentRange(byte_range))
+            for byte_range in self.byte_ranges
+        ]
+
     def render_GET(self, request):
         """See `Resource`."""
-        request.setHeader(b"accept-ranges", b"none")
+        request.setHeader(b"accept-ranges", b"bytes")
+        if self.etag is not None:
+            request.setHeader(b"etag", self.etag)
+
+        if self._isCached(request):
+            # `_isCached` also sets the response code for us, so if the
+            # request is cached, we close the file now that we've made sure
+            # that the request would otherwise succeed and return an empty
+            # body.
+            self.stream.close()
+            return b""
 
-        if request.setLastModified(self._modification_time) is http.CACHED:
-            # `setLastModified` also sets the response code for us, so if
-            # the request is cached, we close the file now that we've made
-            # sure that the request would otherwise succeed and return an
-            # empty body.
+        if self.byte_ranges is not None and not self.byte_ranges:
+            request.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+            request.setHeader(b"content-range", b"bytes */%d" % self.size)
+            request.setHeader(b"content-length", b"0")
             self.stream.close()
             return b""
 
-        if request.method == b"HEAD":
-            # Set the content headers here, rather than making a producer.
+        if self.byte_ranges is None:
+            request.setResponseCode(http.OK)
             self._setContentHeaders(request)
+            producer = FileProducer(request, self.stream)
+        elif len(self.byte_ranges) == 1:
+            request.setResponseCode(http.PARTIAL_CONTENT)
+            first, last = self.byte_ranges[0]
+            self._setContentHeaders(request, length=last - first + 1)
+            request.setHeader(
+                b"content-range", self._contentRange(self.byte_ranges[0])
+            )
+            producer = FileProducer(request, self.stream)
+        else:
+            request.setResponseCode(http.PARTIAL_CONTENT)
+            boundary = b"%x%x" % (int(time.time() * 1000000), os.getpid())
+            separators = self._getMultipartSeparators(boundary)
+            trailer = b"\r\n--%s--\r\n" % boundary
+            length = len(trailer) + sum(
+                len(separator) + last - first + 1
+                for separator, (first, last) in zip(
+                    separators, self.byte_ranges
+                )
+            )
+            request.setHeader(b"content-length", intToBytes(length))
+            request.setHeader(
+                b"content-type",
+                b"multipart/byteranges; boundary=%s" % boundary,
+            )
+            producer = MultipleRangeProducer(
+                request,
+                self.stream,
+                self.open_range,
+                list(zip(separators, self.byte_ranges)),
+                trailer,
+            )
+
+        if request.method == b"HEAD":
+            # The headers are all set, so there's no need for a producer.
             self.stream.close()
             return b""
 
-        # static.File has HTTP range support, which would be nice to have.
-        # Unfortunately, static.File isn't a good match for producing data
-        # dynamically by fetching it from Swift. The librarian used to sit
-        # behind Squid, which took care of this, but it no longer does. I
-        # think we will need to cargo-cult the byte-range support and three
-        # Producer implementations from static.File, making the small
-        # modifications to cope with self.fileObject.read maybe returning a
-        # Deferred, and the static.File.makeProducer method to return the
-        # correct producer.
-        self._setContentHeaders(request)
-        request.setResponseCode(http.OK)
-        producer = FileProducer(request, self.stream)
         producer.start()
-
         return server.NOT_DONE_YET
 
 
@@ -283,6 +481,14 @@ def pauseProducing(self):
         """See `IPushProducer`."""
         self.producing = False
 
+    def _nextStream(self):
+        """Move on to the next stream once the current one is exhausted.
+
+        :return: True (or a Deferred firing with True) if there is more
+            data to produce, otherwise False.
+        """
+        return False
+
     @defer.inlineCallbacks
     def _produceFromStream(self):
         """Read data from our stream and write it to our consumer."""
@@ -294,7 +500,11 @@ def _produceFromStream(self):
                 return
             if data:
                 self.request.write(data)
-            else:
+                continue
+            more = yield self._nextStream()
+            if not self.request:
+                return
+            if not more:
                 self.request.unregisterProducer()
                 self.request.finish()
                 self.stopProducing()
@@ -312,6 +522,59 @@ def stopProducing(self):
         self.request = None
 
 
+class MultipleRangeProducer(FileProducer):
+    """Produce a multipart/byteranges response.
+
+    Each part is read from its own stream, so that only the requested
+    parts of the file are ever read.
+    """
+
+    def __init__(self, request, stream, open_range, parts, trailer):
+        """Construct a `MultipleRangeProducer`.
+
+        :param stream: A stream for the first part.
+        :param open_range: A callable taking a (first, last) tuple and
+            returning a Deferred that fires with a stream for that part of
+            the file.
+        :param parts: A list of (separator, byte range) tuples.
+        :param trailer: The data to send after the last part.
+        """
+        super().__init__(request, stream)
+        self.open_range = open_range
+        self.parts = parts
+        self.trailer = trailer
+
+    def start(self):
+        separator, _ = self.parts.pop(0)
+        self.request.write(separator)
+        super().start()
+
+    @defer.inlineCallbacks
+    def _nextStream(self):
+        self.stream.close()
+        if not self.parts:
+            self.request.write(self.trailer)
+            return False
+        separator, byte_range = self.parts.pop(0)
+        stream = yield self.open_range(byte_range)
+        if not self.request:
+            # stopProducing was called while we were waiting.
+            if stream is not None:
+                stream.close()
+            return False
+        if stream is None:
+            # The file went away part-way through the response.  We've
+            # already promised a Content-Length, so all we can do is drop
+            # the connection.
+            log.msg("Content vanished while sending byte ranges.")
+            self.request.loseConnection()
+            self.stopProducing()
+            return False
+        self.stream = stream
+        self.request.write(separator)
+        return True
+
+
 class DigestSearchResource(resource.Resource):
     def __init__(self, storage):
         self.storage = storage
@@ -0,0 +1,140 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Resolve the build-dependencies of many builds at once."""
+
+__all__ = [
+    "BuildDependencyResolver",
+]
+
+import warnings
+from collections import defaultdict
+
+from debian.deb822 import PkgRelation
+from storm.expr import And, Or
+
+from lp.services.database.interfaces import IStandbyStore
+from lp.soyuz.adapters.archivedependencies import expand_dependencies
+from lp.soyuz.enums import PackagePublishingStatus
+from lp.soyuz.model.binarypackagename import BinaryPackageName
+from lp.soyuz.model.binarypackagerelease import BinaryPackageRelease
+from lp.soyuz.model.component import Component
+from lp.soyuz.model.publishing import BinaryPackagePublishingHistory
+
+
+class BuildDependencyResolver:
+    """Find dependency candidates for a batch of builds.
+
+    `IArchive.findDepCandidates` runs a query for each dependency of each
+    build.  Instead, this groups builds by the context in which their
+    dependencies are looked up (the distro arch series and the archives,
+    pockets and components it expands to), and loads the published
+    versions of every package that any build in a context depends on
+    with a single query per context.
+
+    Pass the resolver to `IBinaryPackageBuild.updateDependencies` for
+    each of the builds it was created with.
+    """
+
+    def __init__(self, builds):
+        """Load dependency candidates for `builds`.
+
+        :param builds: A sequence of `IBinaryPackageBuild`s.
+        """
+        # Map of build IDs to dependency contexts.
+        self._contexts = {}
+        # Map of dependency contexts to maps of binary package names to
+        # sets of published versions.
+        self._indexes = {}
+        archive_dependencies = {}
+        context_names = defaultdict(set)
+        for build in builds:
+            names = self._getDependencyNames(build)
+            if not names:
+                continue
+            archive = build.archive
+            if archive.id not in archive_dependencies:
+                archive_dependencies[archive.id] = list(archive.dependencies)
+            deps = expand_dependencies(
+                archive,
+                build.distro_arch_series,
+                build.pocket,
+                build.current_component,
+                build.source_package_release.sourcepackagename.name,
+                archive_dependencies[archive.id],
+            )
+            context = (
+                build.distro_arch_series.id,
+                tuple(
+                    (dep_archive.id, dep_pocket, tuple(components))
+                    for dep_archive, _, dep_pocket, components in deps
+                ),
+            )
+            self._contexts[build.id] = context
+            context_names[context].update(names)
+        for context, names in context_names.items():
+            self._indexes[context] = self._loadIndex(context, names)
+
+    @staticmethod
+    def _getDependencyNames(build):
+        """Return the names of the packages that `build` depends on.
+
+        Dependencies that cannot be parsed are left for
+        `IBinaryPackageBuild.updateDependencies` to complain about.
+        """
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("error")
+                parsed_deps = PkgRelation.parse_relations(build.dependencies)
+        except (AttributeError, Warning):
+            return set()
+        return {token["name"] for or_dep in parsed_deps for token in or_dep}
+
+    def _loadIndex(self, context, names):
+        """Load the published versions of `names` in a context."""
+        distro_arch_series_id, deps = context
+        archive_clause = Or(
+            *(
+                And(
+                    BinaryPackagePublishingHistory.archive_id == archive_id,
+                    BinaryPackagePublishingHistory.pocket == pocket,
+                    Component.name.is_in(components),
+                )
+                for archive_id, pocket, components in deps
+            )
+        )
+        rows = (
+            IStandbyStore(BinaryPackagePublishingHistory)
+            .find(
+                (BinaryPackageName.name, BinaryPackageRelease.version),
+                BinaryPackageName.name.is_in(names),
+                BinaryPackagePublishingHistory.binarypackagename
+                == BinaryPackageName.id,
+                BinaryPackagePublishingHistory.binarypackagerelease
+                == BinaryPackageRelease.id,
+                BinaryPackagePublishingHistory.distroarchseries_id
+                == distro_arch_series_id,
+                BinaryPackagePublishingHistory.status
+                == PackagePublishingStatus.PUBLISHED,
+                BinaryPackagePublishingHistory.component_id == Component.id,
+                archive_clause,
+            )
+            .config(distinct=True)
+        )
+        index = defaultdict(set)
+        for name, version in rows:
+            index[name].add(version)
+        return index
+
+    def getCandidateVersions(self, build, name):
+        """Return the published versions that could satisfy a dependency.
+
+        :param build: One of the `IBinaryPackageBuild`s that this resolver
+            was created with.
+        :param name: The name of a binary package that `build` depends on.
+        :return: A set of version strings.
+        """
+        context = self._contexts.get(build.id)
+        if context is None:
+            return set()
+        return self._indexes[context].get(name, set())
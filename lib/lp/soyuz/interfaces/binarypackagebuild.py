@@ -177,8 +177,12 @@ class IBinaryPackageBuildView(IPackageBuildView):
         exported_as="score",
     )
 
-    def updateDependencies():
-        """Update the build-dependencies line within the targeted context."""
+    def updateDependencies(resolver=None):
+        """Update the build-dependencies line within the targeted context.
+
+        :param resolver: If not None, a `BuildDependencyResolver` created
+            with this build, used to look up dependency candidates in bulk.
+        """
 
     def __getitem__(name):
         """Mapped to getBinaryPackageRelease."""
@@ -0,0 +1,30 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Interface for the files shipped in binary packages."""
+
+__all__ = [
+    "IBinaryPackageReleaseContentsSet",
+]
+
+from zope.interface import Interface
+
+
+class IBinaryPackageReleaseContentsSet(Interface):
+    """The files shipped in binary package releases."""
+
+    def add(bpr, paths):
+        """Record the files shipped in a binary package release.
+
+        :param bpr: An `IBinaryPackageRelease`.
+        :param paths: An iterable of the paths (as bytes) of the files
+            shipped in `bpr`, relative to the root of the filesystem.
+        """
+
+    def getPaths(bpr_ids):
+        """Return the files recorded for some binary package releases.
+
+        :param bpr_ids: A collection of `IBinaryPackageRelease` IDs.
+        :return: A dict mapping the IDs of those releases that have any
+            recorded files to sorted lists of their paths (as bytes).
+        """
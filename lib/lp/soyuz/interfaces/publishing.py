@@ -1133,6 +1133,38 @@ def copyBinaries(archive, distroseries, pocket, bpphs, policy=None):
             records.
         """
 
+    def copySources(
+        archive,
+        distroseries,
+        pocket,
+        spphs,
+        overrides=None,
+        create_dsd_job=True,
+        creator=None,
+        sponsor=None,
+    ):
+        """Copy multiple sources to a given destination.
+
+        This is the bulk equivalent of
+        `ISourcePackagePublishingHistory.copyTo`, creating all the new
+        publications with a single query.  It does not check whether the
+        sources are already published in the destination.
+
+        :param archive: The target `IArchive`.
+        :param distroseries: The target `IDistroSeries`.
+        :param pocket: The target `PackagePublishingPocket`.
+        :param spphs: A list of `ISourcePackagePublishingHistory`s to copy.
+        :param overrides: An optional dict mapping `ISourcePackageName`s to
+            `ISourceOverride`s to apply to the copies.
+        :param create_dsd_job: A boolean indicating whether or not dsd jobs
+            should be created for the new source publications.
+        :param creator: An optional `IPerson` who requested the copies.
+        :param sponsor: An optional `IPerson` who sponsored the copies.
+
+        :return: A list of the new `ISourcePackagePublishingHistory`
+            records.
+        """
+
     def newSourcePublication(
         archive,
         sourcepackagerelease,
@@ -1335,7 +1367,7 @@ def getActiveArchSpecificPublications(
         """
 
     def getSourcesForPublishing(
-        archive, distroseries=None, pocket=None, component=None
+        archive, distroseries=None, pocket=None, component=None, preload=True
     ):
         """Get source publications which are published in a given context.
 
@@ -1343,14 +1375,28 @@ def getSourcesForPublishing(
         :param distroseries: The `DistroSeries` to search, or None.
         :param pocket: The `PackagePublishingPocket` to search, or None.
         :param component: The `Component` to search, or None.
+        :param preload: If False, don't preload publisher-relevant objects;
+            callers may then use `preloadSourcesForPublishing` on a subset
+            of the results.
         :return: A result set of `SourcePackagePublishingHistory` objects in
             the given context and with the `PUBLISHED` status, ordered by
             source package name, with associated publisher-relevant objects
             preloaded.
         """
 
+    def preloadSourcesForPublishing(spphs):
+        """Preload objects needed to write Sources index stanzas.
+
+        :param spphs: A sequence of `SourcePackagePublishingHistory`
+            objects.
+        """
+
     def getBinariesForPublishing(
-        archive, distroarchseries=None, pocket=None, component=None
+        archive,
+        distroarchseries=None,
+        pocket=None,
+        component=None,
+        preload=True,
     ):
         """Get binary publications which are published in a given context.
 
@@ -1358,12 +1404,22 @@ def getBinariesForPublishing(
         :param distroarchseries: The `DistroArchSeries` to search, or None.
         :param pocket: The `PackagePublishingPocket` to search, or None.
         :param component: The `Component` to search, or None.
+        :param preload: If False, don't preload publisher-relevant objects;
+            callers may then use `preloadBinariesForPublishing` on a subset
+            of the results.
         :return: A result set of `BinaryPackagePublishingHistory` objects in
             the given context and with the `PUBLISHED` status, ordered by
             binary package name, with associated publisher-relevant objects
             preloaded.
         """
 
+    def preloadBinariesForPublishing(bpphs):
+        """Preload objects needed to write Packages index stanzas.
+
+        :param bpphs: A sequence of `BinaryPackagePublishingHistory`
+            objects.
+        """
+
     def getChangesFilesForSources(one_or_more_source_publications):
         """Return all changesfiles for each given source publication.
 
@@ -616,34 +616,44 @@ def _checkDependencyVersion(self, available, required, relation):
 
         return version_relation_map[relation](dep_result)
 
-    def _isDependencySatisfied(self, token):
+    def _isDependencySatisfied(self, token, resolver=None):
         """Check if the given dependency token is satisfied.
 
         Check if the dependency exists and that its version constraint is
         satisfied.
+
+        :param resolver: If not None, a `BuildDependencyResolver` created
+            with this build, to look up candidates in rather than querying
+            the database.
         """
         name, version, relation = self._parseDependencyToken(token)
 
         # There may be several published versions in the available
         # archives and pockets. If any one of them satisfies our
         # constraints, the dependency is satisfied.
-        dep_candidates = self.archive.findDepCandidates(
-            self.distro_arch_series,
-            self.pocket,
-            self.current_component,
-            self.source_package_release.sourcepackagename.name,
-            name,
-        )
+        if resolver is not None:
+            candidate_versions = resolver.getCandidateVersions(self, name)
+        else:
+            candidate_versions = (
+                dep_candidate.binarypackagerelease.version
+                for dep_candidate in self.archive.findDepCandidates(
+                    self.distro_arch_series,
+                    self.pocket,
+                    self.current_component,
+                    self.source_package_release.sourcepackagename.name,
+                    name,
+                )
+            )
 
-        for dep_candidate in dep_candidates:
+        for candidate_version in candidate_versions:
             if self._checkDependencyVersion(
-                dep_candidate.binarypackagerelease.version, version, relation
+                candidate_version, version, relation
             ):
                 return True
 
         return False
 
-    def updateDependencies(self):
+    def updateDependencies(self, resolver=None):
         """See `IBuild`."""
 
         # apt_pkg requires init_system to get version_compare working
@@ -664,7 +674,10 @@ def updateDependencies(self):
 
         remaining_deps = []
         for or_dep in parsed_deps:
-            if not any(self._isDependencySatisfied(token) for token in or_dep):
+            if not any(
+                self._isDependencySatisfied(token, resolver=resolver)
+                for token in or_dep
+            ):
                 remaining_deps.append(or_dep)
 
         # Update dependencies line
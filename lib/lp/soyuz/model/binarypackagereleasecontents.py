@@ -0,0 +1,105 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""The files shipped in binary packages."""
+
+__all__ = [
+    "BinaryPackagePath",
+    "BinaryPackageReleaseContents",
+    "BinaryPackageReleaseContentsSet",
+]
+
+from collections import defaultdict
+
+from storm.locals import Bytes, Int, Reference
+from zope.interface import implementer
+
+from lp.services.database.interfaces import IPrimaryStore, IStore
+from lp.services.database.stormbase import StormBase
+from lp.soyuz.interfaces.binarypackagereleasecontents import (
+    IBinaryPackageReleaseContentsSet,
+)
+
+
+class BinaryPackagePath(StormBase):
+    """A path of a file shipped in one or more binary packages."""
+
+    __storm_table__ = "BinaryPackagePath"
+
+    id = Int(primary=True)
+    path = Bytes(name="path", allow_none=False)
+
+
+class BinaryPackageReleaseContents(StormBase):
+    """A file shipped in a binary package release."""
+
+    __storm_table__ = "BinaryPackageReleaseContents"
+    __storm_primary__ = ("binarypackagerelease_id", "binarypackagepath_id")
+
+    binarypackagerelease_id = Int(
+        name="binarypackagerelease", allow_none=False
+    )
+    binarypackagerelease = Reference(
+        binarypackagerelease_id, "BinaryPackageRelease.id"
+    )
+
+    binarypackagepath_id = Int(name="binarypackagepath", allow_none=False)
+    binarypackagepath = Reference(binarypackagepath_id, "BinaryPackagePath.id")
+
+
+@implementer(IBinaryPackageReleaseContentsSet)
+class BinaryPackageReleaseContentsSet:
+    """See `IBinaryPackageReleaseContentsSet`."""
+
+    def add(self, bpr, paths):
+        """See `IBinaryPackageReleaseContentsSet`."""
+        paths = sorted(set(paths))
+        if not paths:
+            return
+        store = IPrimaryStore(BinaryPackagePath)
+        # Other uploads may be adding some of the same paths at the same
+        # time, so let the database resolve any conflicts rather than
+        # looking for existing paths first.  Paths are unique by their
+        # SHA-256 hashes, since they may be too long to index directly;
+        # look them up the same way so that the index is used.
+        store.execute(
+            """
+            INSERT INTO BinaryPackagePath (path)
+            SELECT unnest(?::bytea[])
+            ON CONFLICT DO NOTHING
+            """,
+            (paths,),
+        )
+        store.execute(
+            """
+            INSERT INTO BinaryPackageReleaseContents
+                (binarypackagerelease, binarypackagepath)
+            SELECT ?, BinaryPackagePath.id
+            FROM BinaryPackagePath, unnest(?::bytea[]) AS new_path (path)
+            WHERE sha256(BinaryPackagePath.path) = sha256(new_path.path)
+            ON CONFLICT DO NOTHING
+            """,
+            (bpr.id, paths),
+        )
+
+    def getPaths(self, bpr_ids):
+        """See `IBinaryPackageReleaseContentsSet`."""
+        if not bpr_ids:
+            return {}
+        rows = IStore(BinaryPackageReleaseContents).find(
+            (
+                BinaryPackageReleaseContents.binarypackagerelease_id,
+                BinaryPackagePath.path,
+            ),
+            BinaryPackageReleaseContents.binarypackagepath_id
+            == BinaryPackagePath.id,
+            BinaryPackageReleaseContents.binarypackagerelease_id.is_in(
+                bpr_ids
+            ),
+        )
+        paths = defaultdict(list)
+        for bpr_id, path in rows:
+            paths[bpr_id].append(path)
+        return {
+            bpr_id: sorted(bpr_paths) for bpr_id, bpr_paths in paths.items()
+        }
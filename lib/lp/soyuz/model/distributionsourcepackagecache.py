@@ -8,6 +8,7 @@
 from collections import defaultdict
 from operator import attrgetter, itemgetter
 
+from storm.expr import Or
 from storm.locals import Int, Reference, Unicode
 from zope.interface import implementer
 
@@ -25,7 +26,11 @@
 from lp.soyuz.model.binarypackagebuild import BinaryPackageBuild
 from lp.soyuz.model.binarypackagename import BinaryPackageName
 from lp.soyuz.model.binarypackagerelease import BinaryPackageRelease
-from lp.soyuz.model.publishing import SourcePackagePublishingHistory
+from lp.soyuz.model.distroarchseries import DistroArchSeries
+from lp.soyuz.model.publishing import (
+    BinaryPackagePublishingHistory,
+    SourcePackagePublishingHistory,
+)
 from lp.soyuz.model.sourcepackagerelease import SourcePackageRelease
 
 _DEFAULT = object()
@@ -80,7 +85,9 @@ def distributionsourcepackage(self):
         )
 
     @classmethod
-    def findCurrentSourcePackageNames(cls, distro, archive):
+    def findCurrentSourcePackageNames(
+        cls, distro, archive, sourcepackagenames=None
+    ):
         if archive is None:
             spn_ids = IStore(SeriesSourcePackageBranch).find(
                 SeriesSourcePackageBranch.sourcepackagenameID,
@@ -88,15 +95,85 @@ def findCurrentSourcePackageNames(cls, distro, archive):
                 SeriesSourcePackageBranch.distroseriesID == DistroSeries.id,
             )
         else:
+            clauses = []
+            if sourcepackagenames is not None:
+                clauses.append(
+                    SourcePackagePublishingHistory.sourcepackagename_id.is_in(
+                        [spn.id for spn in sourcepackagenames]
+                    )
+                )
             spn_ids = IStore(SourcePackagePublishingHistory).find(
                 SourcePackagePublishingHistory.sourcepackagename_id,
                 SourcePackagePublishingHistory.archive == archive,
                 SourcePackagePublishingHistory.status.is_in(
                     active_publishing_status
                 ),
+                *clauses,
             )
         return bulk.load(SourcePackageName, spn_ids.config(distinct=True))
 
+    @classmethod
+    def findChangedSourcePackageNames(cls, distro, since):
+        """Find source packages whose publications have changed recently.
+
+        A source package has changed if any of its source or binary
+        publications was created, superseded, deleted or obsoleted since
+        the given time.  Binary publications count because the cache
+        records the names and summaries of a source's binaries.
+
+        :param distro: target `IDistribution`.
+        :param since: a timezone-aware `datetime`.
+        :return: a dict mapping archive IDs to sets of
+            `ISourcePackageName`s.
+        """
+        store = IStore(SourcePackagePublishingHistory)
+        rows = set(
+            store.find(
+                (
+                    SourcePackagePublishingHistory.archive_id,
+                    SourcePackagePublishingHistory.sourcepackagename_id,
+                ),
+                SourcePackagePublishingHistory.distroseries_id
+                == DistroSeries.id,
+                DistroSeries.distribution == distro,
+                Or(
+                    SourcePackagePublishingHistory.datecreated >= since,
+                    SourcePackagePublishingHistory.datesuperseded >= since,
+                    SourcePackagePublishingHistory.scheduleddeletiondate
+                    >= since,
+                ),
+            ).config(distinct=True)
+        )
+        rows.update(
+            store.find(
+                (
+                    BinaryPackagePublishingHistory.archive_id,
+                    BinaryPackageBuild.source_package_name_id,
+                ),
+                BinaryPackagePublishingHistory.distroarchseries_id
+                == DistroArchSeries.id,
+                DistroArchSeries.distroseries_id == DistroSeries.id,
+                DistroSeries.distribution == distro,
+                BinaryPackagePublishingHistory.binarypackagerelease_id
+                == BinaryPackageRelease.id,
+                BinaryPackageRelease.build_id == BinaryPackageBuild.id,
+                Or(
+                    BinaryPackagePublishingHistory.datecreated >= since,
+                    BinaryPackagePublishingHistory.datesuperseded >= since,
+                    BinaryPackagePublishingHistory.scheduleddeletiondate
+                    >= since,
+                ),
+            ).config(distinct=True)
+        )
+        spns = {
+            spn.id: spn
+            for spn in bulk.load(SourcePackageName, [row[1] for row in rows])
+        }
+        changed = defaultdict(set)
+        for archive_id, spn_id in rows:
+            changed[archive_id].add(spns[spn_id])
+        return changed
+
     @classmethod
     def _find(cls, distro, archive=_DEFAULT):
         """The set of all source package info caches for this distribution.
@@ -340,7 +417,61 @@ def updateAll(cls, distro, archive, log, ztm, commit_chunk=500):
                 key=attrgetter("name"),
             )
         )
+        return cls._updateInChunks(
+            distro, spns, archive, log, ztm, commit_chunk
+        )
+
+    @classmethod
+    def updateNames(
+        cls, distro, sourcepackagenames, archive, log, ztm, commit_chunk=500
+    ):
+        """Update the source package cache for some source packages.
 
+        Cache records are updated for those of the given packages that
+        are still published in the archive, and removed for the others.
+        Updates for disabled archives are skipped entirely.
+
+        :param sourcepackagenames: a collection of `ISourcePackageName`s;
+        :param archive: target `IArchive`;
+        :param log: logger object for printing debug level information;
+        :param ztm:  transaction used for partial commits, every chunk of
+            'commit_chunk' updates is committed;
+        :param commit_chunk: number of updates before commit, defaults to 500.
+
+        :return the number packages updated done
+        """
+        if not archive.enabled:
+            return 0
+
+        current = set(
+            cls.findCurrentSourcePackageNames(
+                distro, archive, sourcepackagenames=sourcepackagenames
+            )
+        )
+        old = [spn for spn in sourcepackagenames if spn not in current]
+        if old:
+            log.debug(
+                "Removing source caches for %s",
+                ", ".join(sorted(spn.name for spn in old)),
+            )
+            IStore(cls).find(
+                cls,
+                cls.distribution == distro,
+                cls.archive == archive,
+                cls.sourcepackagename_id.is_in([spn.id for spn in old]),
+            ).remove()
+        return cls._updateInChunks(
+            distro,
+            sorted(current, key=attrgetter("name")),
+            archive,
+            log,
+            ztm,
+            commit_chunk,
+        )
+
+    @classmethod
+    def _updateInChunks(cls, distro, spns, archive, log, ztm, commit_chunk):
+        """Update caches for `spns`, committing every `commit_chunk`."""
         number_of_updates = 0
         chunks = []
         chunk = []
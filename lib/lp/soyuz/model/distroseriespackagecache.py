@@ -8,7 +8,7 @@
 from collections import defaultdict
 from operator import attrgetter
 
-from storm.expr import Desc, Max, Select
+from storm.expr import Desc, Max, Or, Select
 from storm.locals import Int, Reference, Unicode
 from zope.interface import implementer
 
@@ -59,7 +59,16 @@ def __init__(
         self.description = description
 
     @classmethod
-    def findCurrentBinaryPackageNames(cls, archive, distroseries):
+    def findCurrentBinaryPackageNames(
+        cls, archive, distroseries, binarypackagenames=None
+    ):
+        clauses = []
+        if binarypackagenames is not None:
+            clauses.append(
+                BinaryPackagePublishingHistory.binarypackagename_id.is_in(
+                    [bpn.id for bpn in binarypackagenames]
+                )
+            )
         bpn_ids = (
             IStore(BinaryPackagePublishingHistory)
             .find(
@@ -75,6 +84,7 @@ def findCurrentBinaryPackageNames(cls, archive, distroseries):
                 BinaryPackagePublishingHistory.status.is_in(
                     active_publishing_status
                 ),
+                *clauses,
             )
             .config(distinct=True)
             # Not necessary for correctness, but useful for testability; and
@@ -84,6 +94,51 @@ def findCurrentBinaryPackageNames(cls, archive, distroseries):
         )
         return bulk.load(BinaryPackageName, bpn_ids)
 
+    @classmethod
+    def findChangedBinaryPackageNames(cls, distroseries, since):
+        """Find binary packages whose publications have changed recently.
+
+        A publication has changed if it was created, superseded, deleted
+        or obsoleted since the given time, so may have been added to or
+        removed from the set of active publications.
+
+        :param distroseries: target `IDistroSeries`.
+        :param since: a timezone-aware `datetime`.
+        :return: a dict mapping archive IDs to sets of
+            `IBinaryPackageName`s.
+        """
+        rows = list(
+            IStore(BinaryPackagePublishingHistory)
+            .find(
+                (
+                    BinaryPackagePublishingHistory.archive_id,
+                    BinaryPackagePublishingHistory.binarypackagename_id,
+                ),
+                BinaryPackagePublishingHistory.distroarchseries_id.is_in(
+                    Select(
+                        DistroArchSeries.id,
+                        tables=[DistroArchSeries],
+                        where=DistroArchSeries.distroseries == distroseries,
+                    )
+                ),
+                Or(
+                    BinaryPackagePublishingHistory.datecreated >= since,
+                    BinaryPackagePublishingHistory.datesuperseded >= since,
+                    BinaryPackagePublishingHistory.scheduleddeletiondate
+                    >= since,
+                ),
+            )
+            .config(distinct=True)
+        )
+        bpns = {
+            bpn.id: bpn
+            for bpn in bulk.load(BinaryPackageName, [row[1] for row in rows])
+        }
+        changed = defaultdict(set)
+        for archive_id, bpn_id in rows:
+            changed[archive_id].add(bpns[bpn_id])
+        return changed
+
     @classmethod
     def _find(cls, distroseries, archive=None):
         """All of the cached binary package records for this distroseries.
@@ -262,7 +317,69 @@ def updateAll(cls, distroseries, archive, log, ztm, commit_chunk=500):
                 key=attrgetter("name"),
             )
         )
+        return cls._updateInChunks(
+            distroseries, bpns, archive, log, ztm, commit_chunk
+        )
 
+    @classmethod
+    def updateNames(
+        cls,
+        distroseries,
+        binarypackagenames,
+        archive,
+        log,
+        ztm,
+        commit_chunk=500,
+    ):
+        """Update the binary package cache for some binary packages.
+
+        Cache records are updated for those of the given packages that
+        are still published in this distro series, and removed for the
+        others.  Updates for disabled archives are skipped entirely.
+
+        :param binarypackagenames: a collection of `IBinaryPackageName`s;
+        :param archive: target `IArchive`;
+        :param log: logger object for printing debug level information;
+        :param ztm:  transaction used for partial commits, every chunk of
+            'commit_chunk' updates is committed;
+        :param commit_chunk: number of updates before commit, defaults to 500.
+
+        :return the number of packages updated.
+        """
+        if not archive.enabled:
+            return 0
+
+        current = set(
+            cls.findCurrentBinaryPackageNames(
+                archive, distroseries, binarypackagenames=binarypackagenames
+            )
+        )
+        old = [bpn for bpn in binarypackagenames if bpn not in current]
+        if old:
+            log.debug(
+                "Removing binary caches for %s",
+                ", ".join(sorted(bpn.name for bpn in old)),
+            )
+            IStore(cls).find(
+                cls,
+                cls.distroseries == distroseries,
+                cls.archive == archive,
+                cls.binarypackagename_id.is_in([bpn.id for bpn in old]),
+            ).remove()
+        return cls._updateInChunks(
+            distroseries,
+            sorted(current, key=attrgetter("name")),
+            archive,
+            log,
+            ztm,
+            commit_chunk,
+        )
+
+    @classmethod
+    def _updateInChunks(
+        cls, distroseries, bpns, archive, log, ztm, commit_chunk
+    ):
+        """Update caches for `bpns`, committing every `commit_chunk`."""
         number_of_updates = 0
         chunks = []
         chunk = []
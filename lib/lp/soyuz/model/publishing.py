@@ -1663,6 +1663,123 @@ def copyBinaries(
             channel=channel,
         )
 
+    def copySources(
+        self,
+        archive,
+        distroseries,
+        pocket,
+        spphs,
+        overrides=None,
+        create_dsd_job=True,
+        creator=None,
+        sponsor=None,
+    ):
+        """See `IPublishingSet`."""
+        # Circular import.
+        from lp.registry.model.distributionsourcepackage import (
+            DistributionSourcePackage,
+        )
+
+        if distroseries.distribution != archive.distribution:
+            raise AssertionError(
+                "Series distribution %s doesn't match archive distribution %s."
+                % (distroseries.distribution.name, archive.distribution.name)
+            )
+        if not spphs:
+            return []
+        if overrides is None:
+            overrides = {}
+
+        values = []
+        for spph in spphs:
+            sourcepackagerelease = spph.sourcepackagerelease
+            component = spph.component
+            section = spph.section
+            override = overrides.get(sourcepackagerelease.sourcepackagename)
+            if override is not None:
+                if override.component is not None:
+                    component = override.component
+                if override.section is not None:
+                    section = override.section
+            channel = spph.channel
+            if channel is not None:
+                if sourcepackagerelease.format == SourcePackageType.DPKG:
+                    raise AssertionError(
+                        "Can't publish dpkg source packages to a channel"
+                    )
+                if pocket != PackagePublishingPocket.RELEASE:
+                    raise AssertionError(
+                        "Channel publications must be in the RELEASE pocket"
+                    )
+                channel = channel_string_to_list(channel)
+            if sourcepackagerelease.format == SourcePackageType.DPKG:
+                if component is None:
+                    raise AssertionError(
+                        "dpkg source publications require a component"
+                    )
+                if section is None:
+                    raise AssertionError(
+                        "dpkg source publications require a section"
+                    )
+            values.append(
+                (
+                    archive,
+                    spph.archive,
+                    distroseries,
+                    pocket,
+                    channel,
+                    sourcepackagerelease,
+                    sourcepackagerelease.sourcepackagename,
+                    sourcepackagerelease.format,
+                    get_component(archive, distroseries, component),
+                    section,
+                    PackagePublishingStatus.PENDING,
+                    UTC_NOW,
+                    spph,
+                    creator,
+                    sponsor,
+                )
+            )
+
+        SPPH = SourcePackagePublishingHistory
+        pubs = bulk.create(
+            (
+                SPPH.archive,
+                SPPH.copied_from_archive,
+                SPPH.distroseries,
+                SPPH.pocket,
+                SPPH._channel,
+                SPPH.sourcepackagerelease,
+                SPPH.sourcepackagename,
+                SPPH._format,
+                SPPH.component,
+                SPPH.section,
+                SPPH.status,
+                SPPH.datecreated,
+                SPPH.ancestor,
+                SPPH.creator,
+                SPPH.sponsor,
+            ),
+            values,
+            get_objects=True,
+        )
+
+        pubs_by_name = {pub.sourcepackagename: pub for pub in pubs}
+        for pub in pubs_by_name.values():
+            DistributionSourcePackage.ensure(pub)
+        if create_dsd_job and archive == distroseries.main_archive:
+            dsd_job_source = getUtility(IDistroSeriesDifferenceJobSource)
+            for sourcepackagename in pubs_by_name:
+                dsd_job_source.createForPackagePublication(
+                    distroseries, sourcepackagename, pocket
+                )
+        for spph in spphs:
+            del get_property_cache(
+                spph.sourcepackagerelease
+            ).published_archives
+
+        return pubs
+
     def newSourcePublication(
         self,
         archive,
@@ -2091,7 +2208,12 @@ def getActiveArchSpecificPublications(
         )
 
     def getSourcesForPublishing(
-        self, archive, distroseries=None, pocket=None, component=None
+        self,
+        archive,
+        distroseries=None,
+        pocket=None,
+        component=None,
+        preload=True,
     ):
         """See `IPublishingSet`."""
         clauses = [
@@ -2116,42 +2238,47 @@ def getSourcesForPublishing(
             .find(SourcePackagePublishingHistory, *clauses)
             .order_by(SourcePackageName.name)
         )
+        if not preload:
+            return spphs
+        return DecoratedResultSet(
+            spphs, pre_iter_hook=self.preloadSourcesForPublishing
+        )
 
-        def eager_load(spphs):
-            # Preload everything which will be used by archivepublisher's
-            # build_source_stanza_fields.
-            bulk.load_related(Section, spphs, ["section_id"])
-            sprs = bulk.load_related(
-                SourcePackageRelease, spphs, ["sourcepackagerelease_id"]
-            )
-            bulk.load_related(
-                SourcePackageName, sprs, ["sourcepackagename_id"]
-            )
-            spr_ids = set(map(attrgetter("id"), sprs))
-            sprfs = list(
-                IStore(SourcePackageReleaseFile)
-                .find(
-                    SourcePackageReleaseFile,
-                    SourcePackageReleaseFile.sourcepackagerelease_id.is_in(
-                        spr_ids
-                    ),
-                )
-                .order_by(SourcePackageReleaseFile.libraryfile_id)
-            )
-            file_map = defaultdict(list)
-            for sprf in sprfs:
-                file_map[sprf.sourcepackagerelease].append(sprf)
-            for spr, files in file_map.items():
-                get_property_cache(spr).files = files
-            lfas = bulk.load_related(
-                LibraryFileAlias, sprfs, ["libraryfile_id"]
+    def preloadSourcesForPublishing(self, spphs):
+        """See `IPublishingSet`."""
+        # Preload everything which will be used by archivepublisher's
+        # build_source_stanza_fields.
+        bulk.load_related(Section, spphs, ["section_id"])
+        sprs = bulk.load_related(
+            SourcePackageRelease, spphs, ["sourcepackagerelease_id"]
+        )
+        bulk.load_related(SourcePackageName, sprs, ["sourcepackagename_id"])
+        spr_ids = set(map(attrgetter("id"), sprs))
+        sprfs = list(
+            IStore(SourcePackageReleaseFile)
+            .find(
+                SourcePackageReleaseFile,
+                SourcePackageReleaseFile.sourcepackagerelease_id.is_in(
+                    spr_ids
+                ),
             )
-            bulk.load_related(LibraryFileContent, lfas, ["content_id"])
-
-        return DecoratedResultSet(spphs, pre_iter_hook=eager_load)
+            .order_by(SourcePackageReleaseFile.libraryfile_id)
+        )
+        file_map = defaultdict(list)
+        for sprf in sprfs:
+            file_map[sprf.sourcepackagerelease].append(sprf)
+        for spr, files in file_map.items():
+            get_property_cache(spr).files = files
+        lfas = bulk.load_related(LibraryFileAlias, sprfs, ["libraryfile_id"])
+        bulk.load_related(LibraryFileContent, lfas, ["content_id"])
 
     def getBinariesForPublishing(
-        self, archive, distroarchseries=None, pocket=None, component=None
+        self,
+        archive,
+        distroarchseries=None,
+        pocket=None,
+        component=None,
+        preload=True,
     ):
         """See `IPublishingSet`."""
         clauses = [
@@ -2177,38 +2304,36 @@ def getBinariesForPublishing(
             .find(BinaryPackagePublishingHistory, *clauses)
             .order_by(BinaryPackageName.name)
         )
+        if not preload:
+            return bpphs
+        return DecoratedResultSet(
+            bpphs, pre_iter_hook=self.preloadBinariesForPublishing
+        )
 
-        def eager_load(bpphs):
-            # Preload everything which will be used by archivepublisher's
-            # build_binary_stanza_fields.
-            bulk.load_related(Section, bpphs, ["section_id"])
-            bprs = bulk.load_related(
-                BinaryPackageRelease, bpphs, ["binarypackagerelease_id"]
-            )
-            bpbs = bulk.load_related(BinaryPackageBuild, bprs, ["build_id"])
-            sprs = bulk.load_related(
-                SourcePackageRelease, bpbs, ["source_package_release_id"]
-            )
-            bpfs = bulk.load_referencing(
-                BinaryPackageFile, bprs, ["binarypackagerelease_id"]
-            )
-            file_map = defaultdict(list)
-            for bpf in bpfs:
-                file_map[bpf.binarypackagerelease].append(bpf)
-            for bpr, files in file_map.items():
-                get_property_cache(bpr).files = files
-            lfas = bulk.load_related(
-                LibraryFileAlias, bpfs, ["libraryfile_id"]
-            )
-            bulk.load_related(LibraryFileContent, lfas, ["content_id"])
-            bulk.load_related(
-                SourcePackageName, sprs, ["sourcepackagename_id"]
-            )
-            bulk.load_related(
-                BinaryPackageName, bprs, ["binarypackagename_id"]
-            )
-
-        return DecoratedResultSet(bpphs, pre_iter_hook=eager_load)
+    def preloadBinariesForPublishing(self, bpphs):
+        """See `IPublishingSet`."""
+        # Preload everything which will be used by archivepublisher's
+        # build_binary_stanza_fields.
+        bulk.load_related(Section, bpphs, ["section_id"])
+        bprs = bulk.load_related(
+            BinaryPackageRelease, bpphs, ["binarypackagerelease_id"]
+        )
+        bpbs = bulk.load_related(BinaryPackageBuild, bprs, ["build_id"])
+        sprs = bulk.load_related(
+            SourcePackageRelease, bpbs, ["source_package_release_id"]
+        )
+        bpfs = bulk.load_referencing(
+            BinaryPackageFile, bprs, ["binarypackagerelease_id"]
+        )
+        file_map = defaultdict(list)
+        for bpf in bpfs:
+            file_map[bpf.binarypackagerelease].append(bpf)
+        for bpr, files in file_map.items():
+            get_property_cache(bpr).files = files
+        lfas = bulk.load_related(LibraryFileAlias, bpfs, ["libraryfile_id"])
+        bulk.load_related(LibraryFileContent, lfas, ["content_id"])
+        bulk.load_related(SourcePackageName, sprs, ["sourcepackagename_id"])
+        bulk.load_related(BinaryPackageName, bprs, ["binarypackagename_id"])
 
     def getChangesFilesForSources(self, one_or_more_source_publications):
         """See `IPublishingSet`."""
@@ -4,6 +4,8 @@
 """Package copying utilities."""
 
 __all__ = [
+    "BulkCopyChecker",
+    "BulkPackageCopier",
     "CopyChecker",
     "check_copy_permissions",
     "do_copy",
@@ -11,15 +13,22 @@
     "update_files_privacy",
 ]
 
+from collections import defaultdict
+
 import apt_pkg
+import transaction
 from lazr.delegates import delegate_to
+from storm.expr import And, Cast, Desc, Or
 from zope.component import getAdapter, getUtility
 from zope.security.proxy import removeSecurityProxy
 
 from lp.app.interfaces.security import IAuthorization
 from lp.registry.interfaces.role import IPersonRoles
 from lp.registry.model.person import Person
+from lp.registry.model.sourcepackagename import SourcePackageName
 from lp.services.database.bulk import load_related
+from lp.services.database.interfaces import IStore
+from lp.services.looptuner import TunableLoop
 from lp.soyuz.adapters.overrides import SourceOverride
 from lp.soyuz.enums import SourcePackageFormat
 from lp.soyuz.interfaces.archive import CannotCopy
@@ -35,6 +44,8 @@
 from lp.soyuz.model.processacceptedbugsjob import (
     close_bugs_for_sourcepublication,
 )
+from lp.soyuz.model.publishing import SourcePackagePublishingHistory
+from lp.soyuz.model.sourcepackagerelease import SourcePackageRelease
 from lp.soyuz.scripts.custom_uploads_copier import CustomUploadsCopier
 
 
@@ -301,6 +312,45 @@ def getConflicts(self, candidate):
         inventory_key = self._getInventoryKey(candidate)
         return self._inventory.get(inventory_key, [])
 
+    def _getDestinationConflicts(self, source):
+        """Return publications of the same source version in the archive.
+
+        :param source: copy candidate, `ISourcePackagePublishingHistory`.
+        :return: a list of `ISourcePackagePublishingHistory`.
+        """
+        return list(
+            self.archive.getPublishedSources(
+                name=source.sourcepackagerelease.name,
+                version=source.sourcepackagerelease.version,
+                exact_match=True,
+            )
+        )
+
+    def _getDestinationFiles(self, source_files):
+        """Return the SHA-1s of the named source files in the archive.
+
+        :param source_files: a list of file names.
+        :return: a dict mapping file names to SHA-1s.
+        """
+        return self.archive.getFilesAndSha1s(source_files)
+
+    def _getAncestry(self, source, series, pocket):
+        """Return the active publication of the source in the destination.
+
+        :param source: copy candidate, `ISourcePackagePublishingHistory`.
+        :param series: destination `IDistroSeries`.
+        :param pocket: destination `PackagePublishingPocket`.
+        :return: the `ISourcePackagePublishingHistory` with the highest
+            version, or None.
+        """
+        return self.archive.getPublishedSources(
+            name=source.source_package_name,
+            exact_match=True,
+            distroseries=series,
+            pocket=pocket,
+            status=active_publishing_status,
+        ).first()
+
     def _checkArchiveConflicts(self, source, series):
         """Check for possible conflicts in the destination archive.
 
@@ -321,26 +371,19 @@ def _checkArchiveConflicts(self, source, series):
         :raise CannotCopy: when a copy is not allowed to be performed
             containing the reason of the error.
         """
-        destination_archive_conflicts = self.archive.getPublishedSources(
-            name=source.sourcepackagerelease.name,
-            version=source.sourcepackagerelease.version,
-            exact_match=True,
-        )
+        destination_archive_conflicts = self._getDestinationConflicts(source)
 
         inventory_conflicts = self.getConflicts(source)
 
         # If there are no conflicts with the same version, we can skip the
         # rest of the checks, but we still want to check conflicting files
         if (
-            destination_archive_conflicts.is_empty()
+            len(destination_archive_conflicts) == 0
             and len(inventory_conflicts) == 0
         ):
             self._checkConflictingFiles(source)
             return
 
-        # Cache the conflicting publications because they will be iterated
-        # more than once.
-        destination_archive_conflicts = list(destination_archive_conflicts)
         destination_archive_conflicts.extend(inventory_conflicts)
 
         # Identify published binaries and incomplete builds or unpublished
@@ -442,7 +485,7 @@ def _checkConflictingFiles(self, source):
             sprf.libraryfile.filename
             for sprf in source.sourcepackagerelease.files
         ]
-        destination_sha1s = self.archive.getFilesAndSha1s(source_files)
+        destination_sha1s = self._getDestinationFiles(source_files)
         for lf in source.sourcepackagerelease.files:
             if lf.libraryfile.filename in destination_sha1s:
                 sha1 = lf.libraryfile.content.sha1
@@ -535,13 +578,7 @@ def checkCopy(
         # published in the destination archive.
         self._checkArchiveConflicts(source, series)
 
-        ancestry = self.archive.getPublishedSources(
-            name=source.source_package_name,
-            exact_match=True,
-            distroseries=series,
-            pocket=pocket,
-            status=active_publishing_status,
-        ).first()
+        ancestry = self._getAncestry(source, series, pocket)
         if ancestry is not None:
             ancestry_version = ancestry.sourcepackagerelease.version
             copy_version = source.sourcepackagerelease.version
@@ -566,6 +603,143 @@ def checkCopy(
         self.addCopy(source)
 
 
+class BulkCopyChecker(CopyChecker):
+    """Check many copy candidates, looking up the destination in bulk.
+
+    `prefetch` must be called with the candidates before any of them are
+    checked.  It finds conflicting publications, ancestry and existing
+    files in the destination archive for all of the candidates at once,
+    rather than with several queries per candidate.
+    """
+
+    def prefetch(self, sources, series, pocket):
+        """Look up the destination archive for a batch of candidates.
+
+        :param sources: a list of `ISourcePackagePublishingHistory`.
+        :param series: the destination `IDistroSeries`, or None to copy
+            each source to its own series.
+        :param pocket: the destination `PackagePublishingPocket`.
+        """
+        getUtility(IPublishingSet).preloadSourcesForPublishing(
+            [removeSecurityProxy(source) for source in sources]
+        )
+
+        # Publications of the same versions anywhere in the archive.
+        self._conflicts = defaultdict(list)
+        versions = {
+            (
+                source.sourcepackagerelease.name,
+                source.sourcepackagerelease.version,
+            )
+            for source in sources
+        }
+        if versions:
+            conflicts = IStore(SourcePackagePublishingHistory).find(
+                (
+                    SourcePackagePublishingHistory,
+                    SourcePackageName.name,
+                    SourcePackageRelease.version,
+                ),
+                SourcePackagePublishingHistory.archive == self.archive,
+                SourcePackagePublishingHistory.sourcepackagerelease_id
+                == SourcePackageRelease.id,
+                SourcePackageRelease.sourcepackagename_id
+                == SourcePackageName.id,
+                Or(
+                    *(
+                        And(
+                            SourcePackageName.name == name,
+                            Cast(SourcePackageRelease.version, "text")
+                            == version,
+                        )
+                        for name, version in versions
+                    )
+                ),
+            )
+            for conflict, name, version in conflicts.order_by(
+                Desc(SourcePackagePublishingHistory.id)
+            ):
+                self._conflicts[(name, version)].append(conflict)
+
+        # Active publications of the same packages in the destination
+        # suites, highest version first.
+        self._destination_sources = defaultdict(list)
+        names_by_series = defaultdict(set)
+        for source in sources:
+            destination_series = series or source.distroseries
+            names_by_series[destination_series].add(source.source_package_name)
+        for destination_series, names in names_by_series.items():
+            for pub in self.archive.getPublishedSources(
+                name=sorted(names),
+                exact_match=True,
+                distroseries=destination_series,
+                pocket=pocket,
+                status=active_publishing_status,
+                eager_load=True,
+            ):
+                self._destination_sources[
+                    (destination_series.id, pub.source_package_name)
+                ].append(pub)
+
+        # Files in the destination archive with the same names as files
+        # in candidates from other archives.
+        filenames = {
+            sprf.libraryfile.filename
+            for source in sources
+            if source.archive.id != self.archive.id
+            for sprf in source.sourcepackagerelease.files
+        }
+        if filenames:
+            self._destination_files = self.archive.getFilesAndSha1s(
+                sorted(filenames)
+            )
+        else:
+            self._destination_files = {}
+
+    def _getDestinationConflicts(self, source):
+        """See `CopyChecker`."""
+        return list(
+            self._conflicts[
+                (
+                    source.sourcepackagerelease.name,
+                    source.sourcepackagerelease.version,
+                )
+            ]
+        )
+
+    def _getDestinationFiles(self, source_files):
+        """See `CopyChecker`."""
+        return {
+            filename: self._destination_files[filename]
+            for filename in source_files
+            if filename in self._destination_files
+        }
+
+    def _getAncestry(self, source, series, pocket):
+        """See `CopyChecker`."""
+        pubs = self._destination_sources[
+            (series.id, source.source_package_name)
+        ]
+        return pubs[0] if pubs else None
+
+    def getDestinationSource(self, source, series):
+        """Return this version of the source if already in the destination.
+
+        :param source: copy candidate, `ISourcePackagePublishingHistory`.
+        :param series: destination `IDistroSeries`.
+        :return: an active `ISourcePackagePublishingHistory`, or None.
+        """
+        for pub in self._destination_sources[
+            (series.id, source.source_package_name)
+        ]:
+            if (
+                pub.sourcepackagerelease.version
+                == source.sourcepackagerelease.version
+            ):
+                return pub
+        return None
+
+
 def do_copy(
     sources,
     archive,
@@ -836,7 +1010,6 @@ def _do_direct_copy(
         publications.
     """
     copies = []
-    custom_files = []
 
     # Copy source if it's not yet copied.
     source_in_destination = archive.getPublishedSources(
@@ -876,6 +1049,59 @@ def _do_direct_copy(
         copies.append(source_copy)
     else:
         source_copy = source_in_destination.first()
+
+    copies.extend(
+        _copy_binaries_and_uploads(
+            source,
+            source_copy,
+            archive,
+            series,
+            pocket,
+            include_binaries,
+            policy,
+            override,
+            logger=logger,
+        )
+    )
+
+    if move:
+        removal_comment = "Moved to %s" % series.getSuite(pocket)
+        if archive != source.archive:
+            removal_comment += " in %s" % archive.reference
+        getUtility(IPublishingSet).requestDeletion(
+            [source], creator, removal_comment=removal_comment
+        )
+
+    return copies
+
+
+def _copy_binaries_and_uploads(
+    source,
+    source_copy,
+    archive,
+    series,
+    pocket,
+    include_binaries,
+    policy,
+    override,
+    logger=None,
+):
+    """Finish copying a source once its publication has been copied.
+
+    Copy the source's binaries if requested, copy any custom uploads that
+    came with the source or its binaries, and create any builds that the
+    copied source still needs.
+
+    :param source: the original `ISourcePackagePublishingHistory`.
+    :param source_copy: the `ISourcePackagePublishingHistory` in the
+        destination.
+    :param policy: the destination's `IOverridePolicy`, or None.
+    :param override: the `ISourceOverride` applied to the copied source.
+
+    :return: a list of the copied `BinaryPackagePublishingHistory` records.
+    """
+    copies = []
+    custom_files = []
     if source_copy.packageupload is not None:
         custom_files.extend(source_copy.packageupload.customfiles)
 
@@ -920,12 +1146,235 @@ def _do_direct_copy(
     if source_copy.sourcepackagerelease.ci_build is None:
         source_copy.createMissingBuilds(logger=logger)
 
-    if move:
-        removal_comment = "Moved to %s" % series.getSuite(pocket)
-        if archive != source.archive:
-            removal_comment += " in %s" % archive.reference
-        getUtility(IPublishingSet).requestDeletion(
-            [source], creator, removal_comment=removal_comment
+    return copies
+
+
+class BulkPackageCopier(TunableLoop):
+    """Copy a large number of sources, a chunk at a time.
+
+    This is a variant of `do_copy` for copies too large to make in a
+    single transaction, such as archive rebuilds.  Each chunk of
+    candidates is checked with a `BulkCopyChecker`, its source
+    publications are created with a single insert by
+    `IPublishingSet.copySources`, and it is committed before the next
+    chunk is started.
+
+    Unlike `do_copy`, this does not send notifications or support moves,
+    and a candidate that cannot be copied does not stop the others from
+    being copied: the reasons for skipping candidates are collected in
+    `errors` instead.
+    """
+
+    maximum_chunk_size = 1000
+
+    def __init__(
+        self,
+        log,
+        sources,
+        archive,
+        series,
+        pocket,
+        include_binaries=False,
+        person=None,
+        check_permissions=True,
+        strict_binaries=True,
+        close_bugs=True,
+        create_dsd_job=True,
+        unembargo=False,
+        phased_update_percentage=None,
+        dry_run=False,
+        abort_time=None,
+    ):
+        """Create a bulk copier.
+
+        The parameters are as for `do_copy`, except for:
+
+        :param log: a logger.
+        :param dry_run: if True, abort each chunk rather than committing it.
+        :param abort_time: if not None, stop after this many seconds.
+        """
+        super().__init__(log, abort_time)
+        self.sources = list(sources)
+        self.archive = archive
+        self.series = series
+        self.pocket = pocket
+        self.include_binaries = include_binaries
+        self.person = person
+        self.check_permissions = check_permissions
+        self.strict_binaries = strict_binaries
+        self.close_bugs = close_bugs
+        self.create_dsd_job = create_dsd_job
+        self.unembargo = unembargo
+        self.phased_update_percentage = phased_update_percentage
+        self.dry_run = dry_run
+        self.start_at = 0
+        self.copied = 0
+        self.errors = []
+
+    def isDone(self):
+        return self.start_at >= len(self.sources)
+
+    def __call__(self, chunk_size):
+        chunk = self.sources[self.start_at : self.start_at + int(chunk_size)]
+        copies = self.copyChunk(chunk)
+        self.copied += len(copies)
+        self.start_at += len(chunk)
+        if self.dry_run:
+            transaction.abort()
+        else:
+            transaction.commit()
+        self.log.debug(
+            "Copied %d publications for %d of %d sources.",
+            self.copied,
+            self.start_at,
+            len(self.sources),
         )
 
-    return copies
+    def _getDestinationSeries(self, source):
+        return self.series if self.series is not None else source.distroseries
+
+    def copyChunk(self, sources):
+        """Check and copy a chunk of sources.
+
+        :return: a list of the new `ISourcePackagePublishingHistory` and
+            `IBinaryPackagePublishingHistory` records.
+        """
+        copy_checker = BulkCopyChecker(
+            self.archive,
+            self.include_binaries,
+            strict_binaries=self.strict_binaries,
+            unembargo=self.unembargo,
+        )
+        copy_checker.prefetch(sources, self.series, self.pocket)
+        sources_by_series = defaultdict(list)
+        for source in sources:
+            sources_by_series[self._getDestinationSeries(source)].append(
+                source
+            )
+        for series, series_sources in sources_by_series.items():
+            # Check permissions for all the sources in a series at once,
+            # and only check them one at a time to find out which ones
+            # are refused.
+            check_each = False
+            if self.check_permissions:
+                try:
+                    check_copy_permissions(
+                        self.person,
+                        self.archive,
+                        series,
+                        self.pocket,
+                        series_sources,
+                    )
+                except CannotCopy:
+                    check_each = True
+            for source in series_sources:
+                try:
+                    copy_checker.checkCopy(
+                        source,
+                        series,
+                        self.pocket,
+                        self.person,
+                        check_permissions=check_each,
+                    )
+                except CannotCopy as reason:
+                    self.errors.append(
+                        "%s (%s)" % (source.displayname, reason)
+                    )
+
+        checked_by_series = defaultdict(list)
+        for source in copy_checker.getCheckedCopies():
+            checked_by_series[self._getDestinationSeries(source)].append(
+                source
+            )
+        copies = []
+        for series, series_sources in checked_by_series.items():
+            copies.extend(
+                self._copyToSeries(copy_checker, series, series_sources)
+            )
+        return copies
+
+    def _copyToSeries(self, copy_checker, series, sources):
+        """Copy checked sources to a single destination series."""
+        policy = self.archive.getOverridePolicy(
+            series,
+            self.pocket,
+            phased_update_percentage=self.phased_update_percentage,
+        )
+        overrides = {}
+        if policy is not None:
+            overrides = policy.calculateSourceOverrides(
+                {
+                    source.sourcepackagerelease.sourcepackagename: (
+                        SourceOverride()
+                    )
+                    for source in sources
+                }
+            )
+
+        # Several candidates may be the same source release, which only
+        # needs to be copied once.
+        new_sources = {}
+        for source in sources:
+            if copy_checker.getDestinationSource(source, series) is None:
+                new_sources.setdefault(
+                    source.sourcepackagerelease.id, source.context
+                )
+        new_pubs = getUtility(IPublishingSet).copySources(
+            self.archive,
+            series,
+            self.pocket,
+            list(new_sources.values()),
+            overrides=overrides,
+            create_dsd_job=self.create_dsd_job,
+            creator=self.person,
+        )
+        new_pubs_by_release = {
+            pub.sourcepackagerelease_id: pub for pub in new_pubs
+        }
+
+        copies = []
+        for source in sources:
+            sub_copies = []
+            source_copy = new_pubs_by_release.pop(
+                source.sourcepackagerelease.id, None
+            )
+            if source_copy is not None:
+                if self.close_bugs:
+                    ancestry = copy_checker._getAncestry(
+                        source, series, self.pocket
+                    )
+                    close_bugs_for_sourcepublication(
+                        source_copy,
+                        (
+                            ancestry.sourcepackagerelease.version
+                            if ancestry is not None
+                            else None
+                        ),
+                    )
+                sub_copies.append(source_copy)
+            else:
+                source_copy = copy_checker.getDestinationSource(source, series)
+                if source_copy is None:
+                    # Copied for an earlier candidate in this chunk.
+                    continue
+            sub_copies.extend(
+                _copy_binaries_and_uploads(
+                    source,
+                    source_copy,
+                    self.archive,
+                    series,
+                    self.pocket,
+                    self.include_binaries,
+                    policy,
+                    overrides.get(
+                        source.sourcepackagerelease.sourcepackagename
+                    ),
+                    logger=self.log,
+                )
+            )
+            if not self.archive.private and source.hasRestrictedFiles():
+                for pub_record in sub_copies:
+                    for changed_file in update_files_privacy(pub_record):
+                        self.log.info("Made %s public" % changed_file.filename)
+            copies.extend(sub_copies)
+        return copies
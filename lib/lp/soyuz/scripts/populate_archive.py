@@ -23,7 +23,9 @@
 from lp.soyuz.interfaces.component import IComponentSet
 from lp.soyuz.interfaces.packagecloner import IPackageCloner
 from lp.soyuz.interfaces.packagecopyrequest import IPackageCopyRequestSet
+from lp.soyuz.interfaces.publishing import active_publishing_status
 from lp.soyuz.scripts.ftpmasterbase import SoyuzScript, SoyuzScriptError
+from lp.soyuz.scripts.packagecopier import BulkPackageCopier
 
 
 def specified(option):
@@ -70,6 +72,7 @@ def populateArchive(
         packageset_delta_flag,
         packageset_tags,
         nonvirtualized,
+        bulk_copy_flag=False,
     ):
         """Create archive, populate it with packages and builds.
 
@@ -99,6 +102,8 @@ def populateArchive(
 
         :param packageset_tags: list of packagesets to limit the packages
             copied to.
+        :param bulk_copy_flag: whether to copy the origin's sources in
+            chunks with a `BulkPackageCopier` rather than cloning them.
         """
 
         def loadProcessors(arch_tags):
@@ -277,7 +282,9 @@ def build_location(distro, suite, component, packageset_names=None):
         pcr.markAsInprogress()
         self.txn.commit()
 
-        if merge_copy_flag:
+        if bulk_copy_flag:
+            self._bulkCopy(the_origin, the_destination)
+        elif merge_copy_flag:
             pkg_cloner.mergeCopy(the_origin, the_destination)
         else:
             pkg_cloner.clonePackages(
@@ -287,6 +294,43 @@ def build_location(distro, suite, component, packageset_names=None):
         # Mark the package copy request as completed.
         pcr.markAsCompleted()
 
+    def _bulkCopy(self, origin, destination):
+        """Copy the origin's sources a chunk at a time.
+
+        Unlike `IPackageCloner`, this goes through the usual copy checks,
+        and only logs the sources that cannot be copied rather than
+        failing the whole population.
+        """
+        names = None
+        if origin.packagesets:
+            names = set()
+            for packageset in origin.packagesets:
+                names.update(packageset.getSourcesIncluded())
+        sources = origin.archive.getPublishedSources(
+            name=sorted(names) if names is not None else None,
+            distroseries=origin.distroseries,
+            pocket=origin.pocket,
+            status=active_publishing_status,
+            component_name=(
+                origin.component.name if origin.component is not None else None
+            ),
+        )
+        copier = BulkPackageCopier(
+            self.logger,
+            sources,
+            destination.archive,
+            destination.distroseries,
+            destination.pocket,
+            check_permissions=False,
+            close_bugs=False,
+            create_dsd_job=False,
+            dry_run=self.options.dryrun,
+        )
+        copier.run()
+        for error in copier.errors:
+            self.logger.warning("Not copied: %s", error)
+        self.logger.info("Copied %d publications.", copier.copied)
+
     def _packageset_delta(self, origin, destination):
         """Perform a package set delta operation between two archives.
 
@@ -348,6 +392,7 @@ def mainTask(self):
             opts.packageset_delta_flag,
             opts.packageset_tags,
             opts.nonvirtualized,
+            bulk_copy_flag=opts.bulk_copy_flag,
         )
 
     def add_my_options(self):
@@ -472,6 +517,17 @@ def add_my_options(self):
             help="Create the archive as nonvirtual if specified.",
         )
 
+        self.parser.add_option(
+            "--bulk-copy",
+            dest="bulk_copy_flag",
+            default=False,
+            action="store_true",
+            help=(
+                "Copy the packages in chunks through the package copier, "
+                "committing after each chunk."
+            ),
+        )
+
     def setupLocation(self):
         # SoyuzScript's default model of a single context location doesn't
         # make sense here.
@@ -14,6 +14,7 @@
 from lp.services.database.bulk import load_related
 from lp.services.database.interfaces import IStore
 from lp.services.looptuner import LoopTuner, TunableLoop
+from lp.soyuz.adapters.builddependencies import BuildDependencyResolver
 from lp.soyuz.interfaces.binarypackagebuild import UnparsableDependencies
 from lp.soyuz.model.binarypackagebuild import BinaryPackageBuild
 from lp.soyuz.model.distroarchseries import PocketChroot
@@ -58,6 +59,7 @@ def __call__(self, chunk_size):
             PocketChroot.chroot != None,
         )
         chroot_series = {chroot.distroarchseries_id for chroot in chroots}
+        builds = []
         for build in bpbs:
             das = build.distro_arch_series
             if (
@@ -67,8 +69,12 @@ def __call__(self, chunk_size):
                 or not das.enabled
             ):
                 continue
+            builds.append(build)
+        # Look up the dependencies of the whole chunk at once.
+        resolver = BuildDependencyResolver(builds)
+        for build in builds:
             try:
-                build.updateDependencies()
+                build.updateDependencies(resolver=resolver)
             except UnparsableDependencies as e:
                 self.log.error(e)
                 continue
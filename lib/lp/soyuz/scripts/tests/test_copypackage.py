@@ -24,6 +24,7 @@
 from lp.registry.interfaces.sourcepackage import SourcePackageType
 from lp.services.database.constants import UTC_NOW
 from lp.services.database.sqlbase import flush_database_caches
+from lp.services.log.logger import DevNullLogger
 from lp.soyuz.adapters.overrides import SourceOverride
 from lp.soyuz.enums import (
     ArchivePermissionType,
@@ -48,6 +49,8 @@
     SourcePackagePublishingHistory,
 )
 from lp.soyuz.scripts.packagecopier import (
+    BulkCopyChecker,
+    BulkPackageCopier,
     CopyChecker,
     _do_direct_copy,
     do_copy,
@@ -2845,3 +2848,125 @@ def test_copies_to_ppa_do_not_close_bugs(self):
         proposed_bug = getUtility(IBugSet).get(proposed_bug_id)
         [proposed_bug_task] = proposed_bug.bugtasks
         self.assertEqual(proposed_bug_task.status, BugTaskStatus.NEW)
+
+
+class TestBulkPackageCopier(TestCaseWithFactory):
+    layer = LaunchpadZopelessLayer
+
+    def setUp(self):
+        super().setUp()
+        self.test_publisher = SoyuzTestPublisher()
+        self.test_publisher.prepareBreezyAutotest()
+        self.archive = self.factory.makeArchive(
+            distribution=self.test_publisher.ubuntutest
+        )
+        self.series = self.test_publisher.breezy_autotest
+        self.pocket = PackagePublishingPocket.RELEASE
+
+    def makeSources(self, count):
+        return [
+            self.test_publisher.getPubSource(
+                sourcename="name-%d" % self.factory.getUniqueInteger(),
+                status=PackagePublishingStatus.PUBLISHED,
+            )
+            for _ in range(count)
+        ]
+
+    def makeCopier(self, sources, **kwargs):
+        return BulkPackageCopier(
+            DevNullLogger(),
+            sources,
+            self.archive,
+            self.series,
+            self.pocket,
+            check_permissions=False,
+            **kwargs,
+        )
+
+    def getCopiedNames(self):
+        return [
+            pub.source_package_name
+            for pub in self.archive.getPublishedSources(
+                distroseries=self.series, pocket=self.pocket
+            )
+        ]
+
+    def test_copies_sources_in_chunks(self):
+        sources = self.makeSources(3)
+        copier = self.makeCopier(sources)
+        transaction.commit()
+        copier(2)
+        self.assertEqual(2, copier.start_at)
+        self.assertFalse(copier.isDone())
+        copier(2)
+        self.assertTrue(copier.isDone())
+        self.assertEqual(3, copier.copied)
+        self.assertEqual([], copier.errors)
+        self.assertContentEqual(
+            [source.source_package_name for source in sources],
+            self.getCopiedNames(),
+        )
+
+    def test_copied_source_records_origin(self):
+        [source] = self.makeSources(1)
+        [copy] = self.makeCopier([source]).copyChunk([source])
+        self.assertEqual(
+            source.sourcepackagerelease, copy.sourcepackagerelease
+        )
+        self.assertEqual(source.archive, copy.copied_from_archive)
+        self.assertEqual(PackagePublishingStatus.PENDING, copy.status)
+
+    def test_collects_errors(self):
+        # Candidates that cannot be copied are skipped and reported,
+        # without stopping the others from being copied.
+        old, new = self.makeSources(2)
+        self.test_publisher.getPubSource(
+            sourcename=old.source_package_name,
+            version="999",
+            archive=self.archive,
+            status=PackagePublishingStatus.PUBLISHED,
+        )
+        copier = self.makeCopier([old, new])
+        copies = copier.copyChunk([old, new])
+        self.assertEqual(
+            [new.sourcepackagerelease],
+            [copy.sourcepackagerelease for copy in copies],
+        )
+        self.assertEqual(1, len(copier.errors))
+        self.assertIn("version older than", copier.errors[0])
+
+    def test_dry_run(self):
+        sources = self.makeSources(2)
+        copier = self.makeCopier(sources, dry_run=True)
+        transaction.commit()
+        copier(10)
+        self.assertTrue(copier.isDone())
+        self.assertEqual([], self.getCopiedNames())
+
+    def test_check_queries(self):
+        # Checking a chunk of candidates with a BulkCopyChecker issues
+        # fewer queries than checking them one at a time.
+        def record_check(checker_class, sources):
+            flush_database_caches()
+            with StormStatementRecorder() as recorder:
+                copy_checker = checker_class(
+                    self.archive, include_binaries=False
+                )
+                if checker_class is BulkCopyChecker:
+                    copy_checker.prefetch(sources, self.series, self.pocket)
+                for source in sources:
+                    copy_checker.checkCopy(
+                        source,
+                        self.series,
+                        self.pocket,
+                        check_permissions=False,
+                    )
+                self.assertEqual(
+                    len(sources), len(list(copy_checker.getCheckedCopies()))
+                )
+            return recorder
+
+        sources = self.makeSources(10)
+        bulk_recorder = record_check(BulkCopyChecker, sources)
+        recorder = record_check(CopyChecker, sources)
+        self.assertThat(bulk_recorder, HasQueryCount(LessThan(recorder.count)))
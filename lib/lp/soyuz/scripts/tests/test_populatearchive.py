@@ -492,6 +492,33 @@ def testMergeCopy(self):
             },
         )
 
+    def testBulkCopy(self):
+        """Populate a copy archive with --bulk-copy.
+
+        The sources go through the package copier rather than the cloner,
+        and build records are still created for them.
+        """
+        hoary = getUtility(IDistributionSet)["ubuntu"]["hoary"]
+
+        # Verify that we have the right source packages in the sample data.
+        self._verifyPackagesInSampleData(hoary)
+
+        extra_args = ["-a", "386", "--bulk-copy"]
+        copy_archive = self.runScript(
+            extra_args=extra_args,
+            exists_after=True,
+            output_substr="Copied 7 publications.",
+        )
+        self._verifyClonedSourcePackages(copy_archive, hoary)
+
+        builds = getUtility(IBinaryPackageBuildSet).getBuildsForArchive(
+            copy_archive, status=BuildStatus.NEEDSBUILD
+        )
+        build_spns = [
+            get_spn(removeSecurityProxy(build)).name for build in builds
+        ]
+        self.assertEqual(self.expected_build_spns, sorted(build_spns))
+
     def testUnknownOriginArchive(self):
         """Try copy archive population with a unknown origin archive.
 
@@ -3,10 +3,17 @@
 
 """Test update-pkgcache."""
 
+from datetime import datetime, timezone
+
 import transaction
+from zope.component import getUtility
 
 from lp.services.log.logger import BufferLogger
+from lp.services.scripts.interfaces.scriptactivity import IScriptActivitySet
 from lp.soyuz.enums import PackagePublishingStatus
+from lp.soyuz.model.distributionsourcepackagecache import (
+    DistributionSourcePackageCache,
+)
 from lp.soyuz.model.distroseriespackagecache import DistroSeriesPackageCache
 from lp.soyuz.scripts.update_pkgcache import PackageCacheUpdater
 from lp.testing import TestCaseWithFactory
@@ -94,3 +101,95 @@ def commit(self):
             "DEBUG Committing\n".format(bpns=bpns),
             logger.getLogBuffer(),
         )
+
+    def test_getHighWaterMark(self):
+        # The high-water mark is a little before the start of the last
+        # successful run.
+        script = self.makeScript()
+        self.assertIsNone(script.getHighWaterMark())
+        date_started = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        getUtility(IScriptActivitySet).recordSuccess(
+            script.name, date_started, datetime.now(timezone.utc)
+        )
+        self.assertEqual(
+            date_started - script.incremental_overlap,
+            script.getHighWaterMark(),
+        )
+
+    def test_updateChangedCaches(self):
+        # An incremental update only updates the caches of packages whose
+        # publications have changed.
+        distroseries = self.factory.makeDistroSeries()
+        distribution = distroseries.distribution
+        das = self.factory.makeDistroArchSeries(distroseries=distroseries)
+        archive, other_archive = [
+            self.factory.makeArchive(distribution=distribution)
+            for _ in range(2)
+        ]
+        old_date = datetime(2010, 1, 1, tzinfo=timezone.utc)
+        since = datetime(2015, 1, 1, tzinfo=timezone.utc)
+
+        def make_publications(archive, datecreated):
+            spph = self.factory.makeSourcePackagePublishingHistory(
+                distroseries=distroseries,
+                archive=archive,
+                status=PackagePublishingStatus.PUBLISHED,
+                date_uploaded=datecreated,
+            )
+            bpph = self.factory.makeBinaryPackagePublishingHistory(
+                distroarchseries=das,
+                archive=archive,
+                status=PackagePublishingStatus.PUBLISHED,
+                datecreated=datecreated,
+            )
+            return spph, bpph
+
+        old_pubs = [make_publications(archive, old_date) for _ in range(2)]
+        make_publications(other_archive, old_date)
+        script = self.makeScript()
+        with dbuser(self.dbuser):
+            script.updateDistributionCache(distribution, archive)
+            archive.updateArchiveCache()
+        self.assertEqual(2, archive.sources_cached)
+        self.assertEqual(2, archive.binaries_cached)
+
+        new_spph, new_bpph = make_publications(
+            archive, datetime.now(timezone.utc)
+        )
+        for pub in old_pubs[0]:
+            pub.requestDeletion(archive.owner)
+        with dbuser(self.dbuser):
+            script.updateChangedCaches(distribution, since)
+
+        self.assertContentEqual(
+            [
+                old_pubs[1][0].sourcepackagename.name,
+                new_spph.sourcepackagename.name,
+            ],
+            [
+                cache.name
+                for cache in DistributionSourcePackageCache._find(
+                    distribution, archive
+                )
+            ],
+        )
+        self.assertContentEqual(
+            [
+                old_pubs[1][1].binarypackagename.name,
+                new_bpph.binarypackagename.name,
+            ],
+            [
+                cache.name
+                for cache in DistroSeriesPackageCache._find(
+                    distroseries, archive
+                )
+            ],
+        )
+        self.assertEqual(2, archive.sources_cached)
+        self.assertEqual(2, archive.binaries_cached)
+        self.assertIn(
+            new_spph.sourcepackagename.name, archive.package_description_cache
+        )
+        # Nothing changed in the other archive, so it was left alone.
+        self.assertEqual(0, other_archive.sources_cached)
+        self.assertEqual(0, other_archive.binaries_cached)
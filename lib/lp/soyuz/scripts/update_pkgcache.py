@@ -9,12 +9,19 @@
 
 __all__ = "PackageCacheUpdater"
 
+from collections import defaultdict
+from datetime import timedelta
+from operator import attrgetter
+
 from zope.component import getUtility
 
 from lp.registry.interfaces.distribution import IDistributionSet
+from lp.services.database import bulk
 from lp.services.scripts.base import LaunchpadCronScript
+from lp.services.scripts.interfaces.scriptactivity import IScriptActivitySet
 from lp.soyuz.enums import ArchivePurpose
 from lp.soyuz.interfaces.archive import IArchiveSet
+from lp.soyuz.model.archive import Archive
 from lp.soyuz.model.distributionsourcepackagecache import (
     DistributionSourcePackageCache,
 )
@@ -27,8 +34,39 @@ class PackageCacheUpdater(LaunchpadCronScript):
     It iterates over all distributions, distroseries and archives (including
     PPAs) updating the package caches to reflect what is currently published
     in those locations.
+
+    With --incremental, only the caches for packages whose publications
+    have changed since the last successful run are updated.
     """
 
+    # Publications are timestamped when their transaction starts, so some
+    # that were committed just after the previous run looked for them may
+    # appear to be older than it.  Look this far further back to catch
+    # them.
+    incremental_overlap = timedelta(hours=1)
+
+    def add_my_options(self):
+        self.parser.add_option(
+            "--incremental",
+            action="store_true",
+            default=False,
+            help=(
+                "Only update caches for packages whose publications have "
+                "changed since the last successful run."
+            ),
+        )
+
+    def getHighWaterMark(self):
+        """Return the time from which to look for changed publications.
+
+        :return: a timezone-aware `datetime`, or None if there is no
+            record of a previous successful run.
+        """
+        activity = getUtility(IScriptActivitySet).getLastActivity(self.name)
+        if activity is None:
+            return None
+        return activity.date_started - self.incremental_overlap
+
     def updateDistributionPackageCounters(self, distribution):
         """Update package counters for a given distribution."""
         for distroseries in distribution:
@@ -87,9 +125,71 @@ def updateDistroSeriesCache(self, distroseries, archive):
         if updates > 0:
             self.txn.commit()
 
+    def updateChangedCaches(self, distribution, since):
+        """Update package caches for publications changed since a time.
+
+        Only cache records for packages with changed publications are
+        updated, and only PPAs with changed publications have their
+        consolidated caches rebuilt.  Disabled archives are skipped; a
+        full run cleans up after them.
+        """
+        changed_binaries = defaultdict(dict)
+        for distroseries in distribution.series:
+            changed = DistroSeriesPackageCache.findChangedBinaryPackageNames(
+                distroseries, since
+            )
+            for archive_id, bpns in changed.items():
+                changed_binaries[archive_id][distroseries] = bpns
+        changed_sources = (
+            DistributionSourcePackageCache.findChangedSourcePackageNames(
+                distribution, since
+            )
+        )
+        archives = bulk.load(
+            Archive, set(changed_binaries) | set(changed_sources)
+        )
+        for archive in sorted(archives, key=attrgetter("id")):
+            # Only the main archives and PPAs have package caches.
+            if not (archive.is_main or archive.is_ppa):
+                continue
+            self.logger.info(
+                "Updating %s changed packages" % archive.displayname
+            )
+            for distroseries, bpns in sorted(
+                changed_binaries[archive.id].items(),
+                key=lambda item: item[0].id,
+            ):
+                DistroSeriesPackageCache.updateNames(
+                    distroseries, bpns, archive, ztm=self.txn, log=self.logger
+                )
+            spns = changed_sources.get(archive.id)
+            if spns:
+                DistributionSourcePackageCache.updateNames(
+                    distribution,
+                    spns,
+                    archive,
+                    ztm=self.txn,
+                    log=self.logger,
+                )
+            if archive.is_ppa:
+                archive.updateArchiveCache()
+            self.txn.commit()
+
     def main(self):
         self.logger.debug("Starting the package cache update")
 
+        since = None
+        if self.options.incremental:
+            since = self.getHighWaterMark()
+            if since is None:
+                self.logger.info(
+                    "No previous run recorded; updating all package caches"
+                )
+            else:
+                self.logger.info(
+                    "Updating packages changed since %s" % since.isoformat()
+                )
+
         # Do the package counter and cache update for each distribution.
         distroset = getUtility(IDistributionSet)
         for distribution in distroset:
@@ -98,25 +198,34 @@ def main(self):
             )
             self.updateDistributionPackageCounters(distribution)
 
-            self.logger.info("Updating %s main archives" % distribution.name)
-            for archive in distribution.all_distro_archives:
-                self.updateDistributionCache(distribution, archive)
+            if since is not None:
+                self.logger.info(
+                    "Updating %s changed packages" % distribution.name
+                )
+                self.updateChangedCaches(distribution, since)
+            else:
+                self.logger.info(
+                    "Updating %s main archives" % distribution.name
+                )
+                for archive in distribution.all_distro_archives:
+                    self.updateDistributionCache(distribution, archive)
 
             self.logger.info(
                 "Updating %s official branch links" % distribution.name
             )
             self.updateDistributionCache(distribution, None)
 
-            self.logger.info("Updating %s PPAs" % distribution.name)
-            archives = getUtility(IArchiveSet).getArchivesForDistribution(
-                distribution,
-                purposes=[ArchivePurpose.PPA],
-                check_permissions=False,
-                exclude_pristine=True,
-            )
-            for archive in archives:
-                self.updateDistributionCache(distribution, archive)
-                archive.updateArchiveCache()
+            if since is None:
+                self.logger.info("Updating %s PPAs" % distribution.name)
+                archives = getUtility(IArchiveSet).getArchivesForDistribution(
+                    distribution,
+                    purposes=[ArchivePurpose.PPA],
+                    check_permissions=False,
+                    exclude_pristine=True,
+                )
+                for archive in archives:
+                    self.updateDistributionCache(distribution, archive)
+                    archive.updateArchiveCache()
 
             # Commit any remaining update for a distribution.
             self.txn.commit()
@@ -0,0 +1,72 @@
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Test the files recorded as shipped in binary packages."""
+
+import hashlib
+
+from zope.component import getUtility
+
+from lp.soyuz.interfaces.binarypackagereleasecontents import (
+    IBinaryPackageReleaseContentsSet,
+)
+from lp.testing import TestCaseWithFactory
+from lp.testing.layers import DatabaseFunctionalLayer
+
+
+class TestBinaryPackageReleaseContentsSet(TestCaseWithFactory):
+    layer = DatabaseFunctionalLayer
+
+    def setUp(self):
+        super().setUp()
+        self.contents_set = getUtility(IBinaryPackageReleaseContentsSet)
+
+    def test_getPaths_empty(self):
+        bpr = self.factory.makeBinaryPackageRelease()
+        self.assertEqual({}, self.contents_set.getPaths([]))
+        self.assertEqual({}, self.contents_set.getPaths([bpr.id]))
+
+    def test_add(self):
+        bpr = self.factory.makeBinaryPackageRelease()
+        self.contents_set.add(bpr, [b"usr/bin/foo", b"usr/share/doc/foo"])
+        self.assertEqual(
+            {bpr.id: [b"usr/bin/foo", b"usr/share/doc/foo"]},
+            self.contents_set.getPaths([bpr.id]),
+        )
+
+    def test_add_shares_paths(self):
+        # Paths shipped by several packages are only stored once, and
+        # recording the same files twice is harmless.
+        bprs = [self.factory.makeBinaryPackageRelease() for _ in range(2)]
+        self.contents_set.add(bprs[0], [b"etc/foo.conf", b"usr/bin/foo"])
+        self.contents_set.add(bprs[1], [b"etc/foo.conf", b"usr/bin/bar"])
+        self.contents_set.add(bprs[1], [b"usr/bin/bar"])
+        self.assertEqual(
+            {
+                bprs[0].id: [b"etc/foo.conf", b"usr/bin/foo"],
+                bprs[1].id: [b"etc/foo.conf", b"usr/bin/bar"],
+            },
+            self.contents_set.getPaths([bpr.id for bpr in bprs]),
+        )
+
+    def test_add_non_utf8_path(self):
+        bpr = self.factory.makeBinaryPackageRelease()
+        self.contents_set.add(bpr, [b"usr/share/caf\xe9"])
+        self.assertEqual(
+            {bpr.id: [b"usr/share/caf\xe9"]},
+            self.contents_set.getPaths([bpr.id]),
+        )
+
+    def test_add_long_path(self):
+        # Paths too long to fit in a btree index entry can be stored.
+        bpr = self.factory.makeBinaryPackageRelease()
+        # Use hashes so that the path doesn't compress well.
+        path = b"usr/share/" + b"/".join(
+            hashlib.sha256(b"%d" % i).hexdigest().encode("ASCII")
+            for i in range(200)
+        )
+        self.contents_set.add(bpr, [path])
+        self.contents_set.add(bpr, [path])
+        self.assertEqual(
+            {bpr.id: [path]}, self.contents_set.getPaths([bpr.id])
+        )
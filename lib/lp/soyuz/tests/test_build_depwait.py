@@ -6,11 +6,17 @@
 
 from lp.buildmaster.enums import BuildStatus
 from lp.registry.interfaces.person import IPersonSet
+from lp.soyuz.adapters.builddependencies import BuildDependencyResolver
 from lp.soyuz.enums import ArchivePurpose, PackagePublishingStatus
 from lp.soyuz.interfaces.component import IComponentSet
 from lp.soyuz.tests.test_publishing import SoyuzTestPublisher
-from lp.testing import TestCaseWithFactory, person_logged_in
+from lp.testing import (
+    StormStatementRecorder,
+    TestCaseWithFactory,
+    person_logged_in,
+)
 from lp.testing.layers import LaunchpadFunctionalLayer
+from lp.testing.matchers import HasQueryCount
 from lp.testing.sampledata import ADMIN_EMAIL
 
 
@@ -105,3 +111,73 @@ def test_update_dependancies_respects_component(self):
         # Now that we have moved it main, we can see it.
         build.updateDependencies()
         self.assertEqual("", build.dependencies)
+
+    def makeDepwaitBuild(self, dependencies):
+        spph = self.publisher.getPubSource(
+            sourcename=self.factory.getUniqueString(),
+            version="%s.1" % self.factory.getUniqueInteger(),
+            distroseries=self.distroseries,
+            archive=self.archive,
+        )
+        [build] = spph.createMissingBuilds()
+        with person_logged_in(self.admin):
+            build.updateStatus(
+                BuildStatus.MANUALDEPWAIT,
+                worker_status={"dependencies": dependencies},
+            )
+        return build
+
+    def publishBinary(self, name, version, component="main"):
+        with person_logged_in(self.admin):
+            [bpph] = self.publisher.getPubBinaries(
+                binaryname=name,
+                distroseries=self.distroseries,
+                version=version,
+                builder=self.builder,
+                archive=self.archive,
+                status=PackagePublishingStatus.PUBLISHED,
+                component=component,
+            )
+        return bpph
+
+    def test_update_dependencies_with_resolver(self):
+        # A BuildDependencyResolver gives the same answers as querying for
+        # each dependency, including for version constraints and
+        # components.
+        satisfied = self.factory.getUniqueUnicode()
+        too_old = self.factory.getUniqueUnicode()
+        universe = self.factory.getUniqueUnicode()
+        self.publishBinary(satisfied, "1.0")
+        self.publishBinary(too_old, "1.0")
+        self.publishBinary(universe, "1.0", component="universe")
+        build = self.makeDepwaitBuild(
+            "%s (>= 1.0), %s (>= 2.0), %s" % (satisfied, too_old, universe)
+        )
+        transaction.commit()
+        build.updateDependencies(resolver=BuildDependencyResolver([build]))
+        self.assertEqual(
+            "%s (>= 2.0), %s" % (too_old, universe), build.dependencies
+        )
+
+    def test_resolver_query_count(self):
+        # A BuildDependencyResolver looks up all of a build's dependencies
+        # in a constant number of queries.
+        def resolve(dependency_count):
+            names = [
+                self.factory.getUniqueUnicode()
+                for _ in range(dependency_count)
+            ]
+            for name in names:
+                self.publishBinary(name, "1.0")
+            build = self.makeDepwaitBuild(", ".join(names))
+            transaction.commit()
+            with StormStatementRecorder() as recorder:
+                build.updateDependencies(
+                    resolver=BuildDependencyResolver([build])
+                )
+            self.assertEqual("", build.dependencies)
+            return recorder
+
+        recorder1 = resolve(1)
+        recorder2 = resolve(5)
+        self.assertThat(recorder2, HasQueryCount.byEquality(recorder1))
@@ -47,6 +47,7 @@
 from lp.services.database.interfaces import IStore
 from lp.services.librarian.interfaces import ILibraryFileAliasSet
 from lp.services.log.logger import BufferLogger, DevNullLogger
+from lp.soyuz.adapters.overrides import SourceOverride
 from lp.soyuz.enums import (
     ArchivePublishingMethod,
     ArchivePurpose,
@@ -1588,6 +1589,114 @@ def get_index_stanzas():
         self.assertThat(recorder1, HasQueryCount(Equals(11)))
         self.assertThat(recorder2, HasQueryCount.byEquality(recorder1))
 
+    def test_copySources(self):
+        # copySources creates a pending copy of each source in the
+        # destination, recording where it was copied from.
+        series = self.factory.makeDistroSeries()
+        spphs = [
+            self.factory.makeSourcePackagePublishingHistory(
+                distroseries=series, status=PackagePublishingStatus.PUBLISHED
+            )
+            for _ in range(3)
+        ]
+        archive = self.factory.makeArchive(
+            distribution=series.distribution, purpose=ArchivePurpose.PPA
+        )
+        copies = getUtility(IPublishingSet).copySources(
+            archive,
+            series,
+            PackagePublishingPocket.RELEASE,
+            spphs,
+            creator=self.person,
+        )
+        self.assertContentEqual(
+            [
+                (
+                    spph.sourcepackagerelease,
+                    spph.archive,
+                    spph,
+                    spph.component,
+                    spph.section,
+                )
+                for spph in spphs
+            ],
+            [
+                (
+                    copy.sourcepackagerelease,
+                    copy.copied_from_archive,
+                    copy.ancestor,
+                    copy.component,
+                    copy.section,
+                )
+                for copy in copies
+            ],
+        )
+        for copy in copies:
+            self.assertEqual(archive, copy.archive)
+            self.assertEqual(series, copy.distroseries)
+            self.assertEqual(PackagePublishingStatus.PENDING, copy.status)
+            self.assertEqual(self.person, copy.creator)
+
+    def test_copySources_applies_overrides(self):
+        spph = self.factory.makeSourcePackagePublishingHistory()
+        universe = getUtility(IComponentSet)["universe"]
+        section = self.factory.makeSection()
+        [copy] = getUtility(IPublishingSet).copySources(
+            spph.archive,
+            spph.distroseries,
+            PackagePublishingPocket.PROPOSED,
+            [spph],
+            overrides={
+                spph.sourcepackagename: SourceOverride(
+                    component=universe, section=section
+                )
+            },
+        )
+        self.assertEqual(universe, copy.component)
+        self.assertEqual(section, copy.section)
+        self.assertEqual(PackagePublishingPocket.PROPOSED, copy.pocket)
+
+    def test_copySources_refuses_dpkg_channel(self):
+        # dpkg source packages can't be published to a channel.
+        spph = self.factory.makeSourcePackagePublishingHistory()
+        removeSecurityProxy(spph)._channel = ["stable"]
+        self.assertRaisesWithContent(
+            AssertionError,
+            "Can't publish dpkg source packages to a channel",
+            getUtility(IPublishingSet).copySources,
+            spph.archive,
+            spph.distroseries,
+            PackagePublishingPocket.RELEASE,
+            [spph],
+        )
+
+    def test_copySources_query_count(self):
+        # The number of queries that copySources issues does not depend
+        # on the number of sources being copied.
+        series = self.factory.makeDistroSeries()
+        archive = self.factory.makeArchive(
+            distribution=series.distribution, purpose=ArchivePurpose.PPA
+        )
+        spphs = []
+
+        def copy_sources():
+            getUtility(IPublishingSet).copySources(
+                archive, series, PackagePublishingPocket.RELEASE, spphs
+            )
+            del spphs[:]
+
+        def make_source():
+            spphs.append(
+                self.factory.makeSourcePackagePublishingHistory(
+                    distroseries=series,
+                    sourcepackagename="copied",
+                    version="1.%d" % self.factory.getUniqueInteger(),
+                )
+            )
+
+        recorder1, recorder2 = record_two_runs(copy_sources, make_source, 1, 5)
+        self.assertThat(recorder2, HasQueryCount.byEquality(recorder1))
+
 
 class TestSourceDomination(TestNativePublishingBase):
     """Test SourcePackagePublishingHistory.supersede() operates correctly."""
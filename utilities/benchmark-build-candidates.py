@@ -0,0 +1,143 @@
+#!/usr/bin/python3 -S
+
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Compare the ways buildd-manager has of finding build candidates.
+
+Usage hint:
+
+% utilities/benchmark-build-candidates.py --fill 20000
+
+Candidates are looked up for every group of builders in the database,
+both with one `IBuildQueueSet.findBuildCandidates` query per group and
+with a single `IBuildQueueSet.findBuildCandidatesForGroups` query.  The
+script fails if the two ways find different candidates.
+
+--fill queues extra builds spread over the builders' processors before
+measuring, to approximate a busy build farm on a development database.
+They are never committed.
+"""
+
+import _pythonpath  # noqa: F401
+
+import random
+import time
+
+import transaction
+from zope.component import getUtility
+
+from lp.buildmaster.interactor import extract_vitals_from_db
+from lp.buildmaster.interfaces.builder import IBuilderSet
+from lp.buildmaster.interfaces.buildqueue import IBuildQueueSet
+from lp.buildmaster.manager import PrefetchedBuildCandidates
+from lp.buildmaster.model.buildqueue import BuildQueue
+from lp.services.database.interfaces import IStore
+from lp.services.scripts.base import LaunchpadScript, LaunchpadScriptFailure
+from lp.testing import StormStatementRecorder
+from lp.testing.factory import LaunchpadObjectFactory
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        # Don't let objects cached by a previous run flatter this one.
+        IStore(BuildQueue).invalidate()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+class BenchmarkBuildCandidates(LaunchpadScript):
+    description = "Compare per-group and bulk build candidate queries."
+
+    def add_my_options(self):
+        self.parser.add_option(
+            "-r",
+            "--repeat",
+            type="int",
+            default=5,
+            help="Number of times to repeat each lookup (default: %default).",
+        )
+        self.parser.add_option(
+            "--fill",
+            type="int",
+            default=0,
+            metavar="N",
+            help="Queue N extra builds first (never committed).",
+        )
+
+    def fill(self, count):
+        factory = LaunchpadObjectFactory()
+        processors = {
+            processor
+            for builder in getUtility(IBuilderSet)
+            for processor in builder.processors
+        }
+        dases = [
+            factory.makeDistroArchSeries(processor=processor)
+            for processor in sorted(processors, key=lambda p: p.name)
+        ]
+        for i in range(count):
+            bq = factory.makeBinaryPackageBuild(
+                distroarchseries=dases[i % len(dases)]
+            ).queueBuild()
+            bq.manualScore(random.randint(0, 5000))
+        IStore(BuildQueue).flush()
+        self.logger.info("Queued %d builds.", count)
+
+    def main(self):
+        try:
+            if self.options.fill:
+                self.fill(self.options.fill)
+            all_vitals = [
+                extract_vitals_from_db(builder)
+                for builder in getUtility(IBuilderSet)
+            ]
+            candidates = PrefetchedBuildCandidates(all_vitals)
+            builder_groups = candidates.getBuilderGroupQueries(
+                list(candidates.builder_groups)
+            )
+            bq_set = getUtility(IBuildQueueSet)
+
+            def per_group():
+                return [
+                    [bq.id for bq in bq_set.findBuildCandidates(*group)]
+                    for group in builder_groups
+                ]
+
+            def bulk():
+                return [
+                    [bq.id for bq in bqs]
+                    for bqs in bq_set.findBuildCandidatesForGroups(
+                        builder_groups
+                    )
+                ]
+
+            if per_group() != bulk():
+                raise LaunchpadScriptFailure(
+                    "The two queries found different candidates!"
+                )
+
+            print(
+                "Finding candidates for %d builder groups, best of %d."
+                % (len(builder_groups), self.options.repeat)
+            )
+            for name, func in (("per-group", per_group), ("bulk", bulk)):
+                with StormStatementRecorder() as recorder:
+                    func()
+                print(
+                    "%-10s %8.3fs  %3d queries"
+                    % (
+                        name,
+                        best_time(func, self.options.repeat),
+                        recorder.count,
+                    )
+                )
+        finally:
+            transaction.abort()
+
+
+if __name__ == "__main__":
+    BenchmarkBuildCandidates("benchmark-build-candidates").run()
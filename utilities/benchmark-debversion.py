@@ -0,0 +1,104 @@
+#! /usr/bin/python3 -S
+
+# Copyright 2026 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Compare the speed of the ways we have of sorting Debian versions.
+
+Usage hint:
+
+% utilities/benchmark-debversion.py /path/to/dists/*/main/source/Sources.xz
+
+Versions are read from the given Sources or Packages files, which may be
+compressed, and sorted both by comparing pairs of versions with
+apt_pkg.version_compare and by using version_sort_key.  The script fails
+if the two orders differ.
+"""
+
+import _pythonpath  # noqa: F401
+
+import sys
+import time
+from functools import cmp_to_key
+from optparse import OptionParser
+
+import apt_pkg
+
+from lp.archivepublisher.debversion import sort_by_version, version_sort_key
+
+
+def read_versions(paths):
+    versions = []
+    for path in paths:
+        with apt_pkg.TagFile(path) as tagfile:
+            for section in tagfile:
+                if "Version" in section:
+                    versions.append(section["Version"])
+    return versions
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] INDEX [INDEX...]")
+    parser.add_option(
+        "-r",
+        "--repeat",
+        type="int",
+        default=5,
+        help="Number of times to repeat each sort (default: %default).",
+    )
+    options, args = parser.parse_args()
+    if not args:
+        parser.error("No index files given.")
+    apt_pkg.init_system()
+
+    versions = read_versions(args)
+    print("Sorting %d versions, best of %d." % (len(versions), options.repeat))
+
+    by_compare = sorted(versions, key=cmp_to_key(apt_pkg.version_compare))
+    by_key = sort_by_version(versions)
+    # Versions that compare equal (e.g. "1.0" and "1.0-0") may legitimately
+    # end up in a different order, so compare the orders by their keys.
+    if [version_sort_key(v) for v in by_compare] != [
+        version_sort_key(v) for v in by_key
+    ]:
+        print("The two sort orders differ!")
+        return 1
+
+    timings = [
+        (
+            "apt_pkg.version_compare",
+            best_time(
+                lambda: sorted(
+                    versions, key=cmp_to_key(apt_pkg.version_compare)
+                ),
+                options.repeat,
+            ),
+        ),
+        (
+            "version_sort_key",
+            best_time(lambda: sort_by_version(versions), options.repeat),
+        ),
+        (
+            "version_sort_key (keys only)",
+            best_time(
+                lambda: [version_sort_key(v) for v in versions],
+                options.repeat,
+            ),
+        ),
+    ]
+    for name, elapsed in timings:
+        print("%-30s %8.3fs" % (name, elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())